@@ -42,6 +42,9 @@ import numpy
 import os.path
 import collections
 import contextlib
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from argparse import ArgumentParser
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -59,6 +62,10 @@ import pyFAI.worker
 import pyFAI.io
 from pyFAI.io import DefaultAiWriter
 from pyFAI.io import HDF5Writer
+from pyFAI.io import NumpyWriter
+from pyFAI.io.nexus import is_hdf5
+from pyFAI.io.chunk_reader import ChunkReader, get_datasets
+from pyFAI.io.image import get_frame_layout, map_frames
 from pyFAI.utils.shell import ProgressBar
 from pyFAI.utils import logging_utils
 from pyFAI.utils import header_utils
@@ -317,10 +324,21 @@ DataInfo = collections.namedtuple("DataInfo", "source source_id frame_id fabio_i
 class DataSource(object):
     """Source of data to integrate."""
 
-    def __init__(self, statistics):
+    def __init__(self, statistics, direct_chunk=False, nb_buffers=1, mmap=False):
+        """
+        :param statistics: Statistics instance
+        :param bool direct_chunk: read the HDF5 files chunk by chunk, bypassing fabio
+        :param bool mmap: provide the frames of uncompressed files as read-only views
+            on the memory-mapped file, bypassing fabio
+        :param int nb_buffers: number of frames held at the same time by the consumer,
+            when reading chunk by chunk
+        """
         self._items = []
         self._statistics = statistics
         self._frames_per_items = []
+        self._direct_chunk = direct_chunk
+        self._nb_buffers = nb_buffers
+        self._mmap = mmap
 
     def append(self, item):
         self._items.append(item)
@@ -378,7 +396,73 @@ class DataSource(object):
             pass
         return count > 0
 
+    def _is_chunk_readable(self, item):
+        if not self._direct_chunk or not isinstance(item, (str,)):
+            return False
+        return is_hdf5(item.split("::", 1)[0])
+
+    def _iter_chunk_frames(self, iitem, start_id, item):
+        """Iterate over the frames of an HDF5 file, read chunk by chunk.
+
+        The data of the frames are buffers reused by the reader.
+        """
+        with self._statistics.time_reading():
+            datasets = get_datasets(item)
+        if not datasets:
+            logger.warning("No stack of frames found in %s", item)
+            return
+        filename = item.split("::", 1)[0]
+        h5 = datasets[0].file
+        try:
+            self._frames_per_items.append(sum(len(dataset) for dataset in datasets))
+            iframe = 0
+            for dataset in datasets:
+                with ChunkReader(dataset, nb_buffers=self._nb_buffers) as reader:
+                    frames = reader.iter_frames()
+                    while True:
+                        with self._statistics.time_reading():
+                            data = next(frames, None)
+                        if data is None:
+                            break
+                        yield DataInfo(source=item,
+                                       source_id=iitem,
+                                       frame_id=iframe,
+                                       data_id=start_id + iframe,
+                                       data=data,
+                                       fabio_image=None,
+                                       header=None,
+                                       source_filename=filename)
+                        iframe += 1
+        finally:
+            h5.close()
+
+    def _iter_mapped_frames(self, iitem, start_id, item, description):
+        """Iterate over the frames of an uncompressed file, memory-mapped"""
+        filename, layout = description
+        self._frames_per_items.append(len(layout))
+        frames = map_frames(filename, layout)
+        for iframe in range(len(layout)):
+            with self._statistics.time_reading():
+                data = next(frames)
+            yield DataInfo(source=item,
+                           source_id=iitem,
+                           frame_id=iframe if len(layout) > 1 else None,
+                           data_id=start_id + iframe,
+                           data=data,
+                           fabio_image=None,
+                           header=None,
+                           source_filename=item.split("::", 1)[0])
+
     def _iter_item_frames(self, iitem, start_id, item):
+        if self._mmap and isinstance(item, (str,)):
+            with self._statistics.time_reading():
+                description = get_frame_layout(item)
+            if description is not None:
+                yield from self._iter_mapped_frames(iitem, start_id, item, description)
+                return
+        if self._is_chunk_readable(item):
+            yield from self._iter_chunk_frames(iitem, start_id, item)
+            return
         if isinstance(item, (str,)):
             with self._statistics.time_reading():
                 fabio_image = fabio.open(item)
@@ -517,13 +601,16 @@ class MultiFileWriter(pyFAI.io.Writer):
         if os.path.exists(outpath):
             if self._mode == HDF5Writer.MODE_DELETE:
                 os.unlink(outpath)
-        self._writer = DefaultAiWriter(outpath, engine)
-        self._writer.init(fai_cfg=self._fai_cfg, lima_cfg=self._lima_cfg)
+        if self._writer is not None and self._writer._engine is engine:
+            # Reuse the writer (and its cached header) for the same engine
+            self._writer.set_filename(outpath)
+        else:
+            self._writer = DefaultAiWriter(outpath, engine)
+            self._writer.init(fai_cfg=self._fai_cfg, lima_cfg=self._lima_cfg)
 
     def write(self, data):
         self._writer.write(data)
         self._writer.close()
-        self._writer = None
 
     def close(self):
         pass
@@ -537,8 +624,10 @@ class Statistics(object):
         self._first_processing = 0
         self._processing = 0
         self._reading = 0
+        self._writing = 0
         self._frames = 0
         self._execution = 0
+        self._lock = threading.Lock()
 
     def execution_started(self):
         self._start_time = time.perf_counter()
@@ -553,10 +642,11 @@ class Statistics(object):
         yield
         t2 = time.perf_counter()
         processing = t2 - t1
-        if self._processing == 0:
-            self._first_processing = processing
-        self._processing += processing
-        self._frames += 1
+        with self._lock:
+            if self._processing == 0:
+                self._first_processing = processing
+            self._processing += processing
+            self._frames += 1
 
     @contextlib.contextmanager
     def time_reading(self):
@@ -564,7 +654,17 @@ class Statistics(object):
         yield
         t2 = time.perf_counter()
         reading = t2 - t1
-        self._reading += reading
+        with self._lock:
+            self._reading += reading
+
+    @contextlib.contextmanager
+    def time_writing(self):
+        t1 = time.perf_counter()
+        yield
+        t2 = time.perf_counter()
+        writing = t2 - t1
+        with self._lock:
+            self._writing += writing
 
     def processing_per_frame(self):
         """Average time spend to process a frame"""
@@ -584,17 +684,154 @@ class Statistics(object):
             return float("NaN")
         return self._reading / self._frames
 
+    def writing_per_frame(self):
+        """Average time spend to write a frame"""
+        if self._frames == 0:
+            return float("NaN")
+        return self._writing / self._frames
+
     def total_reading(self):
         return self._reading
 
     def total_processing(self):
         return self._processing
 
+    def total_writing(self):
+        return self._writing
+
     def total_execution(self):
         return self._execution
 
 
-def process(input_data, output, config, monitor_name, observer, write_mode=HDF5Writer.MODE_ERROR, format_=None):
+def _integrate_frame(worker, data_info, monitor_name, statistics):
+    """Integrate one frame
+
+    :return: the result of the integration
+    """
+    logger.debug("Processing %s", data_info.source_filename)
+    if data_info.fabio_image is not None:
+        normalization_factor = get_monitor_value(data_info.fabio_image, monitor_name)
+    else:
+        normalization_factor = 1.0
+
+    with statistics.time_processing():
+        result = worker.process(data=data_info.data,
+                                normalization_factor=normalization_factor)
+    return result
+
+
+def _write_result(writer, worker, data_info, result, statistics):
+    """Write the result of the integration of one frame"""
+    with statistics.time_writing():
+        if hasattr(writer, "prepare_write"):
+            writer.prepare_write(data_info, engine=worker.ai)
+        writer.write(result)
+        # Store reference to input data if possible
+        if isinstance(writer, HDF5Writer) and (data_info.fabio_image is not None):
+            fimg = data_info.fabio_image
+            if "dataset" in dir(fimg):
+                if isinstance(fimg.dataset, list):
+                    for ds in  fimg.dataset:
+                        writer.set_hdf5_input_dataset(ds)
+                else:
+                    writer.set_hdf5_input_dataset(fimg.dataset)
+
+
+def _process_pipeline(source, worker, writer, observer, statistics, monitor_name, nb_threads, prefetch=None):
+    """Integrate all the frames with a pipeline: a thread reads (and decompresses)
+    the frames in advance, a pool of threads integrates them with the same
+    worker and another thread writes the results, in the order of the frames.
+
+    :param int nb_threads: number of integration threads
+    :param int prefetch: maximum number of frames read in advance, by default twice the number of threads
+    """
+    prefetch = prefetch or 2 * nb_threads
+    frames = queue.Queue(maxsize=prefetch)
+    pending = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        try:
+            for data_info in source.frames():
+                if stop.is_set():
+                    break
+                frames.put(data_info)
+        except Exception as err:
+            errors.append(err)
+            stop.set()
+        finally:
+            frames.put(None)
+
+    def write():
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            data_info, future = item
+            if stop.is_set():
+                future.cancel()
+                continue
+            try:
+                result = future.result()
+                if observer.is_interruption_requested():
+                    stop.set()
+                    continue
+                _write_result(writer, worker, data_info, result, statistics)
+                observer.data_result(data_info, result)
+            except Exception as err:
+                errors.append(err)
+                stop.set()
+                continue
+            if observer.is_interruption_requested():
+                stop.set()
+
+    reader = threading.Thread(target=read, name="pyFAI-integrate-reader", daemon=True)
+    writer_thread = threading.Thread(target=write, name="pyFAI-integrate-writer", daemon=True)
+    reader.start()
+    writer_thread.start()
+    exhausted = False  # the reader sent its sentinel
+    with ThreadPoolExecutor(nb_threads, thread_name_prefix="pyFAI-integrate") as executor:
+        try:
+            while True:
+                data_info = frames.get()
+                if data_info is None:
+                    exhausted = True
+                    break
+                if stop.is_set() or observer.is_interruption_requested():
+                    # drain the queue to release the reader
+                    stop.set()
+                    continue
+                observer.processing_data(data_info,
+                                         approximate_count=source.approximate_count())
+                future = executor.submit(_integrate_frame, worker, data_info, monitor_name, statistics)
+                pending.put((data_info, future))
+        finally:
+            if not exhausted:
+                # The loop failed: stop the reader and release it from the queue
+                stop.set()
+                while frames.get() is not None:
+                    pass
+            reader.join()
+            pending.put(None)
+            writer_thread.join()
+    if errors:
+        raise errors[0]
+
+
+def _numpy_output(source):
+    """Name of the numpy stack written next to the input data"""
+    try:
+        basename = source.basename()
+    except Exception:
+        basename = None
+    if not isinstance(basename, str) or not os.path.basename(basename):
+        basename = "integrated"
+    return "%s_pyFAI.npy" % os.path.splitext(basename)[0]
+
+
+def process(input_data, output, config, monitor_name, observer, write_mode=HDF5Writer.MODE_ERROR, format_=None,
+            nb_threads=0, prefetch=None, direct_chunk=False, mmap=False):
     """
     Integrate a set of data.
 
@@ -604,6 +841,13 @@ def process(input_data, output, config, monitor_name, observer, write_mode=HDF5W
     :param IntegrationObserver observer: Observer of the processing
     :param str write_mode: Specify options to deal with IO errors
     :param format_: output format
+    :param int nb_threads: number of integration threads. If set, reading, integration and writing
+        of the frames overlap in a pipeline. By default frames are processed one after the other.
+    :param int prefetch: maximum number of frames read in advance in the pipeline
+    :param bool direct_chunk: read the HDF5 files chunk by chunk, decompressed in a pool of
+        threads into reused buffers, instead of reading them with fabio
+    :param bool mmap: memory-map the uncompressed files (EDF, TIFF, npy, contiguous HDF5)
+        and integrate the frames straight from the page cache, instead of reading them with fabio
     """
     statistics = Statistics()
     statistics.execution_started()
@@ -635,7 +879,15 @@ def process(input_data, output, config, monitor_name, observer, write_mode=HDF5W
     observer.worker_initialized(worker)
 
     # Skip invalide data
-    source = DataSource(statistics=statistics)
+    if (direct_chunk or mmap) and monitor_name is not None:
+        logger.warning("Monitor values are not available without fabio. Using fabio.")
+        direct_chunk = mmap = False
+    if nb_threads:
+        # Frames queued for integration and for writing are held at the same time
+        nb_buffers = 2 * (prefetch or 2 * nb_threads) + 3
+    else:
+        nb_buffers = 1
+    source = DataSource(statistics=statistics, direct_chunk=direct_chunk, nb_buffers=nb_buffers, mmap=mmap)
     for item in input_data:
         if isinstance(item, (str,)):
             if os.path.isfile(item):
@@ -667,13 +919,19 @@ def process(input_data, output, config, monitor_name, observer, write_mode=HDF5W
             output, entry_path = output.split("::", 1)
         else:
             entry_path = None
-        if os.path.isdir(output):
+        if format_ == "npy":
+            if os.path.isdir(output):
+                output = os.path.join(output, os.path.basename(_numpy_output(source)))
+            writer = NumpyWriter(output)
+        elif os.path.isdir(output):
             writer = MultiFileWriter(output, mode=write_mode)
         elif output.endswith(".h5") or output.endswith(".hdf5") or format_ in ("h5", "hdf5"):
             writer = HDF5Writer(output, hpath=entry_path, append_frames=True, mode=write_mode)
         else:
             output_path = os.path.abspath(output)
             writer = MultiFileWriter(output_path, mode=write_mode)
+    elif format_ == "npy":
+        writer = NumpyWriter(_numpy_output(source))
     else:
         if source.is_single_multiframe():
             basename = os.path.splitext(source.basename())[0]
@@ -693,40 +951,25 @@ def process(input_data, output, config, monitor_name, observer, write_mode=HDF5W
         writer.close()
         return 1
 
-    # Integrate all the provided frames one by one
-    for data_info in source.frames():
-        logger.debug("Processing %s", item)
-
-        observer.processing_data(data_info,
-                                 approximate_count=source.approximate_count())
-
-        if data_info.fabio_image is not None:
-            normalization_factor = get_monitor_value(data_info.fabio_image, monitor_name)
-        else:
-            normalization_factor = 1.0
-
-        if hasattr(writer, "prepare_write"):
-            writer.prepare_write(data_info, engine=worker.ai)
-
-        with statistics.time_processing():
-            result = worker.process(data=data_info.data,
-                                    normalization_factor=normalization_factor,
-                                    writer=writer)
-        # Store reference to input data if possible
-        if isinstance(writer, HDF5Writer) and (data_info.fabio_image is not None):
-            fimg = data_info.fabio_image
-            if "dataset" in dir(fimg):
-                if isinstance(fimg.dataset, list):
-                    for ds in  fimg.dataset:
-                        writer.set_hdf5_input_dataset(ds)
-                else:
-                    writer.set_hdf5_input_dataset(fimg.dataset)
-
-        if observer.is_interruption_requested():
-            break
-        observer.data_result(data_info, result)
-        if observer.is_interruption_requested():
-            break
+    if nb_threads:
+        try:
+            _process_pipeline(source, worker, writer, observer, statistics, monitor_name, nb_threads, prefetch)
+        except Exception:
+            writer.close()
+            raise
+    else:
+        # Integrate all the provided frames one by one
+        for data_info in source.frames():
+            observer.processing_data(data_info,
+                                     approximate_count=source.approximate_count())
+            result = _integrate_frame(worker, data_info, monitor_name, statistics)
+            _write_result(writer, worker, data_info, result, statistics)
+
+            if observer.is_interruption_requested():
+                break
+            observer.data_result(data_info, result)
+            if observer.is_interruption_requested():
+                break
 
     writer.close()
 
@@ -742,8 +985,10 @@ def process(input_data, output, config, monitor_name, observer, write_mode=HDF5W
     statistics.execution_finished()
 
     logger.info("[First frame] Preprocessing time: %.0fms", statistics.preprocessing() * 1000)
-    logger.info("[Per frames] Reading time: %.0fms; Processing time: %.0fms", statistics.reading_per_frame() * 1000, statistics.processing_per_frame() * 1000)
-    logger.info("[Total] Reading time: %.3fs; Processing time: %.3fs", statistics.total_reading(), statistics.total_processing())
+    logger.info("[Per frames] Reading time: %.0fms; Processing time: %.0fms; Writing time: %.0fms",
+                statistics.reading_per_frame() * 1000, statistics.processing_per_frame() * 1000, statistics.writing_per_frame() * 1000)
+    logger.info("[Total] Reading time: %.3fs; Processing time: %.3fs; Writing time: %.3fs",
+                statistics.total_reading(), statistics.total_processing(), statistics.total_writing())
     logger.info("Execution done in %.3fs !", statistics.total_execution())
     return result
 
@@ -761,7 +1006,9 @@ def integrate_shell(options, args):
         monitor_name = options.monitor_key
         filenames = args
         output = options.output
-        result = process(filenames, output, config, monitor_name, observer, options.write_mode)
+        result = process(filenames, output, config, monitor_name, observer, options.write_mode,
+                         format_=options.format.lower(), nb_threads=options.nb_threads, prefetch=options.prefetch,
+                         direct_chunk=options.direct_chunk, mmap=options.mmap)
 
     return result
 
@@ -799,7 +1046,8 @@ http://bugs.debian.org/cgi-bin/bugreport.cgi?bug=697348"""
                         help="Directory or file where to store the output data")
     parser.add_argument("-f", "--format",
                         dest="format", default="None",
-                        help="output data format (can be used to enforce HDF5 in combination with --output)")
+                        help="output data format (can be used to enforce HDF5 in combination with --output). "
+                             "Use 'npy' to store all frames in a single binary numpy stack with a JSON sidecar")
     parser.add_argument("-s", "--slow-motor",
                         dest="slow", default=None,
                         help="Dimension of the scan on the slow direction (makes sense only with HDF5)")
@@ -835,6 +1083,23 @@ http://bugs.debian.org/cgi-bin/bugreport.cgi?bug=697348"""
                         dest="overwrite_mode",
                         action="store_true",
                         help="Overwrite the entry of the destination file if it already exists (HDF5 output)")
+    parser.add_argument("--threads",
+                        dest="nb_threads", type=int, default=0,
+                        help="Number of integration threads. Reading, integration and writing of \
+                        the frames are overlapped in a pipeline. By default the frames are \
+                        processed one after the other (no GUI)")
+    parser.add_argument("--prefetch",
+                        dest="prefetch", type=int, default=None,
+                        help="Maximum number of frames read in advance with --threads, \
+                        by default twice the number of threads")
+    parser.add_argument("--direct-chunk",
+                        dest="direct_chunk", action="store_true", default=False,
+                        help="Read HDF5 stacks (like Eiger master files) chunk by chunk, \
+                        decompressing them in a pool of threads (no GUI)")
+    parser.add_argument("--mmap",
+                        dest="mmap", action="store_true", default=False,
+                        help="Memory-map uncompressed files (EDF, TIFF, npy, contiguous HDF5) \
+                        and integrate the frames without copy (no GUI)")
     options = parser.parse_args(args)
 
     # Analysis arguments and options
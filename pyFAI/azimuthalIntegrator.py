@@ -39,10 +39,11 @@ logger = logging.getLogger(__name__)
 import warnings
 import threading
 import gc
+import copy
 from math import pi, log
 import numpy
 from numpy import rad2deg
-from .geometry import Geometry
+from .geometry import Geometry, _wavelength_exponent
 from . import units
 from .utils import EPS32, deg2rad, crc32
 from .utils.decorators import deprecated, deprecated_warning
@@ -64,7 +65,8 @@ else:
 from .load_integrators import ocl_azim_csr, ocl_azim_lut, ocl_sort, histogram, splitBBox, \
                                 splitPixel, splitBBoxCSR, splitBBoxLUT, splitPixelFullCSR, \
                                 histogram_engine, splitPixelFullLUT
-from .engines import Engine
+from .engines import Engine, EngineCache
+from .engines.sparse_cache import SparseCache, get_default_cache
 
 # Few constants for engine names:
 OCL_CSR_ENGINE = "ocl_csr_integr"
@@ -114,6 +116,16 @@ class AzimuthalIntegrator(Geometry):
     boolean mask is also accepted (`True` is the masking value).
     """
 
+    ENGINE_OPTIONS = ("static_normalization", "compact")
+    "Names of the options of the CSR regrid-engines, see `engine_options`"
+
+    TILED_SETUP_SIZE = 1 << 26
+    """Number of pixels above which the corners of the pixels are calculated
+    tile by tile, and not cached, when setting up the sparse matrix with full
+    pixel splitting. This bounds the memory needed for very large detectors,
+    see `Geometry.corner_tiles`. Set to None to deactivate.
+    """
+
     def __init__(self, dist=1, poni1=0, poni2=0,
                  rot1=0, rot2=0, rot3=0,
                  pixel1=None, pixel2=None,
@@ -165,6 +177,9 @@ class AzimuthalIntegrator(Geometry):
         self.engines = {}  # key: name of the engine,
 
         self._empty = 0.0
+        self._sparse_cache = get_default_cache()
+        self._engine_cache = EngineCache()
+        self._engine_options = {}
 
     def reset(self):
         """Reset azimuthal integrator in addition to other arrays.
@@ -177,8 +192,206 @@ class AzimuthalIntegrator(Geometry):
         with self._lock:
             for key in list(self.engines.keys()):  # explicit copy
                 self.engines.pop(key).reset()
+            self._engine_cache.clear()
         gc.collect()
 
+    def _reset_wavelength(self, old_wavelength):
+        """Invalidate the cached arrays and the regrid-engines after a change
+        of wavelength.
+
+        Engines in units which do not depend on the wavelength (2theta, r ...)
+        are kept. CSR and LUT engines in q or d*2 without radial range keep
+        the same pixel-to-bin assignment: a copy with rescaled bins is used.
+        Other engines are discarded.
+
+        :param old_wavelength: previous wavelength in meter
+        """
+        Geometry._reset_wavelength(self, old_wavelength)
+        ratio = old_wavelength / self._wavelength if (old_wavelength and self._wavelength) else None
+        with self._lock:
+            for method in list(self.engines.keys()):  # explicit copy
+                engine = self.engines[method]
+                with engine.lock:
+                    integr = self._rescale_engine(method, engine.engine, engine.key, ratio)
+                    if integr is not None:
+                        engine.set_engine(integr, engine.key)
+                if integr is None:
+                    self.engines.pop(method).reset()
+            self._engine_cache.discard(lambda key: _wavelength_exponent(key[1]) != 0)
+
+    @staticmethod
+    def _rescale_engine(method, integr, key, ratio):
+        """Adapt a regrid-engine to a change of wavelength
+
+        :param method: IntegrationMethod (or name) of the engine
+        :param integr: the regrid-engine
+        :param key: its configuration, see EngineCache.get_key
+        :param ratio: old_wavelength / new_wavelength
+        :return: the engine to use with the new wavelength, or None if it needs to be rebuilt
+        """
+        if integr is None:
+            return
+        unit = key[1] if key else getattr(integr, "unit", None)
+        if unit is None:
+            return
+        exponent = _wavelength_exponent(unit)
+        if exponent == 0:
+            return integr
+        if (not exponent) or (not ratio) or (getattr(integr, "pos0_range", None) is not None):
+            return
+        if not (isinstance(method, IntegrationMethod) and
+                method.algo_lower in ("csr", "lut") and
+                method.impl_lower in ("cython", "python")):
+            return
+        factor = ratio ** exponent
+        try:
+            rescaled = copy.copy(integr)
+        except TypeError as err:
+            logger.debug("Unable to copy the regrid-engine %s: %s", method, err)
+            return
+        for name in ("pos0_min", "pos0_maxin", "pos0_max", "delta", "delta0", "bin_centers", "bin_centers0"):
+            value = getattr(rescaled, name, None)
+            if value is not None:
+                setattr(rescaled, name, value * factor)
+        # Only used to build the sparse matrix
+        for name in ("cpos0", "dpos0"):
+            if getattr(rescaled, name, None) is not None:
+                setattr(rescaled, name, None)
+        return rescaled
+
+    @property
+    def engine_cache_size(self):
+        """Memory budget (in bytes) for the regrid-engines kept aside when
+        the configuration (unit, number of bins, ranges, mask ...) changes.
+
+        With a non-null budget, going back to a previous configuration reuses
+        its engine instead of rebuilding it. The least recently used engines
+        are evicted first. 0 (the default) disables the cache.
+        """
+        return self._engine_cache.max_size
+
+    @engine_cache_size.setter
+    def engine_cache_size(self, value):
+        self._engine_cache.max_size = int(value) if value else 0
+        if not self._engine_cache.max_size:
+            self._engine_cache.clear()
+
+    @property
+    def engine_options(self):
+        """Opt-in options of the CSR regrid-engines (Cython and Python
+        implementations), as a dictionary:
+
+        * static_normalization: the solid-angle and polarization corrections
+          are folded into the engine when it is set up; each frame then only
+          accumulates the signal and its variance. The checksums of those
+          arrays are part of the configuration of the engine, so that
+          alternating settings benefit from the `engine_cache_size`.
+        * compact: the Cython engines store their matrix with 16-bit
+          coefficients and column increments, halving the memory read for
+          each frame at the price of a quantization error, see
+          `CsrIntegrator.set_compact`. Not combined with the static
+          normalization, which is ignored by compact engines.
+
+        Engines are reconfigured on their next use after a change of options.
+        """
+        return dict(self._engine_options)
+
+    @engine_options.setter
+    def engine_options(self, value):
+        value = dict(value or {})
+        unknown = set(value).difference(self.ENGINE_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown engine options: {', '.join(sorted(unknown))}")
+        self._engine_options = value
+
+    def _get_engine_options(self, method, solidangle_checksum=None, polarization_checksum=None):
+        """Engine options which apply to a method, part of the key of its engine
+
+        :param method: IntegrationMethod
+        :param solidangle_checksum: checksum of the solid-angle array, None if not corrected
+        :param polarization_checksum: checksum of the polarization array, None if not corrected
+        :return: tuple of (name, value), empty if no option applies
+        """
+        if not (method.algo_lower == "csr" and method.impl_lower in ("cython", "python")):
+            return ()
+        options = []
+        if self._engine_options.get("static_normalization"):
+            options.append(("static_normalization", (solidangle_checksum, polarization_checksum, None)))
+        if self._engine_options.get("compact") and method.impl_lower == "cython":
+            options.append(("compact", True))
+        return tuple(options)
+
+    @staticmethod
+    def _is_configured(integr, options):
+        """Tells if a CSR integrator is set up with the given engine options
+
+        :param integr: CSR integrator (Cython or Python implementation)
+        :param options: engine options as provided by `_get_engine_options`
+        :return: bool
+        """
+        options = dict(options)
+        return (getattr(integr, "static_checksum", None) == options.get("static_normalization") and
+                bool(getattr(integr, "compact", False)) == bool(options.get("compact")))
+
+    @classmethod
+    def _configure_engine(cls, integr, options, solidangle=None, polarization=None):
+        """Provide a CSR integrator set up with the engine options. Integrators
+        are shared between threads and never modified once published: the
+        options are applied to a copy.
+
+        Should be called from the locked region of the engine.
+
+        :param integr: CSR integrator (Cython or Python implementation)
+        :param options: engine options as provided by `_get_engine_options`
+        :param solidangle: solid-angle array matching the options
+        :param polarization: polarization array matching the options
+        :return: the integrator itself if already set up, else a configured copy
+        """
+        if cls._is_configured(integr, options):
+            return integr
+        options = dict(options)
+        checksum = options.get("static_normalization")
+        integr = copy.copy(integr)
+        if checksum is None:
+            integr.reset_static_normalization()
+        elif integr.static_checksum != checksum:
+            integr.set_static_normalization(solidangle=solidangle, polarization=polarization,
+                                            solidangle_checksum=checksum[0],
+                                            polarization_checksum=checksum[1])
+        if hasattr(integr, "set_compact"):
+            integr.set_compact(bool(options.get("compact")))
+        return integr
+
+    def _swap_engine(self, engine, key):
+        """Store the integrator of an engine in the engine cache and retrieve
+        the one matching the new configuration, if any.
+
+        Should be called from the locked region of the engine.
+
+        :param engine: Engine instance
+        :param key: configuration of the requested integrator, see EngineCache.get_key
+        :return: integrator from the cache or None
+        """
+        self._engine_cache.put(engine.key, engine.engine)
+        integr = self._engine_cache.pop(key)
+        if integr is not None:
+            engine.set_engine(integr, key)
+        return integr
+
+    @staticmethod
+    def _update_mask(integr, mask, mask_checksum):
+        """Apply a new mask to a copy of a CSR integrator: integrators are
+        shared between threads and never modified once published.
+
+        :param integr: CSR integrator from pyFAI.ext
+        :param mask: the new mask
+        :param mask_checksum: its checksum
+        :return: updated integrator or None if it needs to be rebuilt
+        """
+        updated = copy.copy(integr)
+        if updated.update_mask(mask, mask_checksum):
+            return updated
+
     def create_mask(self, data, mask=None,
                     dummy=None, delta_dummy=None,
                     unit=None, radial_range=None,
@@ -372,8 +585,18 @@ class AzimuthalIntegrator(Geometry):
             int2d = True
         else:
             int2d = False
+        if mask is None:
+            mask_checksum = None
+        elif not mask_checksum:
+            mask_checksum = crc32(numpy.ascontiguousarray(mask))
+        if self._sparse_cache is not None:
+            cache_key = self._sparse_cache.get_key(self, "lut", shape, npt, mask_checksum,
+                                                   pos0_range, pos1_range, unit, split, empty)
+            integr = self._sparse_cache.load(cache_key)
+            if integr is not None:
+                return integr
         if split == "full":
-            pos = self.array_from_unit(shape, "corner", unit, scale=False)
+            pos = self._get_corners(shape, unit)
         else:
             pos0 = self.array_from_unit(shape, "center", unit, scale=False)
             if split == "no":
@@ -402,47 +625,63 @@ class AzimuthalIntegrator(Geometry):
             assert mask.shape == shape
         if split == "full":
             if int2d:
-                return splitPixelFullLUT.HistoLUT2dFullSplit(pos,
-                                                bins=npt,
-                                                pos0_range=pos0_range,
-                                                pos1_range=pos1_range,
-                                                mask=mask,
-                                                mask_checksum=mask_checksum,
-                                                allow_pos0_neg=False,
-                                                unit=unit,
-                                                chiDiscAtPi=self.chiDiscAtPi,
-                                                empty=empty)
+                integr = splitPixelFullLUT.HistoLUT2dFullSplit(pos,
+                                                  bins=npt,
+                                                  pos0_range=pos0_range,
+                                                  pos1_range=pos1_range,
+                                                  mask=mask,
+                                                  mask_checksum=mask_checksum,
+                                                  allow_pos0_neg=False,
+                                                  unit=unit,
+                                                  chiDiscAtPi=self.chiDiscAtPi,
+                                                  empty=empty)
             else:
-                return splitPixelFullLUT.HistoLUT1dFullSplit(pos,
-                                                             bins=npt,
-                                                             pos0_range=pos0_range,
-                                                             pos1_range=pos1_range,
-                                                             mask=mask,
-                                                             mask_checksum=mask_checksum,
-                                                             allow_pos0_neg=False,
-                                                             unit=unit,
-                                                             empty=empty)
+                integr = splitPixelFullLUT.HistoLUT1dFullSplit(pos,
+                                                               bins=npt,
+                                                               pos0_range=pos0_range,
+                                                               pos1_range=pos1_range,
+                                                               mask=mask,
+                                                               mask_checksum=mask_checksum,
+                                                               allow_pos0_neg=False,
+                                                               unit=unit,
+                                                               empty=empty)
         else:
             if int2d:
-                return splitBBoxLUT.HistoBBox2d(pos0, dpos0, pos1, dpos1,
-                                                bins=npt,
-                                                pos0_range=pos0_range,
-                                                pos1_range=pos1_range,
-                                                mask=mask,
-                                                mask_checksum=mask_checksum,
-                                                allow_pos0_neg=False,
-                                                unit=unit,
-                                                empty=empty)
+                integr = splitBBoxLUT.HistoBBox2d(pos0, dpos0, pos1, dpos1,
+                                                  bins=npt,
+                                                  pos0_range=pos0_range,
+                                                  pos1_range=pos1_range,
+                                                  mask=mask,
+                                                  mask_checksum=mask_checksum,
+                                                  allow_pos0_neg=False,
+                                                  unit=unit,
+                                                  empty=empty)
             else:
-                return splitBBoxLUT.HistoBBox1d(pos0, dpos0, pos1, dpos1,
-                                                bins=npt,
-                                                pos0_range=pos0_range,
-                                                pos1_range=pos1_range,
-                                                mask=mask,
-                                                mask_checksum=mask_checksum,
-                                                allow_pos0_neg=False,
-                                                unit=unit,
-                                                empty=empty)
+                integr = splitBBoxLUT.HistoBBox1d(pos0, dpos0, pos1, dpos1,
+                                                  bins=npt,
+                                                  pos0_range=pos0_range,
+                                                  pos1_range=pos1_range,
+                                                  mask=mask,
+                                                  mask_checksum=mask_checksum,
+                                                  allow_pos0_neg=False,
+                                                  unit=unit,
+                                                  empty=empty)
+        if self._sparse_cache is not None:
+            self._sparse_cache.save(cache_key, integr)
+        return integr
+
+    def _get_corners(self, shape, unit):
+        """Provide the corners of the pixels for building a sparse matrix with
+        full pixel splitting: tile by tile for detectors larger than
+        `TILED_SETUP_SIZE` pixels, at once otherwise.
+
+        :param shape: shape of the dataset
+        :param unit: radial unit
+        :return: 4D array or CornerTiles
+        """
+        if self.TILED_SETUP_SIZE and (shape[0] * shape[1] > self.TILED_SETUP_SIZE):
+            return self.corner_tiles(shape, unit)
+        return self.array_from_unit(shape, "corner", unit, scale=False)
 
     def setup_CSR(self, shape, npt, mask=None,
                   pos0_range=None, pos1_range=None,
@@ -507,8 +746,18 @@ class AzimuthalIntegrator(Geometry):
             int2d = True
         else:
             int2d = False
+        if mask is None:
+            mask_checksum = None
+        elif not mask_checksum:
+            mask_checksum = crc32(numpy.ascontiguousarray(mask))
+        if self._sparse_cache is not None:
+            cache_key = self._sparse_cache.get_key(self, "csr", shape, npt, mask_checksum,
+                                                   pos0_range, pos1_range, unit, split, empty)
+            integr = self._sparse_cache.load(cache_key)
+            if integr is not None:
+                return integr
         if split == "full":
-            pos = self.array_from_unit(shape, "corner", unit, scale=False)
+            pos = self._get_corners(shape, unit)
         else:
             pos0 = self.array_from_unit(shape, "center", unit, scale=False)
             if split == "no":
@@ -531,47 +780,50 @@ class AzimuthalIntegrator(Geometry):
         if split == "full":
 
             if int2d:
-                return splitPixelFullCSR.FullSplitCSR_2d(pos,
-                                                         bins=npt,
-                                                         pos0_range=pos0_range,
-                                                         pos1_range=pos1_range,
-                                                         mask=mask,
-                                                         mask_checksum=mask_checksum,
-                                                         allow_pos0_neg=False,
-                                                         unit=unit,
-                                                         chiDiscAtPi=self.chiDiscAtPi,
-                                                         empty=empty)
+                integr = splitPixelFullCSR.FullSplitCSR_2d(pos,
+                                                           bins=npt,
+                                                           pos0_range=pos0_range,
+                                                           pos1_range=pos1_range,
+                                                           mask=mask,
+                                                           mask_checksum=mask_checksum,
+                                                           allow_pos0_neg=False,
+                                                           unit=unit,
+                                                           chiDiscAtPi=self.chiDiscAtPi,
+                                                           empty=empty)
             else:
-                return splitPixelFullCSR.FullSplitCSR_1d(pos,
-                                                         bins=npt,
-                                                         pos0_range=pos0_range,
-                                                         pos1_range=pos1_range,
-                                                         mask=mask,
-                                                         mask_checksum=mask_checksum,
-                                                         allow_pos0_neg=False,
-                                                         unit=unit,
-                                                         empty=empty)
+                integr = splitPixelFullCSR.FullSplitCSR_1d(pos,
+                                                           bins=npt,
+                                                           pos0_range=pos0_range,
+                                                           pos1_range=pos1_range,
+                                                           mask=mask,
+                                                           mask_checksum=mask_checksum,
+                                                           allow_pos0_neg=False,
+                                                           unit=unit,
+                                                           empty=empty)
         else:
             if int2d:
-                return splitBBoxCSR.HistoBBox2d(pos0, dpos0, pos1, dpos1,
-                                                bins=npt,
-                                                pos0_range=pos0_range,
-                                                pos1_range=pos1_range,
-                                                mask=mask,
-                                                mask_checksum=mask_checksum,
-                                                allow_pos0_neg=False,
-                                                unit=unit,
-                                                empty=empty)
+                integr = splitBBoxCSR.HistoBBox2d(pos0, dpos0, pos1, dpos1,
+                                                  bins=npt,
+                                                  pos0_range=pos0_range,
+                                                  pos1_range=pos1_range,
+                                                  mask=mask,
+                                                  mask_checksum=mask_checksum,
+                                                  allow_pos0_neg=False,
+                                                  unit=unit,
+                                                  empty=empty)
             else:
-                return splitBBoxCSR.HistoBBox1d(pos0, dpos0, pos1, dpos1,
-                                                bins=npt,
-                                                pos0_range=pos0_range,
-                                                pos1_range=pos1_range,
-                                                mask=mask,
-                                                mask_checksum=mask_checksum,
-                                                allow_pos0_neg=False,
-                                                unit=unit,
-                                                empty=empty)
+                integr = splitBBoxCSR.HistoBBox1d(pos0, dpos0, pos1, dpos1,
+                                                  bins=npt,
+                                                  pos0_range=pos0_range,
+                                                  pos1_range=pos1_range,
+                                                  mask=mask,
+                                                  mask_checksum=mask_checksum,
+                                                  allow_pos0_neg=False,
+                                                  unit=unit,
+                                                  empty=empty)
+        if self._sparse_cache is not None:
+            self._sparse_cache.save(cache_key, integr)
+        return integr
 
     @deprecated(since_version="0.20", only_once=True, deprecated_since="0.20.0")
     def integrate1d_legacy(self, data, npt, filename=None,
@@ -1110,9 +1362,9 @@ class AzimuthalIntegrator(Geometry):
         Multi algorithm implementation (tries to be bullet proof), suitable for SAXS, WAXS, ... and much more
         Takes extra care of normalization and performs proper variance propagation.
 
-        :param ndarray data: 2D array from the Detector/CCD camera
+        :param ndarray data: 2D array from the Detector/CCD camera, or 3D stack of frames integrated at once
         :param int npt: number of points in the output pattern
-        :param str filename: output filename in 2/3 column ascii format
+        :param str filename: output filename in 2/3 column ascii format (single frame only)
         :param bool correctSolidAngle: correct for solid angle of each pixel if True 
         :param ndarray variance: array containing the variance of the data. 
         :param str error_model: When the variance is unknown, an error model can be given: "poisson" (variance = I), "azimuthal" (variance = (I-<I>)^2)
@@ -1132,15 +1384,40 @@ class AzimuthalIntegrator(Geometry):
         :param IntegrationMethod method: IntegrationMethod instance or 3-tuple with (splitting, algorithm, implementation)
         :param Unit unit: Output units, can be "q_nm^-1" (default), "2th_deg", "r_mm" for now.
         :param bool safe: Perform some extra checks to ensure LUT/CSR is still valid. False is faster.
-        :param float normalization_factor: Value of a normalization monitor 
+        :param float normalization_factor: Value of a normalization monitor, one value per frame for a stack
         :param metadata: JSON serializable object containing the metadata, usually a dictionary.
         :return: Integrate1dResult namedtuple with (q,I,sigma) +extra informations in it.
+
+        When `data` is a stack of frames, the intensity, sigma, ... have one line per frame.
+        With the CSR method (Cython or Python implementation) all frames are integrated
+        with a single pass over the sparse matrix, other methods loop over frames.
         """
         method = self._normalize_method(method, dim=1, default=self.DEFAULT_METHOD_1D)
         assert method.dimension == 1
+        if data.ndim == 3:
+            if filename is not None:
+                raise RuntimeError("Saving the integration of a stack of frames is not supported")
+            if not (method.algo_lower == "csr" and method.impl_lower in ("cython", "python")):
+                nframes = data.shape[0]
+                normalization_factor = numpy.broadcast_to(normalization_factor, (nframes,))
+                results = [self.integrate1d_ng(data[i], npt,
+                                               correctSolidAngle=correctSolidAngle,
+                                               variance=None if variance is None else variance[i],
+                                               error_model=error_model,
+                                               radial_range=radial_range, azimuth_range=azimuth_range,
+                                               mask=mask, dummy=dummy, delta_dummy=delta_dummy,
+                                               polarization_factor=polarization_factor,
+                                               dark=dark, flat=flat, method=method, unit=unit,
+                                               safe=safe, normalization_factor=normalization_factor[i],
+                                               metadata=metadata)
+                           for i in range(nframes)]
+                return self._stack_results(results)
+            shape = data.shape[1:]
+        else:
+            shape = data.shape
+        size = int(numpy.prod(shape))
         unit = units.to_unit(unit)
         empty = dummy if dummy is not None else self._empty
-        shape = data.shape
         pos0_scale = unit.scale
 
         if radial_range:
@@ -1212,78 +1489,112 @@ class AzimuthalIntegrator(Geometry):
         if method.algo_lower in ("csr", "lut"):
             # initialize the CSR/LUT integrator in Cython as it may be needed later on.
             cython_method = IntegrationMethod.select_method(method.dimension, method.split_lower, method.algo_lower, "cython")[0]
-            if cython_method not in self.engines:
-                cython_engine = self.engines[cython_method] = Engine()
-            else:
-                cython_engine = self.engines[cython_method]
-            with cython_engine.lock:
-                # Validate that the engine used is the proper one
+            cython_engine = self.engines.get(cython_method)
+            if cython_engine is None:
+                cython_engine = self.engines.setdefault(cython_method, Engine())
+            options = self._get_engine_options(method, solidangle_crc, polarization_crc)
+            cython_options = options if method.impl_lower == "cython" else ()
+            cache_key = EngineCache.get_key(cython_method, unit, npt, shape, mask_crc,
+                                            radial_range, azimuth_range, empty, cython_options)
+            # Lock-free access when the engine matches the configuration, the lock is only needed to rebuild it
+            cython_integr = cython_engine.get_engine(cache_key)
+            if (cython_integr is None) and (not safe):
                 cython_integr = cython_engine.engine
-                cython_reset = None
-                if cython_integr is None:
-                    cython_reset = "of first initialization"
-                if (not cython_reset) and safe:
-                    if cython_integr.unit != unit:
-                        cython_reset = "unit was changed"
-                    if cython_integr.bins != npt:
-                        cython_reset = "number of points changed"
-                    if cython_integr.size != data.size:
-                        cython_reset = "input image size changed"
-                    if cython_integr.empty != empty:
-                        cython_reset = "empty value changed"
-                    if (mask is not None) and (not cython_integr.check_mask):
-                        cython_reset = f"mask but {method.algo_lower.upper()} was without mask"
-                    elif (mask is None) and (cython_integr.cmask is not None):
-                        cython_reset = f"no mask but { method.algo_lower.upper()} has mask"
-                    elif (mask is not None) and (cython_integr.mask_checksum != mask_crc):
-                        cython_reset = "mask changed"
-                    if (radial_range is None) and (cython_integr.pos0_range is not None):
-                        cython_reset = f"radial_range was defined in { method.algo_lower.upper()}"
-                    elif (radial_range is not None) and (cython_integr.pos0_range != radial_range):
-                        cython_reset = f"radial_range is defined but differs in %s" % method.algo_lower.upper()
-                    if (azimuth_range is None) and (cython_integr.pos1_range is not None):
-                        cython_reset = f"azimuth_range not defined and {method.algo_lower.upper()} had azimuth_range defined"
-                    elif (azimuth_range is not None) and (cython_integr.pos1_range != azimuth_range):
-                        cython_reset = f"azimuth_range requested and {method.algo_lower.upper()}'s azimuth_range don't match"
-                if cython_reset:
-                    logger.info("AI.integrate1d_ng: Resetting Cython integrator because %s", cython_reset)
-                    split = method.split_lower
-                    if split == "pseudo":
-                        split = "full"
-                    try:
-                        if method.algo_lower == "csr":
-                            cython_integr = self.setup_CSR(shape, npt, mask,
-                                                           radial_range, azimuth_range,
-                                                           mask_checksum=mask_crc,
-                                                           unit=unit, split=split,
-                                                           empty=empty, scale=False)
-                        else:
-                            cython_integr = self.setup_LUT(shape, npt, mask,
-                                                           radial_range, azimuth_range,
-                                                           mask_checksum=mask_crc,
-                                                           unit=unit, split=split,
-                                                           empty=empty, scale=False)
-                    except MemoryError:  # CSR method is hungry...
-                        logger.warning("MemoryError: falling back on forward implementation")
-                        cython_integr = None
-                        self.reset_engines()
-                        method = self.DEFAULT_METHOD_1D
-                    else:
-                        cython_engine.set_engine(cython_integr)
+            if cython_integr is None:
+                with cython_engine.lock:
+                    # Validate that the engine used is the proper one
+                    cython_integr = cython_engine.engine
+                    cython_reset = None
+                    if cython_integr is None:
+                        cython_reset = "of first initialization"
+                    if (not cython_reset) and safe:
+                        if cython_integr.unit != unit:
+                            cython_reset = "unit was changed"
+                        if cython_integr.bins != npt:
+                            cython_reset = "number of points changed"
+                        if cython_integr.size != size:
+                            cython_reset = "input image size changed"
+                        if cython_integr.empty != empty:
+                            cython_reset = "empty value changed"
+                        if (mask is not None) and (not cython_integr.check_mask):
+                            cython_reset = f"mask but {method.algo_lower.upper()} was without mask"
+                        elif (mask is None) and (cython_integr.cmask is not None):
+                            cython_reset = f"no mask but { method.algo_lower.upper()} has mask"
+                        elif (mask is not None) and (cython_integr.mask_checksum != mask_crc):
+                            updated = None
+                            if (not cython_reset) and (method.algo_lower == "csr"):
+                                updated = self._update_mask(cython_integr, mask, mask_crc)
+                            if updated is None:
+                                cython_reset = "mask changed"
+                            else:
+                                cython_integr = updated
+                        if (radial_range is None) and (cython_integr.pos0_range is not None):
+                            cython_reset = f"radial_range was defined in { method.algo_lower.upper()}"
+                        elif (radial_range is not None) and (cython_integr.pos0_range != radial_range):
+                            cython_reset = f"radial_range is defined but differs in %s" % method.algo_lower.upper()
+                        if (azimuth_range is None) and (cython_integr.pos1_range is not None):
+                            cython_reset = f"azimuth_range not defined and {method.algo_lower.upper()} had azimuth_range defined"
+                        elif (azimuth_range is not None) and (cython_integr.pos1_range != azimuth_range):
+                            cython_reset = f"azimuth_range requested and {method.algo_lower.upper()}'s azimuth_range don't match"
+                    if (not cython_reset) and (not self._is_configured(cython_integr, cython_options)):
+                        # Same matrix with other options: maybe in the engine cache, else configured below
+                        cached = self._swap_engine(cython_engine, cache_key)
+                        if cached is not None:
+                            cython_integr = cached
+                    if cython_reset:
+                        logger.info("AI.integrate1d_ng: Resetting Cython integrator because %s", cython_reset)
+                        cython_integr = self._swap_engine(cython_engine, cache_key)
+                        if cython_integr is not None:
+                            logger.info("AI.integrate1d_ng: Cython integrator retrieved from the engine cache")
+                            cython_reset = None
+                    if cython_reset:
+                        split = method.split_lower
+                        if split == "pseudo":
+                            split = "full"
+                        try:
+                            if method.algo_lower == "csr":
+                                cython_integr = self.setup_CSR(shape, npt, mask,
+                                                               radial_range, azimuth_range,
+                                                               mask_checksum=mask_crc,
+                                                               unit=unit, split=split,
+                                                               empty=empty, scale=False)
+                            else:
+                                cython_integr = self.setup_LUT(shape, npt, mask,
+                                                               radial_range, azimuth_range,
+                                                               mask_checksum=mask_crc,
+                                                               unit=unit, split=split,
+                                                               empty=empty, scale=False)
+                        except MemoryError:  # CSR method is hungry...
+                            logger.warning("MemoryError: falling back on forward implementation")
+                            cython_integr = None
+                            self.reset_engines()
+                            method = self.DEFAULT_METHOD_1D
+                    if cython_integr is not None:
+                        cython_integr = self._configure_engine(cython_integr, cython_options, solidangle, polarization)
+                        cython_engine.set_engine(cython_integr, cache_key)
             # This whole block uses CSR, Now we should treat all the various implementation: Cython, OpenCL and finally Python.
             if method.impl_lower == "cython":
                 # The integrator has already been initialized previously
-                integr = self.engines[method].engine
-                intpl = integr.integrate_ng(data,
-                                            variance=variance,
-                                            poissonian=poissonian,
-                                            dummy=dummy,
-                                            delta_dummy=delta_dummy,
-                                            dark=dark,
-                                            flat=flat,
-                                            solidangle=solidangle,
-                                            polarization=polarization,
-                                            normalization_factor=normalization_factor)
+                integr = cython_integr
+                kwargs = {}
+                if data.ndim == 3:
+                    integrate = integr.integrate_ng_stack
+                else:
+                    integrate = integr.integrate_ng
+                    if method.algo_lower == "csr":
+                        kwargs["solidangle_checksum"] = solidangle_crc
+                        kwargs["polarization_checksum"] = polarization_crc
+                intpl = integrate(data,
+                                  variance=variance,
+                                  poissonian=poissonian,
+                                  dummy=dummy,
+                                  delta_dummy=delta_dummy,
+                                  dark=dark,
+                                  flat=flat,
+                                  solidangle=solidangle,
+                                  polarization=polarization,
+                                  normalization_factor=normalization_factor,
+                                  **kwargs)
             else:  # method.impl_lower in ("opencl", "python"):
                 if method not in self.engines:
                     # instanciated the engine
@@ -1301,7 +1612,7 @@ class AzimuthalIntegrator(Geometry):
                             reset = "unit was changed"
                         if integr.bins != npt:
                             reset = "number of points changed"
-                        if integr.size != data.size:
+                        if integr.size != size:
                             reset = "input image size changed"
                         if integr.empty != empty:
                             reset = "empty value changed"
@@ -1322,11 +1633,11 @@ class AzimuthalIntegrator(Geometry):
 
                     if reset:
                         logger.info("ai.integrate1d_ng: Resetting ocl_csr integrator because %s", reset)
-                        csr_integr = self.engines[cython_method].engine
+                        csr_integr = cython_integr
                         if method.impl_lower == "opencl":
                             try:
                                 integr = method.class_funct_ng.klass(csr_integr.lut,
-                                                                     image_size=data.size,
+                                                                     image_size=size,
                                                                      checksum=csr_integr.lut_checksum,
                                                                      empty=empty,
                                                                      unit=unit,
@@ -1344,7 +1655,7 @@ class AzimuthalIntegrator(Geometry):
                             else:
                                 engine.set_engine(integr)
                         elif method.impl_lower == "python":
-                            integr = method.class_funct_ng.klass(image_size=data.size,
+                            integr = method.class_funct_ng.klass(image_size=size,
                                                                  lut=csr_integr.lut,
                                                                  empty=empty,
                                                                  unit=unit,
@@ -1359,9 +1670,14 @@ class AzimuthalIntegrator(Geometry):
 
                     else:
                         integr = self.engines[method].engine
+                    if method.impl_lower == "python":
+                        configured = self._configure_engine(integr, options, solidangle, polarization)
+                        if configured is not integr:
+                            integr = configured
+                            engine.set_engine(integr)
                 kwargs = {"poissonian": None,
                           "variance": variance}
-                if method.impl_lower == "opencl":
+                if data.ndim != 3:
                     kwargs["polarization_checksum"] = polarization_crc
                     kwargs["solidangle_checksum"] = solidangle_crc
                 if error_model:
@@ -1371,12 +1687,16 @@ class AzimuthalIntegrator(Geometry):
                     elif error_model.startswith("azim"):
                         kwargs["poissonian"] = False
                         kwargs["variance"] = None
-                intpl = integr.integrate_ng(data, dark=dark,
-                                            dummy=dummy, delta_dummy=delta_dummy,
-                                            flat=flat, solidangle=solidangle,
-                                            polarization=polarization,
-                                            normalization_factor=normalization_factor,
-                                            **kwargs)
+                if data.ndim == 3:
+                    integrate = integr.integrate_ng_stack
+                else:
+                    integrate = integr.integrate_ng
+                intpl = integrate(data, dark=dark,
+                                  dummy=dummy, delta_dummy=delta_dummy,
+                                  flat=flat, solidangle=solidangle,
+                                  polarization=polarization,
+                                  normalization_factor=normalization_factor,
+                                  **kwargs)
             # This section is common to all 3 CSR implementations...
             if do_variance:
                 result = Integrate1dResult(intpl.position * unit.scale,
@@ -1446,7 +1766,7 @@ class AzimuthalIntegrator(Geometry):
                         reset = "unit was changed"
                     if integr.bins != npt:
                         reset = "number of points changed"
-                    if integr.size != data.size:
+                    if integr.size != size:
                         reset = "input image size changed"
                     if integr.empty != empty:
                         reset = "empty value changed"
@@ -1607,6 +1927,111 @@ class AzimuthalIntegrator(Geometry):
     _integrate1d_ng = integrate1d_ng
     integrate1d = integrate1d_ng
 
+    def integrate1d_sparse(self, sparse, npt,
+                           correctSolidAngle=True, error_model=None,
+                           radial_range=None, azimuth_range=None,
+                           mask=None, polarization_factor=None,
+                           method=("bbox", "csr", "python"), unit=units.Q,
+                           normalization_factor=1.0, metadata=None):
+        """Calculate the azimuthal integration (1d) of a SparseFrame, as
+        produced by `sparsify`, without densifying it.
+
+        The result is the one of `integrate1d_ng` on the densified image.
+        Only the Python implementation of the CSR engine integrates sparse
+        frames: this engine is built like in `integrate1d_ng` (or reused) and
+        the normalization arrays are folded into it once, so that each frame
+        costs in proportion to its number of peaks.
+
+        :param SparseFrame sparse: sparse frame with the map of the radial position of the pixels
+        :param int npt: number of points in the output pattern
+        :param bool correctSolidAngle: correct for solid angle of each pixel if True
+        :param str error_model: None or "poisson" (variance = I)
+        :param radial_range: The lower and upper range of the radial unit. If not provided, range is simply (min, max).
+        :param azimuth_range: The lower and upper range of the azimuthal angle in degree. If not provided, range is simply (min, max).
+        :param ndarray mask: array with  0 for valid pixels, all other are masked (static mask)
+        :param float polarization_factor: polarization factor between -1 (vertical) and +1 (horizontal), None for no correction
+        :param IntegrationMethod method: the splitting is used, the algorithm is always CSR with the Python implementation
+        :param Unit unit: Output units, can be "q_nm^-1" (default), "2th_deg", "r_mm" for now.
+        :param float normalization_factor: Value of a normalization monitor
+        :param metadata: JSON serializable object containing the metadata, usually a dictionary.
+        :return: Integrate1dResult namedtuple with (q,I,sigma) +extra informations in it.
+        """
+        method = self._normalize_method(method, dim=1, default=self.DEFAULT_METHOD_1D)
+        if not (method.algo_lower == "csr" and method.impl_lower == "python"):
+            method = IntegrationMethod.select_method(1, method.split_lower, "csr", "python")[0]
+        shape = sparse.shape or sparse.mask.shape
+        size = int(numpy.prod(shape))
+        unit = units.to_unit(unit)
+        poissonian = bool(error_model) and error_model.lower().startswith("poisson")
+        pos0_range = None if not radial_range else tuple(radial_range[i] / unit.scale for i in (0, -1))
+        pos1_range = None if azimuth_range is None else self.normalize_azimuth_range(azimuth_range)
+
+        if mask is None:
+            has_mask = "from detector"
+            mask_crc = None if self.mask is None else self.detector.get_mask_crc()
+            if mask_crc is None:
+                has_mask = False
+        else:
+            has_mask = "user provided"
+            mask_crc = crc32(numpy.ascontiguousarray(mask))
+
+        if correctSolidAngle:
+            solidangle = self.solidAngleArray(shape, correctSolidAngle)
+            solidangle_crc = self._cached_array[f"solid_angle#{self._dssa_order}_crc"]
+        else:
+            solidangle_crc = solidangle = None
+
+        if polarization_factor is None:
+            polarization = polarization_crc = None
+        else:
+            polarization, polarization_crc = self.polarization(shape, polarization_factor, with_checksum=True)
+
+        engine = self.engines.get(method)
+        integr = None if engine is None else engine.engine
+        if (integr is None or integr.unit != unit or integr.bins != npt or integr.size != size or
+                integr.empty != self._empty or integr.mask_checksum != mask_crc or
+                integr.pos0_range != pos0_range or integr.pos1_range != pos1_range):
+            # Build the engine the same way as for dense frames
+            self.integrate1d_ng(numpy.zeros(shape, dtype=numpy.float32), npt,
+                                correctSolidAngle=correctSolidAngle,
+                                radial_range=radial_range, azimuth_range=azimuth_range,
+                                mask=mask, polarization_factor=polarization_factor,
+                                method=method, unit=unit)
+            engine = self.engines[method]
+            integr = engine.engine
+        options = (("static_normalization", (solidangle_crc, polarization_crc, None)),)
+        if not self._is_configured(integr, options):
+            with engine.lock:
+                integr = self._configure_engine(engine.engine, options, solidangle, polarization)
+                engine.set_engine(integr)
+        intpl = integr.integrate_sparse(sparse,
+                                        poissonian=poissonian,
+                                        solidangle=solidangle,
+                                        polarization=polarization,
+                                        normalization_factor=normalization_factor,
+                                        solidangle_checksum=solidangle_crc,
+                                        polarization_checksum=polarization_crc)
+        if poissonian:
+            result = Integrate1dResult(intpl.position * unit.scale,
+                                       intpl.intensity,
+                                       intpl.sigma)
+            result._set_sum_variance(intpl.variance)
+        else:
+            result = Integrate1dResult(intpl.position * unit.scale,
+                                       intpl.intensity)
+        result._set_compute_engine(integr.__module__ + "." + integr.__class__.__name__)
+        result._set_unit(integr.unit)
+        result._set_sum_signal(intpl.signal)
+        result._set_sum_normalization(intpl.normalization)
+        result._set_count(intpl.count)
+        result._set_method(method)
+        result._set_has_mask_applied(has_mask)
+        result._set_polarization_factor(polarization_factor)
+        result._set_normalization_factor(normalization_factor)
+        result._set_method_called("integrate1d_sparse")
+        result._set_metadata(metadata)
+        return result
+
     def integrate_radial(self, data, npt, npt_rad=100,
                          correctSolidAngle=True,
                          radial_range=None, azimuth_range=None,
@@ -2120,13 +2545,13 @@ class AzimuthalIntegrator(Geometry):
 
         Multi algorithm implementation (tries to be bullet proof)
 
-        :param data: 2D array from the Detector/CCD camera
+        :param data: 2D array from the Detector/CCD camera, or 3D stack of frames integrated at once
         :type data: ndarray
         :param npt_rad: number of points in the radial direction
         :type npt_rad: int
         :param npt_azim: number of points in the azimuthal direction
         :type npt_azim: int
-        :param filename: output image (as edf format)
+        :param filename: output image (as edf format), single frame only
         :type filename: str
         :param correctSolidAngle: correct for solid angle of each pixel if True
         :type correctSolidAngle: bool
@@ -2158,14 +2583,40 @@ class AzimuthalIntegrator(Geometry):
         :type unit: pyFAI.units.Unit
         :param safe: Do some extra checks to ensure LUT is still valid. False is faster.
         :type safe: bool
-        :param normalization_factor: Value of a normalization monitor
+        :param normalization_factor: Value of a normalization monitor, one value per frame for a stack
         :type normalization_factor: float
         :param metadata: JSON serializable object containing the metadata, usually a dictionary.
         :return: azimuthaly regrouped intensity, q/2theta/r pos. and chi pos.
         :rtype: Integrate2dResult, dict
+
+        When `data` is a stack of frames, the intensity, sigma, ... have one image per frame.
+        With the CSR method in Cython all frames are integrated with a single pass over
+        the sparse matrix, other methods loop over frames.
         """
         method = self._normalize_method(method, dim=2, default=self.DEFAULT_METHOD_2D)
         assert method.dimension == 2
+        if data.ndim == 3:
+            if filename is not None:
+                raise RuntimeError("Saving the integration of a stack of frames is not supported")
+            if not (method.algo_lower == "csr" and method.impl_lower == "cython"):
+                nframes = data.shape[0]
+                normalization_factor = numpy.broadcast_to(normalization_factor, (nframes,))
+                results = [self.integrate2d_ng(data[i], npt_rad, npt_azim,
+                                               correctSolidAngle=correctSolidAngle,
+                                               variance=None if variance is None else variance[i],
+                                               error_model=error_model,
+                                               radial_range=radial_range, azimuth_range=azimuth_range,
+                                               mask=mask, dummy=dummy, delta_dummy=delta_dummy,
+                                               polarization_factor=polarization_factor,
+                                               dark=dark, flat=flat, method=method, unit=unit,
+                                               safe=safe, normalization_factor=normalization_factor[i],
+                                               metadata=metadata)
+                           for i in range(nframes)]
+                return self._stack_results(results)
+            shape = data.shape[1:]
+        else:
+            shape = data.shape
+        size = int(numpy.prod(shape))
         npt = (npt_rad, npt_azim)
         unit = units.to_unit(unit)
         pos0_scale = unit.scale
@@ -2182,8 +2633,6 @@ class AzimuthalIntegrator(Geometry):
             mask = numpy.ascontiguousarray(mask)
             mask_crc = crc32(mask)
 
-        shape = data.shape
-
         if radial_range:
             radial_range = tuple([i / pos0_scale for i in radial_range])
 
@@ -2202,8 +2651,9 @@ class AzimuthalIntegrator(Geometry):
 
         if correctSolidAngle:
             solidangle = self.solidAngleArray(shape, correctSolidAngle)
+            solidangle_crc = self._cached_array[f"solid_angle#{self._dssa_order}_crc"]
         else:
-            solidangle = None
+            solidangle_crc = solidangle = None
 
         if polarization_factor is None:
             polarization = polarization_crc = None
@@ -2239,64 +2689,89 @@ class AzimuthalIntegrator(Geometry):
         if method.algo_lower in ("csr", "lut"):
             intpl = None
             cython_method = IntegrationMethod.select_method(method.dimension, method.split_lower, method.algo_lower, "cython")[0]
-            if cython_method not in self.engines:
-                cython_engine = self.engines[cython_method] = Engine()
-            else:
-                cython_engine = self.engines[cython_method]
-            with cython_engine.lock:
+            cython_engine = self.engines.get(cython_method)
+            if cython_engine is None:
+                cython_engine = self.engines.setdefault(cython_method, Engine())
+            cython_options = self._get_engine_options(method, solidangle_crc, polarization_crc) \
+                             if method.impl_lower == "cython" else ()
+            cache_key = EngineCache.get_key(cython_method, unit, npt, shape, mask_crc,
+                                            radial_range, azimuth_range, empty, cython_options)
+            # Lock-free access when the engine matches the configuration, the lock is only needed to rebuild it
+            cython_integr = cython_engine.get_engine(cache_key)
+            if (cython_integr is None) and (not safe):
                 cython_integr = cython_engine.engine
-                cython_reset = None
-
-                if cython_integr is None:
-                    cython_reset = "of first initialization"
-                if (not cython_reset) and safe:
-                    if cython_integr.unit != unit:
-                        cython_reset = "unit was changed"
-                    if cython_integr.bins != npt:
-                        cython_reset = "number of points changed"
-                    if cython_integr.size != data.size:
-                        cython_reset = "input image size changed"
-                    if cython_integr.empty != empty:
-                        cython_reset = "empty value changed"
-                    if (mask is not None) and (not cython_integr.check_mask):
-                        cython_reset = f"mask but {method.algo_lower.upper()} was without mask"
-                    elif (mask is None) and (cython_integr.cmask is not None):
-                        cython_reset = f"no mask but { method.algo_lower.upper()} has mask"
-                    elif (mask is not None) and (cython_integr.mask_checksum != mask_crc):
-                        cython_reset = "mask changed"
-                    if (radial_range is None) and (cython_integr.pos0_range is not None):
-                        cython_reset = f"radial_range was defined in { method.algo_lower.upper()}"
-                    elif (radial_range is not None) and (cython_integr.pos0_range != radial_range):
-                        cython_reset = f"radial_range is defined but differs in %s" % method.algo_lower.upper()
-                    if (azimuth_range is None) and (cython_integr.pos1_range is not None):
-                        cython_reset = f"azimuth_range not defined and {method.algo_lower.upper()} had azimuth_range defined"
-                    elif (azimuth_range is not None) and (cython_integr.pos1_range != azimuth_range):
-                        cython_reset = f"azimuth_range requested and {method.algo_lower.upper()}'s azimuth_range don't match"
-                if cython_reset:
-                    logger.info("AI.integrate2d_ng: Resetting Cython integrator because %s", cython_reset)
-                    split = method.split_lower
-                    if split == "pseudo":
-                        split = "full"
-                    try:
-                        if method.algo_lower == "csr":
-                            cython_integr = self.setup_CSR(shape, npt, mask,
-                                                           radial_range, azimuth_range,
-                                                           mask_checksum=mask_crc,
-                                                           unit=unit, split=split,
-                                                           empty=empty, scale=False)
-                        else:
-                            cython_integr = self.setup_LUT(shape, npt, mask,
-                                                           radial_range, azimuth_range,
-                                                           mask_checksum=mask_crc,
-                                                           unit=unit, split=split,
-                                                           empty=empty, scale=False)
-                    except MemoryError:  # CSR method is hungry...
-                        logger.warning("MemoryError: falling back on forward implementation")
-                        cython_integr = None
-                        self.reset_engines()
-                        method = self.DEFAULT_METHOD_1D
-                    else:
-                        cython_engine.set_engine(cython_integr)
+            if cython_integr is None:
+                with cython_engine.lock:
+                    cython_integr = cython_engine.engine
+                    cython_reset = None
+
+                    if cython_integr is None:
+                        cython_reset = "of first initialization"
+                    if (not cython_reset) and safe:
+                        if cython_integr.unit != unit:
+                            cython_reset = "unit was changed"
+                        if cython_integr.bins != npt:
+                            cython_reset = "number of points changed"
+                        if cython_integr.size != size:
+                            cython_reset = "input image size changed"
+                        if cython_integr.empty != empty:
+                            cython_reset = "empty value changed"
+                        if (mask is not None) and (not cython_integr.check_mask):
+                            cython_reset = f"mask but {method.algo_lower.upper()} was without mask"
+                        elif (mask is None) and (cython_integr.cmask is not None):
+                            cython_reset = f"no mask but { method.algo_lower.upper()} has mask"
+                        elif (mask is not None) and (cython_integr.mask_checksum != mask_crc):
+                            updated = None
+                            if (not cython_reset) and (method.algo_lower == "csr"):
+                                updated = self._update_mask(cython_integr, mask, mask_crc)
+                            if updated is None:
+                                cython_reset = "mask changed"
+                            else:
+                                cython_integr = updated
+                        if (radial_range is None) and (cython_integr.pos0_range is not None):
+                            cython_reset = f"radial_range was defined in { method.algo_lower.upper()}"
+                        elif (radial_range is not None) and (cython_integr.pos0_range != radial_range):
+                            cython_reset = f"radial_range is defined but differs in %s" % method.algo_lower.upper()
+                        if (azimuth_range is None) and (cython_integr.pos1_range is not None):
+                            cython_reset = f"azimuth_range not defined and {method.algo_lower.upper()} had azimuth_range defined"
+                        elif (azimuth_range is not None) and (cython_integr.pos1_range != azimuth_range):
+                            cython_reset = f"azimuth_range requested and {method.algo_lower.upper()}'s azimuth_range don't match"
+                    if (not cython_reset) and (not self._is_configured(cython_integr, cython_options)):
+                        # Same matrix with other options: maybe in the engine cache, else configured below
+                        cached = self._swap_engine(cython_engine, cache_key)
+                        if cached is not None:
+                            cython_integr = cached
+                    if cython_reset:
+                        logger.info("AI.integrate2d_ng: Resetting Cython integrator because %s", cython_reset)
+                        cython_integr = self._swap_engine(cython_engine, cache_key)
+                        if cython_integr is not None:
+                            logger.info("AI.integrate2d_ng: Cython integrator retrieved from the engine cache")
+                            cython_reset = None
+                    if cython_reset:
+                        split = method.split_lower
+                        if split == "pseudo":
+                            split = "full"
+                        try:
+                            if method.algo_lower == "csr":
+                                cython_integr = self.setup_CSR(shape, npt, mask,
+                                                               radial_range, azimuth_range,
+                                                               mask_checksum=mask_crc,
+                                                               unit=unit, split=split,
+                                                               empty=empty, scale=False)
+                            else:
+                                cython_integr = self.setup_LUT(shape, npt, mask,
+                                                               radial_range, azimuth_range,
+                                                               mask_checksum=mask_crc,
+                                                               unit=unit, split=split,
+                                                               empty=empty, scale=False)
+                        except MemoryError:  # CSR method is hungry...
+                            logger.warning("MemoryError: falling back on forward implementation")
+                            cython_integr = None
+                            self.reset_engines()
+                            method = self.DEFAULT_METHOD_1D
+                    if cython_integr is not None:
+                        cython_integr = self._configure_engine(cython_integr, cython_options, solidangle, polarization)
+                        cython_engine.set_engine(cython_integr, cache_key)
             # This whole block uses CSR, Now we should treat all the various implementation: Cython, OpenCL and finally Python.
             if method.impl_lower != "cython":
                 # method.impl_lower in ("opencl", "python"):
@@ -2316,7 +2791,7 @@ class AzimuthalIntegrator(Geometry):
                             reset = "unit changed"
                         if integr.bins != numpy.prod(npt):
                             reset = "number of points changed"
-                        if integr.size != data.size:
+                        if integr.size != size:
                             reset = "input image size changed"
                         if integr.empty != empty:
                             reset = "empty value changed"
@@ -2359,7 +2834,8 @@ class AzimuthalIntegrator(Geometry):
                             error = True
                         else:
                             error = False
-                            cython_engine.set_engine(cython_integr)
+                            with cython_engine.lock:
+                                cython_engine.set_engine(cython_integr, cache_key)
                 if not error:
                     if method in self.engines:
                         ocl_py_engine = self.engines[method]
@@ -2405,16 +2881,25 @@ class AzimuthalIntegrator(Geometry):
                                                        normalization_factor=normalization_factor)
             if intpl is None:  # fallback if OpenCL failed or default cython
                 # The integrator has already been initialized previously
-                intpl = cython_integr.integrate_ng(data,
-                                                   variance=variance,
-                                                   # poissonian=poissonian,
-                                                   dummy=dummy,
-                                                   delta_dummy=delta_dummy,
-                                                   dark=dark,
-                                                   flat=flat,
-                                                   solidangle=solidangle,
-                                                   polarization=polarization,
-                                                   normalization_factor=normalization_factor)
+                kwargs = {}
+                if data.ndim == 3:
+                    integrate = cython_integr.integrate_ng_stack
+                else:
+                    integrate = cython_integr.integrate_ng
+                    if method.algo_lower == "csr":
+                        kwargs["solidangle_checksum"] = solidangle_crc
+                        kwargs["polarization_checksum"] = polarization_crc
+                intpl = integrate(data,
+                                  variance=variance,
+                                  # poissonian=poissonian,
+                                  dummy=dummy,
+                                  delta_dummy=delta_dummy,
+                                  dark=dark,
+                                  flat=flat,
+                                  solidangle=solidangle,
+                                  polarization=polarization,
+                                  normalization_factor=normalization_factor,
+                                  **kwargs)
             I = intpl.intensity
             bins_rad = intpl.radial
             bins_azim = intpl.azimuthal
@@ -2491,7 +2976,7 @@ class AzimuthalIntegrator(Geometry):
                                 reset = "unit changed"
                             if (integr.bins_radial, integr.bins_azimuthal) != npt:
                                 reset = "number of points changed"
-                            if integr.size != data.size:
+                            if integr.size != size:
                                 reset = "input image size changed"
                             if (mask is not None) and (not integr.check_mask):
                                 reset = "mask but CSR was without mask"
@@ -2652,6 +3137,40 @@ class AzimuthalIntegrator(Geometry):
 
     integrate2d = _integrate2d_ng = integrate2d_ng
 
+    @staticmethod
+    def _stack_results(results):
+        """Merge the integration results of individual frames into the result of a stack
+
+        :param results: list of Integrate1dResult or Integrate2dResult, one per frame
+        :return: Integrate1dResult or Integrate2dResult with one line/image per frame
+        """
+        first = results[0]
+
+        def stack(name):
+            if getattr(first, name) is None:
+                return None
+            return numpy.stack([getattr(res, name) for res in results])
+
+        if isinstance(first, Integrate1dResult):
+            result = Integrate1dResult(first.radial, stack("intensity"), stack("sigma"))
+        else:
+            result = Integrate2dResult(stack("intensity"), first.radial, first.azimuthal, stack("sigma"))
+        result._set_sum_signal(stack("sum_signal"))
+        result._set_sum_variance(stack("sum_variance"))
+        result._set_sum_normalization(stack("sum_normalization"))
+        result._set_count(stack("count"))
+        result._set_method(first.method)
+        result._set_method_called(first.method_called)
+        result._set_compute_engine(first.compute_engine)
+        result._set_unit(first.unit)
+        result._set_has_dark_correction(first.has_dark_correction)
+        result._set_has_flat_correction(first.has_flat_correction)
+        result._set_has_mask_applied(first.has_mask_applied)
+        result._set_polarization_factor(first.polarization_factor)
+        result._set_normalization_factor(numpy.array([res.normalization_factor for res in results]))
+        result._set_metadata(first.metadata)
+        return result
+
     @deprecated(since_version="0.14", reason="Use the class DefaultAiWriter")
     def save1D(self, filename, dim1, I, error=None, dim1_unit=units.TTH,
                has_dark=False, has_flat=False, polarization_factor=None, normalization_factor=None):
@@ -3174,8 +3693,9 @@ class AzimuthalIntegrator(Geometry):
 
         if correctSolidAngle:
             solidangle = self.solidAngleArray(data.shape, correctSolidAngle)
+            solidangle_crc = self._cached_array[f"solid_angle#{self._dssa_order}_crc"]
         else:
-            solidangle = None
+            solidangle_crc = solidangle = None
 
         if polarization_factor is None:
             polarization = polarization_crc = None
@@ -3191,6 +3711,10 @@ class AzimuthalIntegrator(Geometry):
                 cython_engine = self.engines[cython_method] = Engine()
             else:
                 cython_engine = self.engines[cython_method]
+            # Same configuration as in integrate1d_ng, so that the engine is shared
+            cython_options = self._get_engine_options(cython_method, solidangle_crc, polarization_crc)
+            cache_key = EngineCache.get_key(cython_method, unit, npt, data.shape, mask_crc,
+                                            radial_range, azimuth_range, self._empty, cython_options)
             with cython_engine.lock:
                 # Validate that the engine used is the proper one
                 cython_integr = cython_engine.engine
@@ -3211,7 +3735,16 @@ class AzimuthalIntegrator(Geometry):
                     elif (mask is None) and (cython_integr.check_mask):
                         cython_reset = "no mask but CSR has mask"
                     elif (mask is not None) and (cython_integr.mask_checksum != mask_crc):
-                        cython_reset = "mask changed"
+                        updated = None
+                        if (not cython_reset) and (method.algo_lower == "csr"):
+                            updated = self._update_mask(cython_integr, mask, mask_crc)
+                        if updated is None:
+                            cython_reset = "mask changed"
+                        else:
+                            cython_integr = updated
+                            cython_engine.set_engine(self._configure_engine(cython_integr, cython_options,
+                                                                            solidangle, polarization),
+                                                     cache_key)
                     if (radial_range is None) and (cython_integr.pos0_range is not None):
                         cython_reset = "radial_range was defined in CSR"
                     elif (radial_range is not None) and cython_integr.pos0_range != (min(radial_range), max(radial_range) * EPS32):
@@ -3222,6 +3755,11 @@ class AzimuthalIntegrator(Geometry):
                         cython_reset = "azimuth_range requested and CSR's azimuth_range don't match"
                 if cython_reset:
                     logger.info("AI.sigma_clip_ng: Resetting Cython integrator because %s", cython_reset)
+                    cython_integr = self._swap_engine(cython_engine, cache_key)
+                    if cython_integr is not None:
+                        logger.info("AI.sigma_clip_ng: Cython integrator retrieved from the engine cache")
+                        cython_reset = None
+                if cython_reset:
                     split = method.split_lower
                     if split == "pseudo":
                         split = "full"
@@ -3239,7 +3777,9 @@ class AzimuthalIntegrator(Geometry):
                         self.reset_engines()
                         method = self.DEFAULT_METHOD_1D
                     else:
-                        cython_engine.set_engine(cython_integr)
+                        cython_engine.set_engine(self._configure_engine(cython_integr, cython_options,
+                                                                        solidangle, polarization),
+                                                 cache_key)
             if method not in self.engines:
                 # instanciated the engine
                 engine = self.engines[method] = Engine()
@@ -3281,7 +3821,7 @@ class AzimuthalIntegrator(Geometry):
 
                 if reset:
                     logger.info("ai.sigma_clip_ng: Resetting ocl_csr integrator because %s", reset)
-                    csr_integr = self.engines[cython_method].engine
+                    csr_integr = cython_integr
                     if method.impl_lower == "opencl":
                         try:
                             integr = method.class_funct_ng.klass(csr_integr.lut,
@@ -3599,6 +4139,20 @@ class AzimuthalIntegrator(Geometry):
 
     empty = property(get_empty, set_empty)
 
+    def get_sparse_cache(self):
+        return self._sparse_cache
+
+    def set_sparse_cache(self, value):
+        """Set the persistent on-disk cache for CSR/LUT sparse matrices
+
+        :param value: SparseCache instance, directory name or None to disable
+        """
+        if (value is not None) and not isinstance(value, SparseCache):
+            value = SparseCache(value)
+        self._sparse_cache = value
+
+    sparse_cache = property(get_sparse_cache, set_sparse_cache)
+
     def __getnewargs_ex__(self):
         "Helper function for pickling ai"
         return (self.dist, self.poni1, self.poni2,
@@ -3624,8 +4178,6 @@ class AzimuthalIntegrator(Geometry):
 
         :param state: the state of the object
         """
-        for statekey, statevalue in state.items():
-            setattr(self, statekey, statevalue)
-        self._sem = threading.Semaphore()
+        Geometry.__setstate__(self, state)
         self._lock = threading.Semaphore()
         self.engines = {}
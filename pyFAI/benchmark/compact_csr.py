@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#    Copyright (C) 2022-2022 European Synchrotron Radiation Facility, Grenoble, France
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Benchmark of the compact storage of the CSR matrix (engine option
+"compact") against the float32 matrix, for the 1D integration with the
+Cython engine shared by several threads.
+
+Usage::
+
+    python -m pyFAI.benchmark.compact_csr --detector Pilatus1M --threads 1 2 4
+"""
+
+__author__ = "Jérôme Kieffer"
+__date__ = "18/10/2022"
+__license__ = "MIT"
+__copyright__ = "2022 European Synchrotron Radiation Facility, Grenoble, France"
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+from .. import detector_factory
+from ..azimuthalIntegrator import AzimuthalIntegrator
+
+METHOD = ("full", "csr", "cython")
+
+
+def bench(ai, data, npt, nthreads, nframes, compact, unit="q_nm^-1"):
+    """Measure the number of frames integrated per second
+
+    :param ai: AzimuthalIntegrator
+    :param data: frame to integrate
+    :param npt: number of radial bins
+    :param nthreads: number of threads integrating frames concurrently
+    :param nframes: number of frames to integrate
+    :param compact: use the compact storage of the matrix
+    :return: frames per second, bytes of matrix read per frame, result
+    """
+    ai.engine_options = {"compact": compact}
+    result = ai.integrate1d_ng(data, npt, method=METHOD, unit=unit)
+    integr = ai.engines[result.method].engine
+    if compact:
+        nbytes = 4 * integr.compact_nnz
+    else:
+        nbytes = integr.data.nbytes + integr.indices.nbytes
+
+    def integrate(_):
+        return ai.integrate1d_ng(data, npt, method=METHOD, unit=unit)
+
+    with ThreadPoolExecutor(nthreads) as pool:
+        t0 = time.perf_counter()
+        list(pool.map(integrate, range(nframes)))
+        elapsed = time.perf_counter() - t0
+    return nframes / elapsed, nbytes, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-d", "--detector", default="Pilatus1M", help="name of the detector")
+    parser.add_argument("-t", "--threads", type=int, nargs="+", default=None,
+                        help="numbers of threads to test, by default 1, 2, 4 ... up to the number of cores")
+    parser.add_argument("-n", "--frames", type=int, default=50, help="number of frames integrated per measurement")
+    parser.add_argument("--npt", type=int, default=1000, help="number of radial bins")
+    options = parser.parse_args(argv)
+
+    detector = detector_factory(options.detector)
+    ai = AzimuthalIntegrator(dist=0.1, detector=detector, wavelength=1e-10)
+    ai.engine_cache_size = 1 << 32  # keep both engines
+    data = numpy.random.poisson(100, detector.shape).astype(numpy.float32)
+    threads = options.threads
+    if not threads:
+        threads = [1 << i for i in range(max(1, os.cpu_count()).bit_length())]
+
+    print(f"Detector {detector.name} {detector.shape}, {options.npt} bins, {options.frames} frames, method {METHOD}")
+    print(f"{'threads':>8} {'float32 (fps)':>14} {'compact (fps)':>14} {'speed-up':>9}")
+    for nthreads in threads:
+        fps_ref, nbytes_ref, ref = bench(ai, data, options.npt, nthreads, options.frames, False)
+        fps, nbytes, res = bench(ai, data, options.npt, nthreads, options.frames, True)
+        print(f"{nthreads:8d} {fps_ref:14.1f} {fps:14.1f} {fps / fps_ref:9.2f}")
+    valid = ref.count > 0
+    error = abs(res.intensity[valid] - ref.intensity[valid]) / abs(ref.intensity[valid]).max()
+    print(f"Matrix read per frame: float32 {nbytes_ref / 1e6:.1f} MB, compact {nbytes / 1e6:.1f} MB")
+    print(f"Maximum relative error on the intensity: {error.max():.2e}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
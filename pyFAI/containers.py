@@ -62,6 +62,10 @@ class IntegrateResult(tuple):
         self._method_called = None
         self._compute_engine = None
 
+    def __reduce__(self):
+        "Helper function for pickling: the content of the tuple and the attributes"
+        return (self.__class__, tuple(self), self.__dict__)
+
     @property
     def method(self):
         """return the name of the integration method _actually_ used, 
@@ -33,7 +33,7 @@ import logging
 import warnings
 logger = logging.getLogger(__name__)
 import numpy
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, issparse
 from .preproc import preproc as preproc_np
 from ..utils.mathutil import interp_filter
 try:
@@ -47,8 +47,58 @@ from ..utils import calc_checksum
 from ..containers import Integrate1dtpl, Integrate2dtpl
 
 
+def _interpolation_matrix(position, xp):
+    """Sparse matrix performing the linear interpolation of `numpy.interp`
+
+    `matrix.dot(fp)` equals `numpy.interp(position, xp, fp)` for any `fp`,
+    rows of non-finite positions are empty.
+
+    :param position: 1D array with the positions where to interpolate
+    :param xp: 1D array with the increasing positions of the known points
+    :return: csr_matrix of shape (position.size, xp.size)
+    """
+    position = numpy.ascontiguousarray(position, dtype=numpy.float64).ravel()
+    xp = numpy.ascontiguousarray(xp, dtype=numpy.float64).ravel()
+    shape = (position.size, xp.size)
+    rows = numpy.where(numpy.isfinite(position))[0]
+    if xp.size == 1:
+        return csr_matrix((numpy.ones(rows.size), (rows, numpy.zeros(rows.size, dtype=int))), shape=shape)
+    x = position[rows]
+    left = numpy.clip(numpy.searchsorted(xp, x, side="right") - 1, 0, xp.size - 2)
+    t = numpy.clip((x - xp[left]) / (xp[left + 1] - xp[left]), 0.0, 1.0)
+    return csr_matrix((numpy.concatenate((1.0 - t, t)),
+                       (numpy.concatenate((rows, rows)), numpy.concatenate((left, left + 1)))),
+                      shape=shape)
+
+
+def _nbytes(objects):
+    """Memory used by arrays and sparse matrices, buffers shared by several
+    of them are counted once
+
+    :param objects: iterable of arrays, sparse matrices, or tuples and dict of them. Others are ignored.
+    :return: size in bytes
+    """
+    sizes = {}
+    pending = list(objects)
+    while pending:
+        obj = pending.pop()
+        if isinstance(obj, (tuple, list)):
+            pending.extend(obj)
+        elif isinstance(obj, dict):
+            pending.extend(obj.values())
+        elif issparse(obj):
+            pending.extend([getattr(obj, name, None) for name in ("data", "indices", "indptr")])
+        elif isinstance(obj, numpy.ndarray):
+            address = obj.__array_interface__["data"][0]
+            sizes[address] = max(sizes.get(address, 0), obj.nbytes)
+    return sum(sizes.values())
+
+
 class CSRIntegrator(object):
 
+    STACK_BUFFER_SIZE = 1 << 28
+    "Memory (in bytes) for the block of preprocessed frames integrated at once by `integrate_stack`"
+
     def __init__(self,
                  image_size,
                  lut=None,
@@ -69,6 +119,8 @@ class CSRIntegrator(object):
         self.data = None
         self.indices = None
         self.indptr = None
+        self._static = None  # static normalization, see set_static_normalization
+        self._compact = None  # matrices restricted to valid pixels, see _get_compact
         if lut is not None:
             assert len(lut) == 3
             self.set_matrix(*lut)
@@ -86,6 +138,144 @@ class CSRIntegrator(object):
         self.bins = len(indptr) - 1
         self._csr = csr_matrix((data, indices, indptr), shape=(self.bins, self.size))
         self._csr2 = csr_matrix((data * data, indices, indptr), shape=(self.bins, self.size))  # contains the coef squared, used for variance propagation
+        self._static = None
+        self._compact = None
+
+    @property
+    def nbytes(self):
+        """Memory used by the integrator: the matrices, the static
+        normalization and the other arrays it holds. Arrays sharing their
+        buffer are counted once.
+        """
+        return _nbytes(self.__dict__.values())
+
+    @property
+    def valid_pixels(self):
+        """Gather index: sorted indices of the pixels which contribute to the
+        matrix. Masked pixels, excluded when the matrix is built, are absent.
+        """
+        return self._get_compact()[2]
+
+    def _get_compact(self):
+        """Provides the matrices restricted to the columns of valid pixels
+
+        :return: csr, csr2 and gather index. The index is None when all pixels are valid.
+        """
+        if self._compact is None:
+            valid = numpy.bincount(self.indices, minlength=self.size).astype(bool)
+            if valid.all():
+                self._compact = (self._csr, self._csr2, None)
+            else:
+                gather = numpy.where(valid)[0].astype(numpy.int32)
+                position = numpy.cumsum(valid, dtype=numpy.int32) - 1
+                indices = position[self.indices]
+                shape = (self._csr.shape[0], len(gather))
+                self._compact = (csr_matrix((self.data, indices, self.indptr), shape=shape),
+                                 csr_matrix((self.data * self.data, indices, self.indptr), shape=shape),
+                                 gather)
+        return self._compact
+
+    def set_static_normalization(self, solidangle=None, polarization=None, absorption=None,
+                                 solidangle_checksum=None, polarization_checksum=None, absorption_checksum=None):
+        """Precompute the normalization due to arrays which do not change from
+        one frame to another: solid-angle, polarization and absorption.
+
+        When `integrate` is later called with arrays having the same
+        checksums, only the signal and the variance are calculated for each
+        frame. Only per-pixel and per-bin arrays are stored, the matrix is
+        not duplicated. This modifies the integrator: call it before the
+        integrator is shared.
+
+        :param solidangle: solid-angle array (if any)
+        :param polarization: polarization correction array (if any)
+        :param absorption: absorption correction array (if any)
+        :param solidangle_checksum: CRC32 checksum of the solid-angle array, calculated if None
+        :param polarization_checksum: CRC32 checksum of the polarization array, calculated if None
+        :param absorption_checksum: CRC32 checksum of the absorption array, calculated if None
+        """
+        checksum = self._get_checksum(solidangle, polarization, absorption,
+                                      solidangle_checksum, polarization_checksum, absorption_checksum)
+        if self.static_checksum == checksum:
+            return
+        pixel_norm = numpy.ones(self.size, dtype=numpy.float32)
+        for array in (polarization, solidangle, absorption):
+            if array is not None:
+                pixel_norm *= numpy.ascontiguousarray(array, dtype=numpy.float32).ravel()
+        pixel_norm[numpy.isnan(pixel_norm)] = 0.0
+        # Statically invalid pixels do not contribute to the normalization
+        valid = pixel_norm != 0.0
+        self._static = {"checksum": checksum,
+                        "pixel_norm": pixel_norm,
+                        "valid": valid,
+                        "norm": self._csr.dot(pixel_norm.astype(numpy.float64)),
+                        "count": self._csr.dot(valid.astype(numpy.float64))}
+
+    def reset_static_normalization(self):
+        """Discard the precomputed static normalization"""
+        self._static = None
+
+    @property
+    def static_checksum(self):
+        """Checksums of the solid-angle, polarization and absorption arrays
+        of the static normalization, None if there is none"""
+        static = self._static
+        if static is not None:
+            return static["checksum"]
+
+    @staticmethod
+    def _get_checksum(solidangle, polarization, absorption,
+                      solidangle_checksum=None, polarization_checksum=None, absorption_checksum=None):
+        """Checksums identifying the correction arrays of a static normalization
+
+        :return: 3-tuple of CRC32 checksums, None for missing arrays
+        """
+        return tuple(None if array is None else (checksum or calc_checksum(array))
+                     for array, checksum in ((solidangle, solidangle_checksum),
+                                             (polarization, polarization_checksum),
+                                             (absorption, absorption_checksum)))
+
+    def _integrate_static(self, static, signal, variance, poissonian, dummy, delta_dummy, dark, normalization_factor):
+        """Integration with the precomputed static normalization `static`
+
+        The contribution of the pixels discarded dynamically (dummy or NaN) is
+        removed from the static normalization.
+
+        :return: array nbins x 4 with signal, variance, normalization and count
+        """
+        value = numpy.ascontiguousarray(signal, dtype=numpy.float32).ravel()
+        valid = numpy.logical_not(numpy.isnan(value))
+        if dummy is not None:
+            dummy = numpy.float32(dummy)
+            if delta_dummy:
+                valid &= abs(value - dummy) > numpy.float32(delta_dummy)
+            else:
+                valid &= (value != dummy)
+        if poissonian:
+            var = numpy.maximum(value, 1.0)
+        elif variance is not None:
+            var = numpy.ascontiguousarray(variance, dtype=numpy.float32).ravel()
+        else:
+            var = numpy.zeros_like(value)
+        if dark is not None:
+            value = value - numpy.ascontiguousarray(dark, dtype=numpy.float32).ravel()
+        valid &= numpy.logical_not(numpy.logical_or(numpy.isnan(value), numpy.isnan(var)))
+        # Only the dynamically invalid pixels which are statically valid are removed
+        invalid = numpy.logical_and(static["valid"], numpy.logical_not(valid))
+        valid &= static["valid"]
+        res = numpy.empty((numpy.prod(self.bins), 4), dtype=numpy.float32)
+        res[:, 0] = self._csr.dot(numpy.where(valid, value, 0.0))
+        res[:, 1] = self._csr2.dot(numpy.where(valid, var, 0.0))
+        norm = static["norm"]
+        count = static["count"]
+        if invalid.any():
+            norm = norm - self._csr.dot(numpy.where(invalid, static["pixel_norm"], 0.0))
+            count = count - self._csr.dot(invalid.astype(numpy.float32))
+            empty = self._csr.dot(valid.astype(numpy.float32)) == 0
+            norm[empty] = 0.0
+            count[empty] = 0.0
+        res[:, 2] = normalization_factor * norm
+        res[:, 3] = count
+        return res
 
     def integrate(self,
                   signal,
@@ -99,6 +289,9 @@ class CSRIntegrator(object):
                   polarization=None,
                   absorption=None,
                   normalization_factor=1.0,
+                  solidangle_checksum=None,
+                  polarization_checksum=None,
+                  absorption_checksum=None,
                   ):
         """Actually perform the CSR matrix multiplication after preprocessing.
         
@@ -113,11 +306,28 @@ class CSRIntegrator(object):
         :param polarization: :solidangle normalization array
         :param absorption: :absorption normalization array
         :param normalization_factor: scale all normalization with this scalar
+        :param solidangle_checksum: CRC32 checksum of the solid-angle array (if known)
+        :param polarization_checksum: CRC32 checksum of the polarization array (if known)
+        :param absorption_checksum: CRC32 checksum of the absorption array (if known)
         :return: the preprocessed data integrated as array nbins x 4 which contains:
                     regrouped signal, variance, normalization and pixel count 
 
-        Nota: all normalizations are grouped in the preprocessing step.
+        Nota: all normalizations are grouped in the preprocessing step, unless
+        a static normalization has been registered with arrays of the same checksums.
         """
+        static = self._static
+        if ((static is not None) and (flat is None) and (poissonian is not False) and
+                (normalization_factor != 0.0) and
+                static["checksum"] == self._get_checksum(solidangle, polarization, absorption, solidangle_checksum,
+                                                         polarization_checksum, absorption_checksum)):
+            return self._integrate_static(static, signal, variance, poissonian, dummy, delta_dummy,
+                                          dark, normalization_factor)
+        csr, csr2, gather = self._get_compact()
+        if gather is not None:
+            # Only valid pixels get preprocessed
+            signal, variance, dark, flat, solidangle, polarization, absorption = \
+                [None if array is None else numpy.ravel(array)[gather]
+                 for array in (signal, variance, dark, flat, solidangle, polarization, absorption)]
         shape = signal.shape
         prep = preproc(signal,
                        dark=dark,
@@ -138,17 +348,102 @@ class CSRIntegrator(object):
         # logger.warning("prep.shape %s lut_size %s, image_size %s, bins %s", prep.shape, self.lut_size, self.size, self.bins)
         res = numpy.empty((numpy.prod(self.bins), 4), dtype=numpy.float32)
         # logger.warning(self._csr.shape)
-        res[:, 0] = self._csr.dot(prep[:, 0])
-        res[:, 2] = self._csr.dot(prep[:, 2])
-        res[:, 3] = self._csr.dot(prep[:, 3])
+        res[:, 0] = csr.dot(prep[:, 0])
+        res[:, 2] = csr.dot(prep[:, 2])
+        res[:, 3] = csr.dot(prep[:, 3])
         if variance is not None or poissonian:
-            res[:, 1] = self._csr2.dot(prep[:, 1])
+            res[:, 1] = csr2.dot(prep[:, 1])
         elif poissonian is False:
             # ask for azimuthal error model
             avg = res[:, 0] / res[:, 2]
-            avg_ext = self._csr.T.dot(avg)
+            avg_ext = csr.T.dot(avg)
             delta = (prep[:, 0] / prep[:, 2] - avg_ext) ** 2
-            res[:, 1] = self._csr.dot(delta)
+            res[:, 1] = csr.dot(delta)
+        return res
+
+    def integrate_stack(self,
+                        signal,
+                        variance=None,
+                        poissonian=None,
+                        dummy=None,
+                        delta_dummy=None,
+                        dark=None,
+                        flat=None,
+                        solidangle=None,
+                        polarization=None,
+                        absorption=None,
+                        normalization_factor=1.0,
+                        ):
+        """Perform the CSR matrix multiplication on a stack of frames.
+
+        Frames are preprocessed in blocks which fit in `STACK_BUFFER_SIZE`
+        bytes, in a buffer allocated once. Each block is integrated with
+        sparse-matrix x dense-matrix products, so the matrix is read once
+        per block for each of the 3 (or 4 with variance) components,
+        instead of once per frame. Only the valid pixels are preprocessed.
+
+        :param signal: array of shape (nframes, ...) with one frame per slice
+        :param variance: Variance associated with the signal, same shape as signal
+        :param poissonian: set to use signal as variance (minimum 1), set to False to use azimuthal model.
+        :param dummy: values which have to be discarded (dynamic mask)
+        :param delta_dummy: precision for dummy values
+        :param dark: noise to be subtracted from each frame
+        :param flat: flat-field normalization array
+        :param solidangle: solidangle normalization array
+        :param polarization: polarization normalization array
+        :param absorption: absorption normalization array
+        :param normalization_factor: scalar or one value per frame
+        :return: the preprocessed data integrated as array nframes x nbins x 4
+        """
+        nframes = signal.shape[0]
+        normalization_factor = numpy.broadcast_to(normalization_factor, (nframes,))
+        csr, csr2, gather = self._get_compact()
+        size = csr.shape[1]
+        if gather is not None:
+            # Only valid pixels get preprocessed
+            dark, flat, solidangle, polarization, absorption = \
+                [None if array is None else numpy.ravel(array)[gather]
+                 for array in (dark, flat, solidangle, polarization, absorption)]
+        block = int(max(1, min(nframes, self.STACK_BUFFER_SIZE // (16 * max(size, 1)))))
+        # One array per component with the frames along the fast axis: used by scipy without copy
+        buffer = numpy.empty((4, size, block), dtype=numpy.float32)
+        res = numpy.empty((nframes, numpy.prod(self.bins), 4), dtype=numpy.float32)
+        for start in range(0, nframes, block):
+            stop = min(start + block, nframes)
+            prep = buffer if stop - start == block else buffer[:, :, :stop - start]
+            for frame in range(start, stop):
+                data = signal[frame]
+                var = None if variance is None else variance[frame]
+                if gather is not None:
+                    data = numpy.ravel(data)[gather]
+                    var = None if var is None else numpy.ravel(var)[gather]
+                prep[:, :, frame - start] = preproc(data,
+                                                    dark=dark,
+                                                    flat=flat,
+                                                    solidangle=solidangle,
+                                                    polarization=polarization,
+                                                    absorption=absorption,
+                                                    mask=None,
+                                                    dummy=dummy,
+                                                    delta_dummy=delta_dummy,
+                                                    normalization_factor=normalization_factor[frame],
+                                                    empty=self.empty,
+                                                    split_result=4,
+                                                    variance=var,
+                                                    dtype=numpy.float32,
+                                                    poissonian=bool(poissonian)).reshape((size, 4)).T
+            result = res[start:stop]
+            result[..., 0] = csr.dot(prep[0]).T
+            result[..., 2] = csr.dot(prep[2]).T
+            result[..., 3] = csr.dot(prep[3]).T
+            if variance is not None or poissonian:
+                result[..., 1] = csr2.dot(prep[1]).T
+            elif poissonian is False:
+                # ask for azimuthal error model
+                avg = result[..., 0] / result[..., 2]
+                avg_ext = csr.T.dot(avg.T)
+                delta = (prep[0] / prep[2] - avg_ext) ** 2
+                result[..., 1] = csr.dot(delta).T
         return res
 
 
@@ -173,6 +468,7 @@ class CsrIntegrator1d(CSRIntegrator):
         Nota: bins value is deduced from the dimentionality of bin_centers 
         """
         self.bin_centers = bin_centers
+        self._sparse_background = None  # see integrate_sparse
         CSRIntegrator.__init__(self, image_size, lut, empty)
         self.pos0_range = self.pos1_range = None
         self.unit = unit
@@ -187,6 +483,7 @@ class CsrIntegrator1d(CSRIntegrator):
 
         CSRIntegrator.set_matrix(self, data, indices, indptr)
         assert len(self.bin_centers) == self.bins
+        self._sparse_background = None
 
     def integrate(self,
                   signal,
@@ -200,6 +497,9 @@ class CsrIntegrator1d(CSRIntegrator):
                   polarization=None,
                   absorption=None,
                   normalization_factor=1.0,
+                  solidangle_checksum=None,
+                  polarization_checksum=None,
+                  absorption_checksum=None,
                   ):
         """Actually perform the 1D integration 
         
@@ -214,6 +514,9 @@ class CsrIntegrator1d(CSRIntegrator):
         :param polarization: :solidangle normalization array
         :param absorption: :absorption normalization array
         :param normalization_factor: scale all normalization with this scalar
+        :param solidangle_checksum: CRC32 checksum of the solid-angle array (if known)
+        :param polarization_checksum: CRC32 checksum of the polarization array (if known)
+        :param absorption_checksum: CRC32 checksum of the absorption array (if known)
         :return: Integrate1dResult or Integrate1dWithErrorResult object depending on variance 
         
         """
@@ -224,7 +527,8 @@ class CsrIntegrator1d(CSRIntegrator):
         trans = CSRIntegrator.integrate(self, signal, variance, poissonian,
                                         dummy, delta_dummy,
                                         dark, flat, solidangle, polarization,
-                                        absorption, normalization_factor)
+                                        absorption, normalization_factor,
+                                        solidangle_checksum, polarization_checksum, absorption_checksum)
         signal = trans[:, 0]
         variance = trans[:, 1]
         normalization = trans[:, 2]
@@ -244,6 +548,173 @@ class CsrIntegrator1d(CSRIntegrator):
 
     integrate_ng = integrate
 
+    def integrate_ng_stack(self,
+                           signal,
+                           variance=None,
+                           poissonian=None,
+                           dummy=None,
+                           delta_dummy=None,
+                           dark=None,
+                           flat=None,
+                           solidangle=None,
+                           polarization=None,
+                           absorption=None,
+                           normalization_factor=1.0,
+                           ):
+        """Perform the 1D integration of a stack of frames
+
+        :param signal: array of shape (nframes, ...) with one frame per slice
+        :param variance: Variance associated with the signal, same shape as signal
+        :param poissonian: set to use signal as variance (minimum 1), set to False to use azimuthal model.
+        :param dummy: values which have to be discarded (dynamic mask)
+        :param delta_dummy: precision for dummy values
+        :param dark: noise to be subtracted from each frame
+        :param flat: flat-field normalization array
+        :param solidangle: solidangle normalization array
+        :param polarization: polarization normalization array
+        :param absorption: absorption normalization array
+        :param normalization_factor: scalar or one value per frame
+        :return: Integrate1dtpl with arrays of shape (nframes, nbins)
+        """
+        if variance is None and poissonian is None:
+            do_variance = False
+        else:
+            do_variance = True
+        trans = CSRIntegrator.integrate_stack(self, signal, variance, poissonian,
+                                              dummy, delta_dummy,
+                                              dark, flat, solidangle, polarization,
+                                              absorption, normalization_factor)
+        signal = trans[..., 0]
+        variance = trans[..., 1]
+        normalization = trans[..., 2]
+        count = trans[..., -1]  # should be 3
+        mask = (normalization == 0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            intensity = signal / normalization
+            intensity[mask] = self.empty
+            if do_variance:
+                error = numpy.sqrt(variance) / normalization
+                error[mask] = self.empty
+            else:
+                variance = error = None
+        return Integrate1dtpl(self.bin_centers,
+                              intensity, error,
+                              signal, variance, normalization, count)
+
+    def _get_sparse_background(self, sparse):
+        """Provides the matrices projecting the radial background profile of
+        a SparseFrame onto the bins, cached for consecutive frames sharing
+        their radial position map. The cache is keyed on the checksums of the
+        map, only calculated when a frame comes with another map.
+
+        :param sparse: SparseFrame instance
+        :return: dict
+        """
+        cache = self._sparse_background
+        if sparse.mask is None or sparse.radius is None or not numpy.issubdtype(sparse.mask.dtype, numpy.floating):
+            raise ValueError("SparseFrame without map of the radial position of the pixels")
+        if cache is not None and cache["static"] is self._static:
+            if cache["mask"] is sparse.mask and cache["radius"] is sparse.radius:
+                return cache
+            checksum = (calc_checksum(sparse.mask), calc_checksum(sparse.radius))
+            if cache["checksum"] == checksum:
+                return cache
+        else:
+            checksum = (calc_checksum(sparse.mask), calc_checksum(sparse.radius))
+        static = self._static
+        # Masked pixels (NaN radius) are invalid in the densified image
+        interp = _interpolation_matrix(sparse.mask, sparse.radius)
+        valid = numpy.logical_and(numpy.isfinite(sparse.mask.ravel()), static["valid"])[self.indices]
+        shape = self._csr.shape
+        csr = csr_matrix((numpy.where(valid, self.data, 0.0), self.indices, self.indptr), shape=shape)
+        csr2 = csr_matrix((numpy.where(valid, self.data * self.data, 0.0), self.indices, self.indptr), shape=shape)
+        self._sparse_background = {"static": static,
+                                   "checksum": checksum,
+                                   "mask": sparse.mask,
+                                   "radius": sparse.radius,
+                                   "interp": interp,
+                                   "valid": numpy.isfinite(sparse.mask.ravel()),
+                                   "background": csr.dot(interp).tocsr(),
+                                   "background2": csr2.dot(interp).tocsr(),
+                                   "columns": csr.tocsc(),
+                                   "columns2": csr2.tocsc(),
+                                   "norm": csr.dot(static["pixel_norm"].astype(numpy.float64)),
+                                   "count": csr.dot(numpy.ones(self.size, dtype=numpy.float64))}
+        return self._sparse_background
+
+    def integrate_sparse(self,
+                         sparse,
+                         poissonian=None,
+                         solidangle=None,
+                         polarization=None,
+                         absorption=None,
+                         normalization_factor=1.0,
+                         solidangle_checksum=None,
+                         polarization_checksum=None,
+                         absorption_checksum=None):
+        """Integrate a SparseFrame without densifying it.
+
+        The result is the one of `integrate` on the image rebuilt by
+        `densify`: the background profile interpolated at the radial
+        position of each pixel, replaced by the stored intensity for the
+        peaks (the rounding of integer frames excepted). The contribution of
+        the background is obtained from a small (bins x radius) matrix and
+        only the columns of the peak pixels are gathered, so the cost of one
+        frame is proportional to the number of peaks.
+
+        The normalization arrays have to be folded into the engine
+        beforehand with `set_static_normalization`, see
+        `AzimuthalIntegrator.integrate1d_sparse`.
+
+        :param sparse: SparseFrame instance, as produced by `sparsify`
+        :param poissonian: set to use the signal as variance (minimum 1).
+            For background pixels, it is interpolated from the background
+            profile clipped the same way.
+        :param solidangle: solidangle normalization array
+        :param polarization: polarization normalization array
+        :param absorption: absorption normalization array
+        :param normalization_factor: scale all normalization with this scalar
+        :param solidangle_checksum: checksum of the solidangle array, calculated if not provided
+        :param polarization_checksum: checksum of the polarization array, calculated if not provided
+        :param absorption_checksum: checksum of the absorption array, calculated if not provided
+        :return: Integrate1dtpl namedtuple
+        """
+        checksum = self._get_checksum(solidangle, polarization, absorption,
+                                      solidangle_checksum, polarization_checksum, absorption_checksum)
+        if self._static is None or self._static["checksum"] != checksum:
+            raise ValueError("Normalization arrays differ from the static normalization of the engine, "
+                             "see set_static_normalization")
+        cache = self._get_sparse_background(sparse)
+        index = numpy.ascontiguousarray(sparse.index, dtype=numpy.intp)
+        intensity = numpy.ascontiguousarray(sparse.intensity, dtype=numpy.float64)
+        valid = cache["valid"][index]
+        index = index[valid]
+        intensity = intensity[valid]
+        background = numpy.ascontiguousarray(sparse.background_avg, dtype=numpy.float64)
+        columns = cache["columns"][:, index]
+        peak = intensity - cache["interp"][index].dot(background)
+        signal = cache["background"].dot(background) + columns.dot(peak)
+        if poissonian:
+            background = numpy.maximum(background, 1.0)
+            peak = numpy.maximum(intensity, 1.0) - cache["interp"][index].dot(background)
+            variance = cache["background2"].dot(background) + cache["columns2"][:, index].dot(peak)
+        else:
+            variance = None
+        normalization = normalization_factor * cache["norm"]
+        count = cache["count"]
+        mask = (normalization == 0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            result = signal / normalization
+            result[mask] = self.empty
+            if variance is None:
+                error = None
+            else:
+                error = numpy.sqrt(variance) / normalization
+                error[mask] = self.empty
+        return Integrate1dtpl(self.bin_centers,
+                              result, error,
+                              signal, variance, normalization, count)
+
     def sigma_clip(self, data, dark=None, dummy=None, delta_dummy=None,
                    variance=None, dark_variance=None,
                    flat=None, solidangle=None, polarization=None, absorption=None,
@@ -439,7 +910,10 @@ class CsrIntegrator2d(CSRIntegrator):
                   solidangle=None,
                   polarization=None,
                   absorption=None,
-                  normalization_factor=1.0):
+                  normalization_factor=1.0,
+                  solidangle_checksum=None,
+                  polarization_checksum=None,
+                  absorption_checksum=None):
         """Actually perform the 2D integration 
         
         :param signal: array of the right size with the signal in it.
@@ -453,6 +927,9 @@ class CsrIntegrator2d(CSRIntegrator):
         :param polarization: :solidangle normalization array
         :param absorption: :absorption normalization array
         :param normalization_factor: scale all normalization with this scalar
+        :param solidangle_checksum: CRC32 checksum of the solid-angle array (if known)
+        :param polarization_checksum: CRC32 checksum of the polarization array (if known)
+        :param absorption_checksum: CRC32 checksum of the absorption array (if known)
         :return: Integrate2dtpl namedtuple: "radial azimuthal intensity error signal variance normalization count"
         
         """
@@ -462,7 +939,8 @@ class CsrIntegrator2d(CSRIntegrator):
             do_variance = True
         trans = CSRIntegrator.integrate(self, signal, variance, poissonian, dummy, delta_dummy,
                                         dark, flat, solidangle, polarization,
-                                        absorption, normalization_factor)
+                                        absorption, normalization_factor,
+                                        solidangle_checksum, polarization_checksum, absorption_checksum)
         trans.shape = self.bins + (-1,)
 
         signal = trans[..., 0]
@@ -484,6 +962,59 @@ class CsrIntegrator2d(CSRIntegrator):
 
     integrate_ng = integrate
 
+    def integrate_ng_stack(self,
+                           signal,
+                           variance=None,
+                           poissonian=False,
+                           dummy=None,
+                           delta_dummy=None,
+                           dark=None,
+                           flat=None,
+                           solidangle=None,
+                           polarization=None,
+                           absorption=None,
+                           normalization_factor=1.0):
+        """Perform the 2D integration of a stack of frames
+
+        :param signal: array of shape (nframes, ...) with one frame per slice
+        :param variance: Variance associated with the signal, same shape as signal
+        :param poissonian: set to True to variance=max(signal,1), False will implement azimuthal variance
+        :param dummy: values which have to be discarded (dynamic mask)
+        :param delta_dummy: precision for dummy values
+        :param dark: noise to be subtracted from each frame
+        :param flat: flat-field normalization array
+        :param solidangle: solidangle normalization array
+        :param polarization: polarization normalization array
+        :param absorption: absorption normalization array
+        :param normalization_factor: scalar or one value per frame
+        :return: Integrate2dtpl namedtuple with arrays of shape (nframes,) + bins
+        """
+        if variance is None and poissonian is None:
+            do_variance = False
+        else:
+            do_variance = True
+        trans = CSRIntegrator.integrate_stack(self, signal, variance, poissonian, dummy, delta_dummy,
+                                              dark, flat, solidangle, polarization,
+                                              absorption, normalization_factor)
+        trans.shape = (trans.shape[0],) + self.bins + (-1,)
+
+        signal = trans[..., 0]
+        variance = trans[..., 1]
+        normalization = trans[..., 2]
+        count = trans[..., -1]  # should be 3
+        mask = (normalization == 0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            intensity = signal / normalization
+            intensity[mask] = self.empty
+            if do_variance:
+                error = numpy.sqrt(variance) / normalization
+                error[mask] = self.empty
+            else:
+                variance = error = None
+        return Integrate2dtpl(self.bin_centers0, self.bin_centers1,
+                              intensity, error,
+                              signal, variance, normalization, count)
+
     @property
     def check_mask(self):
         return self.mask_checksum is not None
@@ -32,21 +32,179 @@ __status__ = "development"
 
 import logging
 logger = logging.getLogger(__name__)
+from collections import OrderedDict
 from threading import Semaphore
 
 
 class Engine(object):
-    """This class defines a regrid-engine with its locking mechanism"""
+    """This class defines a regrid-engine with its locking mechanism
+
+    The regrid-engine and the key of its configuration are stored together
+    and replaced atomically: a regrid-engine is never modified once published,
+    so readers can use it without the lock, which is only needed to build it.
+    """
 
     def __init__(self, engine=None):
         """Constructor of the class"""
         self.lock = Semaphore()
-        self.engine = engine
+        self._current = (engine, None)  # key: configuration of the engine, see EngineCache.get_key
+
+    @property
+    def engine(self):
+        return self._current[0]
+
+    @property
+    def key(self):
+        return self._current[1]
+
+    @key.setter
+    def key(self, value):
+        "should be called from a locked region"
+        self._current = (self._current[0], value)
+
+    def get_engine(self, key):
+        """Lock-free access to the regrid-engine
+
+        :param key: expected configuration of the engine, see EngineCache.get_key
+        :return: the regrid-engine if it matches the configuration, else None
+        """
+        engine, current = self._current
+        if (key is not None) and (key == current):
+            return engine
 
     def reset(self):
         with self.lock:
-            self.engine = None
+            self._current = (None, None)
 
-    def set_engine(self, engine):
+    def set_engine(self, engine, key=None):
         "should be called from a locked region"
-        self.engine = engine
+        self._current = (engine, key)
+
+
+class EngineCache(object):
+    """Storage of regrid-engines which are not in use anymore, indexed by
+    their complete configuration, so that they can be used again later on
+    instead of being rebuilt.
+
+    The memory of the stored engines is limited to `max_size` bytes, the
+    least recently used ones are evicted first.
+    """
+
+    def __init__(self, max_size=0):
+        """Constructor of the class
+
+        :param max_size: memory budget in bytes, 0 to disable the cache
+        """
+        self.max_size = max_size
+        self._engines = OrderedDict()  # key -> (engine, nbytes)
+        self._lock = Semaphore()
+
+    def __getstate__(self):
+        "Helper function for pickling: only the memory budget is kept"
+        return {"max_size": self.max_size}
+
+    def __setstate__(self, state):
+        "Helper function for unpickling: the cache starts empty"
+        self.__init__(state.get("max_size", 0))
+
+    def __repr__(self):
+        return f"EngineCache with {len(self)} engines using {self.nbytes} bytes out of {self.max_size}"
+
+    def __len__(self):
+        return len(self._engines)
+
+    def __contains__(self, key):
+        return key in self._engines
+
+    @staticmethod
+    def get_key(method, unit, npt, shape, mask_checksum=None,
+                radial_range=None, azimuth_range=None, empty=None, options=None):
+        """Calculate the key identifying the configuration of an engine
+
+        :param method: IntegrationMethod of the engine
+        :param unit: radial unit
+        :param npt: number of bins, int or 2-tuple
+        :param shape: shape of the image
+        :param mask_checksum: checksum of the mask, None if no mask
+        :param radial_range: radial range in internal units
+        :param azimuth_range: azimuthal range in radians
+        :param empty: value for empty bins
+        :param options: engine options, as a tuple of (name, value)
+        :return: hashable tuple
+        """
+        return (method, str(unit), npt, tuple(shape), mask_checksum,
+                None if radial_range is None else tuple(radial_range),
+                None if azimuth_range is None else tuple(azimuth_range),
+                empty, tuple(options) if options else ())
+
+    @staticmethod
+    def get_nbytes(engine):
+        """Estimate the memory used by an engine
+
+        CSR integrators provide their `nbytes`, which includes the static
+        normalization and the compact storage, other engines the size of
+        their look-up table.
+
+        :param engine: regrid-engine, i.e. a CSR or LUT integrator
+        :return: size in bytes
+        """
+        nbytes = getattr(engine, "nbytes", None)
+        if nbytes:
+            return nbytes
+        nbytes = getattr(engine, "lut_nbytes", None)
+        if nbytes:
+            return nbytes
+        lut = getattr(engine, "lut", None)
+        if isinstance(lut, tuple):
+            return sum(getattr(i, "nbytes", 0) for i in lut)
+        return getattr(lut, "nbytes", 0)
+
+    @property
+    def nbytes(self):
+        """Memory used by the engines in the cache"""
+        return sum(nbytes for _, nbytes in self._engines.values())
+
+    def put(self, key, engine):
+        """Store an engine which is not in use anymore
+
+        :param key: configuration of the engine as provided by `get_key`
+        :param engine: the regrid-engine
+        """
+        if (key is None) or (engine is None) or (not self.max_size):
+            return
+        nbytes = self.get_nbytes(engine)
+        if nbytes > self.max_size:
+            return
+        with self._lock:
+            self._engines.pop(key, None)
+            self._engines[key] = (engine, nbytes)
+            total = self.nbytes
+            while total > self.max_size:
+                evicted, (_, size) = self._engines.popitem(last=False)
+                total -= size
+                logger.debug("Evicting engine %s from the cache", evicted)
+
+    def pop(self, key):
+        """Retrieve an engine from the cache. It is removed from the cache
+        since it is expected to be in use.
+
+        :param key: configuration of the engine as provided by `get_key`
+        :return: the regrid-engine or None if not in cache
+        """
+        with self._lock:
+            if key in self._engines:
+                return self._engines.pop(key)[0]
+
+    def discard(self, selector):
+        """Remove the engines for which the selector returns True
+
+        :param selector: function taking the key of an engine, as provided by `get_key`
+        """
+        with self._lock:
+            for key in [key for key in self._engines if selector(key)]:
+                del self._engines[key]
+
+    def clear(self):
+        """Remove all engines from the cache"""
+        with self._lock:
+            self._engines.clear()
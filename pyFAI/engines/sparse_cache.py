@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Azimuthal integration
+#             https://github.com/silx-kit/pyFAI
+#
+#    Copyright (C) 2022-2022 European Synchrotron Radiation Facility, Grenoble, France
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#  .
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#  .
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#  THE SOFTWARE.
+
+"""Persistent on-disk cache for the sparse matrix (CSR/LUT) integrators.
+
+Building the sparse matrix with full pixel splitting on large detectors is
+expensive. This cache stores the matrix of each integrator in a directory,
+keyed by the hash of the complete configuration, so that new processes can
+load it back (memory-mapped) instead of rebuilding it.
+
+The cache is opt-in: either set `AzimuthalIntegrator.sparse_cache` or define
+the `PYFAI_SPARSE_CACHE` environment variable with the cache directory.
+"""
+
+__author__ = "Jérôme Kieffer"
+__contact__ = "Jerome.Kieffer@ESRF.eu"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "18/10/2022"
+__status__ = "development"
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import importlib
+import logging
+logger = logging.getLogger(__name__)
+import numpy
+from .. import units
+from .. import version as pyFAI_version
+
+ENV_VARIABLE = "PYFAI_SPARSE_CACHE"
+"Name of the environment variable used to define the default cache directory"
+
+# Attributes of the integrators which are only needed during the construction of the matrix
+_SKIPPED_ATTRIBUTES = ("cpos0", "dpos0", "cpos1", "dpos1", "pos", "lut")
+
+# Only integrators from this package can be rebuilt
+_ALLOWED_PACKAGE = "pyFAI.ext."
+
+
+def _json_default(obj):
+    """Serialize numpy scalars and arrays in JSON"""
+    if isinstance(obj, numpy.generic):
+        return obj.item()
+    if isinstance(obj, numpy.ndarray):
+        return obj.tolist()
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+def _as_tuple(value):
+    """JSON provides lists where the integrators use tuples"""
+    if isinstance(value, list):
+        return tuple(_as_tuple(i) for i in value)
+    return value
+
+
+def export_engine(engine):
+    """Split a sparse-matrix integrator into its arrays and its other
+    attributes, see `import_engine`
+
+    :param engine: CSR or LUT integrator from pyFAI.ext
+    :return: metadata as a JSON-serializable dict, dict with the arrays
+    """
+    attributes = {}
+    arrays = {}
+    for name, value in engine.__dict__.items():
+        if name in _SKIPPED_ATTRIBUTES:
+            continue
+        if isinstance(value, numpy.ndarray):
+            arrays[name] = value
+        elif name == "unit":
+            attributes[name] = str(value)
+        else:
+            attributes[name] = value
+    if hasattr(engine, "indptr"):
+        sparse = {"data": engine.data, "indices": engine.indices, "indptr": engine.indptr}
+    else:
+        sparse = {"lut": engine.lut}
+    metadata = {"module": engine.__class__.__module__,
+                "class": engine.__class__.__name__,
+                "size": engine.input_size,
+                "empty": engine.empty,
+                "sparse": list(sparse.keys()),
+                "arrays": list(arrays.keys()),
+                "attributes": attributes}
+    for name, value in sparse.items():
+        arrays["_" + name] = value
+    return metadata, arrays
+
+
+def _get_file_checksum(filenames):
+    """Digest of the content of files, like the spline file of a detector
+    which may be edited in place
+
+    :param filenames: name of the file, several names separated by commas (as
+        the offset files of Pilatus detectors), or None
+    :return: hexadecimal digest as string, None if there is no such file
+    """
+    if not filenames:
+        return None
+    digest = hashlib.sha256()
+    found = False
+    for filename in filenames.split(","):
+        if os.path.isfile(filename):
+            found = True
+            with open(filename, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest() if found else None
+
+
+def import_engine(metadata, arrays):
+    """Rebuild a sparse-matrix integrator from the output of `export_engine`.
+
+    Arrays with the proper type are used as they are, without copy.
+
+    :param metadata: dict with the class and the attributes of the integrator
+    :param arrays: dict with the arrays
+    :return: the integrator
+    """
+    if not metadata["module"].startswith(_ALLOWED_PACKAGE):
+        raise ValueError("Integrator from module %s is not allowed" % metadata["module"])
+    module = importlib.import_module(metadata["module"])
+    klass = getattr(module, metadata["class"])
+    sparse = [arrays["_" + name] for name in metadata["sparse"]]
+    engine = klass.__new__(klass)
+    if len(sparse) == 3:
+        module.CsrIntegrator.__init__(engine, tuple(sparse), metadata["size"], metadata["empty"])
+    else:
+        module.LutIntegrator.__init__(engine, sparse[0], metadata["size"], metadata["empty"])
+    for name in _SKIPPED_ATTRIBUTES:
+        if not hasattr(klass, name):
+            setattr(engine, name, None)
+    engine.__dict__.update(metadata["attributes"])
+    for name in metadata["arrays"]:
+        setattr(engine, name, arrays[name])
+    if "unit" in metadata["attributes"]:
+        engine.unit = units.to_unit(metadata["attributes"]["unit"])
+    if len(sparse) == 3:
+        engine.lut = (engine.data, engine.indices, engine.indptr)
+    return engine
+
+
+def get_default_cache():
+    """Provides the cache defined in the environment, if any
+
+    :return: SparseCache instance or None
+    """
+    directory = os.environ.get(ENV_VARIABLE)
+    if directory:
+        return SparseCache(directory)
+
+
+class SparseCache(object):
+    """Directory-based storage of sparse-matrix integrators
+
+    Each integrator is stored in a sub-directory named after the hash of its
+    configuration. Arrays are saved as `npy` files and memory-mapped
+    (copy-on-write) when loaded back, other attributes are stored in JSON.
+    Nothing is unpickled, so the cache can be shared safely.
+    """
+
+    def __init__(self, directory):
+        """Constructor of the class
+
+        :param directory: path of the cache directory, created if needed
+        """
+        self.directory = os.path.abspath(directory)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self):
+        return f"SparseCache in {self.directory}"
+
+    @staticmethod
+    def get_key(geometry, algo, shape, npt, mask_checksum=None,
+                pos0_range=None, pos1_range=None, unit=units.TTH,
+                split="bbox", empty=0.0):
+        """Calculate the key identifying one sparse matrix
+
+        :param geometry: Geometry (or AzimuthalIntegrator) instance
+        :param algo: "csr" or "lut"
+        :param shape: shape of the image
+        :param npt: number of bins, int or 2-tuple
+        :param mask_checksum: checksum of the mask, None if no mask
+        :param pos0_range: range in radial dimension (S.I. units)
+        :param pos1_range: range in azimuthal dimension (radians)
+        :param unit: radial unit
+        :param split: splitting scheme
+        :param empty: value for empty bins
+        :return: hexadecimal digest as string
+        """
+        config = {"geometry": geometry.get_config(),
+                  "spline": _get_file_checksum(geometry.detector.splineFile),
+                  "parallax": repr(geometry.parallax),
+                  "chiDiscAtPi": geometry.chiDiscAtPi,
+                  "array_dtype": str(numpy.dtype(geometry.array_dtype)),
+                  "algo": algo,
+                  "shape": tuple(shape),
+                  "npt": npt,
+                  "mask_checksum": mask_checksum,
+                  "pos0_range": pos0_range,
+                  "pos1_range": pos1_range,
+                  "unit": str(unit),
+                  "split": split,
+                  "empty": empty,
+                  "version": pyFAI_version}
+        serialized = json.dumps(config, sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode()).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.isdir(self.get_path(key))
+
+    def save(self, key, engine):
+        """Store the integrator in the cache
+
+        The entry is written in a temporary directory and moved in place
+        atomically so that concurrent processes never see a partial entry.
+
+        :param key: the key as provided by `get_key`
+        :param engine: CSR or LUT integrator from pyFAI.ext
+        """
+        path = self.get_path(key)
+        if os.path.isdir(path):
+            return
+        tmpdir = tempfile.mkdtemp(prefix=key + ".", dir=self.directory)
+        try:
+            metadata, arrays = export_engine(engine)
+            for name, value in arrays.items():
+                numpy.save(os.path.join(tmpdir, name + ".npy"), value)
+            with open(os.path.join(tmpdir, "metadata.json"), "w") as f:
+                json.dump(metadata, f, default=_json_default)
+            os.rename(tmpdir, path)
+        except Exception as err:
+            logger.warning("Unable to store sparse matrix in cache %s: %s: %s", path, type(err), err)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def load(self, key):
+        """Retrieve an integrator from the cache
+
+        :param key: the key as provided by `get_key`
+        :return: the integrator or None if not in cache
+        """
+        path = self.get_path(key)
+        if not os.path.isdir(path):
+            return
+        try:
+            with open(os.path.join(path, "metadata.json")) as f:
+                metadata = json.load(f)
+            metadata["attributes"] = {key: _as_tuple(value) for key, value in metadata["attributes"].items()}
+            names = metadata["arrays"] + ["_" + name for name in metadata["sparse"]]
+            arrays = {name: numpy.load(os.path.join(path, name + ".npy"), mmap_mode="c", allow_pickle=False)
+                      for name in names}
+            engine = import_engine(metadata, arrays)
+        except Exception as err:
+            logger.warning("Unable to load sparse matrix from cache %s: %s: %s", path, type(err), err)
+            return
+        logger.debug("Sparse matrix loaded from cache %s", path)
+        return engine
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
@@ -40,6 +40,235 @@ import numpy
 
 from .preproc import preproc
 from ..containers import Integrate1dtpl, Integrate2dtpl
+from ..utils import crc32
+
+
+cdef enum raw_kind:
+    RAW_FLOAT32
+    RAW_FLOAT64
+    RAW_INT8
+    RAW_UINT8
+    RAW_INT16
+    RAW_UINT16
+    RAW_INT32
+    RAW_UINT32
+
+# dtypes of the raw signal read natively, without conversion to data_t
+_RAW_KINDS = {numpy.dtype(numpy.float32): RAW_FLOAT32,
+              numpy.dtype(numpy.float64): RAW_FLOAT64,
+              numpy.dtype(numpy.int8): RAW_INT8,
+              numpy.dtype(numpy.uint8): RAW_UINT8,
+              numpy.dtype(numpy.int16): RAW_INT16,
+              numpy.dtype(numpy.uint16): RAW_UINT16,
+              numpy.dtype(numpy.int32): RAW_INT32,
+              numpy.dtype(numpy.uint32): RAW_UINT32}
+
+
+cdef struct raw_t:
+    const void *ptr
+    raw_kind kind
+    bint check_dummy
+    bint integer_dummy
+    int64_t idummy
+    data_t dummy
+    data_t delta_dummy
+
+
+cdef struct preproc_t:
+    data_t signal
+    data_t variance
+    data_t norm
+    data_t count
+
+
+cdef inline bint _read_raw(const raw_t *raw, Py_ssize_t pos, data_t *value) nogil:
+    """Read one pixel of the raw signal, in its native type, and check it
+    against the dummy value.
+
+    Integer signals are compared to an integer dummy value exactly, before
+    any conversion to data_t.
+
+    :param raw: description of the raw buffer
+    :param pos: position of the pixel in the buffer
+    :param value: pointer where to store the pixel value, as data_t
+    :return: False if the pixel is a dummy value
+    """
+    cdef:
+        int64_t ivalue = 0
+        data_t fvalue = 0.0
+        bint is_integer = True
+    if raw.kind == RAW_FLOAT32:
+        fvalue = (<const float32_t*> raw.ptr)[pos]
+        is_integer = False
+    elif raw.kind == RAW_FLOAT64:
+        fvalue = <data_t> (<const float64_t*> raw.ptr)[pos]
+        is_integer = False
+    elif raw.kind == RAW_UINT16:
+        ivalue = (<const uint16_t*> raw.ptr)[pos]
+    elif raw.kind == RAW_UINT32:
+        ivalue = (<const uint32_t*> raw.ptr)[pos]
+    elif raw.kind == RAW_INT32:
+        ivalue = (<const int32_t*> raw.ptr)[pos]
+    elif raw.kind == RAW_INT16:
+        ivalue = (<const int16_t*> raw.ptr)[pos]
+    elif raw.kind == RAW_UINT8:
+        ivalue = (<const uint8_t*> raw.ptr)[pos]
+    else:
+        ivalue = (<const int8_t*> raw.ptr)[pos]
+    if is_integer:
+        fvalue = <data_t> ivalue
+    value[0] = fvalue
+    if not raw.check_dummy:
+        return True
+    if is_integer and raw.integer_dummy:
+        return ivalue != raw.idummy
+    if raw.delta_dummy == 0:
+        return fvalue != raw.dummy
+    return fabs(fvalue - raw.dummy) > raw.delta_dummy
+
+
+cdef inline preproc_t _preproc_pixel(const raw_t *raw,
+                                     Py_ssize_t pos,
+                                     index_t idx,
+                                     const data_t *dark,
+                                     const data_t *flat,
+                                     const data_t *solidangle,
+                                     const data_t *polarization,
+                                     const data_t *absorption,
+                                     const data_t *variance,
+                                     bint poissonian,
+                                     data_t dummy,
+                                     data_t delta_dummy,
+                                     data_t normalization_factor) nogil:
+    """Preprocessing of a single pixel, performed on the fly within the
+    matrix-vector product.
+
+    Same algorithm as `pyFAI.ext.preproc.c4_preproc`. NULL pointers
+    disable the associated correction. There is no mask: masked pixels are
+    excluded from the matrix when it is built.
+
+    :param raw: raw signal buffer
+    :param pos: position of the pixel in the raw buffer
+    :param idx: index of the pixel in the correction arrays
+    :return: structure with signal, variance, normalization and count
+    """
+    cdef:
+        preproc_t result
+        data_t one_num, one_den, one_var, one_flat
+        bint is_valid
+    is_valid = _read_raw(raw, pos, &one_num)
+    one_den = normalization_factor
+    if poissonian:
+        one_var = max(one_num, <data_t> 1.0)
+    elif variance != NULL:
+        one_var = variance[idx]
+    else:
+        one_var = 0.0
+
+    is_valid = is_valid and not isnan(one_num)
+
+    if is_valid and (flat != NULL):
+        one_flat = flat[idx]
+        if delta_dummy == 0:
+            is_valid = (one_flat != dummy)
+        else:
+            is_valid = fabs(one_flat - dummy) > delta_dummy
+
+    if is_valid:
+        if dark != NULL:
+            one_num = one_num - dark[idx]
+        if flat != NULL:
+            one_den = one_den * flat[idx]
+        if polarization != NULL:
+            one_den = one_den * polarization[idx]
+        if solidangle != NULL:
+            one_den = one_den * solidangle[idx]
+        if absorption != NULL:
+            one_den = one_den * absorption[idx]
+        if (isnan(one_num) or isnan(one_den) or isnan(one_var) or (one_den == 0)):
+            is_valid = False
+
+    if is_valid:
+        result.signal = one_num
+        result.variance = one_var
+        result.norm = one_den
+        result.count = 1.0
+    else:
+        result.signal = 0.0
+        result.variance = 0.0
+        result.norm = 0.0
+        result.count = 0.0
+    return result
+
+
+cdef raw_t _as_raw(const uint8_t[::1] buffer, dtype, dummy, delta_dummy):
+    """Describe a raw signal buffer for `_read_raw`
+
+    :param buffer: the raw signal, viewed as bytes
+    :param dtype: the actual dtype of the signal, one of _RAW_KINDS
+    :param dummy: value for dead pixels, or None
+    :param delta_dummy: precision for dead-pixel value
+    :return: raw_t structure
+    """
+    cdef raw_t raw
+    raw.ptr = &buffer[0]
+    raw.kind = _RAW_KINDS[dtype]
+    raw.check_dummy = dummy is not None
+    raw.dummy = <data_t> float(dummy or 0.0)
+    raw.delta_dummy = <data_t> float(delta_dummy or 0.0)
+    raw.integer_dummy = (raw.check_dummy and (dtype.kind in "iu")
+                         and (float(dummy) == int(dummy))
+                         and (float(delta_dummy or 0.0) < 1.0))
+    raw.idummy = int(dummy) if raw.integer_dummy else 0
+    return raw
+
+
+def _as_signal(array, shape):
+    """Prepare the raw signal for the integration: no conversion is performed
+    for the dtypes which can be read natively
+
+    :param array: the signal as ndarray
+    :param shape: expected shape of the contiguous buffer
+    :return: contiguous array
+    """
+    array = numpy.ascontiguousarray(array).reshape(shape)
+    if array.dtype not in _RAW_KINDS:
+        array = numpy.ascontiguousarray(array, dtype=data_d)
+    return array
+
+
+def _nbytes(arrays):
+    """Memory used by some arrays, those sharing the same buffer are counted once
+
+    :param arrays: iterable of arrays or tuples of arrays, other objects are ignored
+    :return: size in bytes
+    """
+    sizes = {}
+    pending = list(arrays)
+    while pending:
+        array = pending.pop()
+        if isinstance(array, tuple):
+            pending.extend(array)
+            continue
+        if not isinstance(array, numpy.ndarray):
+            continue
+        address = array.__array_interface__["data"][0]
+        sizes[address] = max(sizes.get(address, 0), array.nbytes)
+    return sum(sizes.values())
+
+
+def _as_data(array, int size, str name):
+    """Convert an optional correction array to a contiguous 1D array of data_t
+
+    :param array: ndarray or None
+    :param size: expected number of elements
+    :param name: name of the array, for the error message
+    :return: contiguous array of data_t, or None
+    """
+    if array is None:
+        return None
+    assert array.size == size, f"{name} array size"
+    return numpy.ascontiguousarray(array.ravel(), dtype=data_d)
 
 
 cdef class CsrIntegrator(object):
@@ -58,6 +287,15 @@ cdef class CsrIntegrator(object):
         readonly data_t empty
         readonly data_t[::1] _data
         readonly index_t[::1] _indices, _indptr
+        # static normalization, see set_static_normalization
+        tuple _static
+        object _valid_pixels
+        # compact storage, see set_compact
+        readonly bint compact
+        readonly acc_t compact_scale
+        readonly index_t compact_nnz, compact_offset
+        uint16_t[::1] _compact_data, _compact_delta
+        index_t[::1] _compact_indptr, _compact_start
 
     def __init__(self,
                   tuple lut,
@@ -84,6 +322,12 @@ cdef class CsrIntegrator(object):
         self._data = None
         self._indices = None
         self._indpts = None
+        self._static = None
+        self._valid_pixels = None
+        self._compact_data = None
+        self._compact_delta = None
+        self._compact_indptr = None
+        self._compact_start = None
         self.empty = 0
         self.input_size = 0
         self.output_size = 0 
@@ -99,6 +343,313 @@ cdef class CsrIntegrator(object):
     def indptr(self):
         return numpy.asarray(self._indptr)
 
+    @property
+    def nbytes(self):
+        """Memory used by the integrator: the matrix, the static normalization,
+        the compact storage and the other arrays it holds (bin positions,
+        mask ...). Arrays sharing their buffer are counted once.
+        """
+        arrays = [self.data, self.indices, self.indptr, self._valid_pixels, self._static]
+        if self.compact:
+            arrays += [numpy.asarray(self._compact_data), numpy.asarray(self._compact_delta),
+                       numpy.asarray(self._compact_indptr), numpy.asarray(self._compact_start)]
+        if hasattr(self, "__dict__"):
+            arrays += [value for value in self.__dict__.values()
+                       if isinstance(value, (numpy.ndarray, tuple))]
+        return _nbytes(arrays)
+
+    @property
+    def valid_pixels(self):
+        """Gather index: sorted indices of the pixels which contribute to the
+        matrix. Masked pixels, excluded when the matrix is built, are absent.
+        """
+        if self._valid_pixels is None:
+            self._valid_pixels = numpy.where(numpy.bincount(self.indices, minlength=self.input_size))[0].astype(index_d)
+        return self._valid_pixels
+
+    def __copy__(self):
+        """Shallow copy of the integrator: arrays are shared, not duplicated.
+
+        Integrators are used concurrently without lock, so the ones in use
+        are never modified in place: a copy is modified (i.e. with
+        `update_mask`) and published instead.
+        """
+        cdef CsrIntegrator new
+        cls = self.__class__
+        new = cls.__new__(cls)
+        CsrIntegrator.__init__(new, (self.data, self.indices, self.indptr), self.input_size, self.empty)
+        new._static = self._static
+        new._valid_pixels = self._valid_pixels
+        new.compact = self.compact
+        new.compact_scale = self.compact_scale
+        new.compact_offset = self.compact_offset
+        new.compact_nnz = self.compact_nnz
+        new._compact_data = self._compact_data
+        new._compact_delta = self._compact_delta
+        new._compact_indptr = self._compact_indptr
+        new._compact_start = self._compact_start
+        if hasattr(self, "__dict__"):
+            new.__dict__.update(self.__dict__)
+        return new
+
+    def mask_pixels(self, pixels):
+        """Remove the contributions of some pixels from the matrix, in place.
+
+        Neither the geometry nor the pixel splitting are recalculated: the
+        entries of those columns are simply dropped, other coefficients and
+        the bins are unchanged. The static normalization and the compact
+        storage are discarded.
+
+        :param pixels: indices of the pixels to exclude (in the flattened image)
+        :return: number of entries removed from the matrix
+        """
+        cdef:
+            index_t removed
+        pixels = numpy.asarray(pixels, dtype=numpy.intp).ravel()
+        if pixels.size == 0:
+            return 0
+        excluded = numpy.zeros(self.input_size, dtype=bool)
+        excluded[pixels] = True
+        keep = numpy.logical_not(excluded[self.indices])
+        removed = self.nnz - numpy.count_nonzero(keep)
+        if removed == 0:
+            return 0
+        indptr = numpy.concatenate(([0], numpy.cumsum(keep, dtype=numpy.int64)))[self.indptr]
+        CsrIntegrator.__init__(self, (self.data[keep], self.indices[keep], indptr),
+                               self.input_size, self.empty)
+        self.reset_static_normalization()
+        self.set_compact(False)
+        self._valid_pixels = None
+        return removed
+
+    def update_mask(self, mask, mask_checksum=None):
+        """Update the matrix of an integrator after a change of the mask.
+
+        Pixels which become masked are removed from the matrix with
+        `mask_pixels`, the bins (`bin_centers`, `pos0_range` ...) are kept
+        as they are. Their contributions having never been calculated, pixels
+        which become valid again require to rebuild the integrator.
+
+        This relies on the `cmask` and `mask_checksum` attributes of the
+        actual integrators.
+
+        :param mask: new mask, 1 for masked pixels, 0 for valid ones
+        :param mask_checksum: checksum of the new mask, calculated if None
+        :return: True if the matrix was updated, False if it needs to be rebuilt
+        """
+        new_mask = numpy.ascontiguousarray(mask, dtype=mask_d).ravel()
+        if new_mask.size != self.input_size:
+            return False
+        masked = new_mask != 0
+        if self.cmask is None:
+            previous = numpy.zeros(self.input_size, dtype=bool)
+        else:
+            previous = numpy.asarray(self.cmask) != 0
+        if numpy.any(previous & ~masked):
+            return False
+        self.mask_pixels(numpy.where(masked & ~previous)[0])
+        self.cmask = new_mask
+        self.mask_checksum = mask_checksum if mask_checksum else crc32(mask)
+        if getattr(self, "lut", None) is not None:
+            self.lut_checksum = crc32(self.data)
+            self.lut = (self.data, self.indices, self.indptr)
+            self.lut_nbytes = sum([i.nbytes for i in self.lut])
+        return True
+
+    def set_static_normalization(self,
+                                 solidangle=None,
+                                 polarization=None,
+                                 absorption=None,
+                                 solidangle_checksum=None,
+                                 polarization_checksum=None,
+                                 absorption_checksum=None):
+        """Precompute the normalization due to arrays which do not change from
+        one frame to another, i.e. the solid-angle, the polarization and the
+        absorption corrections.
+
+        The normalization of each pixel, and the normalization and number of
+        pixels of each bin, are calculated once; the matrix itself is not
+        duplicated. When `integrate_ng` is later called with arrays having
+        the same checksums, only the signal and variance are accumulated for
+        each frame: the per-pixel normalization is read only for the pixels
+        discarded dynamically (dummy or NaN), to remove their contribution
+        from the precomputed normalization.
+
+        This modifies the integrator: call it before the integrator is shared.
+
+        :param solidangle: array with the solid angle of each pixel (if any)
+        :param polarization: array with the polarization correction values (if any)
+        :param absorption: Apparent efficiency of a pixel due to parallax effect
+        :param solidangle_checksum: CRC32 checksum of the solid-angle array, calculated if None
+        :param polarization_checksum: CRC32 checksum of the polarization array, calculated if None
+        :param absorption_checksum: CRC32 checksum of the absorption array, calculated if None
+        """
+        cdef:
+            index_t i, j, idx
+            acc_t acc_norm, acc_count, coef
+            data_t one_norm
+            data_t[::1] csolidangle, cpolarization, cabsorption, pixel_norm
+            acc_t[::1] static_norm, static_count
+            mask_t[::1] cmask
+            bint check_mask = self.check_mask
+        checksum = self._get_checksum(solidangle, polarization, absorption,
+                                      solidangle_checksum, polarization_checksum, absorption_checksum)
+        if (self._static is not None) and (self._static[0] == checksum):
+            return
+        pixel_norm = numpy.ones(self.input_size, dtype=data_d)
+        csolidangle = _as_data(solidangle, self.input_size, "solidangle")
+        cpolarization = _as_data(polarization, self.input_size, "polarization")
+        cabsorption = _as_data(absorption, self.input_size, "absorption")
+        if check_mask:
+            cmask = numpy.ascontiguousarray(self.cmask.ravel(), dtype=mask_d)
+        # Same order of operation as in the preprocessing
+        for idx in range(self.input_size):
+            one_norm = 1.0
+            if cpolarization is not None:
+                one_norm = one_norm * cpolarization[idx]
+            if csolidangle is not None:
+                one_norm = one_norm * csolidangle[idx]
+            if cabsorption is not None:
+                one_norm = one_norm * cabsorption[idx]
+            if isnan(one_norm) or (check_mask and cmask[idx]):
+                one_norm = 0.0
+            pixel_norm[idx] = one_norm
+
+        static_norm = numpy.zeros(self.output_size, dtype=acc_d)
+        static_count = numpy.zeros(self.output_size, dtype=acc_d)
+        with nogil:
+            for i in range(self.output_size):
+                acc_norm = 0.0
+                acc_count = 0.0
+                for j in range(self._indptr[i], self._indptr[i + 1]):
+                    coef = self._data[j]
+                    idx = self._indices[j]
+                    # Statically invalid pixels (null normalization) are skipped
+                    if coef == 0.0 or pixel_norm[idx] == 0.0:
+                        continue
+                    acc_norm = acc_norm + coef * pixel_norm[idx]
+                    acc_count = acc_count + coef
+                static_norm[i] = acc_norm
+                static_count[i] = acc_count
+        self._static = (checksum, numpy.asarray(pixel_norm),
+                        numpy.asarray(static_norm), numpy.asarray(static_count))
+
+    def set_compact(self, bint enabled=True):
+        """Enable the compact storage of the matrix for `integrate_ng` and
+        `integrate_ng_stack`: 4 bytes per non-zero element instead of 8.
+
+        * Coefficients are quantized on 16 bits:
+          coef ~ (q - compact_offset) * compact_scale, with
+          compact_scale = (max(coef) - min(coef, 0)) / 65535. The offset is
+          only non-null if the matrix contains negative coefficients. The
+          absolute error on each coefficient is at most compact_scale / 2,
+          i.e. 7.6e-6 for coefficients in [0, 1]. The relative error on the signal and the
+          normalization of a bin is bounded by the same amount divided by the
+          smallest coefficient of the bin; coefficients smaller than
+          compact_scale / 2 are dropped.
+        * Column indices are sorted within each row and stored as 16-bit
+          increments from the first index of the row. Increments larger than
+          65535 are split using additional null coefficients.
+
+        The float32 matrix is kept for the other methods. Compact storage is
+        not combined with the static normalization. `compact_nnz` is the
+        number of entries, padding included.
+
+        :param enabled: set to False to go back to the float32 matrix
+        :raise ValueError: if the matrix contains non-finite coefficients
+        """
+        cdef:
+            index_t nrow = self.output_size
+        if not enabled:
+            self.compact = False
+            self.compact_nnz = 0
+            self._compact_data = None
+            self._compact_delta = None
+            self._compact_indptr = None
+            self._compact_start = None
+            return
+        if self.compact:
+            return
+        data = self.data
+        if not numpy.isfinite(data).all():
+            raise ValueError("Compact storage requires finite coefficients")
+        indices = self.indices.astype(numpy.int64)
+        indptr = self.indptr.astype(numpy.int64)
+        row = numpy.repeat(numpy.arange(nrow), numpy.diff(indptr))
+        order = numpy.lexsort((indices, row))
+        indices = indices[order]
+        data = data[order]
+        maxi = max(data.max(), 0.0) if data.size else 0.0
+        mini = min(data.min(), 0.0) if data.size else 0.0
+        scale = (maxi - mini) / 65535.0 if maxi > mini else 1.0
+        offset = int(numpy.round(-mini / scale))
+        quantized = (numpy.round(data / scale) + offset).astype(numpy.uint16)
+        start = numpy.zeros(nrow, dtype=index_d)
+        first = indptr[:nrow]
+        nonempty = indptr[1:] > first
+        start[nonempty] = indices[first[nonempty]]
+        delta = numpy.zeros_like(indices)
+        delta[1:] = numpy.diff(indices)
+        delta[first[nonempty]] = 0
+        # Increments above 65535 are split with padding entries having a null coefficient
+        npad = numpy.maximum(delta - 1, 0) // 65535
+        size = npad + 1
+        cumsize = numpy.concatenate(([0], numpy.cumsum(size)))
+        position = cumsize[1:] - 1
+        compact_data = numpy.full(int(size.sum()), offset, dtype=numpy.uint16)
+        compact_delta = numpy.full(compact_data.size, 65535, dtype=numpy.uint16)
+        compact_data[position] = quantized
+        compact_delta[position] = delta - npad * 65535
+        self._compact_indptr = cumsize[indptr].astype(index_d)
+        self._compact_data = compact_data
+        self._compact_delta = compact_delta
+        self._compact_start = start
+        self.compact_scale = scale
+        self.compact_offset = offset
+        self.compact_nnz = compact_data.size
+        self.compact = True
+
+    def reset_static_normalization(self):
+        """Discard the precomputed static normalization"""
+        self._static = None
+
+    @property
+    def static_checksum(self):
+        """Checksums of the solid-angle, polarization and absorption arrays
+        of the static normalization, None if there is none"""
+        if self._static is not None:
+            return self._static[0]
+
+    @staticmethod
+    def _get_checksum(solidangle, polarization, absorption,
+                      solidangle_checksum=None, polarization_checksum=None, absorption_checksum=None):
+        """Checksums identifying the correction arrays of a static normalization
+
+        :return: 3-tuple of CRC32 checksums, None for missing arrays
+        """
+        return tuple(None if array is None else (checksum or crc32(array))
+                     for array, checksum in ((solidangle, solidangle_checksum),
+                                             (polarization, polarization_checksum),
+                                             (absorption, absorption_checksum)))
+
+    def _pack_result(self, merged, error, sum_sig, sum_var, sum_norm, sum_count):
+        """Build the result named-tuple from the accumulated arrays"""
+        if self.bin_centers is None:
+            # 2D integration case
+            return Integrate2dtpl(self.bin_centers0, self.bin_centers1,
+                                  numpy.asarray(merged).reshape(self.bins).T,
+                                  numpy.asarray(error).reshape(self.bins).T,
+                                  numpy.asarray(sum_sig).reshape(self.bins).T,
+                                  numpy.asarray(sum_var).reshape(self.bins).T,
+                                  numpy.asarray(sum_norm).reshape(self.bins).T,
+                                  numpy.asarray(sum_count).reshape(self.bins).T,)
+        else:
+            # 1D integration case: "position intensity error signal variance normalization count"
+            return Integrate1dtpl(self.bin_centers,
+                                  numpy.asarray(merged), numpy.asarray(error),
+                                  numpy.asarray(sum_sig), numpy.asarray(sum_var),
+                                  numpy.asarray(sum_norm), numpy.asarray(sum_count))
+
     def integrate_legacy(self,
                          weights,
                          dummy=None,
@@ -141,7 +692,8 @@ cdef class CsrIntegrator(object):
             acc_t[::1] sum_data = numpy.zeros(self.output_size, dtype=acc_d)
             acc_t[::1] sum_count = numpy.zeros(self.output_size, dtype=acc_d)
             data_t[::1] merged = numpy.zeros(self.output_size, dtype=data_d)
-            data_t[::1] cdata, tdata, cflat, cdark, csolidAngle, cpolarization
+            const data_t[::1] cdata, tdata
+            data_t[::1] work, cflat, cdark, csolidAngle, cpolarization
         assert weights.size == self.input_size, "weights size"
 
         if dummy is not None:
@@ -175,7 +727,7 @@ cdef class CsrIntegrator(object):
 
         if (do_dark + do_flat + do_polarization + do_solidAngle):
             tdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
-            cdata = numpy.empty(self.input_size, dtype=data_d)
+            work = numpy.empty(self.input_size, dtype=data_d)
             if do_dummy:
                 for i in prange(self.input_size, nogil=True, schedule="static"):
                     data = tdata[i]
@@ -189,9 +741,9 @@ cdef class CsrIntegrator(object):
                             data = data / cpolarization[i]
                         if do_solidAngle:
                             data = data / csolidAngle[i]
-                        cdata[i] = data
+                        work[i] = data
                     else:  # set all dummy_like values to cdummy. simplifies further processing
-                        cdata[i] = cdummy
+                        work[i] = cdummy
             else:
                 for i in prange(self.input_size, nogil=True, schedule="static"):
                     data = tdata[i]
@@ -203,17 +755,19 @@ cdef class CsrIntegrator(object):
                         data = data / cpolarization[i]
                     if do_solidAngle:
                         data = data / csolidAngle[i]
-                    cdata[i] = data
+                    work[i] = data
+            cdata = work
         else:
             if do_dummy:
                 tdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
-                cdata = numpy.zeros(self.input_size, dtype=data_d)
+                work = numpy.zeros(self.input_size, dtype=data_d)
                 for i in prange(self.input_size, nogil=True, schedule="static"):
                     data = tdata[i]
                     if ((cddummy != 0) and (fabs(data - cdummy) > cddummy)) or ((cddummy == 0) and (data != cdummy)):
-                        cdata[i] = data
+                        work[i] = data
                     else:
-                        cdata[i] = cdummy
+                        work[i] = cdummy
+                cdata = work
             else:
                 cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
 
@@ -266,6 +820,9 @@ cdef class CsrIntegrator(object):
                      polarization=None,
                      absorption=None,
                      data_t normalization_factor=1.0,
+                     solidangle_checksum=None,
+                     polarization_checksum=None,
+                     absorption_checksum=None,
                      ):
         """
         Actually perform the integration which in this case consists of:
@@ -292,75 +849,134 @@ cdef class CsrIntegrator(object):
         :param absorption: Apparent efficiency of a pixel due to parallax effect
         :type absorption: ndarray        
         :param normalization_factor: divide the valid result by this value
+        :param solidangle_checksum: CRC32 checksum of the solid-angle array (if known)
+        :param polarization_checksum: CRC32 checksum of the polarization array (if known)
+        :param absorption_checksum: CRC32 checksum of the absorption array (if known)
 
         :return: positions, pattern, weighted_histogram and unweighted_histogram
         :rtype: Integrate1dtpl 4-named-tuple of ndarrays
+
+        The preprocessing (dark, flat, solid-angle, polarization, absorption,
+        mask and dummy) is fused into the matrix-vector product: it is applied
+        on the fly to each pixel read, no intermediate image is allocated.
+        Integer images (8, 16 or 32 bits) are read natively, without
+        conversion to float, and an integer dummy value is compared exactly.
+
+        When the checksums of the solid-angle, polarization and absorption
+        arrays match the ones registered with `set_static_normalization`, the
+        precomputed normalization is used, unless a flat-field, the azimuthal
+        error model or the compact storage (see `set_compact`) is used.
+        Checksums which are not provided are calculated.
         """
         cdef:
-            index_t i, j, idx = 0
+            index_t i, j, idx = 0, start, stop
+            bint compact = self.compact
+            acc_t compact_scale = self.compact_scale
+            index_t compact_offset = self.compact_offset
             acc_t acc_sig = 0.0, acc_var = 0.0, acc_norm = 0.0, acc_count = 0.0, coef = 0.0
             acc_t delta, x, omega_A, omega_B, omega3
-            data_t empty
+            data_t empty, cdummy, cddummy, cnormalization_factor = normalization_factor
             acc_t[::1] sum_sig = numpy.empty(self.output_size, dtype=acc_d)
             acc_t[::1] sum_var = numpy.empty(self.output_size, dtype=acc_d)
             acc_t[::1] sum_norm = numpy.empty(self.output_size, dtype=acc_d)
             acc_t[::1] sum_count = numpy.empty(self.output_size, dtype=acc_d)
             data_t[::1] merged = numpy.empty(self.output_size, dtype=data_d)
             data_t[::1] error = numpy.empty(self.output_size, dtype=data_d)
-            data_t[:, ::1] preproc4
+            data_t[::1] cdark, cflat, csolidangle, cpolarization, cabsorption, cvariance
+            raw_t raw
+            const data_t *pdark = NULL
+            const data_t *pflat = NULL
+            const data_t *psolidangle = NULL
+            const data_t *ppolarization = NULL
+            const data_t *pabsorption = NULL
+            const data_t *pvariance = NULL
+            preproc_t pix
+            bint do_poissonian = poissonian is True
             bint do_azimuthal_variance = poissonian is False
         assert weights.size == self.input_size, "weights size"
+        static = self._static
+        if ((static is not None) and (flat is None) and (not do_azimuthal_variance) and
+                (normalization_factor != 0.0) and (not compact) and
+                static[0] == self._get_checksum(solidangle, polarization, absorption, solidangle_checksum,
+                                                polarization_checksum, absorption_checksum)):
+            return self._integrate_static(static, weights, variance, do_poissonian, dummy, delta_dummy,
+                                          dark, normalization_factor)
         empty = dummy if dummy is not None else self.empty
-        #Call the preprocessor ...
-        preproc4 = preproc(weights.ravel(),
-                           dark=dark,
-                           flat=flat,
-                           solidangle=solidangle,
-                           polarization=polarization,
-                           absorption=absorption,
-                           mask=self.cmask if self.check_mask else None,
-                           dummy=dummy, 
-                           delta_dummy=delta_dummy,
-                           normalization_factor=normalization_factor, 
-                           empty=self.empty,
-                           split_result=4,
-                           variance=variance,
-                           dtype=data_d,
-                           poissonian= poissonian is True)
+        if dummy is not None:
+            cdummy = <data_t> float(dummy)
+            cddummy = <data_t> float(delta_dummy or 0.0)
+        else:
+            # Same convention as pyFAI.ext.preproc: the flat is checked against empty
+            cdummy = cddummy = <data_t> (self.empty or 0.0)
+
+        signal = _as_signal(weights, self.input_size)
+        raw = _as_raw(signal.view(numpy.uint8), signal.dtype, dummy, delta_dummy)
+        cdark = _as_data(dark, self.input_size, "dark")
+        if cdark is not None:
+            pdark = &cdark[0]
+        cflat = _as_data(flat, self.input_size, "flat")
+        if cflat is not None:
+            pflat = &cflat[0]
+        csolidangle = _as_data(solidangle, self.input_size, "solidangle")
+        if csolidangle is not None:
+            psolidangle = &csolidangle[0]
+        cpolarization = _as_data(polarization, self.input_size, "polarization")
+        if cpolarization is not None:
+            ppolarization = &cpolarization[0]
+        cabsorption = _as_data(absorption, self.input_size, "absorption")
+        if cabsorption is not None:
+            pabsorption = &cabsorption[0]
+        cvariance = _as_data(variance, self.input_size, "variance")
+        if cvariance is not None:
+            pvariance = &cvariance[0]
 
         for i in prange(self.output_size, nogil=True, schedule="guided"):
             acc_sig = 0.0
             acc_var = 0.0
             acc_norm = 0.0
             acc_count = 0.0
-            for j in range(self._indptr[i], self._indptr[i + 1]):
-                coef = self._data[j]
+            if compact:
+                start = self._compact_indptr[i]
+                stop = self._compact_indptr[i + 1]
+                idx = self._compact_start[i]
+            else:
+                start = self._indptr[i]
+                stop = self._indptr[i + 1]
+            for j in range(start, stop):
+                if compact:
+                    idx = idx + self._compact_delta[j]
+                    coef = (<index_t> self._compact_data[j] - compact_offset) * compact_scale
+                else:
+                    coef = self._data[j]
+                    idx = self._indices[j]
                 if coef == 0.0:
                     continue
-                idx = self._indices[j]
-                
+                pix = _preproc_pixel(&raw, idx, idx, pdark, pflat, psolidangle, ppolarization,
+                                     pabsorption, pvariance, do_poissonian,
+                                     cdummy, cddummy, cnormalization_factor)
+
                 if do_azimuthal_variance:
                     if acc_count == 0.0:
-                        acc_sig = coef * preproc4[idx, 0]
+                        acc_sig = coef * pix.signal
                         #Variance remains at 0
-                        acc_norm = coef * preproc4[idx, 2] 
-                        acc_count = coef * preproc4[idx, 3]
+                        acc_norm = coef * pix.norm 
+                        acc_count = coef * pix.count
                     else:
                         # see https://dbs.ifi.uni-heidelberg.de/files/Team/eschubert/publications/SSDBM18-covariance-authorcopy.pdf
                         omega_A = acc_norm
-                        omega_B = coef * preproc4[idx, 2]
+                        omega_B = coef * pix.norm
                         acc_norm = omega_A + omega_B
                         omega3 = acc_norm * omega_A * omega_B
-                        x = coef * preproc4[idx, 0]
+                        x = coef * pix.signal
                         delta = omega_B*acc_sig - omega_A*x
                         acc_var = acc_var +  delta*delta/omega3
                         acc_sig = acc_sig + x
-                        acc_count = acc_count + coef * preproc4[idx, 3]
+                        acc_count = acc_count + coef * pix.count
                 else:
-                    acc_sig = acc_sig + coef * preproc4[idx, 0]
-                    acc_var = acc_var + coef * coef * preproc4[idx, 1]
-                    acc_norm = acc_norm + coef * preproc4[idx, 2] 
-                    acc_count = acc_count + coef * preproc4[idx, 3]
+                    acc_sig = acc_sig + coef * pix.signal
+                    acc_var = acc_var + coef * coef * pix.variance
+                    acc_norm = acc_norm + coef * pix.norm 
+                    acc_count = acc_count + coef * pix.count
 
             sum_sig[i] = acc_sig
             sum_var[i] = acc_var
@@ -373,20 +989,289 @@ cdef class CsrIntegrator(object):
                 merged[i] = empty
                 error[i] = empty
                 
+        return self._pack_result(merged, error, sum_sig, sum_var, sum_norm, sum_count)
+
+    def _integrate_static(self,
+                          tuple static,
+                          weights,
+                          variance,
+                          bint poissonian,
+                          dummy,
+                          delta_dummy,
+                          dark,
+                          data_t normalization_factor):
+        """Integration with the precomputed static normalization, see
+        `set_static_normalization`, as provided in `static`
+
+        Only the signal and its variance are accumulated. The contribution
+        of the pixels discarded dynamically is removed from the static
+        normalization of the bin.
+
+        :return: Integrate1dtpl or Integrate2dtpl named-tuple
+        """
+        cdef:
+            index_t i, j, idx = 0, nvalid = 0
+            acc_t acc_sig = 0.0, acc_var = 0.0, lost_norm = 0.0, lost_count = 0.0, coef = 0.0
+            acc_t norm, count
+            data_t empty, value, one_var
+            bint is_valid
+            acc_t[::1] sum_sig = numpy.empty(self.output_size, dtype=acc_d)
+            acc_t[::1] sum_var = numpy.empty(self.output_size, dtype=acc_d)
+            acc_t[::1] sum_norm = numpy.empty(self.output_size, dtype=acc_d)
+            acc_t[::1] sum_count = numpy.empty(self.output_size, dtype=acc_d)
+            data_t[::1] merged = numpy.empty(self.output_size, dtype=data_d)
+            data_t[::1] error = numpy.empty(self.output_size, dtype=data_d)
+            data_t[::1] cdark, cvariance
+            data_t[::1] pixel_norm = static[1]
+            acc_t[::1] static_norm = static[2]
+            acc_t[::1] static_count = static[3]
+            const data_t *pdark = NULL
+            const data_t *pvariance = NULL
+            raw_t raw
+        empty = dummy if dummy is not None else self.empty
+        signal = _as_signal(weights, self.input_size)
+        raw = _as_raw(signal.view(numpy.uint8), signal.dtype, dummy, delta_dummy)
+        cdark = _as_data(dark, self.input_size, "dark")
+        if cdark is not None:
+            pdark = &cdark[0]
+        cvariance = _as_data(variance, self.input_size, "variance")
+        if cvariance is not None:
+            pvariance = &cvariance[0]
+
+        for i in prange(self.output_size, nogil=True, schedule="guided"):
+            acc_sig = 0.0
+            acc_var = 0.0
+            lost_norm = 0.0
+            lost_count = 0.0
+            nvalid = 0
+            for j in range(self._indptr[i], self._indptr[i + 1]):
+                coef = self._data[j]
+                idx = self._indices[j]
+                if coef == 0.0 or pixel_norm[idx] == 0.0:
+                    continue
+                is_valid = _read_raw(&raw, idx, &value)
+                if poissonian:
+                    one_var = max(value, <data_t> 1.0)
+                elif pvariance != NULL:
+                    one_var = pvariance[idx]
+                else:
+                    one_var = 0.0
+                if is_valid and pdark != NULL:
+                    value = value - pdark[idx]
+                if is_valid and not (isnan(value) or isnan(one_var)):
+                    acc_sig = acc_sig + coef * value
+                    acc_var = acc_var + coef * coef * one_var
+                    nvalid = nvalid + 1
+                else:
+                    lost_norm = lost_norm + coef * pixel_norm[idx]
+                    lost_count = lost_count + coef
+            if nvalid > 0:
+                norm = normalization_factor * (static_norm[i] - lost_norm)
+                count = static_count[i] - lost_count
+            else:
+                norm = 0.0
+                count = 0.0
+            sum_sig[i] = acc_sig
+            sum_var[i] = acc_var
+            sum_norm[i] = norm
+            sum_count[i] = count
+            if count > 0.0:
+                merged[i] = acc_sig / norm
+                error[i] = sqrt(acc_var) / norm
+            else:
+                merged[i] = empty
+                error[i] = empty
+
+        return self._pack_result(merged, error, sum_sig, sum_var, sum_norm, sum_count)
+
+    def integrate_ng_stack(self,
+                           weights,
+                           variance=None,
+                           poissonian=None,
+                           dummy=None,
+                           delta_dummy=None,
+                           dark=None,
+                           flat=None,
+                           solidangle=None,
+                           polarization=None,
+                           absorption=None,
+                           normalization_factor=1.0,
+                           ):
+        """
+        Integrate a stack of frames at once, i.e. a sparse-matrix x dense-matrix product.
+
+        Each row of the matrix is read once and stays in cache while it is
+        applied to all frames of the stack, which spreads the cost of
+        streaming the CSR matrix from memory over the whole stack.
+
+        :param weights: stack of input images, shape (nframes, ...)
+        :type weights: ndarray
+        :param variance: the variance associate to the images, same shape as weights
+        :type variance: ndarray
+        :param poissonian: set to use signal as variance (minimum 1), set to False to use azimuthal model.
+        :param dummy: value for dead pixels (optional)
+        :type dummy: float
+        :param delta_dummy: precision for dead-pixel value in dynamic masking
+        :type delta_dummy: float
+        :param dark: array with the dark-current value to be subtracted (if any)
+        :type dark: ndarray
+        :param flat: array with the dark-current value to be divided by (if any)
+        :type flat: ndarray
+        :param solidAngle: array with the solid angle of each pixel to be divided by (if any)
+        :type solidAngle: ndarray
+        :param polarization: array with the polarization correction values to be divided by (if any)
+        :type polarization: ndarray
+        :param absorption: Apparent efficiency of a pixel due to parallax effect
+        :type absorption: ndarray
+        :param normalization_factor: divide the valid result by this value, scalar or one value per frame
+
+        :return: positions, pattern, weighted_histogram and unweighted_histogram with one line per frame
+        :rtype: Integrate1dtpl 4-named-tuple of ndarrays
+
+        Like `integrate_ng`, the preprocessing is performed on the fly.
+        """
+        cdef:
+            index_t i, j, f, idx = 0, nframes, start, stop
+            bint compact = self.compact
+            acc_t compact_scale = self.compact_scale
+            index_t compact_offset = self.compact_offset
+            acc_t acc_sig = 0.0, acc_var = 0.0, acc_norm = 0.0, acc_count = 0.0, coef = 0.0
+            acc_t delta, x, omega_A, omega_B, omega3
+            data_t empty, cdummy, cddummy
+            acc_t[:, ::1] sum_sig, sum_var, sum_norm, sum_count
+            data_t[:, ::1] merged, error, cvariance
+            data_t[::1] cnorm, cdark, cflat, csolidangle, cpolarization, cabsorption
+            const data_t *pdark = NULL
+            const data_t *pflat = NULL
+            const data_t *psolidangle = NULL
+            const data_t *ppolarization = NULL
+            const data_t *pabsorption = NULL
+            const data_t *pvariance = NULL
+            preproc_t pix
+            raw_t raw
+            Py_ssize_t offset
+            bint do_poissonian = poissonian is True
+            bint do_variance = variance is not None
+            bint do_azimuthal_variance = poissonian is False
+        nframes = weights.shape[0]
+        assert weights.size == nframes * self.input_size, "weights size"
+        if variance is not None:
+            assert variance.size == weights.size, "variance size"
+        empty = dummy if dummy is not None else self.empty
+        if dummy is not None:
+            cdummy = <data_t> float(dummy)
+            cddummy = <data_t> float(delta_dummy or 0.0)
+        else:
+            # Same convention as pyFAI.ext.preproc: the flat is checked against empty
+            cdummy = cddummy = <data_t> (self.empty or 0.0)
+        cnorm = numpy.ascontiguousarray(numpy.broadcast_to(normalization_factor, (nframes,)), dtype=data_d)
+        sum_sig = numpy.empty((nframes, self.output_size), dtype=acc_d)
+        sum_var = numpy.empty((nframes, self.output_size), dtype=acc_d)
+        sum_norm = numpy.empty((nframes, self.output_size), dtype=acc_d)
+        sum_count = numpy.empty((nframes, self.output_size), dtype=acc_d)
+        merged = numpy.empty((nframes, self.output_size), dtype=data_d)
+        error = numpy.empty((nframes, self.output_size), dtype=data_d)
+
+        signal = _as_signal(weights, (nframes, self.input_size))
+        raw = _as_raw(signal.reshape(-1).view(numpy.uint8), signal.dtype, dummy, delta_dummy)
+        if do_variance:
+            cvariance = numpy.ascontiguousarray(variance.reshape(nframes, self.input_size), dtype=data_d)
+        cdark = _as_data(dark, self.input_size, "dark")
+        if cdark is not None:
+            pdark = &cdark[0]
+        cflat = _as_data(flat, self.input_size, "flat")
+        if cflat is not None:
+            pflat = &cflat[0]
+        csolidangle = _as_data(solidangle, self.input_size, "solidangle")
+        if csolidangle is not None:
+            psolidangle = &csolidangle[0]
+        cpolarization = _as_data(polarization, self.input_size, "polarization")
+        if cpolarization is not None:
+            ppolarization = &cpolarization[0]
+        cabsorption = _as_data(absorption, self.input_size, "absorption")
+        if cabsorption is not None:
+            pabsorption = &cabsorption[0]
+
+        for i in prange(self.output_size, nogil=True, schedule="guided"):
+            for f in range(nframes):
+                acc_sig = 0.0
+                acc_var = 0.0
+                acc_norm = 0.0
+                acc_count = 0.0
+                offset = <Py_ssize_t> f * self.input_size
+                if do_variance:
+                    pvariance = &cvariance[f, 0]
+                else:
+                    pvariance = NULL
+                if compact:
+                    start = self._compact_indptr[i]
+                    stop = self._compact_indptr[i + 1]
+                    idx = self._compact_start[i]
+                else:
+                    start = self._indptr[i]
+                    stop = self._indptr[i + 1]
+                for j in range(start, stop):
+                    if compact:
+                        idx = idx + self._compact_delta[j]
+                        coef = (<index_t> self._compact_data[j] - compact_offset) * compact_scale
+                    else:
+                        coef = self._data[j]
+                        idx = self._indices[j]
+                    if coef == 0.0:
+                        continue
+                    pix = _preproc_pixel(&raw, offset + idx, idx, pdark, pflat, psolidangle, ppolarization,
+                                         pabsorption, pvariance, do_poissonian,
+                                         cdummy, cddummy, cnorm[f])
+
+                    if do_azimuthal_variance:
+                        if acc_count == 0.0:
+                            acc_sig = coef * pix.signal
+                            #Variance remains at 0
+                            acc_norm = coef * pix.norm
+                            acc_count = coef * pix.count
+                        else:
+                            # see https://dbs.ifi.uni-heidelberg.de/files/Team/eschubert/publications/SSDBM18-covariance-authorcopy.pdf
+                            omega_A = acc_norm
+                            omega_B = coef * pix.norm
+                            acc_norm = omega_A + omega_B
+                            omega3 = acc_norm * omega_A * omega_B
+                            x = coef * pix.signal
+                            delta = omega_B*acc_sig - omega_A*x
+                            acc_var = acc_var +  delta*delta/omega3
+                            acc_sig = acc_sig + x
+                            acc_count = acc_count + coef * pix.count
+                    else:
+                        acc_sig = acc_sig + coef * pix.signal
+                        acc_var = acc_var + coef * coef * pix.variance
+                        acc_norm = acc_norm + coef * pix.norm
+                        acc_count = acc_count + coef * pix.count
+
+                sum_sig[f, i] = acc_sig
+                sum_var[f, i] = acc_var
+                sum_norm[f, i] = acc_norm
+                sum_count[f, i] = acc_count
+                if acc_count > 0.0:
+                    merged[f, i] = acc_sig / acc_norm
+                    error[f, i] = sqrt(acc_var) / acc_norm
+                else:
+                    merged[f, i] = empty
+                    error[f, i] = empty
+
         if self.bin_centers is None:
             # 2D integration case
+            shape = (nframes,) + tuple(self.bins)
             return Integrate2dtpl(self.bin_centers0, self.bin_centers1,
-                              numpy.asarray(merged).reshape(self.bins).T, 
-                              numpy.asarray(error).reshape(self.bins).T,
-                              numpy.asarray(sum_sig).reshape(self.bins).T, 
-                              numpy.asarray(sum_var).reshape(self.bins).T, 
-                              numpy.asarray(sum_norm).reshape(self.bins).T, 
-                              numpy.asarray(sum_count).reshape(self.bins).T,)
+                                  numpy.asarray(merged).reshape(shape).transpose(0, 2, 1),
+                                  numpy.asarray(error).reshape(shape).transpose(0, 2, 1),
+                                  numpy.asarray(sum_sig).reshape(shape).transpose(0, 2, 1),
+                                  numpy.asarray(sum_var).reshape(shape).transpose(0, 2, 1),
+                                  numpy.asarray(sum_norm).reshape(shape).transpose(0, 2, 1),
+                                  numpy.asarray(sum_count).reshape(shape).transpose(0, 2, 1))
         else:
             # 1D integration case: "position intensity error signal variance normalization count"
-            return Integrate1dtpl(self.bin_centers, 
-                                  numpy.asarray(merged),numpy.asarray(error) ,
-                                  numpy.asarray(sum_sig),numpy.asarray(sum_var), 
+            return Integrate1dtpl(self.bin_centers,
+                                  numpy.asarray(merged), numpy.asarray(error),
+                                  numpy.asarray(sum_sig), numpy.asarray(sum_var),
                                   numpy.asarray(sum_norm), numpy.asarray(sum_count))
     
     def sigma_clip(self, 
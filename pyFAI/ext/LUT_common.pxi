@@ -80,6 +80,19 @@ cdef class LutIntegrator(object):
         self.output_size = 0 
         self.nnz = 0
 
+    def __copy__(self):
+        """Shallow copy of the integrator: the LUT is shared, not duplicated.
+
+        Integrators are used concurrently without lock, so the ones in use
+        are never modified in place: a copy is modified and published instead.
+        """
+        cls = self.__class__
+        new = cls.__new__(cls)
+        LutIntegrator.__init__(new, self._lut, self.input_size, self.empty)
+        if hasattr(self, "__dict__"):
+            new.__dict__.update(self.__dict__)
+        return new
+
     @property
     def lut(self):
         """Getter a copy of the LUT as an actual numpy array"""
@@ -132,7 +145,8 @@ cdef class LutIntegrator(object):
             acc_t[::1] sum_data = numpy.empty(self.output_size, dtype=acc_d)
             acc_t[::1] sum_count = numpy.empty(self.output_size, dtype=acc_d)
             data_t[::1] merged = numpy.empty(self.output_size, dtype=data_d)
-            float[:] cdata, tdata, cflat, cdark, csolidAngle, cpolarization
+            const float[:] cdata, tdata
+            float[:] work, cflat, cdark, csolidAngle, cpolarization
 
         assert weights.size == self.input_size, "weights size"
 
@@ -165,7 +179,7 @@ cdef class LutIntegrator(object):
 
         if (do_dark + do_flat + do_polarization + do_solidAngle):
             tdata = numpy.ascontiguousarray(weights.ravel(), dtype=numpy.float32)
-            cdata = numpy.zeros(self.input_size, dtype=numpy.float32)
+            work = numpy.zeros(self.input_size, dtype=numpy.float32)
             if do_dummy:
                 for i in prange(self.input_size, nogil=True, schedule="static"):
                     data = tdata[i]
@@ -179,10 +193,10 @@ cdef class LutIntegrator(object):
                             data = data / cpolarization[i]
                         if do_solidAngle:
                             data = data / csolidAngle[i]
-                        cdata[i] = data
+                        work[i] = data
                     else:
                         # set all dummy_like values to cdummy. simplifies further processing
-                        cdata[i] = cdummy
+                        work[i] = cdummy
             else:
                 for i in prange(self.input_size, nogil=True, schedule="static"):
                     data = tdata[i]
@@ -194,17 +208,19 @@ cdef class LutIntegrator(object):
                         data = data / cpolarization[i]
                     if do_solidAngle:
                         data = data / csolidAngle[i]
-                    cdata[i] = data
+                    work[i] = data
+            cdata = work
         else:
             if do_dummy:
                 tdata = numpy.ascontiguousarray(weights.ravel(), dtype=numpy.float32)
-                cdata = numpy.zeros(self.input_size, dtype=numpy.float32)
+                work = numpy.zeros(self.input_size, dtype=numpy.float32)
                 for i in prange(self.input_size, nogil=True, schedule="static"):
                     data = tdata[i]
                     if ((cddummy != 0) and (fabs(data - cdummy) > cddummy)) or ((cddummy == 0) and (data != cdummy)):
-                        cdata[i] = data
+                        work[i] = data
                     else:
-                        cdata[i] = cdummy
+                        work[i] = cdummy
+                cdata = work
             else:
                 cdata = numpy.ascontiguousarray(weights.ravel(), dtype=numpy.float32)
 
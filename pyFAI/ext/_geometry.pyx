@@ -37,7 +37,7 @@ coordinates.
 
 __author__ = "Jerome Kieffer"
 __license__ = "MIT"
-__date__ = "14/09/2021"
+__date__ = "18/10/2022"
 __copyright__ = "2011-2020, ESRF"
 __contact__ = "jerome.kieffer@esrf.fr"
 
@@ -58,6 +58,11 @@ ctypedef fused float_or_double:
     cython.double
     cython.float
 
+# and a third one for the results
+ctypedef fused result_t:
+    cython.double
+    cython.float
+
 try:    
     MAX_THREADS = min(MAX_THREADS, len(os.sched_getaffinity(os.getpid()))) # Limit to the actual number of threads
 except Exception:
@@ -190,16 +195,80 @@ cdef inline double f_sina(double p1, double p2, double L) nogil:
     return sqrt(r2 / (L * L + r2))
 
 
+cdef inline double f_dtth(double t1, double t2, double t3, double dt1, double dt2, double dt3) nogil:
+    """Calculate the derivative of 2 theta for 1 pixel
+
+    :param t1, t2, t3: position of the pixel in the laboratory referential
+    :param dt1, dt2, dt3: derivative of this position with respect to the parameter
+    :return: derivative of 2 theta, 0 on the beam-center where it is not defined
+    """
+    cdef:
+        double rho2 = t1 * t1 + t2 * t2
+        double rho = sqrt(rho2)
+    if rho == 0.0:
+        return 0.0
+    return (t3 * (t1 * dt1 + t2 * dt2) / rho - rho * dt3) / (rho2 + t3 * t3)
+
+
 ################################################################################
 # End of pure cython function declaration
 ################################################################################
 
 
+def _calc_pos_zyx(double L, double poni1, double poni2,
+                  double rot1, double rot2, double rot3,
+                  float_or_double[::1] c1,
+                  float_or_double[::1] c2,
+                  float_or_double[::1] c3,
+                  bint use_c3,
+                  cython.floating[::1] t1,
+                  cython.floating[::1] t2,
+                  cython.floating[::1] t3):
+    """Kernel of calc_pos_zyx, for positions and results in single or double precision.
+    Calculations are always performed in double precision.
+    """
+    cdef:
+        double sinRot1 = sin(rot1)
+        double cosRot1 = cos(rot1)
+        double sinRot2 = sin(rot2)
+        double cosRot2 = cos(rot2)
+        double sinRot3 = sin(rot3)
+        double cosRot3 = cos(rot3)
+        Py_ssize_t  size = c1.shape[0], i = 0
+        double p1, p2, p3
+    for i in prange(size, nogil=True, schedule="static", num_threads=1 if size<MIN_SIZE else MAX_THREADS):
+        p1 = c1[i] - poni1
+        p2 = c2[i] - poni2
+        if use_c3:
+            p3 = c3[i] + L
+        else:
+            p3 = L
+        t1[i] = f_t1(p1, p2, p3, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
+        t2[i] = f_t2(p1, p2, p3, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
+        t3[i] = f_t3(p1, p2, p3, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
+
+
+def _as_positions(*positions):
+    """Flatten the arrays of positions without changing their precision
+    (i.e. without copy) when all are in single precision, else in double precision.
+
+    :param positions: numpy arrays, or None
+    :return: list of contiguous 1D arrays, or None
+    """
+    if all(pos.dtype == numpy.float32 for pos in positions if pos is not None):
+        dtype = numpy.float32
+    else:
+        dtype = numpy.float64
+    return [None if pos is None else numpy.ascontiguousarray(pos.ravel(), dtype=dtype)
+            for pos in positions]
+
+
 def calc_pos_zyx(double L, double poni1, double poni2,
                  double rot1, double rot2, double rot3,
                  pos1 not None,
                  pos2 not None,
-                 pos3=None):
+                 pos3=None,
+                 dtype=numpy.float64):
     """Calculate the 3D coordinates in the sample's referential
 
     :param L: distance sample - PONI
@@ -211,48 +280,22 @@ def calc_pos_zyx(double L, double poni1, double poni2,
     :param pos1: numpy array with distances in meter along dim1 from PONI (Y)
     :param pos2: numpy array with distances in meter along dim2 from PONI (X)
     :param pos3: numpy array with distances in meter along Sample->PONI (Z), positive behind the detector
-    :return: 3-tuple of ndarray of double with same shape and size as pos1
+    :param dtype: numpy.float64 (default) or numpy.float32 for the result
+    :return: 3-tuple of ndarray of dtype with same shape and size as pos1
 
+    Positions in single precision are used as they are, without copy.
     """
-    cdef:
-        double sinRot1 = sin(rot1)
-        double cosRot1 = cos(rot1)
-        double sinRot2 = sin(rot2)
-        double cosRot2 = cos(rot2)
-        double sinRot3 = sin(rot3)
-        double cosRot3 = cos(rot3)
-        Py_ssize_t  size = pos1.size, i = 0
-        double p1, p2, p3
+    cdef Py_ssize_t  size = pos1.size
     assert pos2.size == size, "pos2.size == size"
-    cdef:
-        double[::1] c1 = numpy.ascontiguousarray(pos1.ravel(), dtype=numpy.float64)
-        double[::1] c2 = numpy.ascontiguousarray(pos2.ravel(), dtype=numpy.float64)
-        double[::1] c3
-        double[::1] t1 = numpy.empty(size, dtype=numpy.float64)
-        double[::1] t2 = numpy.empty(size, dtype=numpy.float64)
-        double[::1] t3 = numpy.empty(size, dtype=numpy.float64)
-
-    if pos3 is None:
-        for i in prange(size, nogil=True, schedule="static", num_threads=1 if size<MIN_SIZE else MAX_THREADS):
-            p1 = c1[i] - poni1
-            p2 = c2[i] - poni2
-            t1[i] = f_t1(p1, p2, L, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
-            t2[i] = f_t2(p1, p2, L, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
-            t3[i] = f_t3(p1, p2, L, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
-    else:
+    if pos3 is not None:
         assert pos3.size == size, "pos3.size == size"
-        c3 = numpy.ascontiguousarray(pos3.ravel(), dtype=numpy.float64)
-        for i in prange(size, nogil=True, schedule="static", num_threads=1 if size<MIN_SIZE else MAX_THREADS):
-            p1 = c1[i] - poni1
-            p2 = c2[i] - poni2
-            p3 = c3[i] + L
-            t1[i] = f_t1(p1, p2, p3, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
-            t2[i] = f_t2(p1, p2, p3, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
-            t3[i] = f_t3(p1, p2, p3, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
-
-    r1 = numpy.asarray(t1)
-    r2 = numpy.asarray(t2)
-    r3 = numpy.asarray(t3)
+    c1, c2, c3 = _as_positions(pos1, pos2, pos3)
+    r1 = numpy.empty(size, dtype=dtype)
+    r2 = numpy.empty(size, dtype=dtype)
+    r3 = numpy.empty(size, dtype=dtype)
+    _calc_pos_zyx(L, poni1, poni2, rot1, rot2, rot3,
+                  c1, c2, c1 if c3 is None else c3, c3 is not None,
+                  r1, r2, r3)
 
     if pos1.ndim == 3:
         return (r3.reshape(pos1.shape[0], pos1.shape[1], pos1.shape[2]),
@@ -468,6 +511,223 @@ def calc_r(double L, double rot1, double rot2, double rot3,
         return numpy.asarray(out)
 
 
+def calc_batch(params not None,
+               pos1 not None,
+               pos2 not None,
+               pos3=None,
+               space="2th",
+               wavelength=None,
+               group=None,
+               bint chi_discontinuity_at_pi=True):
+    """Calculate the position of pixels for many geometries at once, using OpenMP
+
+    Unlike other functions of this module, the positions of the pixels are
+    not relative to the PONI since it may differ from one geometry to the other.
+
+    :param params: 2D array (M, 6) with dist, poni1, poni2, rot1, rot2, rot3 of each geometry,
+                   or (M, 7) with the wavelength (in meter) of each geometry in the last column
+    :param pos1: numpy array with distances in meter along dim1 from the detector origin (Y), N pixels
+    :param pos2: numpy array with distances in meter along dim2 from the detector origin (X)
+    :param pos3: numpy array with distances in meter along Sample->PONI (Z), positive behind the detector
+    :param space: can be "2th", "chi", "q" or "r". Radial units are radians, nm^-1 and meter
+    :param wavelength: in meter, needed for q when params has only 6 columns
+    :param group: array with the index of the geometry for each pixel. By default, all
+                  pixels are evaluated with all geometries
+    :param chi_discontinuity_at_pi: set to False to obtain chi in the range [0, 2pi[ instead of [-pi, pi[
+    :return: ndarray of double with shape (M, N), or (N,) when group is provided
+    :raise: KeyError when space is bad !
+            ValueError when wavelength is missing
+    """
+    cdef:
+        double[:, ::1] cparam = numpy.ascontiguousarray(numpy.atleast_2d(params), dtype=numpy.float64)
+        Py_ssize_t ngeo = cparam.shape[0], size = pos1.size, npix, k, g, i
+        double[:, ::1] trigo = numpy.empty((ngeo, 6), dtype=numpy.float64)
+        double[::1] wl = numpy.zeros(ngeo, dtype=numpy.float64)
+        int[::1] cgroup
+        double[::1] c1, c2, c3, out
+        int cspace = 0
+        bint use_group = group is not None, use_c3 = pos3 is not None
+        double p1, p2, p3, t1, t2, t3, value
+
+    assert pos2.size == size, "pos2.size == size"
+    assert cparam.shape[1] in (6, 7), "params.shape[1] in (6, 7)"
+    if space == "2th":
+        cspace = 1
+    elif space == "q":
+        cspace = 2
+        if cparam.shape[1] == 7:
+            wl = numpy.ascontiguousarray(numpy.asarray(cparam)[:, 6])
+        elif wavelength:
+            wl[:] = wavelength
+        else:
+            raise ValueError("wavelength is needed for q calculation")
+    elif space == "r":
+        cspace = 3
+    elif space == "chi":
+        cspace = 4
+    else:
+        raise KeyError("Not implemented space %s in cython" % space)
+
+    c1 = numpy.ascontiguousarray(pos1.ravel(), dtype=numpy.float64)
+    c2 = numpy.ascontiguousarray(pos2.ravel(), dtype=numpy.float64)
+    if use_c3:
+        assert pos3.size == size, "pos3.size == size"
+        c3 = numpy.ascontiguousarray(pos3.ravel(), dtype=numpy.float64)
+    else:
+        c3 = c1
+    if use_group:
+        group = numpy.ascontiguousarray(group, dtype=numpy.intc).ravel()
+        assert group.size == size, "group.size == size"
+        if size and ((group.min() < 0) or (group.max() >= ngeo)):
+            raise ValueError("Group index out of the range of geometries")
+        cgroup = group
+        npix = size
+    else:
+        npix = ngeo * size
+    out = numpy.empty(npix, dtype=numpy.float64)
+
+    for g in range(ngeo):
+        trigo[g, 0] = sin(cparam[g, 3])
+        trigo[g, 1] = cos(cparam[g, 3])
+        trigo[g, 2] = sin(cparam[g, 4])
+        trigo[g, 3] = cos(cparam[g, 4])
+        trigo[g, 4] = sin(cparam[g, 5])
+        trigo[g, 5] = cos(cparam[g, 5])
+
+    for k in prange(npix, nogil=True, schedule="static", num_threads=1 if npix<MIN_SIZE else MAX_THREADS):
+        if use_group:
+            g = cgroup[k]
+            i = k
+        else:
+            g = k // size
+            i = k % size
+        p1 = c1[i] - cparam[g, 1]
+        p2 = c2[i] - cparam[g, 2]
+        if use_c3:
+            p3 = cparam[g, 0] + c3[i]
+        else:
+            p3 = cparam[g, 0]
+        t1 = f_t1(p1, p2, p3, trigo[g, 0], trigo[g, 1], trigo[g, 2], trigo[g, 3], trigo[g, 4], trigo[g, 5])
+        t2 = f_t2(p1, p2, p3, trigo[g, 0], trigo[g, 1], trigo[g, 2], trigo[g, 3], trigo[g, 4], trigo[g, 5])
+        if cspace == 4:
+            value = atan2(t1, t2)
+            if not chi_discontinuity_at_pi:
+                value = (value + twopi) % twopi
+        elif cspace == 3:
+            value = sqrt(t1 * t1 + t2 * t2)
+        else:
+            t3 = f_t3(p1, p2, p3, trigo[g, 0], trigo[g, 1], trigo[g, 2], trigo[g, 3], trigo[g, 4], trigo[g, 5])
+            value = atan2(sqrt(t1 * t1 + t2 * t2), t3)
+            if cspace == 2:
+                value = 4.0e-9 * M_PI / wl[g] * sin(value / 2.0)
+        out[k] = value
+
+    if use_group:
+        return numpy.asarray(out)
+    return numpy.asarray(out).reshape(ngeo, size)
+
+
+def calc_jacobian(double L, double rot1, double rot2, double rot3,
+                  pos1 not None,
+                  pos2 not None,
+                  pos3=None,
+                  space="2th",
+                  wavelength=None):
+    """Calculate the radial position of pixels together with its analytic
+    derivatives with respect to the 7 parameters of the geometry, using OpenMP
+
+    :param L: distance sample - PONI
+    :param rot1: angle1
+    :param rot2: angle2
+    :param rot3: angle3
+    :param pos1: numpy array with distances in meter along dim1 from PONI (Y)
+    :param pos2: numpy array with distances in meter along dim2 from PONI (X)
+    :param pos3: numpy array with distances in meter along Sample->PONI (Z), positive behind the detector
+    :param space: can be "2th" or "q". Units are radians and nm^-1
+    :param wavelength: in meter, needed for q
+    :return: 2-tuple with the values (N,) and the jacobian (N, 7), i.e. the derivatives
+             with respect to dist, poni1, poni2, rot1, rot2, rot3 and wavelength (S.I. units)
+    :raise: KeyError when space is bad !
+            ValueError when wavelength is missing
+    """
+    cdef:
+        double sinRot1 = sin(rot1)
+        double cosRot1 = cos(rot1)
+        double sinRot2 = sin(rot2)
+        double cosRot2 = cos(rot2)
+        double sinRot3 = sin(rot3)
+        double cosRot3 = cos(rot3)
+        Py_ssize_t size = pos1.size, i = 0, j
+        double[::1] c1, c2, c3, out
+        double[:, ::1] jac
+        bint use_c3 = pos3 is not None, is_q
+        double p1, p2, p3, t1, t2, t3, value, factor, wl = 0.0
+
+    assert pos2.size == size, "pos2.size == size"
+    if space == "2th":
+        is_q = False
+    elif space == "q":
+        is_q = True
+        if not wavelength:
+            raise ValueError("wavelength is needed for q calculation")
+        wl = wavelength
+    else:
+        raise KeyError("Not implemented space %s in cython" % space)
+
+    c1 = numpy.ascontiguousarray(pos1.ravel(), dtype=numpy.float64)
+    c2 = numpy.ascontiguousarray(pos2.ravel(), dtype=numpy.float64)
+    if use_c3:
+        assert pos3.size == size, "pos3.size == size"
+        c3 = numpy.ascontiguousarray(pos3.ravel(), dtype=numpy.float64)
+    else:
+        c3 = c1
+    out = numpy.empty(size, dtype=numpy.float64)
+    jac = numpy.zeros((size, 7), dtype=numpy.float64)
+
+    for i in prange(size, nogil=True, schedule="static", num_threads=1 if size<MIN_SIZE else MAX_THREADS):
+        p1 = c1[i]
+        p2 = c2[i]
+        if use_c3:
+            p3 = L + c3[i]
+        else:
+            p3 = L
+        t1 = f_t1(p1, p2, p3, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
+        t2 = f_t2(p1, p2, p3, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
+        t3 = f_t3(p1, p2, p3, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
+        value = atan2(sqrt(t1 * t1 + t2 * t2), t3)
+        # dist, poni1 and poni2 translate the pixel along the columns of the rotation matrix
+        jac[i, 0] = f_dtth(t1, t2, t3,
+                           -(cosRot1 * cosRot3 * sinRot2 + sinRot1 * sinRot3),
+                           cosRot3 * sinRot1 - cosRot1 * sinRot2 * sinRot3,
+                           cosRot1 * cosRot2)
+        jac[i, 1] = f_dtth(t1, t2, t3,
+                           -cosRot2 * cosRot3,
+                           -cosRot2 * sinRot3,
+                           -sinRot2)
+        jac[i, 2] = f_dtth(t1, t2, t3,
+                           cosRot1 * sinRot3 - cosRot3 * sinRot1 * sinRot2,
+                           -(cosRot1 * cosRot3 + sinRot1 * sinRot2 * sinRot3),
+                           cosRot2 * sinRot1)
+        jac[i, 3] = f_dtth(t1, t2, t3,
+                           p2 * (cosRot1 * cosRot3 * sinRot2 + sinRot1 * sinRot3) + p3 * (cosRot3 * sinRot1 * sinRot2 - cosRot1 * sinRot3),
+                           p2 * (cosRot1 * sinRot2 * sinRot3 - cosRot3 * sinRot1) + p3 * (cosRot1 * cosRot3 + sinRot1 * sinRot2 * sinRot3),
+                           -cosRot2 * (p2 * cosRot1 + p3 * sinRot1))
+        jac[i, 4] = f_dtth(t1, t2, t3,
+                           cosRot3 * (p2 * sinRot1 * cosRot2 - p1 * sinRot2 - p3 * cosRot1 * cosRot2),
+                           sinRot3 * (p2 * sinRot1 * cosRot2 - p1 * sinRot2 - p3 * cosRot1 * cosRot2),
+                           p1 * cosRot2 + p2 * sinRot1 * sinRot2 - p3 * cosRot1 * sinRot2)
+        # rot3 is a rotation around the beam: 2theta does not depend on it (jac[i, 5] = 0)
+        if is_q:
+            factor = 2.0e-9 * M_PI / wl * cos(value / 2.0)
+            value = 4.0e-9 * M_PI / wl * sin(value / 2.0)
+            for j in range(5):
+                jac[i, j] = factor * jac[i, j]
+            jac[i, 6] = -value / wl
+        out[i] = value
+
+    return numpy.asarray(out), numpy.asarray(jac)
+
+
 def calc_cosa(double L,
               pos1 not None,
               pos2 not None,
@@ -540,6 +800,53 @@ def calc_sina(double L,
         return numpy.asarray(out)
 
 
+def _calc_rad_azim(double L,
+                   double poni1,
+                   double poni2,
+                   double rot1,
+                   double rot2,
+                   double rot3,
+                   float_or_double[::1] c1,
+                   float_or_double[::1] c2,
+                   float_or_double[::1] c3,
+                   bint use_c3,
+                   int cspace,
+                   double fwavelength,
+                   bint chi_discontinuity_at_pi,
+                   float[:, ::1] out):
+    """Kernel of calc_rad_azim, for positions in single or double precision.
+    Calculations are always performed in double precision.
+    """
+    cdef:
+        double sinRot1 = sin(rot1)
+        double cosRot1 = cos(rot1)
+        double sinRot2 = sin(rot2)
+        double cosRot2 = cos(rot2)
+        double sinRot3 = sin(rot3)
+        double cosRot3 = cos(rot3)
+        Py_ssize_t  size = c1.shape[0], i = 0
+        double t1, t2, t3, p3, chi
+    for i in prange(size, nogil=True, schedule="static", num_threads=1 if size<MIN_SIZE else MAX_THREADS):
+        if use_c3:
+            p3 = L + c3[i]
+        else:
+            p3 = L
+        t1 = f_t1(c1[i] - poni1, c2[i] - poni2, p3, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
+        t2 = f_t2(c1[i] - poni1, c2[i] - poni2, p3, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
+        t3 = f_t3(c1[i] - poni1, c2[i] - poni2, p3, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
+        if cspace == 1:
+            out[i, 0] = atan2(sqrt(t1 * t1 + t2 * t2), t3)
+        elif cspace == 2:
+            out[i, 0] = 4.0e-9 * M_PI / fwavelength * sin(atan2(sqrt(t1 * t1 + t2 * t2), t3) / 2.0)
+        elif cspace == 3:
+            out[i, 0] = sqrt(t1 * t1 + t2 * t2)
+        chi = atan2(t1, t2)
+        if chi_discontinuity_at_pi:
+            out[i, 1] = chi
+        else:
+            out[i, 1] = (chi + twopi) % twopi
+
+
 def calc_rad_azim(double L,
                   double poni1,
                   double poni2,
@@ -566,26 +873,19 @@ def calc_rad_azim(double L,
     :param pos3: numpy array with distances in meter along Sample->PONI (Z), positive behind the detector
     :param space: can be "2th", "q" or "r" for radial units. Azimuthal units are radians
     :param chi_discontinuity_at_pi: set to False to obtain chi in the range [0, 2pi[ instead of [-pi, pi[
-    :return: ndarray of double with same shape and size as pos1 + (2,),
+    :return: ndarray of float with same shape and size as pos1 + (2,),
     :raise: KeyError when space is bad !
             ValueError when wavelength is missing
 
+    Positions in single precision are used as they are, without copy.
     """
-    cdef Py_ssize_t  size = pos1.size, i = 0
-    assert pos2.size == size, "pos2.size == size"
     cdef:
-        double sinRot1 = sin(rot1)
-        double cosRot1 = cos(rot1)
-        double sinRot2 = sin(rot2)
-        double cosRot2 = cos(rot2)
-        double sinRot3 = sin(rot3)
-        double cosRot3 = cos(rot3)
+        Py_ssize_t  size = pos1.size
         int cspace = 0
-        double[::1] c1 = numpy.ascontiguousarray(pos1.ravel(), dtype=numpy.float64)
-        double[::1] c2 = numpy.ascontiguousarray(pos2.ravel(), dtype=numpy.float64)
-        double[::1] c3
-        float[:, ::1] out = numpy.empty((size, 2), dtype=numpy.float32)
-        double t1, t2, t3, fwavelength, chi
+        double fwavelength = 0.0
+    assert pos2.size == size, "pos2.size == size"
+    if pos3 is not None:
+        assert pos3.size == size, "pos3.size == size"
 
     if space == "2th":
         cspace = 1
@@ -600,42 +900,12 @@ def calc_rad_azim(double L,
     else:
         raise KeyError("Not implemented space %s in cython" % space)
 
-    if pos3 is None:
-        for i in prange(size, nogil=True, schedule="static", num_threads=1 if size<MIN_SIZE else MAX_THREADS):
-            t1 = f_t1(c1[i] - poni1, c2[i] - poni2, L, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
-            t2 = f_t2(c1[i] - poni1, c2[i] - poni2, L, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
-            t3 = f_t3(c1[i] - poni1, c2[i] - poni2, L, sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
-            if cspace == 1:
-                out[i, 0] = atan2(sqrt(t1 * t1 + t2 * t2), t3)
-            elif cspace == 2:
-                out[i, 0] = 4.0e-9 * M_PI / fwavelength * sin(atan2(sqrt(t1 * t1 + t2 * t2), t3) / 2.0)
-            elif cspace == 3:
-                out[i, 0] = sqrt(t1 * t1 + t2 * t2)
-            chi = atan2(t1, t2)
-            if chi_discontinuity_at_pi:
-                out[i, 1] = chi
-            else:
-                out[i, 1] = (chi + twopi) % twopi
-    else:
-        assert pos3.size == size, "pos3.size == size"
-        c3 = numpy.ascontiguousarray(pos3.ravel(), dtype=numpy.float64)
-        for i in prange(size, nogil=True, schedule="static", num_threads=1 if size<MIN_SIZE else MAX_THREADS):
-            t1 = f_t1(c1[i] - poni1, c2[i] - poni2, L + c3[i], sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
-            t2 = f_t2(c1[i] - poni1, c2[i] - poni2, L + c3[i], sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
-            t3 = f_t3(c1[i] - poni1, c2[i] - poni2, L + c3[i], sinRot1, cosRot1, sinRot2, cosRot2, sinRot3, cosRot3)
-            if cspace == 1:
-                out[i, 0] = atan2(sqrt(t1 * t1 + t2 * t2), t3)
-            elif cspace == 2:
-                out[i, 0] = 4.0e-9 * M_PI / fwavelength * sin(atan2(sqrt(t1 * t1 + t2 * t2), t3) / 2.0)
-            elif cspace == 3:
-                out[i, 0] = sqrt(t1 * t1 + t2 * t2)
-            chi = atan2(t1, t2)
-            if chi_discontinuity_at_pi:
-                out[i, 1] = chi
-            else:
-                out[i, 1] = (chi + twopi) % twopi
+    c1, c2, c3 = _as_positions(pos1, pos2, pos3)
+    nout = numpy.empty((size, 2), dtype=numpy.float32)
+    _calc_rad_azim(L, poni1, poni2, rot1, rot2, rot3,
+                   c1, c2, c1 if c3 is None else c3, c3 is not None,
+                   cspace, fwavelength, chi_discontinuity_at_pi, nout)
 
-    nout = numpy.asarray(out)
     if pos1.ndim == 3:
         return nout.reshape(pos1.shape[0], pos1.shape[1], pos1.shape[2], 2)
     if pos1.ndim == 2:
@@ -644,26 +914,17 @@ def calc_rad_azim(double L,
         return nout
 
 
-def calc_delta_chi(cython.floating[:, ::1] centers,
-                   float_or_double[:, :, :, ::1] corners):
-    """Calculate the delta chi array (azimuthal angles) using OpenMP
-
-    :param centers: numpy array with chi angles of the center of the pixels
-    :param corners: numpy array with chi angles of the corners of the pixels
-    :return: ndarray of double with same shape and size as centers woth the delta chi per pixel
-    """
+def _calc_delta_chi(cython.floating[:, ::1] centers,
+                    float_or_double[:, :, :, ::1] corners,
+                    result_t[:, ::1] res):
+    """Kernel of calc_delta_chi, for a result in single or double precision"""
     cdef:
         Py_ssize_t width, height, row, col, corn, nbcorn
         double co, ce, delta0, delta1, delta2, delta
-        double[:, ::1] res
 
     height = centers.shape[0]
     width = centers.shape[1]
-    assert corners.shape[0] == height, "height match"
-    assert corners.shape[1] == width, "width match"
     nbcorn = corners.shape[2]
-
-    res = numpy.empty((height, width), dtype=numpy.float64)
     with nogil:
         for row in prange(height, num_threads=MAX_THREADS):
             for col in range(width):
@@ -677,4 +938,22 @@ def calc_delta_chi(cython.floating[:, ::1] centers,
                     if delta0 > delta:
                         delta = delta0
                 res[row, col] = delta
-    return numpy.asarray(res)
+
+
+def calc_delta_chi(centers not None,
+                   corners not None,
+                   dtype=numpy.float64):
+    """Calculate the delta chi array (azimuthal angles) using OpenMP
+
+    :param centers: numpy array with chi angles of the center of the pixels
+    :param corners: numpy array with chi angles of the corners of the pixels
+    :param dtype: numpy.float64 (default) or numpy.float32 for the result
+    :return: ndarray of dtype with same shape and size as centers woth the delta chi per pixel
+    """
+    height = centers.shape[0]
+    width = centers.shape[1]
+    assert corners.shape[0] == height, "height match"
+    assert corners.shape[1] == width, "width match"
+    res = numpy.empty((height, width), dtype=dtype)
+    _calc_delta_chi(centers, corners, res)
+    return res
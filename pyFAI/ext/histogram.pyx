@@ -89,7 +89,7 @@ def _histogram_omp(pos,
     cdef:
         int size = pos.size
         position_t[::1] cpos = numpy.ascontiguousarray(pos.ravel(), dtype=position_d)
-        data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
+        const data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
         acc_t[::1] out_data = numpy.zeros(bins, dtype=acc_d)
         acc_t[::1] out_count = numpy.zeros(bins, dtype=acc_d)
         data_t[::1] out_merge = numpy.zeros(bins, dtype=data_d)
@@ -183,7 +183,7 @@ def _histogram_nomp(pos,
     cdef:
         int  size = pos.size
         position_t[::1] cpos = numpy.ascontiguousarray(pos.ravel(), dtype=position_d)
-        data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
+        const data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
         acc_t[::1] out_data = numpy.zeros(bins, dtype=acc_d)
         acc_t[::1] out_count = numpy.zeros(bins, dtype=acc_d)
         data_t[::1] out_merge = numpy.zeros(bins, dtype=data_d)
@@ -278,7 +278,7 @@ def histogram2d(pos0,
     cdef:
         position_t[::1] cpos0 = numpy.ascontiguousarray(pos0.ravel(), dtype=position_d)
         position_t[::1] cpos1 = numpy.ascontiguousarray(pos1.ravel(), dtype=position_d)
-        data_t[::1] data = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
+        const data_t[::1] data = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
         acc_t[:, ::1] out_data = numpy.zeros((bins0, bins1), dtype=acc_d)
         acc_t[:, ::1] out_count = numpy.zeros((bins0, bins1), dtype=acc_d)
         data_t[:, ::1] out_merge = numpy.zeros((bins0, bins1), dtype=data_d)
@@ -348,7 +348,7 @@ def histogram_preproc(pos,
     cdef:
         Py_ssize_t  size = pos.size, bin = 0, i, j
         position_t[::1] cpos = numpy.ascontiguousarray(pos.ravel(), dtype=position_d)
-        data_t[:, ::1] cdata = numpy.ascontiguousarray(weights, dtype=data_d).reshape(-1, nchan)
+        const data_t[:, ::1] cdata = numpy.ascontiguousarray(weights, dtype=data_d).reshape(-1, nchan)
         acc_t[:, ::1] out_prop = numpy.zeros((bins, 4), dtype=acc_d)
         position_t delta, min0, max0, maxin0
         position_t a = 0.0
@@ -537,7 +537,7 @@ def histogram2d_engine(pos0,
     cdef:
         position_t[::1] cpos0 = numpy.ascontiguousarray(pos0.ravel(), dtype=position_d)
         position_t[::1] cpos1 = numpy.ascontiguousarray(pos1.ravel(), dtype=position_d)
-        data_t[:, ::1] data = numpy.ascontiguousarray(weights.reshape((-1, nchan)), dtype=data_d)
+        const data_t[:, ::1] data = numpy.ascontiguousarray(weights.reshape((-1, nchan)), dtype=data_d)
         acc_t[:, :, ::1] out_data = numpy.zeros((bins0, bins1, 4), dtype=acc_d)
         data_t[:, ::1] out_signal = numpy.zeros((bins0, bins1), dtype=data_d)
         data_t[:, ::1] out_error
@@ -52,7 +52,7 @@ from .isnan cimport isnan
 from cython cimport floating
 
 
-cdef floating[::1]c1_preproc(floating[::1] data,
+cdef floating[::1]c1_preproc(const floating[::1] data,
                              floating[::1] dark=None,
                              floating[::1] flat=None,
                              floating[::1] solidangle=None,
@@ -138,7 +138,7 @@ cdef floating[::1]c1_preproc(floating[::1] data,
     return result
 
 
-cdef floating[:, ::1]c2_preproc(floating[::1] data,
+cdef floating[:, ::1]c2_preproc(const floating[::1] data,
                                 floating[::1] dark=None,
                                 floating[::1] flat=None,
                                 floating[::1] solidangle=None,
@@ -227,7 +227,7 @@ cdef floating[:, ::1]c2_preproc(floating[::1] data,
     return result
 
 
-cdef floating[:, ::1]c3_preproc(floating[::1] data,
+cdef floating[:, ::1]c3_preproc(const floating[::1] data,
                                 floating[::1] dark=None,
                                 floating[::1] flat=None,
                                 floating[::1] solidangle=None,
@@ -335,7 +335,7 @@ cdef floating[:, ::1]c3_preproc(floating[::1] data,
     return result
 
 
-cdef floating[:, ::1]c4_preproc(floating[::1] data,
+cdef floating[:, ::1]c4_preproc(const floating[::1] data,
                                 floating[::1] dark=None,
                                 floating[::1] flat=None,
                                 floating[::1] solidangle=None,
@@ -449,7 +449,7 @@ cdef floating[:, ::1]c4_preproc(floating[::1] data,
     return result
 
 
-def _preproc(floating[::1] raw,
+def _preproc(const floating[::1] raw,
              tuple shape,
              bint check_dummy,
              floating dummy,
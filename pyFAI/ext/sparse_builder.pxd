@@ -53,11 +53,13 @@ cdef class SparseBuilder(object):
     cdef bool _use_heap_linked_list
     cdef bool _use_packed_list
     cdef object _mode
+    cdef SparseBuilder _next
 
     cdef void *_create_bin(self) nogil
     cdef void _copy_bin_indexes_to(self, int bin_id, int32_t *dest) nogil
     cdef void _copy_bin_coefs_to(self, int bin_id, float32_t *dest) nogil
     cdef void _copy_bin_data_to(self, int bin_id, pixel_t *dest) nogil
 
+    cdef int _cget_own_bin_size(self, int bin_id) nogil
     cdef int cget_bin_size(self, int bin_id) nogil
     cdef void cinsert(self, int bin_id, int index, float32_t coef) nogil
@@ -558,6 +558,25 @@ cdef class SparseBuilder(object):
             raise ValueError("bin_id out of range")
         self.cinsert(bin_id, index, coef)
 
+    def chain(self, SparseBuilder other not None):
+        """Append the content of another builder after the content of this
+        one, bin per bin.
+
+        The other builder is referenced, not copied: it should not be fed
+        anymore. This allows to fill several builders in parallel and to
+        export them as a single sparse matrix.
+
+        :param SparseBuilder other: builder with the same number of bins
+        """
+        if other._nbin != self._nbin:
+            raise ValueError("Builders have a different number of bins")
+        if self._use_packed_list or other._use_packed_list:
+            raise NotImplementedError("Not implemented for the 'pack' mode")
+        if self._next is None:
+            self._next = other
+        else:
+            self._next.chain(other)
+
     @cython.boundscheck(False)
     @cython.wraparound(False)
     @cython.cdivision(True)
@@ -614,7 +633,20 @@ cdef class SparseBuilder(object):
     @cython.wraparound(False)
     @cython.cdivision(True)
     cdef int cget_bin_size(self, int bin_id) nogil:
-        """Returns the size of a specific bin.
+        """Returns the size of a specific bin, chained builders included.
+
+        :param int bin_id: Index of the bin
+        :rtype: int
+        """
+        if self._next is None:
+            return self._cget_own_bin_size(bin_id)
+        return self._cget_own_bin_size(bin_id) + self._next.cget_bin_size(bin_id)
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    @cython.cdivision(True)
+    cdef int _cget_own_bin_size(self, int bin_id) nogil:
+        """Returns the size of a specific bin in this builder only.
 
         :param int bin_id: Index of the bin
         :rtype: int
@@ -672,6 +704,8 @@ cdef class SparseBuilder(object):
                     sizes[bin_id] = pixel_bin.size()
                 else:
                     sizes[bin_id] = 0
+        if self._next is not None:
+            return numpy.asarray(sizes) + self._next.get_bin_sizes()
         return numpy.asarray(sizes)
 
     @cython.boundscheck(False)
@@ -700,10 +734,13 @@ cdef class SparseBuilder(object):
                 pixel_bin = get_internal_data(&self._data)._bins[bin_id]
                 if pixel_bin != NULL:
                     size += pixel_bin.size()
+        if self._next is not None:
+            size += self._next.size()
         return size
 
     cdef void _copy_bin_indexes_to(self, int bin_id, int32_t *dest) nogil:
         cdef:
+            int32_t *start = dest
             PixelBin *pixel_bin
             compact_bin_t *compact_bin
             chained_pixel_t *chained_pixel
@@ -724,9 +761,12 @@ cdef class SparseBuilder(object):
             pixel_bin = get_internal_data(&self._data)._bins[bin_id]
             if pixel_bin != NULL:
                 pixel_bin.copy_indexes_to(dest)
+        if self._next is not None:
+            self._next._copy_bin_indexes_to(bin_id, start + self._cget_own_bin_size(bin_id))
 
     cdef void _copy_bin_coefs_to(self, int bin_id, float32_t *dest) nogil:
         cdef:
+            float32_t *start = dest
             PixelBin *pixel_bin
             compact_bin_t *compact_bin
             chained_pixel_t *chained_pixel
@@ -747,9 +787,12 @@ cdef class SparseBuilder(object):
             pixel_bin = get_internal_data(&self._data)._bins[bin_id]
             if pixel_bin != NULL:
                 pixel_bin.copy_coefs_to(dest)
+        if self._next is not None:
+            self._next._copy_bin_coefs_to(bin_id, start + self._cget_own_bin_size(bin_id))
 
     cdef void _copy_bin_data_to(self, int bin_id, pixel_t *dest) nogil:
         cdef:
+            pixel_t *start = dest
             PixelBin *pixel_bin
             compact_bin_t *compact_bin
             chained_pixel_t *chained_pixel
@@ -770,6 +813,8 @@ cdef class SparseBuilder(object):
             pixel_bin = get_internal_data(&self._data)._bins[bin_id]
             if pixel_bin != NULL:
                 pixel_bin.copy_data_to(dest)
+        if self._next is not None:
+            self._next._copy_bin_data_to(bin_id, start + self._cget_own_bin_size(bin_id))
 
     @cython.boundscheck(False)
     @cython.wraparound(False)
@@ -31,7 +31,7 @@
 
 __author__ = "Valentin Valls"
 __license__ = "MIT"
-__date__ = "14/01/2021"
+__date__ = "18/10/2022"
 __copyright__ = "2018-2021, ESRF"
 
 
@@ -47,10 +47,52 @@ from cython.operator cimport dereference
 from cython.operator cimport preincrement
 cimport cython
 from cython cimport floating
+cimport pyFAI.ext._openmp as _openmp
 
 include "sparse_builder.pxi"
 include "regrid_common.pxi"
 
+MIN_CHUNK = 16384
+"Minimum number of pixels processed by each thread in `parallel_build`"
+
+
+def parallel_build(fill_chunk, Py_ssize_t size, int nbin, int block_size=512, int nthread=0):
+    """Build a sparse matrix from chunks of pixels processed in parallel
+
+    The pixels are split in contiguous chunks, each of them is inserted in
+    its own builder by a different thread. The builders are then chained in
+    order: within each bin, elements are sorted by pixel index, exactly like
+    with a serial build, whatever the number of threads.
+
+    :param fill_chunk: callable(builder, start, stop) inserting the
+        contributions of the pixels start to stop-1 in the builder. It should
+        release the GIL.
+    :param size: number of pixels
+    :param nbin: number of bins
+    :param block_size: size of the blocks of the builders
+    :param nthread: number of threads, by default the OpenMP setting
+    :return: SparseBuilder instance
+    """
+    cdef:
+        int nchunk, chunk
+        Py_ssize_t[::1] bounds
+    if nthread <= 0:
+        nthread = _openmp.omp_get_max_threads()
+    nchunk = max(1, min(nthread, size // MIN_CHUNK))
+    bounds = numpy.linspace(0, size, nchunk + 1).astype(numpy.intp)
+    builders = [SparseBuilder(nbin, block_size=block_size,
+                              heap_size=(bounds[chunk + 1] - bounds[chunk] + 1023) & ~(1023))
+                for chunk in range(nchunk)]
+    if nchunk == 1:
+        fill_chunk(builders[0], 0, size)
+    else:
+        for chunk in prange(nchunk, nogil=True, schedule="static", chunksize=1, num_threads=nchunk):
+            with gil:
+                fill_chunk(builders[chunk], bounds[chunk], bounds[chunk + 1])
+        for chunk in range(1, nchunk):
+            builders[0].chain(builders[chunk])
+    return builders[0]
+
 
 def feed_histogram(SparseBuilder builder not None,
                    pos,
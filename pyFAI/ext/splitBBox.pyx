@@ -118,7 +118,8 @@ def histoBBox1d(weights,
         bint check_pos1 = False, check_mask = False, check_dummy = False
         bint do_dark = False, do_flat = False, do_polarization = False, do_solidangle = False
         position_t delta
-        data_t[::1] cdata, cflat, cdark, cpolarization, csolidangle, out_merge
+        const data_t[::1] cdata
+        data_t[::1] cflat, cdark, cpolarization, csolidangle, out_merge
         position_t[::1] cpos0, dpos0, cpos1, dpos1
         mask_t[::1] cmask=None
         acc_t inv_area, delta_right, delta_left
@@ -315,7 +316,7 @@ def histoBBox1d_engine(weights,
     cdef:
         Py_ssize_t i, idx
         # Related to data: single precision
-        data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
+        const data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
         data_t[::1] cflat, cdark, cpolarization, csolidangle, cvariance
         data_t cdummy, ddummy=0.0
 
@@ -557,7 +558,7 @@ def histoBBox2d(weights,
 
     cdef:
         #Related to data: single precision
-        data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
+        const data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
         data_t[::1] cflat, cdark, cpolarization, csolidangle
         data_t cdummy, ddummy
 
@@ -825,7 +826,7 @@ def histoBBox2d_engine(weights,
         bins1 = 1
     cdef:
         # Related to data: single precision
-        data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
+        const data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
         data_t[::1] cflat, cdark, cpolarization, csolidangle, cvariance
         data_t cdummy, ddummy=0.0
         # Related to positions: double precision
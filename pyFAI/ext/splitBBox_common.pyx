@@ -35,22 +35,23 @@
 
 __author__ = "Jerome Kieffer"
 __contact__ = "Jerome.kieffer@esrf.fr"
-__date__ = "07/01/2022"
+__date__ = "18/10/2022"
 __status__ = "stable"
 __license__ = "MIT"
 
 include "regrid_common.pxi"
 from ..utils import crc32
 from .sparse_builder cimport SparseBuilder
+from .sparse_builder import parallel_build
 from libc.math cimport INFINITY
 import logging
 logger = logging.getLogger(__name__)
 
 
-def calc_boundaries(position_t[::1] pos0,
-                    position_t[::1] delta_pos0=None,
-                    position_t[::1] pos1=None,
-                    position_t[::1] delta_pos1=None,
+def calc_boundaries(floating[::1] pos0,
+                    floating[::1] delta_pos0=None,
+                    floating[::1] pos1=None,
+                    floating[::1] delta_pos1=None,
                     mask_t[::1] cmask=None,
                     pos0_range=None,
                     pos1_range=None,
@@ -163,20 +164,25 @@ class SplitBBoxIntegrator:
         :param chiDiscAtPi: tell if azimuthal discontinuity is at 0 (0° when False) or π (180° when True)
         :param clip_pos1: clip the azimuthal range to [-π π] (or [0 2π] depending on chiDiscAtPi), set to False to deactivate behavior
         """
-        self.cpos0 = numpy.ascontiguousarray(pos0.ravel(), dtype=position_d)
+        # positions in single precision are kept as they are: no copy
+        if all(pos.dtype == numpy.float32 for pos in (pos0, delta_pos0, pos1, delta_pos1) if pos is not None):
+            dtype = numpy.float32
+        else:
+            dtype = position_d
+        self.cpos0 = numpy.ascontiguousarray(pos0.ravel(), dtype=dtype)
         self.size = pos0.size
         self.dpos0 = None
         self.cpos1 = None
         self.dpos1 = None
 
         if delta_pos0 is not None:
-            self.dpos0 = numpy.ascontiguousarray(delta_pos0.ravel(), dtype=position_d)
+            self.dpos0 = numpy.ascontiguousarray(delta_pos0.ravel(), dtype=dtype)
             assert self.dpos0.size == self.size, "dpos0 size"
         if pos1 is not None:
-            self.cpos1 = numpy.ascontiguousarray(pos1.ravel(), dtype=position_d)
+            self.cpos1 = numpy.ascontiguousarray(pos1.ravel(), dtype=dtype)
             assert self.cpos1.size == self.size, "cpos1 size"
         if delta_pos1 is not None:
-            self.dpos1 = numpy.ascontiguousarray(delta_pos1.ravel(), dtype=position_d)
+            self.dpos1 = numpy.ascontiguousarray(delta_pos1.ravel(), dtype=dtype)
             assert self.dpos1.size == self.size, "dpos1 size"
         
         if "__len__" in dir(bins): 
@@ -212,9 +218,18 @@ class SplitBBoxIntegrator:
 
     def calc_lut_1d(self):
         """Calculate the LUT and return the LUT-builder object
+
+        Chunks of pixels are processed in parallel, see `parallel_build`
+        """
+        return parallel_build(self._calc_lut_1d_chunk, self.size, self.bins, block_size=32)
+
+    def _calc_lut_1d_chunk(self, SparseBuilder builder, Py_ssize_t start, Py_ssize_t stop):
+        """Insert the contributions of pixels start to stop-1 in the builder
         """
         cdef:
             position_t[::1] cpos0, cpos1, dpos0, dpos1  
+            float32_t[::1] cpos0_32, cpos1_32, dpos0_32, dpos1_32
+            bint single = self.cpos0.dtype == numpy.float32
             mask_t[::1] cmask
             position_t pos0_min = 0.0, pos1_min = 0.0, pos1_maxin=0.0
             position_t delta, inv_area=0.0
@@ -222,13 +237,18 @@ class SplitBBoxIntegrator:
             position_t fbin0_min, fbin0_max, delta_left, delta_right
             Py_ssize_t bins, idx=0, bin=0, bin0_max=0, bin0_min=0, size
             bint check_pos1=self.pos1_range, check_mask=False, do_split=True
-            SparseBuilder builder 
         
         check_pos1=self.pos1_range is not None        
-        cpos0 = self.cpos0
-        cpos1 = self.cpos1
-        dpos0 = self.dpos0
-        dpos1 = self.dpos1 
+        if single:
+            cpos0_32 = self.cpos0
+            cpos1_32 = self.cpos1
+            dpos0_32 = self.dpos0
+            dpos1_32 = self.dpos1
+        else:
+            cpos0 = self.cpos0
+            cpos1 = self.cpos1
+            dpos0 = self.dpos0
+            dpos1 = self.dpos1 
         if self.dpos0 is None:
             do_split = False
         pos0_min = self.pos0_min
@@ -239,23 +259,20 @@ class SplitBBoxIntegrator:
         size = self.size
         check_mask = self.check_mask
         cmask = self.cmask
-        #heap size is larger than the size of the image and a multiple of 1024 which can be divided by 32
-        builder = SparseBuilder(bins, block_size=32, heap_size=(size+1023)&~(1023)) 
-            
         with nogil:
-            for idx in range(size):
+            for idx in range(start, stop):
                 if (check_mask) and (cmask[idx]):
                     continue
-                c0 = cpos0[idx]
+                c0 = cpos0_32[idx] if single else cpos0[idx]
                 if do_split:
-                    d0 = dpos0[idx]
+                    d0 = dpos0_32[idx] if single else dpos0[idx]
                 min0 = c0 - d0
                 max0 = c0 + d0
 
                 if check_pos1:
-                    c1 = cpos1[idx]
+                    c1 = cpos1_32[idx] if single else cpos1[idx]
                     if do_split:
-                        d1 = dpos1[idx]
+                        d1 = dpos1_32[idx] if single else dpos1[idx]
                     if (c1+d1 < pos1_min) or (c1 - d1 > pos1_maxin):
                         continue
 
@@ -284,14 +301,22 @@ class SplitBBoxIntegrator:
                     if bin0_min + 1 < bin0_max:
                         for bin in range(bin0_min + 1, bin0_max):
                             builder.cinsert(bin, idx, inv_area)
-        return builder
 
     def calc_lut_2d(self):
         """Calculate the LUT and return the LUT-builder object
+
+        Chunks of pixels are processed in parallel, see `parallel_build`
+        """
+        return parallel_build(self._calc_lut_2d_chunk, self.size, self.bins[0] * self.bins[1], block_size=8)
+
+    def _calc_lut_2d_chunk(self, SparseBuilder builder, Py_ssize_t start, Py_ssize_t stop):
+        """Insert the contributions of pixels start to stop-1 in the builder
         """
         cdef:
             Py_ssize_t bins0, bins1, size
             position_t[::1] cpos0, cpos1, dpos0, dpos1  
+            float32_t[::1] cpos0_32, cpos1_32, dpos0_32, dpos1_32
+            bint single = self.cpos0.dtype == numpy.float32
             mask_t[::1] cmask
             bint check_mask=False, do_split=True
             position_t c0, c1, d0, d1, min0 = 0, max0 = 0, min1 = 0, max1 = 0, inv_area = 0
@@ -300,15 +325,20 @@ class SplitBBoxIntegrator:
             position_t fbin0_min, fbin0_max, fbin1_min, fbin1_max
             Py_ssize_t i = 0, j = 0, idx = 0
             Py_ssize_t bin0_min, bin0_max, bin1_min, bin1_max
-            SparseBuilder builder
         
         bins0=self.bins[0]
         bins1=self.bins[1]
         size = self.size
-        cpos0 = self.cpos0
-        cpos1 = self.cpos1
-        dpos0 = self.dpos0
-        dpos1 = self.dpos1 
+        if single:
+            cpos0_32 = self.cpos0
+            cpos1_32 = self.cpos1
+            dpos0_32 = self.dpos0
+            dpos1_32 = self.dpos1
+        else:
+            cpos0 = self.cpos0
+            cpos1 = self.cpos1
+            dpos0 = self.dpos0
+            dpos1 = self.dpos1 
         if self.dpos0 is None:
             do_split = False
         pos0_min = self.pos0_min
@@ -319,18 +349,23 @@ class SplitBBoxIntegrator:
         delta0 = self.delta0  
         delta1 = self.delta1  
 
-        #heap size is larger than the size of the image and a multiple of 1024 which can be divided by 8
-        builder = SparseBuilder(bins1*bins0, block_size=8, heap_size=(size+1023)&~(1023)) 
-        
         with nogil:
-            for idx in range(size):
+            for idx in range(start, stop):
                 if (check_mask) and cmask[idx]:
                     continue
-                c0 = cpos0[idx]
-                c1 = cpos1[idx]
+                if single:
+                    c0 = cpos0_32[idx]
+                    c1 = cpos1_32[idx]
+                else:
+                    c0 = cpos0[idx]
+                    c1 = cpos1[idx]
                 if do_split:
-                    d0 = dpos0[idx]
-                    d1 = dpos1[idx]
+                    if single:
+                        d0 = dpos0_32[idx]
+                        d1 = dpos1_32[idx]
+                    else:
+                        d0 = dpos0[idx]
+                        d1 = dpos1[idx]
                 min0 = c0 - d0
                 max0 = c0 + d0
                 min1 = c1 - d1
@@ -405,4 +440,3 @@ class SplitBBoxIntegrator:
                         for j in range(bin1_min + 1, bin1_max):
                             builder.cinsert(bin0_min * bins1 + j, idx, inv_area * delta_left)
                             builder.cinsert(bin0_max * bins1 + j, idx, inv_area * delta_right)
-        return builder
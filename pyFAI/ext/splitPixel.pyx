@@ -104,7 +104,7 @@ def fullSplit1D(pos,
     assert bins > 1, "at lease one bin"
     cdef:
         position_t[:, :, ::1] cpos = numpy.ascontiguousarray(pos, dtype=position_d)
-        data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
+        const data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
         acc_t[::1] sum_data = numpy.zeros(bins, dtype=acc_d)
         acc_t[::1] sum_count = numpy.zeros(bins, dtype=acc_d)
         data_t[::1] merged = numpy.zeros(bins, dtype=data_d)
@@ -300,7 +300,7 @@ def fullSplit1D_engine(pos not None,
     cdef:
         position_t[:, :, ::1] cpos = numpy.ascontiguousarray(pos, dtype=position_d)
         position_t[:, ::1] v8 = numpy.empty((4,2), dtype=position_d)
-        data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
+        const data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
         data_t[::1] cflat, cdark, cpolarization, csolidangle, cvariance
         acc_t[:, ::1] out_data = numpy.zeros((bins, 4), dtype=acc_d)
         data_t[::1] out_intensity = numpy.zeros(bins, dtype=data_d)
@@ -523,7 +523,7 @@ def fullSplit2D(pos,
         bins1 = 1
     cdef:
         position_t[:, :, ::1] cpos = numpy.ascontiguousarray(pos, dtype=position_d)
-        data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
+        const data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
         acc_t[:, ::1] sum_data = numpy.zeros((bins0, bins1), dtype=acc_d)
         acc_t[:, ::1] sum_count = numpy.zeros((bins0, bins1), dtype=acc_d)
         data_t[:, ::1] merged = numpy.zeros((bins0, bins1), dtype=data_d)
@@ -828,7 +828,7 @@ def pseudoSplit2D_engine(pos not None,
         bins1 = 1
     cdef:
         position_t[:, :, ::1] cpos = numpy.ascontiguousarray(pos, dtype=position_d)
-        data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
+        const data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
         acc_t[:, :, ::1] out_data = numpy.zeros((bins0, bins1, 4), dtype=acc_d)
         data_t[:, ::1] out_error, out_intensity = numpy.zeros((bins0, bins1), dtype=data_d)
         mask_t[:] cmask = None
@@ -1161,7 +1161,7 @@ def fullSplit2D_engine(pos not None,
     cdef:
         position_t[:, :, ::1] cpos = numpy.ascontiguousarray(pos, dtype=position_d)
         position_t[:, ::1] v8 = numpy.empty((4,2), dtype=position_d)
-        data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
+        const data_t[::1] cdata = numpy.ascontiguousarray(weights.ravel(), dtype=data_d)
         acc_t[:, :, ::1] out_data = numpy.zeros((bins0, bins1, 4), dtype=acc_d)
         data_t[:, ::1] out_error, out_intensity = numpy.zeros((bins0, bins1), dtype=data_d)
         mask_t[:] cmask = None
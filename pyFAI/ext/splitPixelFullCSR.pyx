@@ -99,7 +99,7 @@ class FullSplitCSR_1d(CsrIntegrator, FullSplitIntegrator):
 
         lut = self.calc_lut_1d().to_csr()
         #Call the constructor of the parent class
-        CsrIntegrator.__init__(self, lut, self.pos.shape[0], empty or 0.0)    
+        CsrIntegrator.__init__(self, lut, self.size, empty or 0.0)    
 
         self.lut_checksum = crc32(self.data)        
         self.lut = (self.data, self.indices, self.indptr)
@@ -166,7 +166,7 @@ class FullSplitCSR_2d(CsrIntegrator, FullSplitIntegrator):
 
         lut = self.calc_lut_2d().to_csr()
         #Call the constructor of the parent class
-        CsrIntegrator.__init__(self, lut, self.pos.shape[0], empty or 0.0)    
+        CsrIntegrator.__init__(self, lut, self.size, empty or 0.0)    
 
         self.lut_checksum = crc32(self.data) 
         self.lut = (self.data, self.indices, self.indptr)
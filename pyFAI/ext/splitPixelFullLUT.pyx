@@ -90,7 +90,7 @@ class HistoLUT1dFullSplit(LutIntegrator, FullSplitIntegrator):
         
         lut = self.calc_lut_1d().to_lut()
         #Call the constructor of the parent class
-        LutIntegrator.__init__(self, lut, self.pos.shape[0], empty or 0.0)  
+        LutIntegrator.__init__(self, lut, self.size, empty or 0.0)  
         
         self.lut_checksum = crc32(self.lut)
         self.lut_nbytes = self.lut.nbytes
@@ -155,7 +155,7 @@ class HistoLUT2dFullSplit(LutIntegrator, FullSplitIntegrator):
         
         lut = self.calc_lut_2d().to_lut()
         #Call the constructor of the parent class
-        LutIntegrator.__init__(self, lut, self.pos.shape[0], empty or 0.0)    
+        LutIntegrator.__init__(self, lut, self.size, empty or 0.0)    
         
         self.lut_checksum = crc32(self.lut)
         self.lut_nbytes = lut.nbytes
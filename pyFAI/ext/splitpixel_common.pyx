@@ -35,13 +35,14 @@
 
 __author__ = "Jerome Kieffer"
 __contact__ = "Jerome.kieffer@esrf.fr"
-__date__ = "07/01/2022"
+__date__ = "18/10/2022"
 __status__ = "stable"
 __license__ = "MIT"
 
 include "regrid_common.pxi"
 from ..utils import crc32
 from .sparse_builder cimport SparseBuilder
+from .sparse_builder import parallel_build
 from libc.math cimport INFINITY
 import logging
 logger = logging.getLogger(__name__)
@@ -55,7 +56,15 @@ elif logging.root.level >= logging.INFO:
 else:
     NUM_WARNING = 10000
 
-def calc_boundaries(position_t[:, :, ::1] cpos,
+cdef inline void _copy_corners(float32_t[:, :, ::1] cpos, Py_ssize_t idx, position_t[:, ::1] v8) nogil:
+    "Copy the corners of the pixel idx, stored in single precision"
+    cdef Py_ssize_t i
+    for i in range(4):
+        v8[i, 0] = cpos[idx, i, 0]
+        v8[i, 1] = cpos[idx, i, 1]
+
+
+def calc_boundaries(floating[:, :, ::1] cpos,
                     mask_t[::1] cmask=None,
                     pos0_range=None,
                     pos1_range=None,
@@ -111,6 +120,18 @@ def calc_boundaries(position_t[:, :, ::1] cpos,
                 pos1_max = max(pos1_max, max1)
                 pos1_min = min(pos1_min, min1)
 
+    return _clip_boundaries(pos0_min, pos0_max, pos1_min, pos1_max,
+                            pos0_range, pos1_range, allow_pos0_neg, chiDiscAtPi, clip_pos1)
+
+
+def _clip_boundaries(position_t pos0_min, position_t pos0_max,
+                     position_t pos1_min, position_t pos1_max,
+                     pos0_range, pos1_range,
+                     bint allow_pos0_neg, bint chiDiscAtPi, bint clip_pos1):
+    """Apply the constrains on the boundaries found from the pixels, see `calc_boundaries`
+
+    :return: Boundaries(pos0_min, pos0_max, pos1_min, pos1_max)
+    """
     if (not allow_pos0_neg):
         pos0_min = max(0.0, pos0_min)
         pos0_max = max(0.0, pos0_max)
@@ -130,6 +151,54 @@ def calc_boundaries(position_t[:, :, ::1] cpos,
     return Boundaries(pos0_min, pos0_max, pos1_min, pos1_max)
 
 
+def _as_corners(pos):
+    """Provide the corners as a contiguous 3D array (size, 4, 2), in single
+    precision if provided in single precision, else in double precision.
+    """
+    if pos.ndim > 3:  # create a view
+        pos = pos.reshape((-1, 4, 2))
+    assert pos.shape[1] == 4, "pos.shape[1] == 4"
+    assert pos.shape[2] == 2, "pos.shape[2] == 2"
+    assert pos.ndim == 3, "pos.ndim == 3"
+    # positions in single precision are kept as they are: no copy
+    return numpy.ascontiguousarray(pos, dtype=numpy.float32 if pos.dtype == numpy.float32 else position_d)
+
+
+def calc_boundaries_tiled(tiles,
+                          mask_t[::1] cmask=None,
+                          pos0_range=None,
+                          pos1_range=None,
+                          bint allow_pos0_neg=False,
+                          bint chiDiscAtPi=True,
+                          bint clip_pos1=False):
+    """Calculate the boundaries in radial/azimuthal space in fullsplit mode,
+    for corners provided tile by tile.
+
+    :param tiles: iterable of (index of the first pixel, array of corners), see `FullSplitIntegrator`
+    :param cmask: 1d array with mask, for all pixels
+    :return: Boundaries(pos0_min, pos0_max, pos1_min, pos1_max), see `calc_boundaries`
+    """
+    cdef:
+        position_t pos0_min = INFINITY, pos0_max = -INFINITY, pos1_min = INFINITY, pos1_max = -INFINITY
+        Py_ssize_t start, stop
+    if (pos0_range is None or pos1_range is None):
+        for start, tile in tiles:
+            tile = _as_corners(tile)
+            stop = start + tile.shape[0]
+            mask = None
+            if cmask is not None:
+                mask = cmask[start:stop]
+                if numpy.asarray(mask).all():
+                    continue
+            tile_boundaries = calc_boundaries(tile, mask, None, None, True, chiDiscAtPi, False)
+            pos0_min = min(pos0_min, tile_boundaries.min0)
+            pos0_max = max(pos0_max, tile_boundaries.max0)
+            pos1_min = min(pos1_min, tile_boundaries.min1)
+            pos1_max = max(pos1_max, tile_boundaries.max1)
+    return _clip_boundaries(pos0_min, pos0_max, pos1_min, pos1_max,
+                            pos0_range, pos1_range, allow_pos0_neg, chiDiscAtPi, clip_pos1)
+
+
 class FullSplitIntegrator:
     """
     Abstract class which contains the boundary selection and the LUT calculation 
@@ -147,7 +216,11 @@ class FullSplitIntegrator:
                  bint clip_pos1=True):
         """Constructor of the class:
         
-        :param pos: 3D or 4D array with the coordinates of each pixel point
+        :param pos: 3D or 4D array with the coordinates of each pixel point,
+            or tiles providing them on demand (for very large detectors): an iterable
+            yielding (index of the first pixel, 3D or 4D array with the coordinates)
+            for consecutive blocks of pixels, with a `size` attribute, the total
+            number of pixels. Tiles are iterated twice when the ranges are not provided.
         :param bins: number of output bins (tth=100, chi=36 by default)
         :param pos0_range: minimum and maximum  of the 2th range
         :param pos1_range: minimum and maximum  of the chi range
@@ -157,13 +230,14 @@ class FullSplitIntegrator:
         :param chiDiscAtPi: tell if azimuthal discontinuity is at 0 (0° when False) or π (180° when True)
         :param clip_pos1: clip the azimuthal range to [-π π] (or [0 2π] depending on chiDiscAtPi), set to False to deactivate behavior
         """
-        if pos.ndim > 3:  # create a view
-            pos = pos.reshape((-1, 4, 2))
-        assert pos.shape[1] == 4, "pos.shape[1] == 4"
-        assert pos.shape[2] == 2, "pos.shape[2] == 2"
-        assert pos.ndim == 3, "pos.ndim == 3"
-        self.pos = numpy.ascontiguousarray(pos, dtype=position_d)
-        self.size = pos.shape[0]
+        if isinstance(pos, numpy.ndarray):
+            self.pos = _as_corners(pos)
+            self.tiles = None
+            self.size = self.pos.shape[0]
+        else:
+            self.pos = None
+            self.tiles = pos
+            self.size = pos.size
         if "__len__" in dir(bins): 
             self.bins = tuple(max(i, 1) for i in bins)
         else:
@@ -184,9 +258,14 @@ class FullSplitIntegrator:
         self.pos1_range = pos1_range
         cdef:
             position_t pos0_max, pos1_max, pos0_maxin, pos1_maxin
-        pos0_min, pos0_maxin, pos1_min, pos1_maxin = calc_boundaries(self.pos, self.cmask, 
-                                                                     pos0_range, pos1_range,
-                                                                     allow_pos0_neg, chiDiscAtPi, clip_pos1)
+        if self.tiles is None:
+            pos0_min, pos0_maxin, pos1_min, pos1_maxin = calc_boundaries(self.pos, self.cmask, 
+                                                                         pos0_range, pos1_range,
+                                                                         allow_pos0_neg, chiDiscAtPi, clip_pos1)
+        else:
+            pos0_min, pos0_maxin, pos1_min, pos1_maxin = calc_boundaries_tiled(self.tiles, self.cmask, 
+                                                                               pos0_range, pos1_range,
+                                                                               allow_pos0_neg, chiDiscAtPi, clip_pos1)
         self.pos0_min = pos0_min
         self.pos1_min = pos1_min
         self.pos0_maxin = pos0_maxin
@@ -194,11 +273,47 @@ class FullSplitIntegrator:
         self.pos0_max = calc_upper_bound(pos0_maxin)
         self.pos1_max = calc_upper_bound(pos1_maxin)
 
+    def _build(self, fill_chunk, int nbin, int block_size):
+        """Build the sparse matrix, tile after tile when the corners are provided by tiles.
+
+        Only the corners of one tile are in memory at once.
+
+        :param fill_chunk: method inserting the contributions of pixels in a builder
+        :param nbin: number of bins
+        :param block_size: size of the blocks of the builders
+        :return: SparseBuilder instance
+        """
+        if self.tiles is None:
+            return parallel_build(fill_chunk, self.size, nbin, block_size=block_size)
+        builder = None
+        for offset, tile in self.tiles:
+            tile = _as_corners(tile)
+            tile_builder = parallel_build(lambda tb, start, stop: fill_chunk(tb, start + offset, stop + offset, tile, offset),
+                                          tile.shape[0], nbin, block_size=block_size)
+            if builder is None:
+                builder = tile_builder
+            else:
+                builder.chain(tile_builder)
+        # The tiles (and the geometry behind) are not needed anymore
+        self.tiles = None
+        return builder
+
     def calc_lut_1d(self):
         """Calculate the LUT and return the LUT-builder object
+
+        Chunks of pixels are processed in parallel, see `parallel_build`
+        """
+        return self._build(self._calc_lut_1d_chunk, self.bins, 32)
+
+    def _calc_lut_1d_chunk(self, SparseBuilder builder, Py_ssize_t start, Py_ssize_t stop,
+                           pos=None, Py_ssize_t offset=0):
+        """Insert the contributions of pixels start to stop-1 in the builder
+
+        :param pos: corners of the pixels offset to offset+len(pos)-1, all pixels by default
         """
         cdef:
-            position_t[:, :, ::1] cpos = numpy.ascontiguousarray(self.pos, dtype=position_d)
+            position_t[:, :, ::1] cpos
+            float32_t[:, :, ::1] cpos32
             position_t[:, ::1] v8 = numpy.empty((4,2), dtype=position_d)
             buffer_t[::1] buffer = numpy.zeros(self.bins, dtype=buffer_d)
             mask_t[::1] cmask = None
@@ -209,7 +324,15 @@ class FullSplitIntegrator:
             position_t min0, max0, min1, max1
             Py_ssize_t bins=self.bins, idx = 0, bin = 0, bin0 = 0, bin0_max = 0, bin0_min = 0, size = 0
             bint check_pos1=self.pos1_range is not None, check_mask = False, chiDiscAtPi=self.chiDiscAtPi
-            SparseBuilder builder = SparseBuilder(bins, block_size=32, heap_size=(size+1023)&~(1023))
+            bint single
+
+        if pos is None:
+            pos = self.pos
+        single = pos.dtype == numpy.float32
+        if single:
+            cpos32 = pos
+        else:
+            cpos = pos
 
         pos0_min = self.pos0_min
         pos1_min = self.pos1_min
@@ -224,12 +347,15 @@ class FullSplitIntegrator:
             cmask = self.cmask
 
         with nogil:
-            for idx in range(size):
+            for idx in range(start, stop):
 
                 if (check_mask) and (cmask[idx]):
                     continue
                 # Play with coordinates ...
-                v8[:, :] = cpos[idx, :, :]
+                if single:
+                    _copy_corners(cpos32, idx - offset, v8)
+                else:
+                    v8[:, :] = cpos[idx - offset, :, :]
                 area_pixel = - _recenter(v8, chiDiscAtPi) / delta
                 a0 = get_bin_number(v8[0, 0], pos0_min, delta)
                 a1 = v8[0, 1]
@@ -277,14 +403,23 @@ class FullSplitIntegrator:
                     # Check the total area:
                     buffer[bin0_min:bin0_max] = 0.0
 
-        return builder
-
     def calc_lut_2d(self):
         """Calculate the LUT and return the LUT-builder object
+
+        Chunks of pixels are processed in parallel, see `parallel_build`
+        """
+        return self._build(self._calc_lut_2d_chunk, self.bins[0] * self.bins[1], 8)
+
+    def _calc_lut_2d_chunk(self, SparseBuilder builder, Py_ssize_t start, Py_ssize_t stop,
+                           pos=None, Py_ssize_t offset=0):
+        """Insert the contributions of pixels start to stop-1 in the builder
+
+        :param pos: corners of the pixels offset to offset+len(pos)-1, all pixels by default
         """
         cdef:
             Py_ssize_t bins0=self.bins[0], bins1=self.bins[1], size = self.size
-            position_t[:, :, ::1] cpos = numpy.ascontiguousarray(self.pos, dtype=position_d)
+            position_t[:, :, ::1] cpos
+            float32_t[:, :, ::1] cpos32
             position_t[:, ::1] v8 = numpy.empty((4,2), dtype=position_d)
             mask_t[:] cmask = self.cmask
             bint check_mask = False, chiDiscAtPi = self.chiDiscAtPi
@@ -295,10 +430,17 @@ class FullSplitIntegrator:
             position_t foffset0, foffset1, sum_area, area
             Py_ssize_t i = 0, j = 0, idx = 0
             Py_ssize_t ioffset0, ioffset1, w0, w1, bw0=15, bw1=15
-            buffer_t[::1] linbuffer = numpy.empty(256, dtype=buffer_d)
+            buffer_t[::1] linbuffer = numpy.zeros(256, dtype=buffer_d)
             buffer_t[:, ::1] buffer = numpy.asarray(linbuffer[:(bw0+1)*(bw1+1)]).reshape((bw0+1,bw1+1))
-            SparseBuilder builder = SparseBuilder(bins1*bins0, block_size=8, heap_size=(size+1023)&~(1023))
-            
+            bint single
+
+        if pos is None:
+            pos = self.pos
+        single = pos.dtype == numpy.float32
+        if single:
+            cpos32 = pos
+        else:
+            cpos = pos
         if self.cmask is not None:
             check_mask = True
             cmask = self.cmask
@@ -312,13 +454,16 @@ class FullSplitIntegrator:
         delta1 = self.delta1  
     
         with nogil:
-            for idx in range(size):
+            for idx in range(start, stop):
     
                 if (check_mask) and (cmask[idx]):
                     continue
                     
                 # Play with coordinates ...
-                v8[:, :] = cpos[idx, :, :]
+                if single:
+                    _copy_corners(cpos32, idx - offset, v8)
+                else:
+                    v8[:, :] = cpos[idx - offset, :, :]
                 area = _recenter(v8, chiDiscAtPi) # this is an unprecise measurement of the surface of the pixels
                 a0 = v8[0, 0]
                 a1 = v8[0, 1]
@@ -396,7 +541,6 @@ class FullSplitIntegrator:
                     for j in range(w1):
                         builder.cinsert((ioffset0 + i)*bins1 + ioffset1 + j, idx, buffer[i, j] * inv_area)
                 linbuffer[:] = 0.0 # reset full buffer since it is likely faster than memsetting 2d view
-        return builder
 
     
     
\ No newline at end of file
@@ -50,6 +50,7 @@ from numpy import radians, degrees, arccos, arctan2, sin, cos, sqrt
 import numpy
 import os
 import threading
+import weakref
 import json
 from collections import namedtuple, OrderedDict
 from . import detectors
@@ -83,6 +84,229 @@ PolarizationArray = namedtuple("PolarizationArray", ["array", "checksum"])
 PolarizationDescription = namedtuple("PolarizationDescription",
                                      ["polarization_factor", "axis_offset"])
 
+# Keys of the cached arrays which are specific to one geometry instance
+_PRIVATE_KEYS = ("last_polarization", "transmission_corr", "transmission_crc")
+# Spaces of the cached arrays which do not depend on the wavelength
+_WAVELENGTH_INDEPENDENT = ("2th", "chi", "r", "cos", "solid")
+# Spaces of the cached arrays which scale like 1/wavelength**n
+_WAVELENGTH_SCALING = {"q": 1, "d*2": 2}
+
+
+def _wavelength_exponent(key):
+    """Tell how an array cached under this key (or a radial unit) depends on
+    the wavelength
+
+    :param key: key in the cached arrays like "q_center", or a radial unit
+    :return: 0 if it does not depend on the wavelength, n if it scales like
+             1/wavelength**n, None if it needs to be recalculated
+    """
+    if isinstance(key, PolarizationDescription) or (key in _PRIVATE_KEYS):
+        return 0
+    space = str(key).split("_")[0].split("#")[0]
+    if space in _WAVELENGTH_INDEPENDENT:
+        return 0
+    return _WAVELENGTH_SCALING.get(space)
+
+
+class ArrayCache(object):
+    """Process-wide storage of the arrays calculated by the geometries, indexed
+    by the configuration they depend on: identical geometries (i.e. in a
+    MultiGeometry, or integrators differing only in the number of bins) share
+    a single copy of each array instead of recalculating it.
+
+    The memory is limited to `max_size` bytes, the least recently used arrays
+    are evicted first. Arrays still used by a geometry remain shared through
+    weak references. The cache is disabled by default (`max_size` = 0), see
+    `ARRAY_CACHE`.
+    """
+
+    def __init__(self, max_size=0):
+        """Constructor of the class
+
+        :param max_size: memory budget in bytes, 0 to disable the cache
+        """
+        self.max_size = max_size
+        self._arrays = OrderedDict()  # key -> (value, nbytes)
+        self._weak = weakref.WeakValueDictionary()
+        self._lock = threading.Semaphore()
+
+    def __repr__(self):
+        return f"ArrayCache with {len(self)} arrays using {self.nbytes} bytes out of {self.max_size}"
+
+    def __len__(self):
+        return len(self._arrays)
+
+    @staticmethod
+    def get_nbytes(value):
+        """Memory used by a cached value (array, PolarizationArray or checksum)"""
+        if isinstance(value, PolarizationArray):
+            value = value.array
+        return getattr(value, "nbytes", 0)
+
+    @property
+    def nbytes(self):
+        """Memory used by the arrays in the cache"""
+        return sum(nbytes for _, nbytes in self._arrays.values())
+
+    def get(self, key):
+        """Retrieve an array from the cache
+
+        :param key: configuration and name of the array, see `Geometry._get_array_signature`
+        :return: the array or None
+        """
+        with self._lock:
+            entry = self._arrays.get(key)
+            if entry is not None:
+                self._arrays.move_to_end(key)
+                return entry[0]
+            return self._weak.get(key)
+
+    def put(self, key, value):
+        """Store an array in the cache. Arrays are shared and should never be
+        modified in place.
+
+        :param key: configuration and name of the array, see `Geometry._get_array_signature`
+        :param value: the array
+        """
+        if (value is None) or (not self.max_size):
+            return
+        nbytes = self.get_nbytes(value)
+        with self._lock:
+            if isinstance(value, numpy.ndarray):
+                self._weak[key] = value
+            if nbytes > self.max_size:
+                return
+            self._arrays.pop(key, None)
+            self._arrays[key] = (value, nbytes)
+            total = self.nbytes
+            while total > self.max_size:
+                _, (_, size) = self._arrays.popitem(last=False)
+                total -= size
+
+    def clear(self):
+        """Remove all arrays from the cache"""
+        with self._lock:
+            self._arrays.clear()
+            self._weak.clear()
+
+
+CORNER_TILE_SIZE = 1 << 22
+"Default number of pixels per tile in `Geometry.corner_tiles`, i.e. 128MB of corners"
+
+ARRAY_CACHE = ArrayCache()
+"""Process-wide cache of the geometry arrays, disabled by default.
+Set `ARRAY_CACHE.max_size` to a memory budget in bytes to enable it."""
+
+
+class CachedArrays(dict):
+    """Dictionary with the arrays cached by a geometry.
+
+    Arrays missing locally are looked up in the process-wide `ARRAY_CACHE`
+    and arrays stored are published there, when this cache is enabled.
+    """
+
+    def __init__(self, geometry):
+        """Constructor of the class
+
+        :param geometry: the geometry owning the arrays
+        """
+        dict.__init__(self)
+        self._geometry = weakref.ref(geometry)
+
+    def __reduce__(self):
+        "Pickled as a plain dictionary"
+        return (dict, (dict(self),))
+
+    def _get_shared_key(self, key):
+        """Key of the array in ARRAY_CACHE, None if it is not shared"""
+        if (not ARRAY_CACHE.max_size) or (key in _PRIVATE_KEYS):
+            return
+        geometry = self._geometry()
+        if geometry is None:
+            return
+        wavelength = _wavelength_exponent(key) != 0
+        return (geometry._get_array_signature(wavelength), key)
+
+    def _get_shared(self, key):
+        shared_key = self._get_shared_key(key)
+        if shared_key is None:
+            return
+        value = ARRAY_CACHE.get(shared_key)
+        if value is not None:
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return dict.__getitem__(self, key)
+        value = self._get_shared(key)
+        return default if value is None else value
+
+    def __missing__(self, key):
+        value = self._get_shared(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        if value is not None:
+            shared_key = self._get_shared_key(key)
+            if shared_key is not None:
+                ARRAY_CACHE.put(shared_key, value)
+
+
+class CornerTiles(object):
+    """Corners of the pixels in radial/azimuthal space, calculated on demand
+    for blocks of rows of the detector, see `Geometry.corner_tiles`.
+
+    Iterating provides, for each tile, the index of its first pixel and the
+    4D array with the corners of its pixels (in S.I. units). Corners already
+    cached by the geometry are used instead of being recalculated.
+    """
+
+    def __init__(self, geometry, shape, unit, rows):
+        """Constructor of the class
+
+        :param geometry: Geometry instance
+        :param shape: shape of the detector
+        :param unit: instance of pyFAI.units.Unit
+        :param rows: number of rows of the detector per tile
+        """
+        self.geometry = geometry
+        self.shape = tuple(shape)
+        self.unit = unit
+        self.rows = rows
+
+    def __repr__(self):
+        return f"CornerTiles of {self.shape} in {self.unit}, {len(self)} tiles of {self.rows} rows"
+
+    @property
+    def size(self):
+        "Number of pixels"
+        return self.shape[0] * self.shape[1]
+
+    def __len__(self):
+        return -(-self.shape[0] // self.rows)
+
+    def __iter__(self):
+        geometry = self.geometry
+        space = self.unit.name.split("_")[0]
+        corners = geometry._cached_array.get(space + "_corner")
+        if ((corners is None) or (corners.shape[:2] != self.shape)) and \
+                ((_geometry is None) or (space not in ("2th", "q", "r"))):
+            logger.info("No fast path for corners in space %s, calculating them at once", space)
+            corners = geometry.corner_array(self.shape, self.unit, scale=False)
+        elif (corners is not None) and (corners.shape[:2] != self.shape):
+            corners = None
+        for start in range(0, self.shape[0], self.rows):
+            stop = min(start + self.rows, self.shape[0])
+            if corners is None:
+                tile = geometry._calc_corners(self.shape, space, start, stop)
+            else:
+                tile = corners[start:stop]
+            yield start * self.shape[1], tile
+
 
 class Geometry(object):
     """This class is the parent-class of azimuthal integrator.
@@ -154,7 +378,7 @@ class Geometry(object):
         self.param = [self._dist, self._poni1, self._poni2,
                       self._rot1, self._rot2, self._rot3]
         self.chiDiscAtPi = True  # chi discontinuity (radians), pi by default
-        self._cached_array = {}  # dict for caching all arrays
+        self._cached_array = CachedArrays(self)  # dict for caching all arrays
         self._dssa_order = 3  # by default we correct for 1/cos(2th), fit2d corrects for 1/cos^3(2th)
         self._wavelength = wavelength
         self._oversampling = None
@@ -162,6 +386,7 @@ class Geometry(object):
         self._sem = threading.Semaphore()
         self._transmission_normal = None
         self._parallax = None
+        self._array_dtype = numpy.float64
 
         if detector:
             if isinstance(detector, utils.StringTypes):
@@ -309,7 +534,7 @@ class Geometry(object):
             self._correct_parallax(d1, d2, p1, p2)
         return p1, p2, p3
 
-    def calc_pos_zyx(self, d0=None, d1=None, d2=None, param=None, corners=False, use_cython=True, do_parallax=False):
+    def calc_pos_zyx(self, d0=None, d1=None, d2=None, param=None, corners=False, use_cython=True, do_parallax=False, dtype=numpy.float64):
         """Calculate the position of a set of points in space in the sample's centers referential.
 
         This is usually used for calculating the pixel position in space.
@@ -322,6 +547,7 @@ class Geometry(object):
         :param corners: return positions on the corners (instead of center)
         :param use_cython: set to False to validate using pure numpy
         :param do_parallax: position should be corrected for parallax effect
+        :param dtype: numpy.float64 (default) or numpy.float32 for the result
         :return: 3-tuple of nd-array, with dim0=along the beam,
                                            dim1=along slowest dimension
                                            dim2=along fastest dimension
@@ -348,7 +574,7 @@ class Geometry(object):
         else:
             p1, p2, p3 = self.detector.calc_cartesian_positions(d1, d2)
         if ((not do_parallax) or (self._parallax is None)) and use_cython and (_geometry is not None):
-            t3, t1, t2 = _geometry.calc_pos_zyx(L, poni1, poni2, rot1, rot2, rot3, p1, p2, p3)
+            t3, t1, t2 = _geometry.calc_pos_zyx(L, poni1, poni2, rot1, rot2, rot3, p1, p2, p3, dtype=dtype)
         else:
             shape = p1.shape
             size = p1.size
@@ -370,7 +596,7 @@ class Geometry(object):
                 assert size == p3.size
             coord_det = numpy.vstack((p1, p2, p3))
             coord_sample = numpy.dot(self.rotation_matrix(param), coord_det)
-            t1, t2, t3 = coord_sample
+            t1, t2, t3 = coord_sample.astype(dtype, copy=False)
             t1.shape = shape
             t2.shape = shape
             t3.shape = shape
@@ -502,8 +728,12 @@ class Geometry(object):
         if self._cached_array.get("q_center") is None:
             with self._sem:
                 if self._cached_array.get("q_center") is None:
-                    qa = numpy.fromfunction(self.qFunction, shape,
-                                            dtype=numpy.float32)
+                    tth = self._cached_array.get("2th_center")
+                    if (tth is not None) and self._wavelength and (tth.shape == tuple(shape)):
+                        qa = self._convert_from_2th(tth, "q")
+                    else:
+                        qa = numpy.fromfunction(self.qFunction, shape,
+                                                dtype=numpy.float32).astype(self._array_dtype, copy=False)
                     self._cached_array["q_center"] = qa
 
         return self._cached_array["q_center"]
@@ -523,8 +753,9 @@ class Geometry(object):
         if self._cached_array.get("r_center") is None:
             with self._sem:
                 if self._cached_array.get("r_center") is None:
-                    self._cached_array["r_center"] = numpy.fromfunction(self.rFunction, shape,
-                                                                        dtype=numpy.float32)
+                    ra = numpy.fromfunction(self.rFunction, shape,
+                                            dtype=numpy.float32)
+                    self._cached_array["r_center"] = ra.astype(self._array_dtype, copy=False)
         return self._cached_array.get("r_center")
 
     def rd2Array(self, shape=None):
@@ -591,7 +822,7 @@ class Geometry(object):
                     ttha = numpy.fromfunction(self.tth,
                                               shape,
                                               dtype=numpy.float32)
-                    self._cached_array["2th_center"] = ttha
+                    self._cached_array["2th_center"] = ttha.astype(self._array_dtype, copy=False)
         return self._cached_array["2th_center"]
 
     def chi(self, d1, d2, path="cython"):
@@ -653,10 +884,99 @@ class Geometry(object):
                                               dtype=numpy.float32)
                     if not self.chiDiscAtPi:
                         chia = chia % (2.0 * numpy.pi)
-                    self._cached_array["chi_center"] = chia
+                    self._cached_array["chi_center"] = chia.astype(self._array_dtype, copy=False)
         return self._cached_array["chi_center"]
 
-    def position_array(self, shape=None, corners=False, dtype=numpy.float64, use_cython=True, do_parallax=False):
+    def calc_batch(self, params, d1, d2, space="2th", group=None, path="cython"):
+        """Calculate the position of a set of pixels for many geometries at
+        once, like the parameters tested by an optimizer or the positions of
+        a goniometer.
+
+        :param params: 2D array (M, 6) with dist, poni1, poni2, rot1, rot2, rot3 of each geometry,
+                       or (M, 7) with the wavelength (in meter) of each geometry in the last column
+        :param d1: position(s) in pixel in first dimension (c order), N pixels
+        :param d2: position(s) in pixel in second dimension (c order)
+        :param space: can be "2th", "chi" (in radians), "q" (in nm^-1) or "r" (in meter)
+        :param group: array with the index of the geometry for each pixel. By default, all
+                      pixels are evaluated with all geometries
+        :param path: can be "cython" or "numpy"
+        :return: array of shape (M, N), or (N,) when group is provided
+        """
+        params = numpy.atleast_2d(numpy.asarray(params, dtype=numpy.float64))
+        d1 = numpy.asarray(d1, dtype=numpy.float64).ravel()
+        d2 = numpy.asarray(d2, dtype=numpy.float64).ravel()
+        if (path == "cython") and (_geometry is not None) and (self._parallax is None):
+            p1, p2, p3 = self.detector.calc_cartesian_positions(d1, d2)
+            return _geometry.calc_batch(params, p1, p2, p3, space, self._wavelength, group,
+                                        chi_discontinuity_at_pi=self.chiDiscAtPi)
+
+        if space not in ("2th", "chi", "q", "r"):
+            raise KeyError("Not implemented space %s" % space)
+        if group is None:
+            out = numpy.empty((params.shape[0], d1.size), dtype=numpy.float64)
+        else:
+            group = numpy.asarray(group).ravel()
+            out = numpy.empty(d1.size, dtype=numpy.float64)
+        for idx, param in enumerate(params):
+            if group is None:
+                select = slice(None)
+            else:
+                select = numpy.where(group == idx)[0]
+            t3, t1, t2 = self.calc_pos_zyx(d0=None, d1=d1[select], d2=d2[select], param=param, do_parallax=True)
+            if space == "chi":
+                value = numpy.arctan2(t1, t2)
+                if not self.chiDiscAtPi:
+                    value = value % (2.0 * numpy.pi)
+            elif space == "r":
+                value = numpy.sqrt(t1 * t1 + t2 * t2)
+            else:
+                value = numpy.arctan2(numpy.sqrt(t1 * t1 + t2 * t2), t3)
+                if space == "q":
+                    wavelength = param[6] if param.size > 6 else self._wavelength
+                    if not wavelength:
+                        raise ValueError("wavelength is needed for q calculation")
+                    value = 4.0e-9 * numpy.pi / wavelength * numpy.sin(value / 2.0)
+            if group is None:
+                out[idx] = value
+            else:
+                out[select] = value
+        return out
+
+    def calc_jacobian(self, d1, d2, param=None, space="2th", path="cython"):
+        """Calculate the radial position of a set of pixels together with its
+        derivatives with respect to the parameters of the geometry, as needed
+        by gradient-based refinement.
+
+        :param d1: position(s) in pixel in first dimension (c order)
+        :param d2: position(s) in pixel in second dimension (c order)
+        :param param: set of 6 geometry parameters (dist, poni1, poni2, rot1, rot2, rot3),
+                      optionally followed by the wavelength (in meter). By default the current geometry
+        :param space: can be "2th" (in radians) or "q" (in nm^-1)
+        :param path: "cython" for analytic derivatives, "numpy" for finite differences
+        :return: 2-tuple with the values (N,) and the jacobian (N, 7), i.e. the derivatives with
+                 respect to dist, poni1, poni2, rot1, rot2, rot3 and wavelength (S.I. units)
+        """
+        if param is None:
+            param = [self._dist, self._poni1, self._poni2, self._rot1, self._rot2, self._rot3]
+        param = numpy.array(param, dtype=numpy.float64).ravel()
+        if param.size == 6:
+            param = numpy.append(param, self._wavelength or 0.0)
+        d1 = numpy.asarray(d1, dtype=numpy.float64).ravel()
+        d2 = numpy.asarray(d2, dtype=numpy.float64).ravel()
+        if (path == "cython") and (_geometry is not None) and (self._parallax is None):
+            p1, p2, p3 = self.detector.calc_cartesian_positions(d1, d2)
+            return _geometry.calc_jacobian(param[0], param[3], param[4], param[5],
+                                           p1 - param[1], p2 - param[2], p3,
+                                           space, param[6])
+
+        # Central finite differences, evaluated as a batch of geometries
+        step = numpy.where(param != 0, 1e-6 * abs(param), 1e-8)
+        params = numpy.vstack((param, param + numpy.diag(step), param - numpy.diag(step)))
+        values = self.calc_batch(params, d1, d2, space, path="numpy")
+        jacobian = (values[1:8] - values[8:]) / (2.0 * step[:, None])
+        return values[0], jacobian.T
+
+    def position_array(self, shape=None, corners=False, dtype=None, use_cython=True, do_parallax=False):
         """Generate an array for the pixel position given the shape of the detector.
 
         if corners is False, the coordinates of the center of the pixel
@@ -671,7 +991,8 @@ class Geometry(object):
 
         :param shape: shape of the array expected
         :param corners: set to true to receive a (...,4,3) array of corner positions
-        :param dtype: output format requested. Double precision is needed for fitting the geometry
+        :param dtype: output format requested, by default the `array_dtype` of the geometry.
+                      Double precision is needed for fitting the geometry
         :param (bool) use_cython: set to false to test the Python path (slower)
         :param do_parallax: correct for parallax effect (if parametrized)
         :return: 3D coodinates as nd-array of size (...,3) or (...,3) (default)
@@ -683,10 +1004,13 @@ class Geometry(object):
             logger.error("Shape is neither specified in the method call, "
                          "neither in the detector: %s", self.detector)
 
+        if dtype is None:
+            dtype = self._array_dtype
         pos = numpy.fromfunction(lambda d1, d2: self.calc_pos_zyx(d0=None, d1=d1, d2=d2,
                                                                   corners=corners,
                                                                   use_cython=use_cython,
-                                                                  do_parallax=do_parallax),
+                                                                  do_parallax=do_parallax,
+                                                                  dtype=dtype),
                                  shape,
                                  dtype=dtype)
         outshape = pos[0].shape + (3,)
@@ -735,42 +1059,13 @@ class Geometry(object):
             with self._sem:
                 if self._cached_array.get(key) is None or shape != self._cached_array.get(key).shape[:2]:
                     corners = None
-                    if (_geometry is not None) and use_cython:
-                        if self.detector.IS_CONTIGUOUS:
-                            d1 = utils.expand2d(numpy.arange(shape[0] + 1.0), shape[1] + 1.0, False)
-                            d2 = utils.expand2d(numpy.arange(shape[1] + 1.0), shape[0] + 1.0, True)
-                            p1, p2, p3 = self.detector.calc_cartesian_positions(d1, d2, center=False, use_cython=True)
-                        else:
-                            det_corners = self.detector.get_pixel_corners()
-                            p1 = det_corners[..., 1]
-                            p2 = det_corners[..., 2]
-                            p3 = det_corners[..., 0]
-                        try:
-                            res = _geometry.calc_rad_azim(self.dist, self.poni1, self.poni2,
-                                                          self.rot1, self.rot2, self.rot3,
-                                                          p1, p2, p3,
-                                                          space, self._wavelength,
-                                                          chi_discontinuity_at_pi=self.chiDiscAtPi)
-                        except KeyError:
-                            logger.warning("No fast path for space: %s", space)
-                        except AttributeError as err:
-                            logger.warning("AttributeError: The binary extension _geomety may be missing: %s", err)
-                        else:
-                            if self.detector.IS_CONTIGUOUS:
-                                if bilinear:
-                                    # convert_corner_2D_to_4D needs contiguous arrays as input
-                                    radi = numpy.ascontiguousarray(res[..., 0], numpy.float32)
-                                    azim = numpy.ascontiguousarray(res[..., 1], numpy.float32)
-                                    corners = bilinear.convert_corner_2D_to_4D(2, radi, azim)
-                                else:
-                                    corners = numpy.zeros((shape[0], shape[1], 4, 2),
-                                                          dtype=numpy.float32)
-                                    corners[:,:, 0,:] = res[:-1,:-1,:]
-                                    corners[:,:, 1,:] = res[1:,:-1,:]
-                                    corners[:,:, 2,:] = res[1:, 1:,:]
-                                    corners[:,:, 3,:] = res[:-1, 1:,:]
-                            else:
-                                corners = res
+                    tth = self._cached_array.get("2th_corner")
+                    if (space in _WAVELENGTH_SCALING) and self._wavelength and \
+                            (tth is not None) and (tth.shape[:2] == shape):
+                        corners = tth.copy()
+                        corners[..., 0] = self._convert_from_2th(tth[..., 0], space)
+                    if (corners is None) and (_geometry is not None) and use_cython:
+                        corners = self._calc_corners(shape, space)
 
                     if corners is None:
                         # In case the fast-path is not implemented
@@ -804,6 +1099,69 @@ class Geometry(object):
         else:
             return res
 
+    def _calc_corners(self, shape, space, start=0, stop=None):
+        """Calculate the corners of the pixels with the fast path, without caching them
+
+        :param shape: shape of the detector
+        :param space: radial space, like "2th", "q" or "r"
+        :param start: first row of the detector
+        :param stop: last row of the detector (excluded), by default the last one
+        :return: 4D array of shape (stop-start, shape[1], 4, 2) or None when there is no fast path
+        """
+        if stop is None:
+            stop = shape[0]
+        if self.detector.IS_CONTIGUOUS:
+            d1 = utils.expand2d(numpy.arange(start, stop + 1.0, dtype=self._array_dtype), shape[1] + 1.0, False)
+            d2 = utils.expand2d(numpy.arange(shape[1] + 1.0, dtype=self._array_dtype), stop - start + 1.0, True)
+            p1, p2, p3 = self.detector.calc_cartesian_positions(d1, d2, center=False, use_cython=True)
+        else:
+            det_corners = self.detector.get_pixel_corners()[start:stop]
+            p1 = det_corners[..., 1]
+            p2 = det_corners[..., 2]
+            p3 = det_corners[..., 0]
+        try:
+            res = _geometry.calc_rad_azim(self.dist, self.poni1, self.poni2,
+                                          self.rot1, self.rot2, self.rot3,
+                                          p1, p2, p3,
+                                          space, self._wavelength,
+                                          chi_discontinuity_at_pi=self.chiDiscAtPi)
+        except KeyError:
+            logger.warning("No fast path for space: %s", space)
+        except AttributeError as err:
+            logger.warning("AttributeError: The binary extension _geomety may be missing: %s", err)
+        else:
+            if not self.detector.IS_CONTIGUOUS:
+                return res
+            if bilinear:
+                # convert_corner_2D_to_4D needs contiguous arrays as input
+                radi = numpy.ascontiguousarray(res[..., 0], numpy.float32)
+                azim = numpy.ascontiguousarray(res[..., 1], numpy.float32)
+                return bilinear.convert_corner_2D_to_4D(2, radi, azim)
+            corners = numpy.zeros((stop - start, shape[1], 4, 2), dtype=numpy.float32)
+            corners[:,:, 0,:] = res[:-1,:-1,:]
+            corners[:,:, 1,:] = res[1:,:-1,:]
+            corners[:,:, 2,:] = res[1:, 1:,:]
+            corners[:,:, 3,:] = res[:-1, 1:,:]
+            return corners
+
+    def corner_tiles(self, shape=None, unit=units.TTH, tile_size=None):
+        """Provide the corners of the pixels, like `corner_array`, but
+        calculated on demand for blocks of rows of the detector (tiles) which
+        are not cached. This allows to build the sparse matrix of very large
+        detectors with a memory footprint set by the size of the tiles.
+
+        :param shape: expected shape
+        :param unit: string like "2th_deg" or an instance of pyFAI.units.Unit
+        :param tile_size: approximate number of pixels per tile, by default CORNER_TILE_SIZE
+        :return: CornerTiles instance, iterable
+        """
+        shape = self.get_shape(shape)
+        if shape is None:
+            logger.error("Shape is neither specified in the method call, "
+                         "neither in the detector: %s", self.detector)
+        tile_size = tile_size or CORNER_TILE_SIZE
+        return CornerTiles(self, shape, units.to_unit(unit), max(1, tile_size // shape[1]))
+
     @deprecated
     def cornerArray(self, shape=None):
         """Generate a 4D array of the given shape with (i,j) (radial
@@ -886,11 +1244,16 @@ class Geometry(object):
             else:
                 return ary
 
-        pos = self.position_array(shape, corners=False)
-        x = pos[..., 2]
-        y = pos[..., 1]
-        z = pos[..., 0]
-        ary = unit.equation(x, y, z, self.wavelength)
+        tth = self._cached_array.get("2th_center")
+        if (space in _WAVELENGTH_SCALING) and self._wavelength and \
+                (tth is not None) and (tth.shape == shape):
+            ary = self._convert_from_2th(tth, space)
+        else:
+            pos = self.position_array(shape, corners=False)
+            x = pos[..., 2]
+            y = pos[..., 1]
+            z = pos[..., 0]
+            ary = unit.equation(x, y, z, self.wavelength).astype(self._array_dtype, copy=False)
         self._cached_array[key] = ary
         if scale and unit:
                 tmp = ary.copy()
@@ -977,7 +1340,7 @@ class Geometry(object):
             with self._sem:
                 if self._cached_array.get(key) is None:
                     if use_cython and (_geometry is not None):
-                        delta = _geometry.calc_delta_chi(center, corner)
+                        delta = _geometry.calc_delta_chi(center, corner, dtype=self._array_dtype)
                         self._cached_array[key] = delta
                     else:
                         twoPi = 2.0 * numpy.pi
@@ -1236,10 +1599,13 @@ class Geometry(object):
         key_crc = f"solid_angle#{self._dssa_order}_crc"
         dssa = self._cached_array.get(key)
         if dssa is None:
-            dssa = numpy.fromfunction(self.diffSolidAngle,
-                                      shape, dtype=numpy.float32)
-            self._cached_array[key_crc] = crc32(dssa)
-            self._cached_array[key] = dssa
+            with self._sem:
+                dssa = self._cached_array.get(key)
+                if dssa is None:
+                    dssa = numpy.fromfunction(self.diffSolidAngle,
+                                              shape, dtype=numpy.float32)
+                    self._cached_array[key_crc] = crc32(dssa)
+                    self._cached_array[key] = dssa
 
         if absolute:
             # not inplace to avoid mangling  the cache !
@@ -1856,6 +2222,7 @@ class Geometry(object):
             tth = self.twoThetaArray(shape)
             chi = self.chiArray(shape)
             with self._sem:
+                pol = self._cached_array.get(desc)
                 if pol is None or (pol.array.shape != shape):
                     # TODO: use numexpr for evaluation
                     cos2_tth = numpy.cos(tth) ** 2
@@ -1891,15 +2258,15 @@ class Geometry(object):
             logger.error("Impossible value for normal transmission: %s", t0)
             return
 
-        with self._sem:
-            if (t0 == self._transmission_normal):
-                transmission_corr = self._cached_array.get("transmission_corr")
-                if ((shape is None) or (transmission_corr is not None and shape == transmission_corr.shape)):
-                    return transmission_corr
+        # Lock-free read of the cached value
+        if (t0 == self._transmission_normal):
+            transmission_corr = self._cached_array.get("transmission_corr")
+            if ((shape is None) or (transmission_corr is not None and shape == transmission_corr.shape)):
+                return transmission_corr
 
-            if shape is None:
-                raise RuntimeError(("You should provide a shape if the"
-                                    " geometry is not yet initiallized"))
+        if shape is None:
+            raise RuntimeError(("You should provide a shape if the"
+                                " geometry is not yet initiallized"))
 
         with self._sem:
             self._transmission_normal = t0
@@ -1923,7 +2290,27 @@ class Geometry(object):
         self.param = [self._dist, self._poni1, self._poni2,
                       self._rot1, self._rot2, self._rot3]
         self._transmission_normal = None
-        self._cached_array = {}
+        self._cached_array = CachedArrays(self)
+
+    def _get_array_signature(self, wavelength=True):
+        """Configuration on which the cached arrays depend, used as key in
+        the process-wide ARRAY_CACHE
+
+        :param wavelength: set to False for arrays which do not depend on the wavelength
+        :return: hashable tuple
+        """
+        detector = self.detector
+        config = json.dumps(detector.get_config(), sort_keys=True, default=str)
+        shape = tuple(detector.shape) if detector.shape is not None else None
+        signature = (detector.__class__.__name__, config, shape, tuple(detector.binning))
+        if not detector.uniform_pixel:
+            # Pixel positions may have been set programmatically
+            signature += (id(detector),)
+        return (signature, self._dist, self._poni1, self._poni2,
+                self._rot1, self._rot2, self._rot3, self.chiDiscAtPi,
+                self._correct_solid_angle_for_spline, repr(self._parallax),
+                numpy.dtype(self._array_dtype).name,
+                self._wavelength if wavelength else None)
 
     def calcfrom1d(self, tth, I, shape=None, mask=None,
                    dim1_unit=units.TTH, correctSolidAngle=True,
@@ -2050,14 +2437,15 @@ class Geometry(object):
         numerical = ["_dist", "_poni1", "_poni2", "_rot1", "_rot2", "_rot3",
                      "chiDiscAtPi", "_wavelength",
                      '_oversampling', '_correct_solid_angle_for_spline',
-                     '_transmission_normal',
+                     '_transmission_normal', '_array_dtype',
                      ]
         # array = []
         for key in numerical:
             new.__setattr__(key, self.__getattribute__(key))
         new.param = [new._dist, new._poni1, new._poni2,
                      new._rot1, new._rot2, new._rot3]
-        new._cached_array = self._cached_array.copy()
+        new._cached_array = CachedArrays(new)
+        dict.update(new._cached_array, self._cached_array)
         return new
 
     def __deepcopy__(self, memo=None):
@@ -2067,7 +2455,7 @@ class Geometry(object):
         numerical = ["_dist", "_poni1", "_poni2", "_rot1", "_rot2", "_rot3",
                      "chiDiscAtPi", "_dssa_order", "_wavelength",
                      '_oversampling', '_correct_solid_angle_for_spline',
-                     '_transmission_normal',
+                     '_transmission_normal', '_array_dtype',
                      ]
         if memo is None:
             memo = {}
@@ -2256,20 +2644,46 @@ class Geometry(object):
             self._wavelength = float(value[0])
         else:
             self._wavelength = float(value)
-        qa = dqa = q_corner = None
-        if old_wl and self._wavelength:
-            if self._cached_array.get("q_center") is not None:
-                qa = self._cached_array["q_center"] * old_wl / self._wavelength
-
-            q_corner = self._cached_array.get("q_corner")
-            if q_corner is not None:
-                q_corner[..., 0] = q_corner[..., 0] * old_wl / self._wavelength
-
-        self.reset()
-        # restore updated values
-        self._cached_array["q_delta"] = dqa
-        self._cached_array["q_center"] = qa
-        self._cached_array["q_corner"] = q_corner
+        if self._wavelength != old_wl:
+            self._reset_wavelength(old_wl)
+
+    def _reset_wavelength(self, old_wavelength):
+        """Invalidate the cached arrays after a change of wavelength.
+
+        Unlike `reset`, arrays which do not depend on the wavelength (2theta,
+        chi, solid-angle, polarization ...) are kept, arrays in q and d*2 are
+        rescaled and other ones are dropped.
+
+        :param old_wavelength: previous wavelength in meter
+        """
+        ratio = old_wavelength / self._wavelength if (old_wavelength and self._wavelength) else None
+        cached = CachedArrays(self)
+        for key, value in list(dict.items(self._cached_array)):
+            exponent = _wavelength_exponent(key)
+            if exponent and ratio and (value is not None):
+                # not inplace: the array may be shared, see ARRAY_CACHE
+                factor = ratio ** exponent
+                if str(key).endswith("_corner"):
+                    value = value.copy()
+                    value[..., 0] *= factor
+                else:
+                    value = value * factor
+            elif exponent != 0:
+                continue
+            dict.__setitem__(cached, key, value)
+        self._cached_array = cached
+
+    def _convert_from_2th(self, tth, space):
+        """Calculate q or d*2 from the 2theta array, with the current wavelength
+
+        :param tth: array with 2theta in radians
+        :param space: "q" for q in nm^-1 or "d*2" for d*2 in nm^-2
+        :return: array of the same shape and type
+        """
+        q = (4.0e-9 * numpy.pi / self._wavelength) * numpy.sin(0.5 * tth)
+        if space == "d*2":
+            return (q / (2.0 * numpy.pi)) ** 2
+        return q
 
     def get_wavelength(self):
         return self._wavelength
@@ -2416,6 +2830,30 @@ class Geometry(object):
         self.reset()
     parallax = property(get_parallax, set_parallax)
 
+    def get_array_dtype(self):
+        return self._array_dtype
+
+    def set_array_dtype(self, value):
+        """Set the precision of the arrays of positions calculated by the geometry
+
+        In single precision, the memory needed for the positions of the pixels
+        (and their corners) is halved, which is significant when building the
+        sparse matrix of large detectors. Calculations are still performed in
+        double precision: the relative error on positions is ~6e-8, i.e. below
+        the µm at 1m, and ~1e-7 rad on angles, much below the size of a pixel.
+
+        Fitting the geometry needs double precision, the default.
+
+        :param value: numpy.float64 (default) or numpy.float32
+        """
+        value = numpy.dtype(value).type
+        if value not in (numpy.float32, numpy.float64):
+            raise ValueError(f"Geometry arrays are either float32 or float64, not {value}")
+        if value != self._array_dtype:
+            self._array_dtype = value
+            self.reset()
+    array_dtype = property(get_array_dtype, set_array_dtype)
+
     # Property to provide _dssa and _dssa_crc and so one to maintain the API
     @property
     def _dssa(self):
@@ -2467,3 +2905,7 @@ class Geometry(object):
         for statekey, statevalue in state.items():
             setattr(self, statekey, statevalue)
         self._sem = threading.Semaphore()
+        # CachedArrays are pickled as plain dictionaries
+        cached = CachedArrays(self)
+        dict.update(cached, state.get("_cached_array") or {})
+        self._cached_array = cached
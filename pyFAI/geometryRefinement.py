@@ -344,6 +344,26 @@ class GeometryRefinement(AzimuthalIntegrator):
             delta_theta *= weights
         return numpy.dot(delta_theta, delta_theta)
 
+    def jacobian1(self, param, d1, d2, rings):
+        "Analytic jacobian of residu1, i.e. derivatives of 2theta with respect to the 6 parameters"
+        return self.calc_jacobian(d1, d2, param[:6])[1][:, :6]
+
+    def gradient3(self, param, free, const, d1, d2, rings, weights=None):
+        "Analytic gradient of residu3 with respect to the free parameters"
+        param7 = self.calc_param7(param, free, const)
+        tth, jacobian = self.calc_jacobian(d1, d2, param7[:6])
+        delta_theta = tth - self.calc_2th(rings, param7[6])
+        if param7[6] > 0:
+            # The expected 2theta = 2.asin(wavelength/2d) depends on the wavelength
+            jacobian[:, 6] = -2.0 * numpy.tan((tth - delta_theta) / 2.0) / param7[6]
+        if weights is not None:
+            delta_theta *= weights
+            jacobian *= weights[:, None]
+        gradient = 2.0 * numpy.dot(delta_theta, jacobian)
+        # the wavelength is refined in Angstrom
+        gradient[6] *= 1e-10
+        return gradient[[self.PARAM_ORDER.index(name) for name in free]]
+
     def refine1(self):
         self.param = numpy.array([self._dist, self._poni1, self._poni2,
                                   self._rot1, self._rot2, self._rot3],
@@ -351,7 +371,8 @@ class GeometryRefinement(AzimuthalIntegrator):
         new_param, rc = leastsq(self.residu1, self.param,
                                 args=(self.data[:, 0],
                                       self.data[:, 1],
-                                      self.data[:, 2]))
+                                      self.data[:, 2]),
+                                Dfun=self.jacobian1)
         oldDeltaSq = self.chi2(tuple(self.param))
         newDeltaSq = self.chi2(tuple(new_param))
         logger.info("Least square retcode=%s %s --> %s",
@@ -413,6 +434,7 @@ class GeometryRefinement(AzimuthalIntegrator):
 
         new_param = fmin_slsqp(self.residu3, param, iter=maxiter,
                                args=(free, const, pos0, pos1, ring, weight),
+                               fprime=self.gradient3,
                                bounds=bounds,
                                acc=1.0e-12,
                                iprint=(logger.getEffectiveLevel() <= logging.INFO))
@@ -738,6 +738,8 @@ class GoniometerRefinement(Goniometer):
     """This class allow the translation of a goniometer geometry into a pyFAI
     geometry using a set of parameter to refine.
     """
+    GRADIENT_FREE = ("nelder-mead", "powell", "cobyla")
+    "Minimizers which do not use the gradient of the cost function"
 
     def __init__(self, param, pos_function, trans_function,
                  detector="Detector", wavelength=None, param_names=None, pos_names=None,
@@ -803,20 +805,85 @@ class GoniometerRefinement(Goniometer):
         geometry_list = ", ".join(self.single_geometries.keys())
         return "%s with %i geometries labeled: %s." % (name, count, geometry_list)
 
+    def _get_pyFAI_param(self, param, motor_pos):
+        """Calculate the 7 parameters of one geometry, the wavelength being in Angstrom
+
+        :param param: parameters of the goniometer
+        :param motor_pos: position of the goniometer
+        :return: list with dist, poni1, poni2, rot1, rot2, rot3, wavelength
+        """
+        single_param = self.trans_function(param, motor_pos)._asdict()
+        pyFAI_param = [single_param.get(name, 0.0)
+                       for name in ["dist", "poni1", "poni2", "rot1", "rot2", "rot3"]]
+        pyFAI_param.append(single_param.get("wavelength", self.wavelength) * 1e10)
+        return pyFAI_param
+
     def residu2(self, param):
         "Actually performs the calulation of the average of the error squared"
-        sumsquare = 0.0
+        refinements = []
+        params = []
+        for single in self.single_geometries.values():
+            if (single.geometry_refinement is not None) and (len(single.geometry_refinement.data) >= 1):
+                refinements.append(single.geometry_refinement)
+                params.append(self._get_pyFAI_param(param, single.get_position()))
+        if not refinements:
+            return 0.0
+        npt = sum(refinement.data.shape[0] for refinement in refinements)
+        first = refinements[0]
+        if any((refinement.detector is not first.detector) or (refinement.parallax is not None)
+               for refinement in refinements):
+            sumsquare = sum(refinement.chi2_wavelength(pyFAI_param)
+                            for refinement, pyFAI_param in zip(refinements, params))
+            return sumsquare / npt
+        # All control points are evaluated at once
+        data = numpy.concatenate([refinement.data[:, :2] for refinement in refinements])
+        group = numpy.repeat(numpy.arange(len(refinements)), [refinement.data.shape[0] for refinement in refinements])
+        tth = first.calc_batch(numpy.array(params)[:, :6], data[:, 0], data[:, 1], "2th", group)
+        tth -= numpy.concatenate([refinement.calc_2th(refinement.data[:, 2], pyFAI_param[6] * 1e-10)
+                                  for refinement, pyFAI_param in zip(refinements, params)])
+        return numpy.dot(tth, tth) / npt
+
+    def gradient2(self, param):
+        """Calculate the gradient of residu2, using the analytic derivatives of
+        each geometry and the numerical derivatives of the transformation
+
+        :param param: parameters of the goniometer
+        :return: the gradient, array of the size of param
+        """
+        param = numpy.asarray(param, dtype=numpy.float64)
+        step = numpy.where(param != 0, 1e-6 * abs(param), 1e-8)
+        gradient = numpy.zeros_like(param)
         npt = 0
         for single in self.single_geometries.values():
+            refinement = single.geometry_refinement
+            if (refinement is None) or (len(refinement.data) < 1):
+                continue
             motor_pos = single.get_position()
-            single_param = self.trans_function(param, motor_pos)._asdict()
-            pyFAI_param = [single_param.get(name, 0.0)
-                           for name in ["dist", "poni1", "poni2", "rot1", "rot2", "rot3"]]
-            pyFAI_param.append(single_param.get("wavelength", self.wavelength) * 1e10)
-            if (single.geometry_refinement is not None) and (len(single.geometry_refinement.data) >= 1):
-                sumsquare += single.geometry_refinement.chi2_wavelength(pyFAI_param)
-                npt += single.geometry_refinement.data.shape[0]
-        return sumsquare / max(npt, 1)
+            pyFAI_param = numpy.array(self._get_pyFAI_param(param, motor_pos))
+            # derivatives of the 7 parameters of the geometry with respect to the ones of the goniometer
+            transformation = numpy.array([(numpy.array(self._get_pyFAI_param(param + delta, motor_pos)) -
+                                           numpy.array(self._get_pyFAI_param(param - delta, motor_pos))) / (2.0 * h)
+                                          for delta, h in zip(numpy.diag(step), step)])
+            wavelength = pyFAI_param[6] * 1e-10
+            data = refinement.data
+            tth, jacobian = refinement.calc_jacobian(data[:, 0], data[:, 1], pyFAI_param[:6])
+            expected = refinement.calc_2th(data[:, 2], wavelength)
+            if wavelength > 0:
+                jacobian[:, 6] = -2e-10 * numpy.tan(numpy.asarray(expected) / 2.0) / wavelength
+            gradient += 2.0 * transformation.dot(numpy.dot(tth - expected, jacobian))
+            npt += data.shape[0]
+        return gradient / max(npt, 1)
+
+    def gradient3(self, fit_param, free, const):
+        """Calculate the gradient of residu3 with respect to the free parameters
+
+        :param fit_param: numpy array of float
+        :param free: names of the free parameters, array of same size as fit_param
+        :param const: dict with constant (non-fitted) parameters
+        :return: the gradient, array of the size of fit_param
+        """
+        gradient = self.gradient2(self.calc_param3(fit_param, free, const))
+        return gradient[[self.nt_param._fields.index(name) for name in free]]
 
     def calc_param3(self, fit_param, free, const):
         """Function that calculate the param vector 
@@ -843,21 +910,7 @@ class GoniometerRefinement(Goniometer):
         :param const: dict with constant (non-fitted) parameters
         :return: cost function value
         """
-        sumsquare = 0.0
-        npt = 0
-        
-        param = self.calc_param3(fit_param, free, const)
-        
-        for single in self.single_geometries.values():
-            motor_pos = single.get_position()
-            single_param = self.trans_function(param, motor_pos)._asdict()
-            pyFAI_param = [single_param.get(name, 0.0)
-                           for name in ["dist", "poni1", "poni2", "rot1", "rot2", "rot3"]]
-            pyFAI_param.append(single_param.get("wavelength", self.wavelength) * 1e10)
-            if (single.geometry_refinement is not None) and (len(single.geometry_refinement.data) >= 1):
-                sumsquare += single.geometry_refinement.chi2_wavelength(pyFAI_param)
-                npt += single.geometry_refinement.data.shape[0]
-        return sumsquare / max(npt, 1)
+        return self.residu2(self.calc_param3(fit_param, free, const))
 
     def chi2(self, param=None):
         """Calculate the average of the square of the error for a given parameter set
@@ -889,6 +942,7 @@ class GoniometerRefinement(Goniometer):
         param = numpy.asarray(self.param, dtype=numpy.float64)
         print(param)
         res = minimize(self.residu2, param, method=method,
+                       jac=None if method.lower() in self.GRADIENT_FREE else self.gradient2,
                        bounds=bounds, tol=1e-12,
                        options=options)
         print(res)
@@ -963,6 +1017,7 @@ class GoniometerRefinement(Goniometer):
 
         res = minimize(self.residu3, param, method=method,
                        args=(free, const),
+                       jac=None if method.lower() in self.GRADIENT_FREE else self.gradient3,
                        bounds=bounds, tol=1e-12,    
                        options=options)
 
@@ -51,6 +51,7 @@ import logging
 import numpy
 import os
 import posixpath
+import queue
 import sys
 import threading
 import time
@@ -83,6 +84,20 @@ from .nexus import get_isotime, from_isotime, is_hdf5, Nexus, h5py
 #     CMP = hdf5plugin.Bitshuffle()
 CMP = {}
 
+NPY_HEADER_SIZE = 128
+"Size of the header of the `.npy` stacks, fixed so that it can be updated in place"
+
+
+def _format_rows(array, row_format):
+    """Format the rows of an array as text with a single formatting operation
+
+    :param array: 2D array, one line per row
+    :param row_format: format of one row, ending with a new line
+    :return: the text
+    """
+    array = numpy.asarray(array)
+    return (row_format * len(array)) % tuple(array.ravel().tolist())
+
 
 class Writer(object):
     """
@@ -171,7 +186,11 @@ class HDF5Writer(Writer):
     MODE_APPEND = "append"
     MODE_OVERWRITE = "overwrite"
 
-    def __init__(self, filename, hpath=None, entry_template=None, fast_scan_width=None, append_frames=False, mode=MODE_ERROR):
+    MAX_CHUNK_BYTES = 1 << 22
+    "Upper limit for the size of the chunks of the buffered mode"
+
+    def __init__(self, filename, hpath=None, entry_template=None, fast_scan_width=None, append_frames=False, mode=MODE_ERROR,
+                 buffer_size=None, compression=None):
         """
         Constructor of an HDF5 writer:
 
@@ -179,6 +198,11 @@ class HDF5Writer(Writer):
         :param str hpath: Name of the entry group that will contains the NXprocess.
         :param str entry_template: Formattable template to create a new entry (if hpath is not specified)
         :param int fast_scan_width: set it to define the width of
+        :param int buffer_size: number of frames kept in memory and written at once. The chunks of the
+            datasets are aligned on the buffer and the datasets grow geometrically, they are trimmed on `close`.
+            Not used with `fast_scan_width`.
+        :param compression: name of an h5py compression filter ("gzip", "lzf") or dict with the
+            compression parameters of the datasets (like `hdf5plugin.Bitshuffle()`)
         """
         Writer.__init__(self, filename)
         if entry_template is None:
@@ -214,9 +238,21 @@ class HDF5Writer(Writer):
         self._current_frame = None
         self._append_frames = append_frames
         self._mode = mode
+        self._buffer_size = int(buffer_size) if buffer_size and not self.fast_scan_width else None
+        self._buffer = None
+        self._error_buffer = None
+        self._buffer_start = 0
+        self._buffer_count = 0
+        self._nframes = 0
+        if compression is None:
+            self._compression = None
+        elif isinstance(compression, StringTypes):
+            self._compression = {"compression": compression}
+        else:
+            self._compression = dict(compression)
 
     def __repr__(self):
-        return "HDF5 writer on file %s:%s %sinitialized" % (self.filename, self.hpath, "" if self._initialized else "un")
+        return "HDF5 writer on file %s:%s %sinitialized" % (self.filename, self.hpath, "" if self.intensity_ds is not None else "un")
 
     def _require_main_entry(self, mode):
         """
@@ -336,21 +372,21 @@ class HDF5Writer(Writer):
                 self.fast_motor.attrs["long_name"] = "Fast motor position"
                 self.fast_motor.attrs["interpretation"] = "scalar"
                 if self.do2D:
-                    chunk = 1, self.fast_scan_width, self.fai_cfg["nbpt_azim"], self.fai_cfg["nbpt_rad"]
+                    chunk = [1, self.fast_scan_width, self.fai_cfg["nbpt_azim"], self.fai_cfg["nbpt_rad"]]
                     self.ndim = 4
                     axis_definition = [".", "fast", "chi", "radial"]
                 else:
-                    chunk = 1, self.fast_scan_width, self.fai_cfg["nbpt_rad"]
+                    chunk = [1, self.fast_scan_width, self.fai_cfg["nbpt_rad"]]
                     self.ndim = 3
                     axis_definition = [".", "fast", "radial"]
             else:
                 if self.do2D:
                     axis_definition = [".", "chi", "radial"]
-                    chunk = 1, self.fai_cfg["nbpt_azim"], self.fai_cfg["nbpt_rad"]
+                    chunk = [1, self.fai_cfg["nbpt_azim"], self.fai_cfg["nbpt_rad"]]
                     self.ndim = 3
                 else:
                     axis_definition = [".", "radial"]
-                    chunk = 1, self.fai_cfg["nbpt_rad"]
+                    chunk = [1, self.fai_cfg["nbpt_rad"]]
                     self.ndim = 2
 
             utf8vlen_dtype = h5py.special_dtype(vlen=str)
@@ -369,6 +405,11 @@ class HDF5Writer(Writer):
                 dtype = numpy.float32
             else:
                 dtype = numpy.dtype(dtype)
+            if self._buffer_size:
+                # Chunks are a divider of the buffer so that each flush writes complete chunks
+                frame_bytes = numpy.prod(chunk[1:]) * numpy.dtype(dtype).itemsize
+                chunk[0] = max([i for i in range(1, self._buffer_size + 1)
+                                if (self._buffer_size % i == 0) and (i == 1 or i * frame_bytes <= self.MAX_CHUNK_BYTES)])
             self.chunk = tuple(chunk)
             self.shape = tuple(shape)
             self.intensity_ds = self._require_dataset(self.DATASET_NAME, dtype=dtype)
@@ -387,6 +428,7 @@ class HDF5Writer(Writer):
         with self._sem:
             if not (self.nxs and self.nxs.h5):
                 raise RuntimeError('No opened file')
+            self._flush_buffer()
             if radial is not None:
                 if radial.shape == self.radial_ds.shape:
                     self.radial_ds[:] = radial
@@ -404,6 +446,13 @@ class HDF5Writer(Writer):
         if self.nxs:
             self.flush()
             with self._sem:
+                if self._buffer_size:
+                    # Trim the datasets grown in advance
+                    size = max(self._nframes, self.shape[0])
+                    for dataset in (self.intensity_ds, self.error_ds):
+                        if (dataset is not None) and (dataset.shape[0] > size):
+                            dataset.resize(size, axis=0)
+                    self._buffer = self._error_buffer = None
                 # Remove any links to HDF5 file
                 self.entry_grp = None
                 self.nxdata_grp = None
@@ -463,7 +512,9 @@ class HDF5Writer(Writer):
             if error is not None and self.error_ds is None:
                 self.error_ds = self._require_dataset(self.DATASET_NAME + "_errors", dtype=error.dtype)
 
-            if self.fast_scan_width:
+            if self._buffer_size:
+                self._buffer_frame(index, intensity, error)
+            elif self.fast_scan_width:
                 index0, index1 = (index // self.fast_scan_width, index % self.fast_scan_width)
                 if index0 >= self.intensity_ds.shape[0]:
                     self.intensity_ds.resize(index0 + 1, axis=0)
@@ -496,6 +547,44 @@ class HDF5Writer(Writer):
                 self.radial_ds[:] = radial
                 self.has_radial_values = True
 
+    def _buffer_frame(self, index, intensity, error=None):
+        """Store one frame in the buffer, which is written when full or
+        when the frames are not consecutive. Needs the semaphore.
+        """
+        if (self._buffer is None) or (index != self._buffer_start + self._buffer_count):
+            self._flush_buffer()
+            self._buffer_start = index
+        if self._buffer is None:
+            self._buffer = numpy.empty((self._buffer_size,) + self.intensity_ds.shape[1:], dtype=self.intensity_ds.dtype)
+        if (error is not None) and (self._error_buffer is None):
+            self._error_buffer = numpy.zeros((self._buffer_size,) + self.error_ds.shape[1:], dtype=self.error_ds.dtype)
+        self._buffer[self._buffer_count] = intensity
+        if error is not None:
+            self._error_buffer[self._buffer_count] = error
+        self._buffer_count += 1
+        if self._buffer_count == self._buffer_size:
+            self._flush_buffer()
+
+    def _flush_buffer(self):
+        """Write the frames of the buffer in a single call per dataset.
+
+        Datasets grow geometrically to limit the number of resize. Needs the semaphore.
+        """
+        if not self._buffer_count:
+            return
+        start = self._buffer_start
+        stop = start + self._buffer_count
+        for dataset, buffer in ((self.intensity_ds, self._buffer), (self.error_ds, self._error_buffer)):
+            if (dataset is None) or (buffer is None):
+                continue
+            if stop > dataset.shape[0]:
+                size = max(stop, 2 * dataset.shape[0])
+                size = -(-size // self.chunk[0]) * self.chunk[0]
+                dataset.resize(size, axis=0)
+            dataset.write_direct(buffer, source_sel=numpy.s_[:self._buffer_count], dest_sel=numpy.s_[start:stop])
+        self._nframes = max(self._nframes, stop)
+        self._buffer_count = 0
+
     def _require_dataset(self, name, dtype):
         """Returns the dataset to store data/error ."""
 
@@ -505,14 +594,15 @@ class HDF5Writer(Writer):
                                                      dtype=dtype,
                                                      chunks=self.chunk,
                                                      maxshape=(None,) + self.chunk[1:],
-                                                     **CMP)
+                                                     **(CMP if self._compression is None else self._compression))
             result.attrs["interpretation"] = u"image"
         else:
             result = self.nxdata_grp.require_dataset(name,
                                                      shape=self.shape,
                                                      dtype=dtype,
                                                      chunks=self.chunk,
-                                                     maxshape=(None,) + self.chunk[1:])
+                                                     maxshape=(None,) + self.chunk[1:],
+                                                     **(self._compression or {}))
 
             result.attrs["interpretation"] = u"spectrum"
         return result
@@ -552,6 +642,7 @@ class DefaultAiWriter(Writer):
         super(DefaultAiWriter, self).__init__(filename, engine)
         self._filename = filename
         self._engine = engine
+        self._engine_header = None
         self._already_written = False
 
     def init(self, fai_cfg=None, lima_cfg=None):
@@ -580,10 +671,15 @@ class DefaultAiWriter(Writer):
         :return: the header
         :rtype: str
         """
-        if "make_headers" in dir(self._engine):
-            header_lst = self._engine.make_headers()
-        else:
-            header_lst = [str(self._engine), ""]
+        config = self._engine.get_config() if "get_config" in dir(self._engine) else None
+        if (self._engine_header is None) or (config is None) or (self._engine_header[0] != config):
+            # The description of the engine is only recomputed when its configuration changes
+            if "make_headers" in dir(self._engine):
+                header = self._engine.make_headers()
+            else:
+                header = [str(self._engine), ""]
+            self._engine_header = (config, header)
+        header_lst = list(self._engine_header[1])
 
         header_lst += ["Mask applied: %s" % has_mask,
                        "Dark current applied: %s" % has_dark,
@@ -635,12 +731,11 @@ class DefaultAiWriter(Writer):
                 f.write("\n# --> %s\n" % (filename.encode("utf8")))
             if error is None:
                 f.write("#%14s %14s\n" % (dim1_unit, "I "))
-                f.write("\n".join(["%14.6e  %14.6e" % (t, i) for t, i in zip(dim1, I)]))
+                f.write(_format_rows(numpy.column_stack((dim1, I)), "%14.6e  %14.6e\n"))
             else:
                 f.write("#%14s  %14s  %14s\n" %
                         (dim1_unit, "I ", "sigma "))
-                f.write("\n".join(["%14.6e  %14.6e %14.6e" % (t, i, s) for t, i, s in zip(dim1, I, error)]))
-            f.write("\n")
+                f.write(_format_rows(numpy.column_stack((dim1, I, error)), "%14.6e  %14.6e %14.6e\n"))
 
     def save2D(self, filename, I, dim1, dim2, error=None, dim1_unit="2th_deg",
                has_mask=None, has_dark=False, has_flat=False,
@@ -843,9 +938,12 @@ class AsciiWriter(Writer):
     def write(self, data, index=0):
         filename = os.path.join(self.directory, self.prefix + (self.index_format % (self.start_index + index)) + self.extension)
         if filename:
+            array = numpy.asarray(data)
+            if array.ndim == 1:
+                array = array[:, None]
             with open(filename, "w") as f:
                 f.write("# Processing time: %s%s" % (get_isotime(), self.header))
-                numpy.savetxt(f, data)
+                f.write(_format_rows(array, " ".join(["%.18e"] * array.shape[1]) + "\n"))
 
 
 class FabioWriter(Writer):
@@ -937,3 +1035,247 @@ class FabioWriter(Writer):
                 f.write("# Processing time: %s%s" % (get_isotime(), self.header))
                 numpy.savetxt(f, data)
 
+
+class NumpyWriter(Writer):
+    """
+    Compact binary writer: all frames are appended to a single `.npy` stack
+    (little-endian), which can be memory-mapped with `numpy.load`. Errors are
+    stored in a second stack, the axes and the configuration in a JSON
+    sidecar file.
+    """
+
+    def __init__(self, filename):
+        """
+        Constructor of the class
+
+        :param str filename: name of the `.npy` file
+        """
+        if filename.endswith(".npy"):
+            filename = filename[:-4]
+        Writer.__init__(self, filename + ".npy", ".npy")
+        self.error_filename = filename + "_errors.npy"
+        self.sidecar = filename + ".json"
+        self._stacks = OrderedDict()  # filename: [file, dtype, shape of a frame, number of frames]
+        self._axes = {}
+
+    def __repr__(self):
+        return "Numpy writer on file %s" % (self.filename)
+
+    @staticmethod
+    def _write_header(fileobj, dtype, shape):
+        """Write the header of a `.npy` file, always with the same size"""
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (numpy.lib.format.dtype_to_descr(dtype), tuple(shape))
+        header = header.ljust(NPY_HEADER_SIZE - 11) + "\n"
+        if len(header) != NPY_HEADER_SIZE - 10:
+            raise ValueError("Header too long for shape %s" % (shape,))
+        fileobj.write(b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1"))
+
+    def _append(self, filename, array):
+        """Append one frame to a stack. Needs the semaphore."""
+        array = numpy.asarray(array)
+        stack = self._stacks.get(filename)
+        if stack is None:
+            dtype = array.dtype.newbyteorder("<")
+            fileobj = open(filename, "wb", buffering=1 << 20)
+            self._write_header(fileobj, dtype, (0,) + array.shape)
+            stack = self._stacks[filename] = [fileobj, dtype, array.shape, 0]
+        elif array.shape != stack[2]:
+            raise ValueError("Shape of the frame %s does not match the one of the stack %s" % (array.shape, stack[2]))
+        stack[0].write(numpy.ascontiguousarray(array, dtype=stack[1]).data)
+        stack[3] += 1
+
+    def write(self, data):
+        """
+        Append the result of one integration to the stack
+
+        :param data: Integrate1dResult, Integrate2dResult or array with intensities
+        """
+        error = None
+        if isinstance(data, containers.IntegrateResult):
+            intensity = data.intensity
+            error = data.sigma
+        else:
+            intensity = data
+        with self._sem:
+            self._append(self.filename, intensity)
+            if error is not None:
+                self._append(self.error_filename, error)
+            if (not self._axes) and isinstance(data, containers.IntegrateResult):
+                self._axes["radial"] = numpy.asarray(data.radial).tolist()
+                self._axes["radial_unit"] = str(data.unit)
+                if isinstance(data, containers.Integrate2dResult):
+                    self._axes["azimuthal"] = numpy.asarray(data.azimuthal).tolist()
+
+    def flush(self):
+        """Update the headers of the stacks and the sidecar file"""
+        with self._sem:
+            description = OrderedDict()
+            description["content"] = "pyFAI integrated data"
+            description["version"] = version
+            description["date"] = get_isotime()
+            description["data"] = None
+            description["errors"] = None
+            for filename, (fileobj, dtype, shape, count) in self._stacks.items():
+                fileobj.flush()
+                position = fileobj.tell()
+                fileobj.seek(0)
+                self._write_header(fileobj, dtype, (count,) + shape)
+                fileobj.seek(position)
+                fileobj.flush()
+                if filename == self.filename:
+                    description["data"] = os.path.basename(filename)
+                    description["shape"] = (count,) + shape
+                    description["dtype"] = numpy.lib.format.dtype_to_descr(dtype)
+                else:
+                    description["errors"] = os.path.basename(filename)
+            description.update(self._axes)
+            description["config"] = self.fai_cfg
+            with open(self.sidecar, "w") as f:
+                json.dump(description, f, indent=2, default=str)
+
+    def close(self):
+        if self._stacks:
+            self.flush()
+        with self._sem:
+            for stack in self._stacks.values():
+                stack[0].close()
+            self._stacks.clear()
+
+
+class AsyncWriter(Writer):
+    """
+    Wrapper running any writer in a background thread, so that the disk
+    latency does not stall the integration.
+
+    Calls are queued in a bounded queue: `write` blocks when the queue is
+    full. Errors of the writer are raised at the next call to `write`,
+    `flush` or `close`. Data must not be modified once written.
+    The methods of the writer listed in `ASYNC_METHODS` are also called in
+    the background thread, in order with the writes. Any other method is
+    called synchronously, once the pending operations are completed, so
+    that its result is returned.
+    """
+
+    ASYNC_METHODS = ("set_hdf5_input_dataset", "prepare_write", "set_filename")
+    "Methods of the writer without result, called in the background thread"
+
+    def __init__(self, writer, queue_size=16):
+        """
+        Constructor of the class
+
+        :param writer: instance of Writer
+        :param int queue_size: maximum number of pending operations
+        """
+        Writer.__init__(self)
+        self.writer = writer
+        self.filename = writer.filename
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._operations = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+        self._max_depth = 0
+        self._thread = threading.Thread(target=self._run, name="pyFAI-AsyncWriter", daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return "Asynchronous %s" % self.writer
+
+    def __getattr__(self, name):
+        if name.startswith("_") or "writer" not in self.__dict__:
+            raise AttributeError(name)
+        attr = getattr(self.writer, name)
+        if not callable(attr):
+            return attr
+        if name in self.ASYNC_METHODS:
+
+            def method(*args, **kwargs):
+                self._submit(attr, args, kwargs)
+        else:
+
+            def method(*args, **kwargs):
+                self._queue.join()
+                self._raise_error()
+                return attr(*args, **kwargs)
+        return method
+
+    def _run(self):
+        """Loop of the background thread"""
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                function, args, kwargs = item
+                if (self._error is not None) and (function != self.writer.close):
+                    # skip the writes until the error is reported
+                    continue
+                t0 = time.perf_counter()
+                try:
+                    function(*args, **kwargs)
+                except Exception as error:
+                    logger.error("Error in asynchronous writer %s: %s: %s", self.writer, type(error), error)
+                    self._error = error
+                latency = time.perf_counter() - t0
+                with self._sem:
+                    self._operations += 1
+                    self._total_latency += latency
+                    self._max_latency = max(self._max_latency, latency)
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        """Raise the error of the writer thread, if any"""
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _submit(self, function, args=(), kwargs=None):
+        if not self._thread.is_alive():
+            raise RuntimeError("Writer is closed")
+        self._raise_error()
+        self._queue.put((function, args, kwargs or {}))
+        with self._sem:
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+
+    def init(self, fai_cfg=None, lima_cfg=None):
+        """Initializes the writer, synchronously as errors are expected here"""
+        self._queue.join()
+        self._raise_error()
+        self.writer.init(fai_cfg=fai_cfg, lima_cfg=lima_cfg)
+
+    def write(self, data, *args, **kwargs):
+        """Queue the data to be written"""
+        self._submit(self.writer.write, (data,) + args, kwargs)
+
+    def flush(self, *args, **kwargs):
+        """Flush the writer and wait for all pending operations to be completed"""
+        self._submit(self.writer.flush, args, kwargs)
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Complete pending operations, close the writer and stop the thread"""
+        if self._thread.is_alive():
+            self._queue.put((self.writer.close, (), {}))
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    @property
+    def queue_depth(self):
+        "Number of pending operations"
+        return self._queue.qsize()
+
+    def get_statistics(self):
+        """Metrics about the background writing
+
+        :return: dict with the current and maximum queue depth, the number of
+            operations and their mean and maximum latency (in seconds)
+        """
+        with self._sem:
+            return {"queue_depth": self._queue.qsize(),
+                    "max_queue_depth": self._max_depth,
+                    "operations": self._operations,
+                    "mean_latency": self._total_latency / self._operations if self._operations else 0.0,
+                    "max_latency": self._max_latency}
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Azimuthal integration
+#             https://github.com/silx-kit/pyFAI
+#
+#    Copyright (C) 2022-2022 European Synchrotron Radiation Facility, Grenoble, France
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#  .
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#  .
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#  THE SOFTWARE.
+
+"""Direct reading of compressed HDF5 chunks.
+
+Stacks of frames written by Eiger/Jungfrau detectors are stored with one
+frame per chunk, usually compressed with bitshuffle-LZ4. Instead of going
+through the HDF5 filter pipeline, the `ChunkReader` reads the raw chunks
+(`read_direct_chunk`) and decompresses them in a pool of threads, directly
+into a ring of pre-allocated buffers, so no memory is allocated per frame.
+
+Supported filters are deflate (gzip), shuffle and bitshuffle (with LZ4,
+requires the `bitshuffle` package). Datasets with other filters, or which
+are not chunked frame by frame, are read through HDF5 into the same buffers.
+
+Usage::
+
+    with ChunkReader("master.h5::/entry/data/data_000001") as reader:
+        for frame in reader.iter_frames():
+            ai.integrate1d_ng(frame, 1000)
+"""
+
+__author__ = "Jérôme Kieffer"
+__contact__ = "Jerome.Kieffer@ESRF.eu"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "18/10/2022"
+__status__ = "development"
+
+import os
+import zlib
+import collections
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+logger = logging.getLogger(__name__)
+from .nexus import h5py
+try:
+    import bitshuffle
+except ImportError:
+    bitshuffle = None
+
+H5Z_FILTER_DEFLATE = 1
+H5Z_FILTER_SHUFFLE = 2
+H5Z_FILTER_BITSHUFFLE = 32008
+BSHUF_LZ4 = 2
+
+ALIGNMENT = 4096
+"Frame buffers are aligned on memory pages"
+
+
+def _unshuffle(buffer, cd_values, dtype, shape, out=None):
+    """Revert the HDF5 byte-shuffle filter"""
+    itemsize = cd_values[0] if cd_values else dtype.itemsize
+    src = numpy.frombuffer(buffer, dtype=numpy.uint8)
+    if out is None:
+        out = numpy.empty(src.size, dtype=numpy.uint8)
+    dst = out.reshape(-1).view(numpy.uint8).reshape(-1, itemsize)
+    planes = src.reshape(itemsize, -1)
+    for i in range(itemsize):
+        # One byte-plane at a time is much faster than a transposed copy
+        dst[:, i] = planes[i]
+    return out
+
+
+def _inflate(buffer, cd_values, dtype, shape, out=None):
+    """Revert the deflate (gzip) filter"""
+    decompressed = zlib.decompress(buffer)
+    if out is None:
+        return decompressed
+    out.reshape(-1).view(numpy.uint8)[...] = numpy.frombuffer(decompressed, dtype=numpy.uint8)
+    return out
+
+
+def _bitunshuffle(buffer, cd_values, dtype, shape, out=None):
+    """Revert the bitshuffle filter, optionally with LZ4 compression"""
+    block_size = cd_values[3] if len(cd_values) > 3 else 0
+    if len(cd_values) > 4 and cd_values[4] == BSHUF_LZ4:
+        # 8 bytes for the size of the chunk and 4 bytes for the block size, big-endian
+        block_size = int.from_bytes(bytes(buffer[8:12]), "big") // dtype.itemsize
+        src = numpy.frombuffer(buffer, dtype=numpy.uint8, offset=12)
+        result = bitshuffle.decompress_lz4(src, shape, dtype, block_size)
+    elif len(cd_values) > 4 and cd_values[4] != 0:
+        raise NotImplementedError("Bitshuffle compression %s is not supported" % cd_values[4])
+    else:
+        result = bitshuffle.bitunshuffle(numpy.frombuffer(buffer, dtype=dtype).reshape(shape), block_size)
+    if out is None:
+        return result
+    out.reshape(-1).view(dtype)[...] = result.reshape(-1)
+    return out
+
+
+DECODERS = {H5Z_FILTER_DEFLATE: _inflate,
+            H5Z_FILTER_SHUFFLE: _unshuffle}
+"Filter id: function decoding a chunk with the signature (buffer, cd_values, dtype, shape, out=None)"
+if bitshuffle is not None:
+    DECODERS[H5Z_FILTER_BITSHUFFLE] = _bitunshuffle
+
+
+def get_datasets(path):
+    """Resolve a path into a list of stacks of frames
+
+    :param path: "file.h5::/path/to/dataset", or a file or a group. For files
+        and groups, the 3D datasets of `/entry/data` (Eiger master file) or of
+        the group are used, in alphabetical order.
+    :return: list of 3D h5py datasets, the file has to be closed by the caller
+    """
+    if h5py is None:
+        raise RuntimeError("h5py is needed to read HDF5 files")
+    if "::" in path:
+        filename, h5path = path.split("::", 1)
+    else:
+        filename, h5path = path, None
+    h5 = h5py.File(filename, "r")
+    if h5path is None:
+        h5path = "/entry/data" if "/entry/data" in h5 else "/"
+    node = h5[h5path]
+    if isinstance(node, h5py.Dataset):
+        return [node]
+    datasets = []
+    for name in sorted(node.keys()):
+        try:
+            item = node[name]
+        except KeyError:
+            # External link to a missing data file
+            logger.warning("Unable to access %s in %s", name, node.name)
+            continue
+        if isinstance(item, h5py.Dataset) and item.ndim == 3:
+            datasets.append(item)
+    return datasets
+
+
+class ChunkReader(object):
+    """Reader of a 3D HDF5 dataset bypassing the HDF5 filter pipeline
+
+    The reader owns a ring of frame buffers: frames provided by `iter_frames`
+    are views on those buffers and remain valid until `nb_buffers` more
+    frames have been read. Copy them if they have to be kept longer.
+    """
+
+    def __init__(self, dataset, nb_threads=None, nb_buffers=1):
+        """Constructor of the class
+
+        :param dataset: h5py dataset or path "file.h5::/path/to/dataset"
+        :param nb_threads: number of decompression threads, by default the number of cores
+        :param nb_buffers: number of frames the consumer holds at the same time
+        """
+        self._file = None
+        if isinstance(dataset, str):
+            if h5py is None:
+                raise RuntimeError("h5py is needed to read HDF5 files")
+            filename, h5path = dataset.split("::", 1) if "::" in dataset else (dataset, "/entry/data/data")
+            self._file = h5py.File(filename, "r")
+            dataset = self._file[h5path]
+        if dataset.ndim != 3:
+            raise TypeError("A stack of frames (3D dataset) is expected, got shape %s" % (dataset.shape,))
+        self.dataset = dataset
+        self.shape = dataset.shape[1:]
+        self.dtype = dataset.dtype
+        self.nb_threads = nb_threads or os.cpu_count()
+        self.nb_buffers = max(1, nb_buffers)
+        self.filters = self._get_filters(dataset)
+        self.direct = (dataset.chunks is not None) and (tuple(dataset.chunks) == (1,) + self.shape) and \
+            all(code in DECODERS for code, _ in self.filters)
+        if not self.direct:
+            logger.info("Dataset %s can not be read chunk by chunk (chunks: %s, filters: %s), using HDF5",
+                        dataset.name, dataset.chunks, [code for code, _ in self.filters])
+        self._ring = None
+
+    def __repr__(self):
+        return "ChunkReader on %s with %s frames of %s (%s)" % (self.dataset.name, len(self), self.shape,
+                                                                   "direct" if self.direct else "HDF5")
+
+    def __len__(self):
+        return self.dataset.shape[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _get_filters(dataset):
+        """List the filters of the dataset
+
+        :return: list of 2-tuple with the filter id and its parameters
+        """
+        plist = dataset.id.get_create_plist()
+        return [plist.get_filter(i)[::2] for i in range(plist.get_nfilters())]
+
+    def _allocate(self, nb_frames):
+        """Allocate a contiguous block of frames aligned on a memory page"""
+        nbytes = int(numpy.prod(self.shape)) * self.dtype.itemsize
+        frame_size = -(-nbytes // ALIGNMENT) * ALIGNMENT
+        block = numpy.empty(nb_frames * frame_size + ALIGNMENT, dtype=numpy.uint8)
+        offset = -block.ctypes.data % ALIGNMENT
+        return [block[offset + i * frame_size: offset + i * frame_size + nbytes].view(self.dtype).reshape(self.shape)
+                for i in range(nb_frames)]
+
+    def read_frame(self, index, out=None):
+        """Read and decompress one frame
+
+        :param index: index of the frame in the stack
+        :param out: buffer for the frame, allocated if None
+        :return: the frame as a 2D array
+        """
+        if out is None:
+            out = numpy.empty(self.shape, dtype=self.dtype)
+        if not self.direct:
+            self.dataset.read_direct(out, numpy.s_[index], numpy.s_[...])
+            return out
+        offset = (index,) + (0,) * len(self.shape)
+        filters = self.filters
+        if not filters:
+            self.dataset.id.read_direct_chunk(offset, out=out.reshape(-1).view(numpy.uint8))
+            return out
+        filter_mask, buffer = self.dataset.id.read_direct_chunk(offset)
+        # Filters are undone in the reverse order, skipping those not applied to this chunk
+        active = [(code, cd_values) for i, (code, cd_values) in enumerate(filters)
+                  if not (filter_mask >> i) & 1]
+        if not active:
+            out.reshape(-1).view(numpy.uint8)[...] = numpy.frombuffer(buffer, dtype=numpy.uint8)
+            return out
+        for code, cd_values in active[:0:-1]:
+            buffer = DECODERS[code](buffer, cd_values, self.dtype, self.shape)
+        code, cd_values = active[0]
+        DECODERS[code](buffer, cd_values, self.dtype, self.shape, out=out)
+        return out
+
+    def iter_frames(self, start=0, stop=None):
+        """Iterate over the frames, decompressed in advance in a pool of threads
+
+        The frames are views on the buffers of the reader, see the class documentation.
+
+        :param start: index of the first frame
+        :param stop: index after the last frame, by default the end of the stack
+        :return: iterator over the 2D frames
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        size = self.nb_buffers + self.nb_threads
+        if self._ring is None or len(self._ring) < size:
+            self._ring = self._allocate(size)
+        ring = self._ring
+        futures = collections.deque()
+        with ThreadPoolExecutor(self.nb_threads, thread_name_prefix="pyFAI-chunk") as executor:
+            index = start
+            while index < min(stop, start + self.nb_threads):
+                futures.append(executor.submit(self.read_frame, index, ring[index % size]))
+                index += 1
+            try:
+                while futures:
+                    frame = futures.popleft().result()
+                    # The slot reused by this read was released by the consumer
+                    if index < stop:
+                        futures.append(executor.submit(self.read_frame, index, ring[index % size]))
+                        index += 1
+                    yield frame
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def close(self):
+        """Release the buffers and the file if opened by the reader"""
+        self._ring = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
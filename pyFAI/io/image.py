@@ -29,8 +29,14 @@
 """
 
 import os.path
+import logging
+import numpy
 import fabio
 import silx.io
+from fabio import TiffIO
+from .nexus import h5py, is_hdf5
+
+logger = logging.getLogger(__name__)
 
 def read_data(image_path):
     """
@@ -72,3 +78,159 @@ def read_image_data(image_path):
     if data.dtype.kind not in "fui":
         raise TypeError("Path %s identify an %s-kind array, but a numerical kind is expected" % (image_path, data.dtype.kind))
     return data
+
+
+def _edf_layout(filename):
+    """Layout of the frames of an uncompressed EDF file"""
+    with open(filename, "rb") as f:
+        if f.read(1) != b"{":
+            # compressed file (gzip, bz2) or not an EDF file
+            return
+    with fabio.open(filename) as image:
+        frames = getattr(image, "_frames", None)
+        if not isinstance(image, fabio.edfimage.EdfImage) or not frames:
+            return
+        layout = []
+        for frame in frames:
+            header = frame.header
+            dtype = numpy.dtype(frame.bytecode)
+            shape = tuple(frame.shape)
+            if header.get("Compression", "None").lower() not in ("none", "no") or \
+                    frame.blobsize != dtype.itemsize * int(numpy.prod(shape)):
+                return
+            byteorder = "<" if header.get("ByteOrder", "LowByteFirst") == "LowByteFirst" else ">"
+            layout.append((frame.start, dtype.newbyteorder(byteorder), shape))
+    return layout
+
+
+def _tiff_layout(filename):
+    """Layout of the frames of an uncompressed grey-scale TIFF file"""
+    tiff = TiffIO.TiffIO(filename, "rb")
+    try:
+        layout = []
+        for index in range(tiff.getNumberOfImages()):
+            info = tiff.getInfo(index)
+            nbits = info["nBits"]
+            if info["compression"] or hasattr(nbits, "index") or info["colormap"] is not None:
+                return
+            kind = {TiffIO.SAMPLE_FORMAT_FLOAT: "f",
+                    TiffIO.SAMPLE_FORMAT_INT: "i",
+                    TiffIO.SAMPLE_FORMAT_UINT: "u",
+                    TiffIO.SAMPLE_FORMAT_VOID: "u"}.get(info["sampleFormat"])
+            if kind is None:
+                return
+            dtype = numpy.dtype("%s%s%i" % (tiff._structChar, kind, nbits // 8))
+            shape = (info["nRows"], info["nColumns"])
+            offsets = info["stripOffsets"]
+            counts = info["stripByteCounts"]
+            # strips must be contiguous and contain exactly the frame
+            if any(offsets[i] + counts[i] != offsets[i + 1] for i in range(len(offsets) - 1)) or \
+                    sum(counts) != dtype.itemsize * shape[0] * shape[1]:
+                return
+            layout.append((offsets[0], dtype, shape))
+    finally:
+        tiff.close()
+    return layout
+
+
+def _hdf5_layout(image_path):
+    """Layout of a contiguous HDF5 dataset
+
+    :return: the file containing the data and the layout of the frames
+    """
+    filename, h5path = image_path.split("::", 1) if "::" in image_path else (image_path, None)
+    with h5py.File(filename, "r") as h5:
+        if h5path is None:
+            h5path = "/entry/data/data" if "/entry/data/data" in h5 else None
+        if h5path is None:
+            return None, None
+        dataset = h5[h5path]
+        if not isinstance(dataset, h5py.Dataset) or dataset.ndim not in (2, 3) or \
+                dataset.chunks is not None or dataset.dtype.kind not in "uif":
+            return None, None
+        offset = dataset.id.get_offset()
+        if offset is None:
+            # Not allocated in the file
+            return None, None
+        shape = dataset.shape[-2:]
+        nbytes = dataset.dtype.itemsize * shape[0] * shape[1]
+        nframes = 1 if dataset.ndim == 2 else dataset.shape[0]
+        layout = [(offset + i * nbytes, dataset.dtype, shape) for i in range(nframes)]
+        return dataset.file.filename, layout
+
+
+def get_frame_layout(image_path, shape=None, dtype=None, offset=0):
+    """Describe the position of the frames in a file, if they can be memory-mapped
+
+    Supported are `npy` files, raw binary files (when `shape` and `dtype` are provided),
+    uncompressed EDF and TIFF files and contiguous HDF5 datasets ("file.h5::/path").
+
+    :param str image_path: path of the file
+    :param shape: shape of a frame, for raw binary files
+    :param dtype: data type of the frames, for raw binary files
+    :param int offset: position of the first frame, for raw binary files
+    :return: the name of the file and a list of (offset, dtype, shape) for each frame,
+        None if the frames can not be memory-mapped
+    """
+    filename = image_path.split("::", 1)[0]
+    if not os.path.isfile(filename):
+        return
+    try:
+        if shape is not None and dtype is not None:
+            dtype = numpy.dtype(dtype)
+            nbytes = dtype.itemsize * int(numpy.prod(shape))
+            nframes = (os.path.getsize(filename) - offset) // nbytes
+            return filename, [(offset + i * nbytes, dtype, tuple(shape)) for i in range(nframes)]
+        if filename.endswith(".npy"):
+            array = numpy.load(filename, mmap_mode="r")
+            if array.ndim not in (2, 3) or not array.flags.c_contiguous:
+                return
+            shape = array.shape[-2:]
+            nbytes = array.dtype.itemsize * shape[0] * shape[1]
+            nframes = 1 if array.ndim == 2 else array.shape[0]
+            return filename, [(array.offset + i * nbytes, array.dtype, shape) for i in range(nframes)]
+        if h5py is not None and is_hdf5(filename):
+            filename, layout = _hdf5_layout(image_path)
+            return (filename, layout) if layout else None
+        with open(filename, "rb") as f:
+            magic = f.read(4)
+        if magic in (b"II*\x00", b"MM\x00*"):
+            layout = _tiff_layout(filename)
+        else:
+            layout = _edf_layout(filename)
+    except Exception as err:
+        logger.debug("Unable to memory-map %s: %s: %s", image_path, type(err).__name__, err)
+        return
+    if layout:
+        return filename, layout
+
+
+def iter_mapped_frames(image_path, shape=None, dtype=None, offset=0):
+    """Iterate over the frames of a file, memory-mapped without any copy
+
+    The frames are read-only views on the file, the data are read from the
+    page cache when accessed.
+
+    :param str image_path: path of the file, see `get_frame_layout` for the supported formats
+    :param shape: shape of a frame, for raw binary files
+    :param dtype: data type of the frames, for raw binary files
+    :param int offset: position of the first frame, for raw binary files
+    :return: iterator over the 2D read-only arrays
+    :raises IOError: if the file can not be memory-mapped
+    """
+    description = get_frame_layout(image_path, shape, dtype, offset)
+    if description is None:
+        raise IOError("Frames from path '%s' can not be memory-mapped" % image_path)
+    return map_frames(*description)
+
+
+def map_frames(filename, layout):
+    """Iterate over memory-mapped frames, as described by `get_frame_layout`
+
+    :param str filename: name of the file containing the frames
+    :param layout: list of (offset, dtype, shape) for each frame
+    :return: iterator over the 2D read-only arrays
+    """
+    mapped = numpy.memmap(filename, dtype=numpy.uint8, mode="r")
+    for start, dtype, shape in layout:
+        yield numpy.ndarray(shape, dtype=dtype, buffer=mapped, offset=start)
@@ -393,6 +393,10 @@ class IntegrationMethod:
             string = ", ".join((str(self.dimension) + "d int", self.pixel_splitting + " split", self.algorithm, self.implementation))
         return "IntegrationMethod(%s)" % string
 
+    def __reduce__(self):
+        "Methods are pickled by their description, unpickled as the registered instance"
+        return (self.__class__.parse, (self.method,))
+
     def _does_manage_variance(self):
         "Checks if the method handles alone the variance in the case poissonian=True or False"
         manage_variance = False
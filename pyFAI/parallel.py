@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Azimuthal integration
+#             https://github.com/silx-kit/pyFAI
+#
+#    Copyright (C) 2022-2022 European Synchrotron Radiation Facility, Grenoble, France
+#
+#    Principal author:       Jérôme Kieffer (Jerome.Kieffer@ESRF.eu)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""This module contains the ParallelIntegrator class:
+
+Integration of many frames with a pool of processes. The regrid-engine
+(sparse matrix) of the azimuthal integrator is built once in the main
+process and published, together with the arrays cached by the geometry
+(solid-angle, polarization ...), in shared memory. Worker processes attach
+to those arrays without copy instead of rebuilding them.
+
+Usage::
+
+    with ParallelIntegrator(ai, 1000, unit="q_nm^-1", method=("full", "csr", "cython")) as integrator:
+        results = integrator.integrate(frames)
+"""
+
+__author__ = "Jérôme Kieffer"
+__contact__ = "Jerome.Kieffer@ESRF.eu"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "18/10/2022"
+__status__ = "development"
+
+import os
+import copy
+import pickle
+import logging
+import multiprocessing
+import numpy
+logger = logging.getLogger(__name__)
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+from .engines import Engine
+from .engines.sparse_cache import export_engine, import_engine
+from .geometry import PolarizationArray, CachedArrays
+from .method_registry import IntegrationMethod
+
+ALIGNMENT = 64
+"Arrays in shared memory are aligned on cache lines"
+
+_worker = None
+"Integrator of the worker process and the parameters of the integration"
+
+
+class SharedArrays(object):
+    """Set of numpy arrays stored in a single block of shared memory
+
+    Only the name of the block and the layout of the arrays are pickled: the
+    unpickled instance attaches to the same block of memory.
+    """
+
+    def __init__(self, arrays):
+        """Constructor of the class: allocates the shared memory and copies
+        the arrays into it
+
+        :param arrays: dict with the name and the content of the arrays
+        """
+        if shared_memory is None:
+            raise RuntimeError("Shared memory requires Python 3.8 or newer")
+        self.layout = []
+        size = 0
+        for name, array in arrays.items():
+            array = numpy.asarray(array)
+            self.layout.append((name, array.dtype, array.shape, size))
+            size += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self._owner = True
+        self.name = self._shm.name
+        for name, shared in self.get().items():
+            shared[...] = arrays[name]
+
+    def __repr__(self):
+        return f"SharedArrays {self.name} with {len(self.layout)} arrays"
+
+    def __getstate__(self):
+        return {"name": self.name, "layout": self.layout}
+
+    def __setstate__(self, state):
+        self.name = state["name"]
+        self.layout = state["layout"]
+        self._shm = shared_memory.SharedMemory(name=self.name)
+        self._owner = False
+
+    @property
+    def nbytes(self):
+        return self._shm.size if self._shm is not None else 0
+
+    def get(self):
+        """Provides the arrays, backed by the shared memory
+
+        :return: dict with the name and the arrays
+        """
+        buffer = self._shm.buf
+        return {name: numpy.ndarray(shape, dtype, buffer=buffer, offset=offset)
+                for name, dtype, shape, offset in self.layout}
+
+    def close(self):
+        """Release the shared memory, which is freed when released by its
+        creator. The arrays provided by `get` must not be used anymore.
+        """
+        if self._shm is None:
+            return
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
+
+
+def _initialize(payload):
+    """Initializer of the worker processes: attach to the shared memory and
+    install the engine in the integrator
+
+    :param payload: pickled configuration, see ParallelIntegrator
+    """
+    global _worker
+    config = pickle.loads(payload)
+    ai = config["ai"]
+    arrays = config["shared"].get()
+    for key, kind, value in config["cached"]:
+        if kind == "array":
+            ai._cached_array[key] = arrays[value]
+        elif kind == "polarization":
+            ai._cached_array[key] = PolarizationArray(arrays[value[0]], value[1])
+        else:
+            ai._cached_array[key] = value
+    if config["engine"] is not None:
+        method, key, metadata = config["engine"]
+        engine_arrays = {name[len("engine:"):]: array for name, array in arrays.items()
+                         if name.startswith("engine:")}
+        engine = ai.engines[method] = Engine()
+        engine.set_engine(import_engine(metadata, engine_arrays), key)
+    # The shared memory remains attached for the life of the process
+    _worker = (ai, config["shared"], config["function"], config["args"], config["kwargs"])
+
+
+def _process(frame):
+    """Integrate one frame in a worker process"""
+    ai, _, function, args, kwargs = _worker
+    return getattr(ai, function)(frame, *args, **kwargs)
+
+
+class ParallelIntegrator(object):
+    """Integration of many frames with a pool of processes sharing the
+    regrid-engine and the geometry arrays of an azimuthal integrator
+
+    The engine is built in the constructor, with the parameters used for all
+    frames. Each process receives the frames to integrate and sends back the
+    result, the sparse matrix and the geometry arrays are never copied.
+    """
+
+    def __init__(self, ai, npt, npt_azim=None, nproc=None, shape=None, mp_context=None, **kwargs):
+        """Constructor of the class
+
+        :param ai: AzimuthalIntegrator instance
+        :param npt: number of radial bins
+        :param npt_azim: number of azimuthal bins for 2D integration, None for 1D integration
+        :param nproc: number of processes, by default the number of cores
+        :param shape: shape of the frames, by default the one of the detector
+        :param mp_context: start method of the processes ("fork", "spawn"), None for the default one
+        :param kwargs: other parameters of `integrate1d_ng` or `integrate2d_ng`, like `unit` or `method`
+        """
+        shape = shape or ai.detector.shape
+        if shape is None:
+            raise ValueError("The shape of the frames is needed to build the engine")
+        if npt_azim is None:
+            self.function = "integrate1d_ng"
+            self.args = (npt,)
+        else:
+            self.function = "integrate2d_ng"
+            self.args = (npt, npt_azim)
+        self.kwargs = kwargs
+        self.nproc = nproc or os.cpu_count()
+        # Build the engine and the geometry arrays once
+        result = getattr(ai, self.function)(numpy.zeros(shape, dtype=numpy.float32), *self.args, **kwargs)
+        self.method = result.method
+
+        arrays = {}
+        engine = None
+        method = self.method
+        if method.algo_lower in ("csr", "lut"):
+            cython_method = IntegrationMethod.select_method(method.dimension, method.split_lower, method.algo_lower, "cython")[0]
+            cython_engine = ai.engines[cython_method]
+            metadata, engine_arrays = export_engine(cython_engine.engine)
+            arrays.update({"engine:" + name: array for name, array in engine_arrays.items()})
+            engine = (cython_method, cython_engine.key, metadata)
+        cached = []
+        names = {}  # id of the array -> name, arrays cached under several keys are shared once
+        for key, value in list(ai._cached_array.items()):
+            if isinstance(value, numpy.ndarray):
+                name = names.setdefault(id(value), f"geometry:{len(names)}")
+                arrays[name] = value
+                cached.append((key, "array", name))
+            elif isinstance(value, PolarizationArray):
+                name = names.setdefault(id(value.array), f"geometry:{len(names)}")
+                arrays[name] = value.array
+                cached.append((key, "polarization", (name, value.checksum)))
+            elif value is not None:
+                cached.append((key, "value", value))
+        self.shared = SharedArrays(arrays)
+
+        clone = copy.copy(ai)
+        clone._cached_array = CachedArrays(clone)
+        payload = pickle.dumps({"ai": clone,
+                                "shared": self.shared,
+                                "cached": cached,
+                                "engine": engine,
+                                "function": self.function,
+                                "args": self.args,
+                                "kwargs": kwargs})
+        context = multiprocessing.get_context(mp_context)
+        self._pool = context.Pool(self.nproc, initializer=_initialize, initargs=(payload,))
+        logger.info("ParallelIntegrator with %s processes sharing %s bytes", self.nproc, self.shared.nbytes)
+
+    def __repr__(self):
+        return f"ParallelIntegrator with {self.nproc} processes using {self.method}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def integrate(self, frames, chunksize=1):
+        """Integrate frames in the pool of processes
+
+        :param frames: iterable of 2D arrays, i.e. a 3D stack
+        :param chunksize: number of frames sent at once to a process
+        :return: list of Integrate1dResult or Integrate2dResult, in the order of the frames
+        """
+        if self._pool is None:
+            raise RuntimeError("ParallelIntegrator is closed")
+        return self._pool.map(_process, frames, chunksize)
+
+    def close(self):
+        """Stop the processes and release the shared memory"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
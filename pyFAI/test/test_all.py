@@ -64,6 +64,7 @@ from . import test_csr
 from . import test_blob_detection
 from . import test_io
 from . import test_io_image
+from . import test_io_chunk_reader
 from . import test_calibrant
 from . import test_polarization
 from . import test_split_pixel
@@ -92,6 +93,7 @@ from . import test_invert_geometry
 from . import test_massif
 from . import test_rectangle
 from . import test_parallax
+from . import test_parallel
 
 
 def suite():
@@ -122,6 +124,7 @@ def suite():
     testsuite.addTest(test_blob_detection.suite())
     testsuite.addTest(test_io.suite())
     testsuite.addTest(test_io_image.suite())
+    testsuite.addTest(test_io_chunk_reader.suite())
     testsuite.addTest(test_calibrant.suite())
     testsuite.addTest(test_polarization.suite())
     testsuite.addTest(test_split_pixel.suite())
@@ -147,6 +150,7 @@ def suite():
     testsuite.addTest(test_massif.suite())
     testsuite.addTest(test_rectangle.suite())
     testsuite.addTest(test_parallax.suite())
+    testsuite.addTest(test_parallel.suite())
     return testsuite
 
 
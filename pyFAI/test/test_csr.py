@@ -30,7 +30,11 @@
 FIXME : make some tests that the functions do what is expected
 """
 
+import os
+import copy
+import json
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 import numpy
 import logging
 from . import utilstest
@@ -42,6 +46,12 @@ from ..ext import splitBBoxCSR
 from ..engines.CSR_engine import CsrIntegrator2d, CsrIntegrator1d
 from ..method_registry import IntegrationMethod
 from .. import azimuthalIntegrator
+from .. import geometry
+from ..engines.sparse_cache import SparseCache
+from ..engines import EngineCache
+from ..utils import crc32
+from ..containers import SparseFrame
+from ..detectors import Detector
 if opencl.ocl:
     from ..opencl import azim_csr as ocl_azim_csr
 
@@ -214,6 +224,606 @@ class TestCSR(utilstest.ParametricTestCase):
         self.assertTrue(numpy.allclose(res_csr[4].T, res_scipy.normalization), "count is same as normalization")
         self.assertTrue(numpy.allclose(res_csr[3].T, res_scipy.signal), "sum_data is almost the same")
 
+    def test_stack(self):
+        """Integrating a stack of frames is the same as integrating each frame"""
+        self.ai.reset()
+        stack = numpy.array([self.data, 2 * self.data, self.data + 10])
+        norm = [1.0, 2.0, 3.0]
+        methods = [("bbox", "csr", "cython"),
+                   ("bbox", "csr", "python"),
+                   ("bbox", "histogram", "cython")]
+        for method in methods:
+            with self.subTest(method=method):
+                res = self.ai.integrate1d_ng(stack, self.N, unit="2th_deg", method=method,
+                                             error_model="poisson", normalization_factor=norm)
+                self.assertEqual(res.intensity.shape, (len(stack), self.N))
+                for i, frame in enumerate(stack):
+                    ref = self.ai.integrate1d_ng(frame, self.N, unit="2th_deg", method=method,
+                                                 error_model="poisson", normalization_factor=norm[i])
+                    self.assertTrue(numpy.allclose(ref.radial, res.radial), "radial matches")
+                    self.assertTrue(numpy.allclose(ref.intensity, res.intensity[i]), "intensity matches")
+                    self.assertTrue(numpy.allclose(ref.sigma, res.sigma[i]), "sigma matches")
+                    self.assertTrue(numpy.allclose(ref.count, res.count[i]), "count matches")
+
+        res = self.ai.integrate2d_ng(stack, 100, 36, unit="2th_deg", method=("bbox", "csr", "cython"))
+        self.assertEqual(res.intensity.shape, (len(stack), 36, 100))
+        for i, frame in enumerate(stack):
+            ref = self.ai.integrate2d_ng(frame, 100, 36, unit="2th_deg", method=("bbox", "csr", "cython"))
+            self.assertTrue(numpy.allclose(ref.intensity, res.intensity[i]), "2D intensity matches")
+            self.assertTrue(numpy.allclose(ref.sum_signal, res.sum_signal[i]), "2D signal matches")
+
+    def test_stack_blocks(self):
+        """Stacks are integrated in blocks of frames, the last one being partial"""
+        from ..engines.CSR_engine import CSRIntegrator
+        self.ai.reset()
+        stack = numpy.array([self.data, 2 * self.data, self.data + 10])
+        method = ("bbox", "csr", "python")
+        ref = self.ai.integrate1d_ng(stack, self.N, unit="2th_deg", method=method, error_model="azimuthal")
+        budget = CSRIntegrator.STACK_BUFFER_SIZE
+        try:
+            CSRIntegrator.STACK_BUFFER_SIZE = 2 * 16 * self.data.size
+            res = self.ai.integrate1d_ng(stack, self.N, unit="2th_deg", method=method, error_model="azimuthal")
+        finally:
+            CSRIntegrator.STACK_BUFFER_SIZE = budget
+        self.assertTrue(numpy.allclose(ref.intensity, res.intensity), "intensity matches")
+        self.assertTrue(numpy.allclose(ref.sigma, res.sigma), "sigma matches")
+
+    def test_fused_preproc(self):
+        """The on-the-fly preprocessing of the cython engine matches the preproc of the python engine"""
+        self.ai.reset()
+        shape = self.data.shape
+        rng = numpy.random.RandomState(seed=0)
+        dark = rng.uniform(0, 5, size=shape).astype(numpy.float32)
+        flat = rng.uniform(0.5, 1.5, size=shape).astype(numpy.float32)
+        flat[::17, ::19] = -1
+        mask = numpy.zeros(shape, dtype=numpy.int8)
+        mask[:, :10] = 1
+        data = self.data.astype(numpy.float32)
+        data[::23, ::29] = -1
+        kwargs = {"unit": "2th_deg", "dark": dark, "flat": flat, "mask": mask,
+                  "dummy":-1, "delta_dummy": 0.5, "polarization_factor": 0.9,
+                  "normalization_factor": 2.0}
+        for error_model in (None, "poisson", "azimuthal"):
+            with self.subTest(error_model=error_model):
+                ref = self.ai.integrate1d_ng(data, self.N, method=("bbox", "csr", "python"),
+                                             error_model=error_model, **kwargs)
+                res = self.ai.integrate1d_ng(data, self.N, method=("bbox", "csr", "cython"),
+                                             error_model=error_model, **kwargs)
+                self.assertTrue(numpy.allclose(ref.sum_signal, res.sum_signal, rtol=1e-5), "signal matches")
+                self.assertTrue(numpy.allclose(ref.sum_normalization, res.sum_normalization, rtol=1e-5), "normalization matches")
+                self.assertTrue(numpy.allclose(ref.count, res.count), "count matches")
+                self.assertTrue(numpy.allclose(ref.intensity, res.intensity, rtol=1e-5), "intensity matches")
+                if error_model == "poisson":
+                    # the python engine uses a different formula for the azimuthal error model
+                    self.assertTrue(numpy.allclose(ref.sigma, res.sigma, rtol=1e-4), "sigma matches")
+
+    def test_integer_input(self):
+        """Integer images are read natively and give the same result as float images"""
+        self.ai.reset()
+        method = ("bbox", "csr", "cython")
+        data = numpy.round(self.data).clip(0, 60000)
+        data[::23, ::29] = 65535
+        for dtype, dummy in ((numpy.uint16, 65535), (numpy.uint32, 65535), (numpy.int32, 65535),
+                             (numpy.int16, None), (numpy.uint8, None), (numpy.float64, 65535)):
+            with self.subTest(dtype=dtype):
+                raw = data.astype(dtype)
+                ref = self.ai.integrate1d_ng(raw.astype(numpy.float32), self.N, unit="2th_deg", method=method,
+                                             dummy=dummy, error_model="poisson")
+                res = self.ai.integrate1d_ng(raw, self.N, unit="2th_deg", method=method,
+                                             dummy=dummy, error_model="poisson")
+                self.assertTrue(numpy.allclose(ref.intensity, res.intensity), "intensity matches")
+                self.assertTrue(numpy.allclose(ref.sigma, res.sigma), "sigma matches")
+                self.assertTrue(numpy.allclose(ref.count, res.count), "count matches")
+
+        stack = numpy.array([data, data // 2]).astype(numpy.uint16)
+        res = self.ai.integrate1d_ng(stack, self.N, unit="2th_deg", method=method, dummy=65535)
+        for i, frame in enumerate(stack):
+            ref = self.ai.integrate1d_ng(frame.astype(numpy.float32), self.N, unit="2th_deg", method=method, dummy=65535)
+            self.assertTrue(numpy.allclose(ref.intensity, res.intensity[i]), "stack intensity matches")
+
+    def test_static_normalization(self):
+        """The precomputed static normalization gives the same result as the full preprocessing"""
+        self.ai.reset()
+        shape = self.data.shape
+        mask = numpy.zeros(shape, dtype=numpy.int8)
+        mask[:, :10] = 1
+        data = self.data.astype(numpy.float32)
+        data[::23, ::29] = -1
+        data[::31, ::37] = numpy.nan
+        dark = numpy.random.RandomState(seed=0).uniform(0, 5, size=shape).astype(numpy.float32)
+        solidangle = self.ai.solidAngleArray(shape)
+        polarization = self.ai.polarization(shape, 0.9)
+        for method in (("bbox", "csr", "cython"), ("bbox", "csr", "python")):
+            self.ai.integrate1d_ng(data, self.N, unit="2th_deg", method=method, mask=mask)
+            integr = self.ai.engines[IntegrationMethod.select_one_available(method, dim=1)].engine
+            for kwargs in ({}, {"dummy":-1, "delta_dummy": 0.5},
+                           {"dark": dark, "dummy":-1, "poissonian": True}):
+                with self.subTest(method=method, kwargs=kwargs):
+                    integr.reset_static_normalization()
+                    ref = integr.integrate_ng(data, solidangle=solidangle, polarization=polarization,
+                                              normalization_factor=2.0, **kwargs)
+                    integr.set_static_normalization(solidangle=solidangle, polarization=polarization)
+                    self.assertEqual(integr.static_checksum, (crc32(solidangle), crc32(polarization), None))
+                    res = integr.integrate_ng(data, solidangle=solidangle.copy(), polarization=polarization,
+                                              normalization_factor=2.0, **kwargs)
+                    self.assertTrue(numpy.allclose(ref.signal, res.signal), "signal matches")
+                    self.assertTrue(numpy.allclose(ref.normalization, res.normalization, rtol=1e-5), "normalization matches")
+                    self.assertTrue(numpy.allclose(ref.count, res.count), "count matches")
+                    self.assertTrue(numpy.allclose(ref.intensity, res.intensity, rtol=1e-5), "intensity matches")
+                    if kwargs.get("poissonian"):
+                        self.assertTrue(numpy.allclose(ref.sigma, res.sigma, rtol=1e-5), "sigma matches")
+            integr.reset_static_normalization()
+
+    def test_static_normalization_option(self):
+        """The static normalization is an engine option, set up with the engine"""
+        self.ai.reset()
+        self.ai.engine_cache_size = 1 << 30
+        try:
+            for dim, method in ((1, ("bbox", "csr", "cython")), (1, ("bbox", "csr", "python")),
+                                (2, ("bbox", "csr", "cython"))):
+                refs = {}
+                self.ai.engine_options = {}
+                for correct in (True, False):
+                    if dim == 1:
+                        res = self.ai.integrate1d_ng(self.data, self.N, unit="2th_deg", method=method,
+                                                     correctSolidAngle=correct, polarization_factor=0.9)
+                    else:
+                        res = self.ai.integrate2d_ng(self.data, 100, 36, unit="2th_deg", method=method,
+                                                     correctSolidAngle=correct, polarization_factor=0.9)
+                    refs[correct] = res
+                    self.assertIsNone(self.ai.engines[res.method].engine.static_checksum, "not enabled by default")
+                self.ai.engine_options = {"static_normalization": True}
+                engines = {}
+                for correct in (True, False, True, False):
+                    with self.subTest(dim=dim, method=method, correctSolidAngle=correct):
+                        if dim == 1:
+                            res = self.ai.integrate1d_ng(self.data, self.N, unit="2th_deg", method=method,
+                                                         correctSolidAngle=correct, polarization_factor=0.9)
+                        else:
+                            res = self.ai.integrate2d_ng(self.data, 100, 36, unit="2th_deg", method=method,
+                                                         correctSolidAngle=correct, polarization_factor=0.9)
+                        integr = self.ai.engines[res.method].engine
+                        checksum = integr.static_checksum
+                        self.assertIsNotNone(checksum)
+                        self.assertEqual(checksum[0] is None, not correct, "solid-angle part of the configuration")
+                        if method[2] == "cython":
+                            # Alternating settings reuses the engines set up previously
+                            self.assertIs(engines.setdefault(correct, integr), integr, "engine reused")
+                        self.assertTrue(numpy.allclose(refs[correct].intensity, res.intensity, rtol=1e-5), "intensity matches")
+                        self.assertTrue(numpy.allclose(refs[correct].count, res.count), "count matches")
+        finally:
+            self.ai.engine_options = {}
+            self.ai.engine_cache_size = 0
+        with self.assertRaises(ValueError):
+            self.ai.engine_options = {"unknown": True}
+
+    def test_valid_pixels(self):
+        """Masked pixels are not part of the matrix, the gather index excludes them"""
+        self.ai.reset()
+        mask = numpy.zeros(self.data.shape, dtype=numpy.int8)
+        mask[:, :50] = 1
+        results = {}
+        for impl in ("cython", "python"):
+            method = ("bbox", "csr", impl)
+            res = self.ai.integrate1d_ng(self.data, self.N, unit="2th_deg", method=method,
+                                         mask=mask, error_model="azimuthal")
+            integr = self.ai.engines[res.method].engine
+            valid = integr.valid_pixels
+            self.assertFalse(mask.ravel()[valid].any(), "no masked pixel in gather index")
+            self.assertTrue(numpy.all(numpy.diff(valid) > 0), "gather index is sorted")
+            results[impl] = res
+        self.assertTrue(numpy.allclose(results["cython"].intensity, results["python"].intensity, rtol=1e-5), "intensity matches")
+        self.assertTrue(numpy.allclose(results["cython"].count, results["python"].count), "count matches")
+
+        res = self.ai.integrate2d_ng(self.data, 100, 36, unit="2th_deg", method=("bbox", "csr", "cython"),
+                                     mask=mask, correctSolidAngle=False, error_model="poisson")
+        engine = self.ai.engines[res.method].engine
+        scipy_engine = CsrIntegrator2d(self.data.size,
+                                       lut=(engine.data, engine.indices, engine.indptr),
+                                       empty=0.0,
+                                       bin_centers0=engine.bin_centers0,
+                                       bin_centers1=engine.bin_centers1)
+        self.assertTrue(numpy.array_equal(engine.valid_pixels, scipy_engine.valid_pixels), "same gather index")
+        res_scipy = scipy_engine.integrate(self.data, poissonian=True)
+        self.assertTrue(numpy.allclose(res.intensity, res_scipy.intensity.T, rtol=1e-5), "2D intensity matches")
+        self.assertTrue(numpy.allclose(res.count, res_scipy.count.T), "2D count matches")
+
+    def test_compact(self):
+        """Compact storage of the matrix gives the same result within the quantization error"""
+        self.ai.reset()
+        # Only a few lines are valid: increments between indices exceed 16 bits
+        mask = numpy.ones(self.data.shape, dtype=numpy.int8)
+        mask[::200] = 0
+        stack = numpy.array([self.data, 2 * self.data])
+        for dim, split in ((1, "full"), (2, "bbox")):
+            with self.subTest(dim=dim, split=split):
+                method = (split, "csr", "cython")
+                if dim == 1:
+                    ref = self.ai.integrate1d_ng(self.data, 100, unit="2th_deg", method=method,
+                                                 mask=mask, error_model="poisson")
+                else:
+                    ref = self.ai.integrate2d_ng(self.data, 100, 36, unit="2th_deg", method=method,
+                                                 mask=mask, error_model="poisson")
+                integr = self.ai.engines[ref.method].engine
+                solidangle = self.ai.solidAngleArray(self.data.shape)
+                ref = integr.integrate_ng(self.data, poissonian=True, solidangle=solidangle)
+                ref_stack = integr.integrate_ng_stack(stack, solidangle=solidangle)
+                integr.set_compact()
+                self.assertTrue(integr.compact)
+                if dim == 1:
+                    self.assertGreater(integr.compact_nnz, integr.nnz, "padding entries used")
+                res = integr.integrate_ng(self.data, poissonian=True, solidangle=solidangle)
+                res_stack = integr.integrate_ng_stack(stack, solidangle=solidangle)
+                integr.set_compact(False)
+                self.assertFalse(integr.compact)
+                bound = integr.compact_scale / 2
+                self.assertTrue(numpy.allclose(ref.count, res.count, atol=integr.nnz * bound), "count matches")
+                # the relative error is large on bins made of small coefficients only
+                valid = ref.count > 0.5
+                self.assertTrue(numpy.allclose(ref.intensity[valid], res.intensity[valid], rtol=1e-4), "intensity matches")
+                self.assertTrue(numpy.allclose(ref.sigma[valid], res.sigma[valid], rtol=1e-4), "sigma matches")
+                self.assertTrue(numpy.allclose(ref_stack.intensity[:, valid], res_stack.intensity[:, valid], rtol=1e-4), "stack matches")
+
+    def test_compact_option(self):
+        """The compact storage is an engine option of the Cython engines"""
+        self.ai.reset()
+        self.ai.engine_cache_size = 1 << 30
+        method = ("bbox", "csr", "cython")
+        try:
+            ref = self.ai.integrate1d_ng(self.data, self.N, unit="2th_deg", method=method)
+            engine = self.ai.engines[ref.method].engine
+            self.assertFalse(engine.compact, "not enabled by default")
+            self.ai.engine_options = {"compact": True}
+            res = self.ai.integrate1d_ng(self.data, self.N, unit="2th_deg", method=method)
+            compact = self.ai.engines[res.method].engine
+            self.assertTrue(compact.compact)
+            self.assertFalse(engine.compact, "published engine unchanged")
+            self.assertGreater(compact.nbytes, engine.nbytes, "compact storage is counted")
+            valid = ref.count > 0.5
+            self.assertTrue(numpy.allclose(ref.intensity[valid], res.intensity[valid], rtol=1e-4), "intensity matches")
+            python = IntegrationMethod.select_one_available(("bbox", "csr", "python"), dim=1)
+            self.assertEqual(self.ai._get_engine_options(python), (), "Python engines have no compact storage")
+            self.ai.engine_options = {}
+            res = self.ai.integrate1d_ng(self.data, self.N, unit="2th_deg", method=method)
+            self.assertIs(self.ai.engines[res.method].engine, engine, "engine retrieved from the cache")
+            self.assertTrue(numpy.array_equal(ref.intensity, res.intensity))
+        finally:
+            self.ai.engine_options = {}
+            self.ai.engine_cache_size = 0
+
+    def test_update_mask(self):
+        """Masking more pixels edits the matrix instead of rebuilding it"""
+        self.ai.reset()
+        mask = numpy.zeros(self.data.shape, dtype=numpy.int8)
+        mask[:, :50] = 1
+        new_mask = mask.copy()
+        new_mask[100:150, 100:200] = 1
+        for split in ("bbox", "full"):
+            with self.subTest(split=split):
+                method = (split, "csr", "cython")
+                self.ai.reset()
+                res = self.ai.integrate1d_ng(self.data, self.N, unit="2th_deg", method=method, mask=mask)
+                previous = self.ai.engines[res.method].engine
+                bin_centers = previous.bin_centers.copy()
+                res = self.ai.integrate1d_ng(self.data, self.N, unit="2th_deg", method=method, mask=new_mask)
+                integr = self.ai.engines[res.method].engine
+                self.assertIsNot(integr, previous, "engine in use is not modified but copied")
+                self.assertIs(integr.bin_centers, previous.bin_centers, "engine not rebuilt")
+                self.assertEqual(previous.mask_checksum, crc32(mask), "previous engine unchanged")
+                self.assertTrue(numpy.array_equal(integr.bin_centers, bin_centers), "bins unchanged")
+                self.assertFalse(new_mask.ravel()[integr.indices].any(), "masked pixels removed")
+                self.assertEqual(integr.mask_checksum, crc32(new_mask))
+                # Same matrix as the one built directly with the new mask on the same range
+                ref = self.ai.setup_CSR(self.data.shape, self.N, new_mask, unit="2th_deg", split=split, scale=False,
+                                        pos0_range=(integr.pos0_min, integr.pos0_maxin))
+                self.assertTrue(numpy.array_equal(integr.indptr, ref.indptr), "indptr matches")
+                self.assertTrue(numpy.array_equal(integr.indices, ref.indices), "indices matches")
+                self.assertTrue(numpy.allclose(integr.data, ref.data, atol=1e-6), "data matches")
+                # Pixels which are unmasked again need a new matrix
+                self.assertFalse(integr.update_mask(mask))
+                res = self.ai.integrate1d_ng(self.data, self.N, unit="2th_deg", method=method, mask=mask)
+                self.assertIsNot(self.ai.engines[res.method].engine, integr, "engine rebuilt")
+
+    def test_wavelength(self):
+        """Engines are kept or rescaled when only the wavelength changes"""
+        ai = azimuthalIntegrator.AzimuthalIntegrator()
+        ai.setPyFAI(**self.ai.getPyFAI())
+        wavelength = ai.wavelength
+        for unit, method in (("2th_deg", ("bbox", "csr", "cython")),
+                             ("q_nm^-1", ("full", "csr", "cython")),
+                             ("q_nm^-1", ("bbox", "lut", "cython"))):
+            with self.subTest(unit=unit, method=method):
+                ai.wavelength = wavelength
+                res = ai.integrate1d_ng(self.data, self.N, unit=unit, method=method)
+                previous = ai.engines[res.method].engine
+                ai.wavelength = 1.1 * wavelength
+                res = ai.integrate1d_ng(self.data, self.N, unit=unit, method=method)
+                integr = ai.engines[res.method].engine
+                if unit.startswith("2th"):
+                    self.assertIs(integr, previous, "engine kept")
+                else:
+                    self.assertIsNot(integr, previous, "engine in use is not modified but copied")
+                    sparse = "data" if method[1] == "csr" else "_lut"
+                    self.assertTrue(numpy.shares_memory(numpy.asarray(getattr(integr, sparse)),
+                                                        numpy.asarray(getattr(previous, sparse))),
+                                    "engine not rebuilt")
+                    self.assertTrue(numpy.allclose(integr.bin_centers * 1.1, previous.bin_centers), "bins rescaled")
+                ref_ai = azimuthalIntegrator.AzimuthalIntegrator()
+                ref_ai.setPyFAI(**ai.getPyFAI())
+                ref = ref_ai.integrate1d_ng(self.data, self.N, unit=unit, method=method)
+                self.assertTrue(numpy.allclose(res.radial, ref.radial, rtol=1e-6), "radial matches")
+                self.assertTrue(numpy.allclose(res.intensity, ref.intensity, rtol=1e-3), "intensity matches")
+        # With a radial range, the pixels are assigned to other bins
+        res = ai.integrate1d_ng(self.data, self.N, unit="q_nm^-1", radial_range=(1, 20))
+        previous = ai.engines[res.method].engine
+        ai.wavelength = wavelength
+        res = ai.integrate1d_ng(self.data, self.N, unit="q_nm^-1", radial_range=(1, 20))
+        self.assertFalse(numpy.shares_memory(ai.engines[res.method].engine.data, previous.data), "engine rebuilt")
+
+    def test_integrate_sparse(self):
+        """SparseFrame are integrated like the densified image"""
+        self.ai.reset()
+        shape = self.data.shape
+        res = self.ai.integrate1d_ng(self.data, 500, unit="r_mm", method=("bbox", "csr", "cython"))
+        engine = self.ai.engines[res.method].engine
+        integr = CsrIntegrator1d(self.data.size, lut=engine.lut, empty=0.0, bin_centers=engine.bin_centers)
+        radius2d = self.ai.array_from_unit(shape, "center", "r_mm", scale=True).astype(numpy.float32)
+        radius2d[:20] = numpy.nan
+        valid = numpy.where(numpy.isfinite(radius2d.ravel()))[0]
+        index = numpy.sort(numpy.random.choice(valid, 2000, replace=False)).astype(numpy.int32)
+        sparse = SparseFrame(index, (numpy.random.random(index.size) * 1000).astype(numpy.float32))
+        sparse._shape = shape
+        sparse._dtype = numpy.dtype(numpy.float32)
+        sparse._mask = radius2d
+        sparse._radius = numpy.linspace(numpy.nanmin(radius2d), numpy.nanmax(radius2d), 300)
+        sparse._background_avg = (10 + 5 * numpy.cos(sparse._radius)).astype(numpy.float32)
+        # densified image, as provided by pyFAI.opencl.peak_finder.densify
+        dense = numpy.interp(radius2d, sparse.radius, sparse.background_avg)
+        dense.ravel()[index] = sparse.intensity
+        dense = dense.astype(numpy.float32)
+        solidangle = self.ai.solidAngleArray(shape)
+        ref = integr.integrate(dense, poissonian=True, solidangle=solidangle)
+        self.assertRaises(ValueError, integr.integrate_sparse, sparse, solidangle=solidangle)
+        integr.set_static_normalization(solidangle=solidangle)
+        res = integr.integrate_sparse(sparse, poissonian=True, solidangle=solidangle)
+        for what in ("intensity", "sigma", "signal", "normalization", "count"):
+            self.assertTrue(numpy.allclose(getattr(ref, what), getattr(res, what), rtol=1e-5), f"{what} matches")
+        background = integr._sparse_background
+        other = SparseFrame(sparse.index, sparse.intensity)
+        other._shape = shape
+        other._mask = radius2d.copy()
+        other._radius = sparse.radius.copy()
+        other._background_avg = sparse.background_avg
+        integr.integrate_sparse(other, solidangle=solidangle)
+        self.assertIs(integr._sparse_background, background, "background matrices reused for the same map")
+
+        # Through the azimuthal integrator
+        method = ("bbox", "csr", "python")
+        ref = self.ai.integrate1d_ng(dense, 500, unit="r_mm", method=method, error_model="poisson")
+        res = self.ai.integrate1d_sparse(sparse, 500, unit="r_mm", method=method, error_model="poisson")
+        self.assertEqual(res.method_called, "integrate1d_sparse")
+        for what in ("radial", "intensity", "sigma", "sum_signal", "sum_normalization", "count"):
+            self.assertTrue(numpy.allclose(getattr(ref, what), getattr(res, what), rtol=1e-5), f"{what} matches")
+        engine = self.ai.engines[res.method].engine
+        res = self.ai.integrate1d_sparse(sparse, 500, unit="r_mm", method=method)
+        self.assertIs(self.ai.engines[res.method].engine, engine, "engine reused")
+
+    def test_engine_cache(self):
+        """Alternating configurations reuses the engines kept in the cache"""
+        self.ai.reset()
+        self.ai.engine_cache_size = 1 << 30
+        method = ("bbox", "csr", "cython")
+        try:
+            ref = self.ai.integrate1d_ng(self.data, self.N, unit="2th_deg", method=method)
+            engine = self.ai.engines[ref.method].engine
+            res = self.ai.integrate1d_ng(self.data, self.N, unit="q_nm^-1", method=method)
+            self.assertIsNot(self.ai.engines[res.method].engine, engine)
+            res = self.ai.integrate1d_ng(self.data, self.N, unit="2th_deg", method=method)
+            self.assertIs(self.ai.engines[res.method].engine, engine, "engine reused")
+            self.assertTrue(numpy.array_equal(ref.intensity, res.intensity))
+            self.assertEqual(len(self.ai._engine_cache), 1, "q engine is cached")
+            self.ai.reset_engines()
+            self.assertEqual(len(self.ai._engine_cache), 0, "reset empties the cache")
+        finally:
+            self.ai.engine_cache_size = 0
+
+        class FakeEngine:
+            def __init__(self, nbytes):
+                self.lut_nbytes = nbytes
+
+        cache = EngineCache(max_size=100)
+        engines = [FakeEngine(40) for i in range(4)]
+        cache.put("a", engines[0])
+        cache.put("b", engines[1])
+        self.assertIs(cache.pop("a"), engines[0])
+        cache.put("a", engines[0])
+        cache.put("c", engines[2])  # evicts b, the least recently used
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.nbytes, 80)
+        cache.put("d", FakeEngine(200))  # larger than the budget
+        self.assertNotIn("d", cache)
+        self.assertIsNone(cache.pop("b"))
+
+    def test_engine_nbytes(self):
+        """The memory of a CSR engine includes the static normalization and the compact storage"""
+        self.ai.reset()
+        solidangle = self.ai.solidAngleArray(self.data.shape)
+        for impl in ("cython", "python"):
+            with self.subTest(impl=impl):
+                res = self.ai.integrate1d_ng(self.data, self.N, unit="2th_deg", method=("bbox", "csr", impl))
+                integr = copy.copy(self.ai.engines[res.method].engine)
+                matrix = integr.data.nbytes + integr.indices.nbytes + integr.indptr.nbytes
+                nbytes = integr.nbytes
+                self.assertGreaterEqual(nbytes, matrix)
+                integr.set_static_normalization(solidangle=solidangle)
+                self.assertGreaterEqual(integr.nbytes, nbytes + 4 * self.data.size, "per-pixel normalization")
+                self.assertLess(integr.nbytes, nbytes + integr.data.nbytes, "matrix not duplicated")
+                if impl == "cython":
+                    nbytes = integr.nbytes
+                    integr.set_compact()
+                    self.assertGreaterEqual(integr.nbytes, nbytes + 4 * integr.nnz, "compact storage")
+                self.assertEqual(EngineCache.get_nbytes(integr), integr.nbytes)
+
+    def test_concurrent_integration(self):
+        """Threads share the engine without lock once it is built"""
+        self.ai.reset()
+        method = ("bbox", "csr", "cython")
+        ref = self.ai.integrate1d_ng(self.data, self.N, unit="2th_deg", method=method)
+        engine = self.ai.engines[ref.method]
+        integr = engine.engine
+
+        def integrate(data):
+            return self.ai.integrate1d_ng(data, self.N, unit="2th_deg", method=method)
+
+        pool = ThreadPoolExecutor(4)
+        try:
+            with engine.lock:  # would block any integration taking the lock
+                futures = [pool.submit(integrate, self.data) for i in range(8)]
+                results = [future.result(timeout=60) for future in futures]
+        finally:
+            pool.shutdown()
+        for res in results:
+            self.assertTrue(numpy.array_equal(ref.intensity, res.intensity))
+        self.assertIs(engine.engine, integr, "engine not rebuilt")
+
+    def test_sigma_clip_engine(self):
+        """The engine built by sigma_clip_ng is used without lock by integrate1d_ng"""
+        self.ai.reset()
+        method = ("bbox", "csr", "cython")
+        self.ai.sigma_clip_ng(self.data, self.N, unit="2th_deg", method=method, error_model="poisson")
+        engine = self.ai.engines[IntegrationMethod.select_one_available(method, dim=1)]
+        integr = engine.engine
+        pool = ThreadPoolExecutor(1)
+        try:
+            with engine.lock:  # would block any integration taking the lock
+                res = pool.submit(self.ai.integrate1d_ng, self.data, self.N,
+                                  unit="2th_deg", method=method).result(timeout=60)
+        finally:
+            pool.shutdown()
+        self.assertIs(engine.engine, integr, "engine not rebuilt")
+        self.assertEqual(res.count.sum(), integr.integrate_ng(self.data).count.sum())
+
+    def test_sparse_cache(self):
+        """Sparse matrices stored on disk are reloaded identical"""
+        cache = SparseCache(os.path.join(UtilsTest.tempdir, "sparse_cache"))
+        cache.clear()
+        ai = azimuthalIntegrator.AzimuthalIntegrator()
+        ai.set_config(self.ai.get_config())
+        ai.sparse_cache = cache
+        mask = numpy.zeros(self.data.shape, dtype=numpy.int8)
+        mask[:10] = 1
+        for method, npt in (("csr", self.N), ("full_csr", self.N), ("lut", self.N), ("csr", (100, 36))):
+            with self.subTest(method=method, npt=npt):
+                if isinstance(npt, tuple):
+                    integrate = lambda: ai.integrate2d_ng(self.data, *npt, unit="2th_deg", method=method, mask=mask)
+                else:
+                    integrate = lambda: ai.integrate1d_ng(self.data, npt, unit="2th_deg", method=method, mask=mask)
+                ai.reset()
+                nentries = len(os.listdir(cache.directory))
+                ref = integrate()
+                self.assertEqual(len(os.listdir(cache.directory)), nentries + 1, "matrix was stored")
+                ai.reset()
+                obt = integrate()
+                self.assertEqual(len(os.listdir(cache.directory)), nentries + 1, "matrix was reused")
+                self.assertTrue(numpy.allclose(ref.intensity, obt.intensity), "intensity matches")
+                self.assertTrue(numpy.allclose(ref.radial, obt.radial), "radial matches")
+                # Second call with the reloaded engine does not reset it
+                engine = ai.engines[obt.method].engine
+                integrate()
+                self.assertIs(engine, ai.engines[obt.method].engine, "engine was not rebuilt")
+        cache.clear()
+
+    def test_sparse_cache_untrusted(self):
+        """Entries of the cache are not unpickled and only rebuild pyFAI integrators"""
+        cache = SparseCache(os.path.join(UtilsTest.tempdir, "sparse_cache_untrusted"))
+        cache.clear()
+        ai = azimuthalIntegrator.AzimuthalIntegrator()
+        ai.set_config(self.ai.get_config())
+        ai.sparse_cache = cache
+        res = ai.integrate2d_ng(self.data, 100, 36, unit="2th_deg", method="csr")
+        entries = os.listdir(cache.directory)
+        self.assertEqual(len(entries), 1)
+        path = cache.get_path(entries[0])
+        self.assertIn("metadata.json", os.listdir(path))
+        self.assertFalse([i for i in os.listdir(path) if i.endswith(".pickle")], "nothing pickled")
+        engine = cache.load(entries[0])
+        self.assertEqual(engine.bins, ai.engines[res.method].engine.bins, "tuples are restored")
+
+        metadata_file = os.path.join(path, "metadata.json")
+        with open(metadata_file) as f:
+            metadata = json.load(f)
+        metadata["module"] = "os"
+        with open(metadata_file, "w") as f:
+            json.dump(metadata, f)
+        with utilstest.TestLogging(logger="pyFAI.engines.sparse_cache", warning=1):
+            self.assertIsNone(cache.load(entries[0]), "foreign module refused")
+        cache.clear()
+
+    def test_sparse_cache_dtype(self):
+        """Geometries computed in float32 and float64 do not share matrices"""
+        cache = SparseCache(os.path.join(UtilsTest.tempdir, "sparse_cache_dtype"))
+        cache.clear()
+        results = {}
+        for dtype in (numpy.float64, numpy.float32):
+            ai = azimuthalIntegrator.AzimuthalIntegrator()
+            ai.set_config(self.ai.get_config())
+            ai.array_dtype = dtype
+            ai.sparse_cache = cache
+            results[dtype] = ai.integrate1d_ng(self.data, self.N, unit="2th_deg", method="csr")
+            ref = azimuthalIntegrator.AzimuthalIntegrator()
+            ref.set_config(self.ai.get_config())
+            ref.array_dtype = dtype
+            expected = ref.integrate1d_ng(self.data, self.N, unit="2th_deg", method="csr")
+            self.assertTrue(numpy.allclose(results[dtype].intensity, expected.intensity), "intensity matches")
+        self.assertEqual(len(os.listdir(cache.directory)), 2, "one matrix per dtype")
+        cache.clear()
+
+    def test_sparse_cache_spline(self):
+        """A spline file edited in place changes the key of the matrices"""
+        ai = azimuthalIntegrator.AzimuthalIntegrator(detector=Detector(1e-4, 1e-4, max_shape=self.data.shape))
+        filename = os.path.join(UtilsTest.tempdir, "sparse_cache.spline")
+        with open(filename, "w") as f:
+            f.write("first version")
+        # Only the file is hashed, it does not need to be a valid spline here
+        ai.detector._splineFile = filename
+        get_key = lambda: SparseCache.get_key(ai, "csr", self.data.shape, self.N)
+        key = get_key()
+        self.assertEqual(key, get_key(), "key is stable")
+        with open(filename, "w") as f:
+            f.write("second version")
+        self.assertNotEqual(key, get_key(), "key depends on the content of the spline")
+        os.unlink(filename)
+
+    def test_tiled_setup(self):
+        """Sparse matrices built tile by tile are identical"""
+        ref_ai = azimuthalIntegrator.AzimuthalIntegrator()
+        ref_ai.set_config(self.ai.get_config())
+        ai = azimuthalIntegrator.AzimuthalIntegrator()
+        ai.set_config(self.ai.get_config())
+        ai.TILED_SETUP_SIZE = 1000
+        mask = numpy.zeros(self.data.shape, dtype=numpy.int8)
+        mask[:10] = 1
+        tile_size = geometry.CORNER_TILE_SIZE
+        geometry.CORNER_TILE_SIZE = 10000
+        self.addCleanup(setattr, geometry, "CORNER_TILE_SIZE", tile_size)
+        for npt, unit, radial_range in ((self.N, "q_nm^-1", None), (self.N, "r_mm", (10, 50)), ((100, 36), "2th_deg", None)):
+            with self.subTest(npt=npt, unit=unit, radial_range=radial_range):
+                ai.reset()
+                tiles = ai._get_corners(self.data.shape, unit)
+                self.assertGreater(len(tiles), 1, "several tiles")
+                if isinstance(npt, tuple):
+                    ref = ref_ai.integrate2d_ng(self.data, *npt, unit=unit, method=("full", "csr", "cython"), mask=mask)
+                    obt = ai.integrate2d_ng(self.data, *npt, unit=unit, method=("full", "csr", "cython"), mask=mask)
+                else:
+                    ref = ref_ai.integrate1d_ng(self.data, npt, unit=unit, method=("full", "csr", "cython"),
+                                                mask=mask, radial_range=radial_range)
+                    obt = ai.integrate1d_ng(self.data, npt, unit=unit, method=("full", "csr", "cython"),
+                                            mask=mask, radial_range=radial_range)
+                self.assertIsNone(ai._cached_array.get(unit.split("_")[0] + "_corner"), "corners not cached")
+                for ref_array, obt_array in zip(ref_ai.engines[ref.method].engine.lut, ai.engines[obt.method].engine.lut):
+                    self.assertTrue(numpy.array_equal(ref_array, obt_array), "same sparse matrix")
+                self.assertTrue(numpy.array_equal(ref.intensity, obt.intensity), "intensity matches")
+
 
 def suite():
     testsuite = unittest.TestSuite()
@@ -532,10 +532,167 @@ class TestBug474(unittest.TestCase):
         self.assertLess(delta, 1e-5, "error on position is %s" % delta)
 
 
+class TestWavelength(unittest.TestCase):
+    """Test the selective invalidation of the cached arrays"""
+
+    def test_set_wavelength(self):
+        detector = detector_factory("Pilatus100k")
+        geo = geometry.Geometry(0.1, 0.02, 0.03, detector=detector, wavelength=1e-10)
+        tth = geo.twoThetaArray()
+        chi = geo.chiArray()
+        solid_angle = geo.solidAngleArray()
+        geo.qArray()
+        geo.corner_array(unit=units.Q, scale=False)
+        geo.center_array(unit="log(q.nm)_None", scale=False)
+        geo.wavelength = 1.5e-10
+        self.assertIs(geo.twoThetaArray(), tth, "2theta kept")
+        self.assertIs(geo.chiArray(), chi, "chi kept")
+        self.assertIs(geo.solidAngleArray(), solid_angle, "solid angle kept")
+        self.assertIsNone(dict.get(geo._cached_array, "log(q.nm)_center"), "log(q) dropped")
+
+        ref = geometry.Geometry(0.1, 0.02, 0.03, detector=detector, wavelength=1.5e-10)
+        self.assertTrue(numpy.allclose(geo.qArray(), ref.qArray(), rtol=1e-5), "q rescaled")
+        self.assertTrue(numpy.allclose(geo.rd2Array(), ref.rd2Array(), rtol=1e-5), "d*2 derived")
+        self.assertTrue(numpy.allclose(geo.corner_array(unit=units.Q, scale=False),
+                                       ref.corner_array(unit=units.Q, scale=False), rtol=1e-5), "q corners rescaled")
+        self.assertTrue(numpy.allclose(geo.center_array(unit="log(q.nm)_None", scale=False),
+                                       ref.center_array(unit="log(q.nm)_None", scale=False), rtol=1e-5), "log(q) recalculated")
+
+    def test_from_2th(self):
+        detector = detector_factory("Pilatus100k")
+        geo = geometry.Geometry(0.1, 0.02, 0.03, detector=detector, wavelength=1e-10)
+        ref = geometry.Geometry(0.1, 0.02, 0.03, detector=detector, wavelength=1e-10)
+        geo.twoThetaArray()
+        geo.corner_array(unit=units.TTH_RAD, scale=False)
+        self.assertTrue(numpy.allclose(geo.qArray(), ref.qArray(), rtol=1e-5), "q from 2theta")
+        for unit in (units.Q, units.RecD2_NM):
+            self.assertTrue(numpy.allclose(geo.corner_array(unit=unit, scale=False)[..., 0],
+                                           ref.corner_array(unit=unit, scale=False)[..., 0], rtol=1e-5), unit)
+
+
+class TestArrayDtype(unittest.TestCase):
+    """Test the geometry arrays calculated in single precision"""
+
+    def test_float32(self):
+        detector = detector_factory("Pilatus100k")
+        ref = AzimuthalIntegrator(0.1, 0.02, 0.03, 0.1, 0.2, detector=detector, wavelength=1e-10)
+        geo = AzimuthalIntegrator(0.1, 0.02, 0.03, 0.1, 0.2, detector=detector, wavelength=1e-10)
+        geo.array_dtype = numpy.float32
+        self.assertRaises(ValueError, setattr, geo, "array_dtype", numpy.int32)
+
+        pos = geo.position_array(corners=True)
+        self.assertEqual(pos.dtype, numpy.float32)
+        self.assertTrue(numpy.allclose(pos, ref.position_array(corners=True), atol=1e-7), "positions")
+        self.assertEqual(ref.position_array(dtype=numpy.float32).dtype, numpy.float32, "explicit dtype")
+        for unit in (units.R_MM, units.Q):
+            center = geo.center_array(unit=unit, scale=False)
+            self.assertEqual(center.dtype, numpy.float32, unit)
+            self.assertTrue(numpy.allclose(center, ref.center_array(unit=unit, scale=False), rtol=1e-6), unit)
+            self.assertTrue(numpy.allclose(geo.corner_array(unit=unit, scale=False),
+                                           ref.corner_array(unit=unit, scale=False), rtol=1e-6), unit)
+        for array, expected in ((geo.twoThetaArray(), ref.twoThetaArray()),
+                                (geo.chiArray(), ref.chiArray()),
+                                (geo.deltaChi(), ref.deltaChi())):
+            self.assertEqual(array.dtype, numpy.float32)
+            self.assertTrue(numpy.allclose(array, expected, atol=1e-6))
+
+        img = numpy.random.RandomState(0).uniform(0, 100, size=detector.shape)
+        for method, name in ((("bbox", "csr", "cython"), "cpos0"), (("full", "csr", "cython"), "pos")):
+            res = geo.integrate1d_ng(img, 100, unit=units.Q, method=method)
+            self.assertEqual(getattr(geo.engines[res.method].engine, name).dtype, numpy.float32, "positions not copied")
+            expected = ref.integrate1d_ng(img, 100, unit=units.Q, method=method)
+            self.assertTrue(numpy.allclose(res.radial, expected.radial, rtol=1e-6), method)
+            self.assertTrue(numpy.allclose(res.intensity, expected.intensity, rtol=1e-4), method)
+
+
+class TestBatch(unittest.TestCase):
+    """Test the evaluation of many geometries at once"""
+
+    def test_calc_batch(self):
+        detector = detector_factory("Pilatus100k")
+        geo = geometry.Geometry(detector=detector, wavelength=1e-10)
+        rng = numpy.random.RandomState(0)
+        params = numpy.array([[0.1 + 0.01 * i, 0.02, 0.03, 0.01 * i, -0.02, 0.03 * i] for i in range(5)])
+        d1 = rng.uniform(0, detector.shape[0], 50)
+        d2 = rng.uniform(0, detector.shape[1], 50)
+        group = numpy.arange(50) % len(params)
+        for space, function in (("2th", "tth"), ("chi", "chi"), ("q", "qFunction"), ("r", "rFunction")):
+            expected = numpy.array([getattr(geometry.Geometry(*param, detector=detector, wavelength=1e-10), function)(d1, d2)
+                                    for param in params])
+            for path in ("cython", "numpy"):
+                res = geo.calc_batch(params, d1, d2, space, path=path)
+                self.assertEqual(res.shape, (len(params), d1.size))
+                self.assertTrue(numpy.allclose(res, expected), (space, path))
+                res = geo.calc_batch(params, d1, d2, space, group=group, path=path)
+                self.assertTrue(numpy.allclose(res, expected[group, numpy.arange(d1.size)]), (space, path, "group"))
+        params7 = numpy.hstack((params, numpy.full((len(params), 1), 2e-10)))
+        for path in ("cython", "numpy"):
+            self.assertTrue(numpy.allclose(2 * geo.calc_batch(params7, d1, d2, "q", path=path),
+                                           geo.calc_batch(params, d1, d2, "q", path=path)), path)
+
+
+    def test_calc_jacobian(self):
+        detector = detector_factory("Pilatus100k")
+        geo = geometry.Geometry(0.1, 0.02, 0.03, 0.1, -0.2, 0.3, detector=detector, wavelength=1e-10)
+        rng = numpy.random.RandomState(0)
+        d1 = rng.uniform(0, detector.shape[0], 50)
+        d2 = rng.uniform(0, detector.shape[1], 50)
+        for space, function in (("2th", geo.tth), ("q", geo.qFunction)):
+            value, jacobian = geo.calc_jacobian(d1, d2, space=space)
+            self.assertEqual(jacobian.shape, (d1.size, 7))
+            self.assertTrue(numpy.allclose(value, function(d1, d2)), space)
+            value, expected = geo.calc_jacobian(d1, d2, space=space, path="numpy")
+            self.assertTrue(numpy.allclose(jacobian, expected, rtol=1e-5, atol=1e-6 * abs(expected).max()), space)
+
+
+class TestArrayCache(unittest.TestCase):
+    """Test the process-wide cache of geometry arrays"""
+
+    def setUp(self):
+        geometry.ARRAY_CACHE.max_size = 1 << 30
+
+    def tearDown(self):
+        geometry.ARRAY_CACHE.max_size = 0
+        geometry.ARRAY_CACHE.clear()
+
+    def test_shared(self):
+        detector = detector_factory("Pilatus100k")
+        ai1 = AzimuthalIntegrator(0.1, 0.02, 0.03, detector=detector, wavelength=1e-10)
+        ai2 = AzimuthalIntegrator(0.1, 0.02, 0.03, detector=detector, wavelength=2e-10)
+        self.assertIs(ai1.twoThetaArray(), ai2.twoThetaArray(), "2theta is shared")
+        self.assertIs(ai1.solidAngleArray(), ai2.solidAngleArray(), "solid angle is shared")
+        self.assertIsNot(ai1.qArray(), ai2.qArray(), "q depends on the wavelength")
+        self.assertGreater(len(geometry.ARRAY_CACHE), 0)
+
+        ai3 = AzimuthalIntegrator(0.2, 0.02, 0.03, detector=detector, wavelength=1e-10)
+        self.assertIsNot(ai1.twoThetaArray(), ai3.twoThetaArray(), "distance differs")
+
+        ref = ai1.twoThetaArray()
+        geometry.ARRAY_CACHE.max_size = 0
+        geometry.ARRAY_CACHE.clear()
+        ai4 = AzimuthalIntegrator(0.1, 0.02, 0.03, detector=detector, wavelength=1e-10)
+        tth = ai4.twoThetaArray()
+        self.assertIsNot(ref, tth, "cache disabled")
+        self.assertTrue(numpy.array_equal(ref, tth), "same result")
+
+    def test_wavelength(self):
+        detector = detector_factory("Pilatus100k")
+        ai = AzimuthalIntegrator(0.1, 0.02, 0.03, detector=detector, wavelength=1e-10)
+        ref = ai.array_from_unit(unit="q_nm^-1", typ="corner").copy()
+        ai.wavelength = 2e-10
+        other = AzimuthalIntegrator(0.1, 0.02, 0.03, detector=detector, wavelength=1e-10)
+        self.assertTrue(numpy.array_equal(ref, other.array_from_unit(unit="q_nm^-1", typ="corner")),
+                        "shared arrays are not modified by a change of wavelength")
+
+
 def suite():
     loader = unittest.defaultTestLoader.loadTestsFromTestCase
     testsuite = unittest.TestSuite()
     testsuite.addTest(loader(TestBug474))
+    testsuite.addTest(loader(TestWavelength))
+    testsuite.addTest(loader(TestArrayCache))
+    testsuite.addTest(loader(TestArrayDtype))
+    testsuite.addTest(loader(TestBatch))
     testsuite.addTest(loader(TestSolidAngle))
     testsuite.addTest(loader(TestBug88SolidAngle))
     testsuite.addTest(loader(TestRecprocalSpacingSquarred))
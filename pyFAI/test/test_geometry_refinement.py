@@ -39,6 +39,7 @@ import os
 import numpy
 import random
 import logging
+from scipy.optimize import approx_fprime
 
 from .utilstest import UtilsTest
 
@@ -858,6 +859,24 @@ class TestGeometryRefinement(unittest.TestCase):
                                    msg="%s is %s, I expected %s%s%s" % (key, r2.__getattribute__(key), ref[key], os.linesep, r2))
 
 
+    def test_gradient(self):
+        """Analytic gradient of the cost function versus finite differences"""
+        mycalibrant = calibrant.ALL_CALIBRANTS("LaB6")
+        mycalibrant.wavelength = 1e-10
+        rng = numpy.random.RandomState(0)
+        data = numpy.column_stack((rng.uniform(0, 1000, 60), rng.uniform(0, 900, 60),
+                                   rng.randint(0, 5, 60), rng.uniform(0.5, 1, 60)))
+        r = GeometryRefinement(data, dist=0.2, poni1=0.08, poni2=0.08, detector="Pilatus1M",
+                               calibrant=mycalibrant, wavelength=mycalibrant.wavelength)
+        free = ["dist", "poni1", "poni2", "rot1", "rot2", "wavelength"]
+        const = {"rot3": 0.01}
+        param = numpy.array([0.21, 0.081, 0.079, 0.01, 0.02, 1.01])
+        args = (free, const, data[:, 0], data[:, 1], data[:, 2], data[:, 3])
+        gradient = r.gradient3(param, *args)
+        expected = approx_fprime(param, r.residu3, 1e-8, *args)
+        self.assertTrue(numpy.allclose(gradient, expected, rtol=1e-5), "gradient=%s expected=%s" % (gradient, expected))
+
+
 def suite():
     testsuite = unittest.TestSuite()
     loader = unittest.defaultTestLoader.loadTestsFromTestCase
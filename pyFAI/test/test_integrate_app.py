@@ -32,6 +32,7 @@ import fabio
 import unittest
 import numpy
 import shutil
+import threading
 import h5py
 
 import pyFAI.app.integrate
@@ -62,6 +63,8 @@ class TestIntegrateApp(unittest.TestCase):
             self.json = None
             self.monitor_key = None
             self.write_mode = None
+            self.nb_threads = 0
+            self.prefetch = None
 
         def __repr__(self):
             return "\n".join(["%s: %s" % (k, self.__getattribute__(k)) for k in dir(self) if "_" not in k])
@@ -419,6 +422,46 @@ class TestProcess(unittest.TestCase):
         numpy.testing.assert_array_almost_equal(result.radial, expected_radial, decimal=1)
         numpy.testing.assert_array_almost_equal(result.azimuthal, expected_azimuthal, decimal=1)
 
+    def test_process_pipeline(self):
+        rng = numpy.random.RandomState(0)
+        data = rng.uniform(0, 100, size=(10, 3, 2))
+        params = {"do_2D": False,
+                  "nbpt_rad": 2,
+                  "method": ("bbox", "histogram", "cython")}
+        config = self.base_config.copy()
+        config.update(params)
+        expected = _ResultObserver()
+        pyFAI.app.integrate.process([data], self.tempDir, config, monitor_name=None, observer=expected)
+        observer = _ResultObserver()
+        output = os.path.join(self.tempDir, "pipeline.h5")
+        pyFAI.app.integrate.process([data], output, config, monitor_name=None, observer=observer,
+                                    nb_threads=3, prefetch=2)
+        self.assertEqual(len(observer.result), len(data))
+        for result, ref in zip(observer.result, expected.result):
+            numpy.testing.assert_array_almost_equal(result.intensity, ref.intensity)
+        with h5py.File(output, "r") as h5:
+            intensity = h5["entry_0000/integrate/results/data"][()]
+        numpy.testing.assert_array_almost_equal(intensity, [ref.intensity for ref in expected.result])
+
+    def test_process_pipeline_error(self):
+        "A failure of the main loop does not leave the reader thread blocked"
+
+        class FailingObserver(_ResultObserver):
+
+            def processing_data(self, data_info, approximate_count=None):
+                if data_info.frame_id == 2:
+                    raise RuntimeError("observer failed")
+
+        data = numpy.random.RandomState(0).uniform(0, 100, size=(20, 3, 2))
+        config = self.base_config.copy()
+        config.update({"do_2D": False, "nbpt_rad": 2, "method": ("bbox", "histogram", "cython")})
+        output = os.path.join(self.tempDir, "pipeline_error.h5")
+        with self.assertRaises(RuntimeError):
+            pyFAI.app.integrate.process([data], output, config, monitor_name=None, observer=FailingObserver(),
+                                        nb_threads=2, prefetch=1)
+        alive = [thread.name for thread in threading.enumerate() if thread.name.startswith("pyFAI-integrate")]
+        self.assertEqual(alive, [], "pipeline threads are stopped")
+
     def test_fabio_integration1d(self):
         data = numpy.array([[0, 0], [0, 100], [0, 0]])
         data = fabio.numpyimage.NumpyImage(data=data)
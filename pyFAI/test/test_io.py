@@ -39,6 +39,7 @@ import os
 import shutil
 import numpy
 import time
+import json
 import sys
 import logging
 from .utilstest import UtilsTest
@@ -46,6 +47,8 @@ from .utilstest import UtilsTest
 logger = logging.getLogger(__name__)
 pyFAI = sys.modules["pyFAI"]
 from pyFAI import io
+from pyFAI import containers
+from pyFAI import units
 
 
 class TestIsoTime(unittest.TestCase):
@@ -119,6 +122,174 @@ class testHDF5Writer(unittest.TestCase):
         statinfo = os.stat(h5file)
         self.assertTrue(statinfo.st_size / 1e6 > nmbytes, "file size (%s) is larger than dataset" % statinfo.st_size)
 
+    def test_buffered(self):
+        if io.h5py is None:
+            self.skipTest("H5py is absent on the system")
+        npt = 100
+        n = 25
+        data = numpy.random.random((n, npt)).astype(numpy.float32)
+        error = numpy.random.random((n, npt)).astype(numpy.float32)
+        radial = numpy.linspace(1, 10, npt)
+        reference = os.path.join(self.tmpdir, "reference.h5")
+        buffered = os.path.join(self.tmpdir, "buffered.h5")
+        for filename, kwargs in ((reference, {}), (buffered, {"buffer_size": 10, "compression": "gzip"})):
+            writer = io.HDF5Writer(filename=filename, append_frames=True, **kwargs)
+            writer.init({"nbpt_rad": npt})
+            for i in range(n):
+                writer.write(pyFAI.containers.Integrate1dResult(radial, data[i], error[i]))
+            writer.close()
+        with io.h5py.File(reference, "r") as ref, io.h5py.File(buffered, "r") as obt:
+            path = ref.attrs["default"] + "/integrate/results/"
+            for name in ("data", "data_errors", "radial"):
+                self.assertTrue(numpy.array_equal(ref[path + name][()], obt[path + name][()]), name)
+            dataset = obt[path + "data"]
+            self.assertEqual(dataset.shape, (n, npt), "dataset trimmed")
+            self.assertEqual(dataset.chunks, (10, npt), "chunks aligned on the buffer")
+            self.assertEqual(dataset.compression, "gzip")
+
+    def test_async(self):
+        if io.h5py is None:
+            self.skipTest("H5py is absent on the system")
+        npt = 100
+        n = 20
+        data = numpy.random.random((n, npt)).astype(numpy.float32)
+        filename = os.path.join(self.tmpdir, "async.h5")
+        writer = io.AsyncWriter(io.HDF5Writer(filename=filename, append_frames=True), queue_size=4)
+        writer.init({"nbpt_rad": npt})
+        for i in range(n):
+            writer.write(data[i])
+        writer.flush()
+        stats = writer.get_statistics()
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertLessEqual(stats["max_queue_depth"], 4)
+        self.assertEqual(stats["operations"], n + 1, "writes + flush")
+        writer.close()
+        with io.h5py.File(filename, "r") as h5:
+            self.assertTrue(numpy.array_equal(h5[h5.attrs["default"] + "/integrate/results/data"][()], data))
+
+        class FailingWriter(io.Writer):
+            closed = False
+
+            def write(self, data):
+                raise IOError("disk full")
+
+            def close(self):
+                self.closed = True
+
+        failing = FailingWriter()
+        writer = io.AsyncWriter(failing)
+        writer.write(data[0])
+        self.assertRaises(IOError, writer.flush)
+        writer.write(data[1])
+        self.assertRaises(IOError, writer.close)
+        self.assertTrue(failing.closed, "writer closed despite the error")
+
+        class RecordingWriter(io.Writer):
+
+            def __init__(self):
+                io.Writer.__init__(self)
+                self.calls = []
+
+            def write(self, data):
+                time.sleep(0.01)
+                self.calls.append("write")
+
+            def set_filename(self, filename):
+                self.calls.append("set_filename")
+
+            def get_calls(self):
+                return list(self.calls)
+
+            def close(self):
+                pass
+
+        recording = RecordingWriter()
+        writer = io.AsyncWriter(recording)
+        writer.write(data[0])
+        writer.set_filename("other")
+        writer.write(data[1])
+        self.assertEqual(writer.get_calls(), ["write", "set_filename", "write"],
+                         "methods with a result are called synchronously, after pending operations")
+        writer.close()
+
+
+class TestBinaryWriter(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tmpdir = os.path.join(UtilsTest.tempdir, "io_BinaryWriter")
+        if not os.path.isdir(self.tmpdir):
+            os.mkdir(self.tmpdir)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir)
+        self.tmpdir = None
+
+    def test_save1D(self):
+        "The vectorized formatting provides the same text as formatting line by line"
+        rng = numpy.random.RandomState(seed=0)
+        dim1 = numpy.linspace(0, 50, 100)
+        intensity = rng.uniform(0, 1000, 100).astype(numpy.float32)
+        error = numpy.sqrt(intensity)
+        filename = os.path.join(self.tmpdir, "save1D.dat")
+        writer = io.DefaultAiWriter(None, None)
+        writer.save1D(filename, dim1, intensity, error)
+        with open(filename) as f:
+            lines = [i for i in f.read().split("\n") if i and not i.startswith("#")]
+        self.assertEqual(len(lines), 100)
+        for line, t, i, s in zip(lines, dim1, intensity, error):
+            self.assertEqual(line, "%14.6e  %14.6e %14.6e" % (t, i, s))
+
+    def test_engine_header(self):
+        "The description of the engine follows the changes of its configuration"
+        from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
+        ai = AzimuthalIntegrator(dist=0.1, detector="Pilatus100k", wavelength=1e-10)
+        writer = io.DefaultAiWriter(os.path.join(self.tmpdir, "header.dat"), ai)
+        header = writer.make_headers()
+        cached = writer._engine_header
+        self.assertEqual(header, writer.make_headers())
+        self.assertIs(writer._engine_header, cached, "description of the engine reused")
+        ai.dist = 0.2
+        updated = writer.make_headers()
+        self.assertNotEqual(header, updated, "header updated")
+        self.assertIn("0.2 m", updated)
+
+    def test_numpy_writer(self):
+        rng = numpy.random.RandomState(seed=0)
+        n, npt = 10, 50
+        radial = numpy.linspace(0.1, 5, npt)
+        intensity = rng.uniform(0, 100, (n, npt)).astype(numpy.float32)
+        filename = os.path.join(self.tmpdir, "stack.npy")
+        writer = io.NumpyWriter(filename)
+        writer.init({"nbpt_rad": npt})
+        for i in range(n):
+            result = containers.Integrate1dResult(radial, intensity[i], numpy.sqrt(intensity[i]))
+            result._set_unit(units.Q)
+            writer.write(result)
+        writer.flush()
+        stack = numpy.load(filename, mmap_mode="r")
+        self.assertEqual(stack.shape, (n, npt), "readable while open")
+        del stack
+        writer.close()
+
+        stack = numpy.load(filename, mmap_mode="r")
+        self.assertEqual(stack.dtype, numpy.float32)
+        self.assertTrue(numpy.array_equal(stack, intensity))
+        errors = numpy.load(writer.error_filename)
+        self.assertTrue(numpy.allclose(errors, numpy.sqrt(intensity)))
+        with open(writer.sidecar) as f:
+            sidecar = json.load(f)
+        self.assertEqual(sidecar["shape"], [n, npt])
+        self.assertEqual(sidecar["radial_unit"], str(units.Q))
+        self.assertTrue(numpy.allclose(sidecar["radial"], radial))
+        self.assertEqual(sidecar["config"]["nbpt_rad"], npt)
+
+        writer = io.NumpyWriter(filename)
+        writer.write(intensity[0])
+        self.assertRaises(ValueError, writer.write, intensity[0, :10])
+        writer.close()
+
 
 class testFabIOWriter(unittest.TestCase):
     """the tested class is not yet finished ... JK07/2017"""
@@ -161,6 +332,7 @@ def suite():
     testsuite.addTest(loader(TestIsoTime))
     testsuite.addTest(loader(TestNexus))
     testsuite.addTest(loader(testHDF5Writer))
+    testsuite.addTest(loader(TestBinaryWriter))
     # testsuite.addTest(loader(testFabIOWriter))
     return testsuite
 
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#    Project: Azimuthal integration
+#             https://github.com/silx-kit/pyFAI
+#
+#    Copyright (C) 2022-2022 European Synchrotron Radiation Facility, Grenoble, France
+#
+#    Principal author:       Jérôme Kieffer (Jerome.Kieffer@ESRF.eu)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"test suite for the direct reading of HDF5 chunks"
+
+__author__ = "Jérôme Kieffer"
+__contact__ = "Jerome.Kieffer@ESRF.eu"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "18/10/2022"
+
+import unittest
+import os
+import shutil
+import numpy
+import logging
+
+logger = logging.getLogger(__name__)
+
+from .utilstest import UtilsTest
+from ..io import chunk_reader
+from ..io.chunk_reader import ChunkReader, get_datasets, h5py
+
+
+@unittest.skipIf(h5py is None, "h5py is absent on the system")
+class TestChunkReader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = os.path.join(UtilsTest.tempdir, cls.__name__)
+        os.makedirs(cls.tmpdir, exist_ok=True)
+        rng = numpy.random.RandomState(seed=0)
+        cls.data = rng.poisson(10, size=(12, 64, 96)).astype(numpy.uint32)
+        cls.filename = os.path.join(cls.tmpdir, "master.h5")
+        with h5py.File(cls.filename, "w") as h5:
+            h5.create_dataset("entry/data/data_000001", data=cls.data[:5], chunks=(1, 64, 96),
+                              compression="gzip", shuffle=True)
+            h5.create_dataset("entry/data/data_000002", data=cls.data[5:], chunks=(1, 64, 96))
+            h5.create_dataset("split", data=cls.data, chunks=(4, 32, 96), compression="gzip")
+            if chunk_reader.bitshuffle is not None:
+                import bitshuffle.h5
+                h5.create_dataset("bitshuffle", data=cls.data, chunks=(1, 64, 96),
+                                  compression=bitshuffle.h5.H5FILTER,
+                                  compression_opts=(0, bitshuffle.h5.H5_COMPRESS_LZ4))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+        cls.tmpdir = cls.data = cls.filename = None
+
+    def test_get_datasets(self):
+        datasets = get_datasets(self.filename)
+        try:
+            self.assertEqual([d.name for d in datasets], ["/entry/data/data_000001", "/entry/data/data_000002"])
+        finally:
+            datasets[0].file.close()
+        datasets = get_datasets(self.filename + "::/split")
+        try:
+            self.assertEqual(len(datasets), 1)
+        finally:
+            datasets[0].file.close()
+
+    def test_read(self):
+        for path, direct, ref in (("entry/data/data_000001", True, self.data[:5]),
+                                  ("entry/data/data_000002", True, self.data[5:]),
+                                  ("split", False, self.data),
+                                  ("bitshuffle", True, self.data)):
+            if path == "bitshuffle" and chunk_reader.bitshuffle is None:
+                continue
+            with self.subTest(path=path):
+                with ChunkReader(self.filename + "::" + path, nb_threads=2) as reader:
+                    self.assertEqual(reader.direct, direct)
+                    self.assertEqual(len(reader), len(ref))
+                    self.assertTrue(numpy.array_equal(reader.read_frame(2), ref[2]))
+                    frames = [frame.copy() for frame in reader.iter_frames(1)]
+                self.assertTrue(numpy.array_equal(numpy.array(frames), ref[1:]))
+
+    def test_buffers(self):
+        "Frames remain valid until nb_buffers more frames are read, no frame is allocated"
+        nb_buffers = 3
+        with ChunkReader(self.filename + "::split", nb_threads=2, nb_buffers=nb_buffers) as reader:
+            kept = []
+            addresses = set()
+            for index, frame in enumerate(reader.iter_frames()):
+                kept.append((index, frame))
+                addresses.add(frame.ctypes.data)
+                self.assertEqual(frame.ctypes.data % chunk_reader.ALIGNMENT, 0)
+                for previous, old in kept[-nb_buffers:]:
+                    self.assertTrue(numpy.array_equal(old, self.data[previous]), "frame %s still valid" % previous)
+        self.assertLessEqual(len(addresses), nb_buffers + 2)
+
+
+def suite():
+    loader = unittest.defaultTestLoader.loadTestsFromTestCase
+    testsuite = unittest.TestSuite()
+    testsuite.addTest(loader(TestChunkReader))
+    return testsuite
+
+
+if __name__ == '__main__':
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
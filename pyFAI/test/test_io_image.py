@@ -40,6 +40,7 @@ import os.path
 import shutil
 import numpy
 import h5py
+import fabio
 
 from silx.io.url import DataUrl
 
@@ -93,10 +94,72 @@ class TestReadImage(unittest.TestCase):
         self.assertIsNotNone(image)
 
 
+class TestMappedFrames(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = os.path.join(utilstest.test_options.tempdir, cls.__name__)
+        os.makedirs(cls.directory)
+        rng = numpy.random.RandomState(seed=0)
+        cls.data = rng.randint(0, 60000, size=(3, 30, 40)).astype(numpy.uint16)
+        edf = fabio.edfimage.EdfImage(data=cls.data[0])
+        for frame in cls.data[1:]:
+            edf.append_frame(data=frame)
+        edf.write(os.path.join(cls.directory, "multi.edf"))
+        fabio.edfimage.EdfImage(data=cls.data[0]).write(os.path.join(cls.directory, "compressed.edf.gz"))
+        fabio.tifimage.TifImage(data=cls.data[0]).write(os.path.join(cls.directory, "frame.tif"))
+        numpy.save(os.path.join(cls.directory, "stack.npy"), cls.data.astype(numpy.float32))
+        cls.data.astype(">u2").tofile(os.path.join(cls.directory, "stack.raw"))
+        with h5py.File(os.path.join(cls.directory, "stack.h5"), mode="w") as h5:
+            h5["/entry/data/data"] = cls.data
+            h5.create_dataset("/chunked", data=cls.data, chunks=(1, 30, 40))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+        cls.directory = cls.data = None
+
+    def test_formats(self):
+        for name, kwargs, nframes in (("multi.edf", {}, 3),
+                                      ("frame.tif", {}, 1),
+                                      ("stack.npy", {}, 3),
+                                      ("stack.raw", {"shape": (30, 40), "dtype": ">u2"}, 3),
+                                      ("stack.h5", {}, 3),
+                                      ("stack.h5::/entry/data/data", {}, 3)):
+            with self.subTest(name=name):
+                frames = list(image_mdl.iter_mapped_frames(os.path.join(self.directory, name), **kwargs))
+                self.assertEqual(len(frames), nframes)
+                for frame, ref in zip(frames, self.data):
+                    self.assertFalse(frame.flags.writeable, "read-only view")
+                    self.assertTrue(numpy.array_equal(frame, ref))
+
+    def test_not_mappable(self):
+        for name in ("compressed.edf.gz", "stack.h5::/chunked", "stack.raw", "missing.edf"):
+            with self.subTest(name=name):
+                self.assertIsNone(image_mdl.get_frame_layout(os.path.join(self.directory, name)))
+                self.assertRaises(IOError, image_mdl.iter_mapped_frames, os.path.join(self.directory, name))
+
+    def test_integrate(self):
+        "Engines accept read-only frames without copying them"
+        from ..azimuthalIntegrator import AzimuthalIntegrator
+        from ..detectors import Detector
+        ai = AzimuthalIntegrator(detector=Detector(1e-4, 1e-4, max_shape=(30, 40)), dist=0.01, wavelength=1e-10)
+        frame = next(image_mdl.iter_mapped_frames(os.path.join(self.directory, "stack.npy")))
+        ref = numpy.array(frame)
+        for method in (("no", "histogram", "cython"), ("bbox", "histogram", "cython"),
+                       ("bbox", "csr", "cython"), ("full", "lut", "cython")):
+            with self.subTest(method=method):
+                for integrate in (lambda data: ai.integrate1d_ng(data, 10, method=method),
+                                  lambda data: ai.integrate2d_ng(data, 10, 8, method=method),
+                                  lambda data: ai.integrate1d_legacy(data, 10, method=method, correctSolidAngle=False)):
+                    self.assertTrue(numpy.allclose(integrate(frame).intensity, integrate(ref).intensity))
+
+
 def suite():
     loader = unittest.defaultTestLoader.loadTestsFromTestCase
     testsuite = unittest.TestSuite()
     testsuite.addTest(loader(TestReadImage))
+    testsuite.addTest(loader(TestMappedFrames))
     return testsuite
 
 
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+#    Project: Azimuthal integration
+#             https://github.com/silx-kit/pyFAI
+#
+#    Copyright (C) 2022-2022 European Synchrotron Radiation Facility, Grenoble, France
+#
+#    Principal author:       Jérôme Kieffer (Jerome.Kieffer@ESRF.eu)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"test suite for the integration with a pool of processes"
+
+__author__ = "Jérôme Kieffer"
+__contact__ = "Jerome.Kieffer@ESRF.eu"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "18/10/2022"
+
+import unittest
+import pickle
+import numpy
+import logging
+
+logger = logging.getLogger(__name__)
+
+from ..azimuthalIntegrator import AzimuthalIntegrator
+from ..detectors import detector_factory
+from .. import parallel
+from ..geometry import CachedArrays
+
+
+def _worker_cache_type():
+    "Class of the array cache of the integrator in a worker process"
+    return type(parallel._worker[0]._cached_array).__name__
+
+
+@unittest.skipIf(parallel.shared_memory is None, "Shared memory not available")
+class TestParallel(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        detector = detector_factory("Pilatus100k")
+        cls.ai = AzimuthalIntegrator(detector=detector, dist=0.1, poni1=0.02, poni2=0.03, wavelength=1e-10)
+        rng = numpy.random.RandomState(seed=0)
+        cls.frames = rng.uniform(0, 100, size=(5,) + detector.shape).astype(numpy.float32)
+        cls.mask = numpy.zeros(detector.shape, dtype=numpy.int8)
+        cls.mask[:20] = 1
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ai = cls.frames = cls.mask = None
+
+    def test_shared_arrays(self):
+        arrays = {"a": numpy.arange(10, dtype=numpy.float32),
+                  "b": numpy.ones((3, 5), dtype=numpy.int8),
+                  "c": numpy.zeros(3, dtype=[("idx", numpy.int32), ("coef", numpy.float32)])}
+        shared = parallel.SharedArrays(arrays)
+        try:
+            attached = pickle.loads(pickle.dumps(shared))
+            content = attached.get()
+            for key, value in arrays.items():
+                self.assertEqual(content[key].dtype, value.dtype)
+                self.assertTrue(numpy.array_equal(content[key], value), key)
+            shared.get()["a"][0] = 5
+            self.assertEqual(content["a"][0], 5, "memory is shared")
+            del content
+            attached.close()
+        finally:
+            shared.close()
+
+    def test_integrate(self):
+        kwargs = {"unit": "q_nm^-1", "method": ("full", "csr", "cython"),
+                  "polarization_factor": 0.9, "mask": self.mask}
+        for npt_azim in (None, 36):
+            with self.subTest(npt_azim=npt_azim):
+                with parallel.ParallelIntegrator(self.ai, 100, npt_azim, nproc=2, **kwargs) as integrator:
+                    results = integrator.integrate(self.frames)
+                self.assertEqual(len(results), len(self.frames))
+                for frame, res in zip(self.frames, results):
+                    if npt_azim is None:
+                        ref = self.ai.integrate1d_ng(frame, 100, **kwargs)
+                    else:
+                        ref = self.ai.integrate2d_ng(frame, 100, npt_azim, **kwargs)
+                    self.assertIs(res.method, ref.method)
+                    self.assertIs(res.unit, ref.unit)
+                    self.assertTrue(numpy.allclose(ref.intensity, res.intensity), "intensity matches")
+
+    def test_worker_cache(self):
+        "Integrators of the worker processes use CachedArrays, like any geometry"
+        clone = pickle.loads(pickle.dumps(self.ai))
+        self.assertIsInstance(clone._cached_array, CachedArrays)
+        with parallel.ParallelIntegrator(self.ai, 100, nproc=1, method=("bbox", "csr", "cython")) as integrator:
+            self.assertEqual(integrator._pool.apply(_worker_cache_type), "CachedArrays")
+
+
+def suite():
+    loader = unittest.defaultTestLoader.loadTestsFromTestCase
+    testsuite = unittest.TestSuite()
+    testsuite.addTest(loader(TestParallel))
+    return testsuite
+
+
+if __name__ == '__main__':
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -185,6 +185,45 @@ class TestSparseBuilder(utilstest.ParametricTestCase):
                 self.assertTrue(numpy.allclose(bin_indexes, previous_bin_indexes))
             previous_coefs, previous_indexes, previous_bin_indexes = coefs, indexes, bin_indexes
 
+    def test_chain(self):
+        for builder in self.subtest_each_builders(5):
+            other = sparse_builder.SparseBuilder(5, mode="block", block_size=2)
+            if builder.mode() == "pack":
+                self.assertRaises(NotImplementedError, builder.chain, other)
+                continue
+            builder.insert(0, 0, 1.0)
+            builder.insert(1, 1, 0.4)
+            other.insert(0, 2, 0.6)
+            other.insert(3, 3, 0.2)
+            builder.chain(other)
+            self.assertEqual(builder.size(), 4)
+            self.assertTrue(numpy.allclose(builder.get_bin_sizes(), numpy.array([2, 1, 0, 1, 0])))
+            self.assertTrue(numpy.allclose(builder.get_bin_indexes(0), numpy.array([0, 2])))
+            coefs, indexes, bin_indexes = builder.to_csr()
+            self.assertTrue(numpy.allclose(coefs, numpy.array([1.0, 0.6, 0.4, 0.2])))
+            self.assertTrue(numpy.allclose(indexes, numpy.array([0, 2, 1, 3])))
+            self.assertTrue(numpy.allclose(bin_indexes, numpy.array([0, 2, 3, 3, 4, 4])))
+            lut = builder.to_lut()
+            self.assertTrue(numpy.allclose(lut["idx"][0], numpy.array([0, 2])))
+
+    def test_parallel_build(self):
+        """The matrix does not depend on the number of threads"""
+        npt = 200
+        size = 50000
+        pos = numpy.random.random(size) * npt
+        bins = pos.astype(int)
+
+        def fill_chunk(builder, start, stop):
+            for idx in range(start, stop):
+                builder.insert(bins[idx], idx, pos[idx] - bins[idx])
+
+        ref = sparse_builder.parallel_build(fill_chunk, size, npt, nthread=1).to_csr()
+        for nthread in (2, 3):
+            with self.subTest(nthread=nthread):
+                res = sparse_builder.parallel_build(fill_chunk, size, npt, nthread=nthread).to_csr()
+                for a, b in zip(ref, res):
+                    self.assertTrue(numpy.array_equal(a, b))
+
 
 def suite():
     loader = unittest.defaultTestLoader.loadTestsFromTestCase
@@ -140,6 +140,20 @@ class Unit(object):
     def __hash__(self):
         return self.name.__hash__()
 
+    def __reduce__(self):
+        """Registered units are pickled by name and unpickled as the
+        registered instance"""
+        for registry in ("RADIAL_UNITS", "AZIMUTHAL_UNITS", "LENGTH_UNITS", "ANGLE_UNITS"):
+            if globals()[registry].get(self.name) is self:
+                return (_get_registered_unit, (registry, self.name))
+        return (Unit, (self.name, self.scale, self.label, self._equation, self.formula,
+                       self.center, self.corner, self.delta, self.short_name, self.unit_symbol))
+
+
+def _get_registered_unit(registry, name):
+    "Helper for unpickling units, see Unit.__reduce__"
+    return globals()[registry][name]
+
 
 RADIAL_UNITS = {}
 